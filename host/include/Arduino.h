@@ -0,0 +1,94 @@
+/*
+    Copyright 2020 by Murray Altheim. All rights reserved. This file is part of
+    the Raspberry Pi Master to Arduino Slave (pimaster2ardslave) project and is
+    released under the MIT License. Please see the LICENSE file included as part
+    of this package.
+
+      author:   Murray Altheim
+      created:  2020-05-18
+      modified: 2020-05-25
+
+    A mock of the parts of the Arduino core used by i2cSlaveCore.cpp, so that
+    it may be compiled and run on Linux. Pin levels and analog values are held
+    in arrays that the host driver (slave_host.cpp) sets and reads, and time
+    is virtual: it only advances when delay() is called or the driver says so.
+    The external interrupts are those of the Leonardo and Micro, and an
+    interrupt attached to a pin is called when the driver changes its level
+    (see mockSetLevel()).
+*/
+
+#ifndef MOCK_ARDUINO_H
+#define MOCK_ARDUINO_H
+
+#include <stdint.h>
+#include <stdio.h>
+
+typedef uint8_t byte;
+typedef bool boolean;
+
+#define HIGH             1
+#define LOW              0
+#define INPUT            0
+#define OUTPUT           1
+#define INPUT_PULLUP     2
+#define CHANGE           1
+#define FALLING          2
+#define RISING           3
+#define NOT_AN_INTERRUPT -1
+#define SDA              2
+#define SCL              3
+
+#define LED_BUILTIN_TX  30
+#define LED_BUILTIN_RX  31
+
+#define MOCK_PIN_COUNT  32
+#define MOCK_CYCLE_LENGTH 32
+#define MOCK_INTERRUPT_COUNT 5
+
+#define lowByte(w)   ((uint8_t) ((w) & 0xff))
+#define highByte(w)  ((uint8_t) ((w) >> 8))
+#define min(a,b) ((a)<(b)?(a):(b))
+#define max(a,b) ((a)>(b)?(a):(b))
+#define noInterrupts()
+#define interrupts()
+#define constrain(amt,low,high) ((amt)<(low)?(low):((amt)>(high)?(high):(amt)))
+
+void pinMode(uint8_t pin, uint8_t mode);
+int digitalRead(uint8_t pin);
+void digitalWrite(uint8_t pin, uint8_t value);
+int analogRead(uint8_t pin);
+unsigned long millis();
+unsigned long micros();
+void delay(unsigned long ms);
+int digitalPinToInterrupt(uint8_t pin);
+void attachInterrupt(uint8_t interrupt, void (*isr)(void), int mode);
+void detachInterrupt(uint8_t interrupt);
+
+// the state behind the mock, for use by the host driver ......................
+
+extern int mockPinModes[MOCK_PIN_COUNT];  // as set by pinMode(), initially INPUT
+extern int mockLevels[MOCK_PIN_COUNT];    // levels read by, or written by, digital I/O
+extern int mockAnalog[MOCK_PIN_COUNT];    // values returned by analogRead()
+extern int mockAnalogCycle[MOCK_PIN_COUNT][MOCK_CYCLE_LENGTH]; // if set, values returned in turn instead
+extern int mockAnalogCycleLength[MOCK_PIN_COUNT];
+extern int mockAnalogCycleIndex[MOCK_PIN_COUNT];
+extern unsigned long mockMicros;          // the virtual time
+extern void (*mockIsrs[MOCK_INTERRUPT_COUNT])(void); // as attached by attachInterrupt(), else NULL
+extern int mockIsrModes[MOCK_INTERRUPT_COUNT];
+
+void mockSetLevel(uint8_t pin, int level); // sets the level presented to a pin, calling any interrupt attached
+
+class MockSerial {
+  public:
+    boolean quiet = true;                 // verbose output is discarded unless false
+    void begin(unsigned long baud) { }
+    void println(const char *line) {
+        if ( ! quiet ) {
+            fprintf(stderr, "%s\n", line);
+        }
+    }
+};
+
+extern MockSerial Serial;
+
+#endif
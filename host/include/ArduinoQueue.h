@@ -0,0 +1,62 @@
+/*
+    Copyright 2020 by Murray Altheim. All rights reserved. This file is part of
+    the Raspberry Pi Master to Arduino Slave (pimaster2ardslave) project and is
+    released under the MIT License. Please see the LICENSE file included as part
+    of this package.
+
+      author:   Murray Altheim
+      created:  2020-05-18
+      modified: 2020-05-18
+
+    A stand-in for ArduinoQueue by Einar Arnason, with the same behaviour for
+    the methods used by i2cSlaveCore.cpp: enqueue() drops the item when the
+    queue is full, and dequeue() returns a default (zero) item when empty.
+*/
+
+#ifndef MOCK_ARDUINO_QUEUE_H
+#define MOCK_ARDUINO_QUEUE_H
+
+template <typename T>
+class ArduinoQueue {
+  public:
+    ArduinoQueue(unsigned int maxItems = 100) : maxItems(maxItems) {
+        items = new T[maxItems];
+    }
+
+    ~ArduinoQueue() {
+        delete[] items;
+    }
+
+    bool enqueue(T item) {
+        if ( isFull() ) {
+            return false;
+        }
+        items[tail] = item;
+        tail = ( tail + 1 ) % maxItems;
+        count++;
+        return true;
+    }
+
+    T dequeue() {
+        if ( isEmpty() ) {
+            return T();
+        }
+        T item = items[head];
+        head = ( head + 1 ) % maxItems;
+        count--;
+        return item;
+    }
+
+    bool isEmpty() { return count == 0; }
+    bool isFull() { return count >= maxItems; }
+    unsigned int item_count() { return count; }
+
+  private:
+    T *items;
+    unsigned int maxItems;
+    unsigned int head = 0;
+    unsigned int tail = 0;
+    unsigned int count = 0;
+};
+
+#endif
@@ -0,0 +1,53 @@
+/*
+    Copyright 2020 by Murray Altheim. All rights reserved. This file is part of
+    the Raspberry Pi Master to Arduino Slave (pimaster2ardslave) project and is
+    released under the MIT License. Please see the LICENSE file included as part
+    of this package.
+
+      author:   Murray Altheim
+      created:  2020-05-18
+      modified: 2020-05-18
+
+    A mock of the slave side of the Arduino Wire library. The host driver
+    stands in for the I²C hardware: deliver() behaves as a write from the
+    master (the bytes are buffered and the onReceive callback called), and
+    request() as a read (the onRequest callback is called and whatever it
+    wrote is returned). As with the real library, writes beyond the 32 byte
+    buffer are dropped.
+*/
+
+#ifndef MOCK_WIRE_H
+#define MOCK_WIRE_H
+
+#include <stdint.h>
+#include <stddef.h>
+
+#define BUFFER_LENGTH 32
+
+class TwoWire {
+  public:
+    void begin(uint8_t address);
+    void onReceive(void (*function)(int));
+    void onRequest(void (*function)(void));
+    int available();
+    int read();
+    size_t write(uint8_t data);
+
+    // host driver ...........................
+    uint8_t address = 0;
+    void deliver(const uint8_t *data, int length);
+    int request(uint8_t *data);
+
+  private:
+    void (*receiveCallback)(int) = 0;
+    void (*requestCallback)(void) = 0;
+    uint8_t rxBuffer[BUFFER_LENGTH];
+    int rxIndex = 0;
+    int rxLength = 0;
+    uint8_t txBuffer[BUFFER_LENGTH];
+    int txLength = 0;
+};
+
+extern TwoWire Wire;
+
+#endif
@@ -0,0 +1,182 @@
+/*
+    Copyright 2020 by Murray Altheim. All rights reserved. This file is part of
+    the Raspberry Pi Master to Arduino Slave (pimaster2ardslave) project and is
+    released under the MIT License. Please see the LICENSE file included as part
+    of this package.
+
+      author:   Murray Altheim
+      created:  2020-05-18
+      modified: 2020-05-25
+
+    The implementation of the mock Arduino core and Wire library.
+*/
+
+#include <string.h>
+#include <Arduino.h>
+#include <Wire.h>
+
+int mockPinModes[MOCK_PIN_COUNT] = {};
+int mockLevels[MOCK_PIN_COUNT] = {};
+int mockAnalog[MOCK_PIN_COUNT] = {};
+int mockAnalogCycle[MOCK_PIN_COUNT][MOCK_CYCLE_LENGTH] = {};
+int mockAnalogCycleLength[MOCK_PIN_COUNT] = {};
+int mockAnalogCycleIndex[MOCK_PIN_COUNT] = {};
+unsigned long mockMicros = 0;
+void (*mockIsrs[MOCK_INTERRUPT_COUNT])(void) = {};
+int mockIsrModes[MOCK_INTERRUPT_COUNT] = {};
+
+MockSerial Serial;
+TwoWire Wire;
+
+// Arduino .....................................................................
+
+void pinMode(uint8_t pin, uint8_t mode) {
+    if ( pin < MOCK_PIN_COUNT ) {
+        mockPinModes[pin] = mode;
+    }
+}
+
+int digitalRead(uint8_t pin) {
+    return pin < MOCK_PIN_COUNT ? mockLevels[pin] : LOW;
+}
+
+void digitalWrite(uint8_t pin, uint8_t value) {
+    if ( pin < MOCK_PIN_COUNT ) {
+        mockLevels[pin] = value ? HIGH : LOW;
+    }
+}
+
+int analogRead(uint8_t pin) {
+    if ( pin >= MOCK_PIN_COUNT ) {
+        return 0;
+    }
+    if ( mockAnalogCycleLength[pin] > 0 ) {
+        int value = mockAnalogCycle[pin][mockAnalogCycleIndex[pin] % mockAnalogCycleLength[pin]];
+        mockAnalogCycleIndex[pin] += 1;
+        return constrain(value, 0, 1023);
+    }
+    return constrain(mockAnalog[pin], 0, 1023);
+}
+
+unsigned long millis() {
+    return mockMicros / 1000;
+}
+
+unsigned long micros() {
+    return mockMicros;
+}
+
+void delay(unsigned long ms) {
+    mockMicros += ms * 1000;
+}
+
+/**
+    Returns the external interrupt of the pin as on the Leonardo and Micro,
+    or NOT_AN_INTERRUPT.
+*/
+int digitalPinToInterrupt(uint8_t pin) {
+    switch ( pin ) {
+        case 3: return 0;
+        case 2: return 1;
+        case 0: return 2;
+        case 1: return 3;
+        case 7: return 4;
+        default: return NOT_AN_INTERRUPT;
+    }
+}
+
+void attachInterrupt(uint8_t interrupt, void (*isr)(void), int mode) {
+    if ( interrupt < MOCK_INTERRUPT_COUNT ) {
+        mockIsrs[interrupt] = isr;
+        mockIsrModes[interrupt] = mode;
+    }
+}
+
+void detachInterrupt(uint8_t interrupt) {
+    if ( interrupt < MOCK_INTERRUPT_COUNT ) {
+        mockIsrs[interrupt] = NULL;
+    }
+}
+
+/**
+    Presents the level to the pin and, if it changed, calls the interrupt
+    attached to the pin (if any) on an edge of its mode.
+*/
+void mockSetLevel(uint8_t pin, int level) {
+    if ( pin >= MOCK_PIN_COUNT ) {
+        return;
+    }
+    int previous = mockLevels[pin];
+    mockLevels[pin] = level ? HIGH : LOW;
+    int interrupt = digitalPinToInterrupt(pin);
+    if ( mockLevels[pin] == previous || interrupt == NOT_AN_INTERRUPT || mockIsrs[interrupt] == NULL ) {
+        return;
+    }
+    int mode = mockIsrModes[interrupt];
+    if ( mode == CHANGE || ( mode == RISING && mockLevels[pin] == HIGH ) || ( mode == FALLING && mockLevels[pin] == LOW ) ) {
+        mockIsrs[interrupt]();
+    }
+}
+
+// Wire ........................................................................
+
+void TwoWire::begin(uint8_t address) {
+    this->address = address;
+}
+
+void TwoWire::onReceive(void (*function)(int)) {
+    receiveCallback = function;
+}
+
+void TwoWire::onRequest(void (*function)(void)) {
+    requestCallback = function;
+}
+
+int TwoWire::available() {
+    return rxLength - rxIndex;
+}
+
+int TwoWire::read() {
+    if ( rxIndex >= rxLength ) {
+        return -1;
+    }
+    return rxBuffer[rxIndex++];
+}
+
+size_t TwoWire::write(uint8_t data) {
+    if ( txLength >= BUFFER_LENGTH ) {
+        return 0;
+    }
+    txBuffer[txLength++] = data;
+    return 1;
+}
+
+/**
+    Behaves as a write of the given bytes from the master, truncated (as
+    by the AVR's TWI buffer) to BUFFER_LENGTH.
+*/
+void TwoWire::deliver(const uint8_t *data, int length) {
+    if ( length > BUFFER_LENGTH ) {
+        length = BUFFER_LENGTH;
+    }
+    memcpy(rxBuffer, data, length);
+    rxIndex = 0;
+    rxLength = length;
+    if ( receiveCallback ) {
+        receiveCallback(length);
+    }
+}
+
+/**
+    Behaves as a read by the master, copying whatever the onRequest
+    callback wrote into 'data' (of at least BUFFER_LENGTH bytes) and
+    returning its length.
+*/
+int TwoWire::request(uint8_t *data) {
+    txLength = 0;
+    if ( requestCallback ) {
+        requestCallback();
+    }
+    memcpy(data, txBuffer, txLength);
+    return txLength;
+}
@@ -0,0 +1,178 @@
+/*
+    Copyright 2020 by Murray Altheim. All rights reserved. This file is part of
+    the Raspberry Pi Master to Arduino Slave (pimaster2ardslave) project and is
+    released under the MIT License. Please see the LICENSE file included as part
+    of this package.
+
+      author:   Murray Altheim
+      created:  2020-05-18
+      modified: 2020-05-25
+
+    A host driver for the slave core, compiled natively against the mocks
+    in host/include. It reads one request per line from stdin and writes one
+    reply per line to stdout, so that it can be driven over a pipe by the
+    HostSlave class in lib/host_slave.py. Bytes are written as two-digit hex.
+
+      w <bytes...>      a write by the master; replies with the nanoseconds
+                        spent in the onReceive callback
+      r                 a read by the master; replies with the nanoseconds
+                        spent in the onRequest callback then the bytes written
+      l                 one sample by the sketch's loop(), whether or not
+                        one is due
+      t <micros>        advance the time, taking any samples due in a capture
+                        at the times they fall due, as the sketch's loop()
+                        does in place of a delay
+      i <pin> <level>   set the level presented to a digital pin, calling
+                        any interrupt attached to it on a matching edge
+      a <pin> <value>   set the raw value presented to an analog pin
+      n <pin> <values...> set raw values presented to an analog pin in turn,
+                        one per analogRead(), repeating
+      o <pin>           reply with the level of a pin
+      s                 reply with the slave's state (see state())
+      e <0|1>           set isEchoTest
+      q                 quit
+
+    Unrecognised requests reply with "?". Pass -v on the command line to have
+    the verbose serial output written to stderr.
+*/
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+#include "../i2cSlaveCore.h"
+
+static long long nanos() {
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (long long) ts.tv_sec * 1000000000LL + ts.tv_nsec;
+}
+
+/**
+    As the sketch's setup(), without the ready blink.
+*/
+static void setup() {
+    resetPinAssignments();
+    resetPinValues();
+    setChangeMask(0);
+    Wire.begin(SLAVE_I2C_ADDRESS);
+    Wire.onReceive(receiveData);
+    Wire.onRequest(requestData);
+}
+
+/**
+    As the sketch's loop(), sampling whether or not a sample is due, as
+    if it were due now.
+*/
+static void loop() {
+    readPinAssignments(millis());
+    loopCount += 1;
+    if ( isVerbose ) {
+        serviceVerbose();
+    }
+}
+
+/**
+    Writes the state compared by the differential tests: the counters,
+    range, pending command, change mask, change queue, interrupt line,
+    capture, framing, sample generation and sample period, the pin, count and
+    period of each counter, then the assignment, value and analog mode of each pin.
+*/
+static void state() {
+    printf("%ld %ld %d %d %d %d %u %u %d %d %d %d %d %d %d %d %u %u", loopCount, requestCount, (int) analogMin, (int) analogMax,
+            isAutoRange ? 1 : 0, pendingCommand, changeMask, changeQueue.item_count(), isChangeLost ? 1 : 0,
+            mockLevels[INTERRUPT_PIN], capturePin, captureCount, captureOverflowed, captureMissed,
+            isFramed ? 1 : 0, lastSequence, (unsigned int) sampleGeneration, samplePeriod);
+    for ( int slot = 0; slot < MAX_COUNTERS; slot++ ) {
+        printf(" %d %lu %lu", counterPins[slot], counterCounts[slot], counterPeriods[slot]);
+    }
+    for ( int pin = 0; pin < 32; pin++ ) {
+        printf(" %d:%d:%d", pinAssignments[pin], pinValues[pin], analogModes[pin]);
+    }
+    printf("\n");
+}
+
+int main(int argc, char **argv) {
+    Serial.quiet = !( argc > 1 && strcmp(argv[1], "-v") == 0 );
+    setup();
+    char line[256];
+    uint8_t data[BUFFER_LENGTH * 4];
+    while ( fgets(line, sizeof(line), stdin) ) {
+        char *cursor = line + 1;
+        if ( line[0] == 'w' ) {
+            int length = 0;
+            char *end;
+            for ( long b = strtol(cursor, &end, 16); end != cursor && length < (int) sizeof(data);
+                    b = strtol(cursor, &end, 16) ) {
+                data[length++] = (uint8_t) b;
+                cursor = end;
+            }
+            long long t0 = nanos();
+            Wire.deliver(data, length);
+            printf("%lld\n", nanos() - t0);
+        } else if ( line[0] == 'r' ) {
+            long long t0 = nanos();
+            int length = Wire.request(data);
+            printf("%lld", nanos() - t0);
+            for ( int i = 0; i < length; i++ ) {
+                printf(" %02x", data[i]);
+            }
+            printf("\n");
+        } else if ( line[0] == 't' ) {
+            unsigned long target = mockMicros + strtoul(cursor, NULL, 10);
+            while ( capturePin >= 0 && (long) ( target - nextCaptureMicros ) >= 0 ) {
+                if ( (long) ( nextCaptureMicros - mockMicros ) > 0 ) {
+                    mockMicros = nextCaptureMicros;
+                }
+                serviceCapture();
+            }
+            mockMicros = target;
+            printf("ok\n");
+        } else if ( line[0] == 'l' ) {
+            loop();
+            printf("ok\n");
+        } else if ( line[0] == 'i' || line[0] == 'a' ) {
+            char *end;
+            int pin = (int) strtol(cursor, &end, 10);
+            int value = (int) strtol(end, NULL, 10);
+            if ( pin >= 0 && pin < MOCK_PIN_COUNT ) {
+                if ( line[0] == 'i' ) {
+                    mockSetLevel(pin, value);
+                } else {
+                    mockAnalog[pin] = value;
+                    mockAnalogCycleLength[pin] = 0;
+                }
+            }
+            printf("ok\n");
+        } else if ( line[0] == 'n' ) {
+            char *end;
+            int pin = (int) strtol(cursor, &end, 10);
+            int length = 0;
+            cursor = end;
+            if ( pin >= 0 && pin < MOCK_PIN_COUNT ) {
+                for ( long value = strtol(cursor, &end, 10); end != cursor && length < MOCK_CYCLE_LENGTH;
+                        value = strtol(cursor, &end, 10) ) {
+                    mockAnalogCycle[pin][length++] = (int) value;
+                    cursor = end;
+                }
+                mockAnalogCycleLength[pin] = length;
+                mockAnalogCycleIndex[pin] = 0;
+            }
+            printf("ok\n");
+        } else if ( line[0] == 'o' ) {
+            int pin = atoi(cursor);
+            printf("%d\n", pin >= 0 && pin < MOCK_PIN_COUNT ? mockLevels[pin] : 0);
+        } else if ( line[0] == 's' ) {
+            state();
+        } else if ( line[0] == 'e' ) {
+            isEchoTest = atoi(cursor) != 0;
+            printf("ok\n");
+        } else if ( line[0] == 'q' ) {
+            break;
+        } else {
+            printf("?\n");
+        }
+        fflush(stdout);
+    }
+    return 0;
+}
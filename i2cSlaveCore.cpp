@@ -0,0 +1,1332 @@
+/*
+    Copyright 2020 by Murray Altheim. All rights reserved. This file is part of
+    the Raspberry Pi Master to Arduino Slave (pimaster2ardslave) project and is
+    released under the MIT License. Please see the LICENSE file included as part
+    of this package.
+
+      author:   Murray Altheim
+      created:  2020-05-18
+      modified: 2020-05-25
+
+    The protocol core of the i2cSlave sketch. See i2cSlaveCore.h.
+*/
+
+#include <stdio.h>        // required for function sprintf
+#include "i2cSlaveCore.h"
+
+// constants .....................................
+int pinsAssigned = 10;                   // we support up to 32 IO pins (D0-D31, A0-A31)
+
+// flags/configuration ...........................
+boolean isVerbose = true;                // write verbose messages to serial console if true
+boolean isEchoTest = false;              // test: when true just echo input to output (default false)
+boolean isFramed = false;                // when true each write is a frame and each reply is framed
+boolean isAutoRange  = false;            // if true automatically adjust range (default false)
+boolean isConstrainAnalogValue = true;   // use constraints to limit the analog value?
+float analogMinDefault = 70.0;           // default minimum of the analog range
+float analogMin = analogMinDefault;      // the minimum expected value from the analog sensor (28 observed on IR)
+float analogMaxDefault = 600.0;          // default minimum of the analog range
+float analogMax = analogMaxDefault;      // the maximum expected value from the analog sensor (685 observed on IR)
+
+// variables .....................................
+ArduinoQueue<byte> inputQueue(QUEUE_LENGTH);
+ArduinoQueue<byte> outputQueue(QUEUE_LENGTH);
+ArduinoQueue<int> changeQueue(CHANGE_QUEUE_LENGTH); // change events awaiting the master
+unsigned int changeMask = 0;             // pins whose changes are queued (bit n for pin n)
+boolean isChangeLost = false;            // true if a change was dropped since the last read
+unsigned long captureBuffer[CAPTURE_LENGTH]; // ring buffer of captured samples
+volatile byte captureHead = 0;           // index of the oldest captured sample
+volatile byte captureCount = 0;          // number of captured samples buffered
+int capturePin = -1;                     // the pin being captured, -1 if none
+unsigned int capturePeriod = 0;          // the capture period in microseconds
+unsigned long nextCaptureMicros = 0;     // when the next sample is due
+byte captureOverflowed = 0;              // samples dropped on a full buffer since the last read
+byte captureMissed = 0;                  // sample times missed since the last read
+int counterPins[MAX_COUNTERS] = { -1, -1, -1 }; // the pin of each counter, -1 if free
+volatile unsigned long counterCounts[MAX_COUNTERS] = {};  // edges counted since the last reset
+volatile unsigned long counterPeriods[MAX_COUNTERS] = {}; // µs between the last two edges, 0 until two are counted
+volatile unsigned long counterLastMicros[MAX_COUNTERS] = {}; // when the last edge was counted
+volatile boolean counterIsTimed[MAX_COUNTERS] = {}; // true once an edge has been counted
+int pendingCommand  = NO_COMMAND;        // a block command awaiting its payload
+int lastSequence    = -1;                // the sequence number of the last frame executed, -1 if none
+byte frame[QUEUE_LENGTH];                // the last framed reply, replayed upon a retry
+byte frameLength    = 0;                 // the length of the last framed reply
+int pinAssignments[32] = {};             // how the pin is assigned
+int pinValues[32] = {};                  // the value of the pin (if it's an input pin)
+byte analogModes[32] = {};               // the analog mode of the pin (ANALOG_MODE_SCALED)
+byte analogParameters[32] = {};          // the parameter of the analog mode, e.g., sample count
+int emaValues[32] = {};                  // the EMA of an ANALOG_MODE_EMA pin in sixteenths, -1 if unset
+long loopCount      = 0;                 // number of times loop() has been called
+uint16_t sampleGeneration = 0;           // number of times the pins have been read, wrapping at 16 bits
+unsigned long sampleMillis = 0;          // when the pins were last read
+unsigned int samplePeriod = LOOP_DELAY_MS; // the period on which the pins are read, in milliseconds
+unsigned long nextSampleMillis = 0;      // when the pins are next due to be read
+unsigned long lastVerboseMillis = 0;     // when the last verbose status display began
+int verbosePin      = -1;                // the next pin of the verbose status display, -1 if none under way
+boolean isConfigChanged = false;         // true if the master has changed the configuration since the last display
+long requestCount   = 0;                 // number of times request has been called (actually, when queue is emptied)
+char buf[100];                           // used by sprintf
+
+// functions ...................................................................
+
+/**
+    Sends the contents of the queue byte-by-byte (LSB, MSB) over
+    the Wire until the output queue is empty. If the output queue
+    is empty, sends EMPTY_QUEUE as an error message.
+*/
+void requestData() {
+    if ( outputQueue.isEmpty() ) {
+        if ( isFramed ) {
+            queueFrameError(0, FRAME_NO_REPLY);
+        } else {
+            queueForOutput(EMPTY_QUEUE);
+        }
+    }
+    while ( !outputQueue.isEmpty() ) {
+        Wire.write(outputQueue.dequeue());
+    }
+}
+
+/**
+    Receives notification that data is available over the Wire,
+    pushing each byte onto the data queue. This function is
+    called repeatedly but doesn't cause the incoming data to be
+    interpreted until a command (2 bytes) has been received,
+    plus for block commands, its payload.
+
+    The bytes may arrive one per write or all at once, e.g., as the
+    write half of a combined write-read (repeated start) transaction.
+    If a write completes a command but carries more bytes than the
+    command requires, the surplus is discarded and TOO_MUCH_DATA is
+    returned in place of the command's response.
+*/
+void receiveData(int byteCount) {
+    if ( isFramed ) {
+        receiveFrame(byteCount);
+        return;
+    }
+    for (int i = 0; i < byteCount; i++) {
+        byte b = Wire.read();
+        inputQueue.enqueue(b);
+        outputQueue.enqueue(b);
+    }
+    if ( pendingCommand == NO_COMMAND && inputQueue.item_count() >= 2 ) { // command is complete
+        byte loByte = inputQueue.dequeue();
+        byte hiByte = inputQueue.dequeue();
+        pendingCommand = (int16_t)( loByte | ( hiByte << 8 ) ); // as a 16 bit int on any platform
+    }
+    if ( pendingCommand != NO_COMMAND && inputQueue.item_count() >= payloadLength(pendingCommand) ) {
+        requestCount += 1;
+        int inputData = pendingCommand;
+        pendingCommand = NO_COMMAND;
+        clearOutputQueue();
+        if ( isEchoTest ) {
+            queueForOutput(inputData);
+        } else if ( isBlockCommand(inputData) ) {
+            handleBlockCommand(inputData);
+        } else {
+            queueForOutput(handleCommand(inputData));
+        }
+        if ( !inputQueue.isEmpty() ) { // surplus bytes in this write
+            clearInputQueue();
+            clearOutputQueue();
+            queueForOutput(TOO_MUCH_DATA);
+        }
+    }
+}
+
+/**
+    Receives a frame, which in framed mode is the whole of each write: a
+    sequence number, the command (LSB, MSB), its payload and a CRC-8 of
+    the preceding bytes. Nothing is carried over from one write to the
+    next, so a lost or corrupted write cannot put the slave out of step.
+
+    The reply is framed in turn (see queueFrame()). If the CRC does not
+    match or the length does not suit the command nothing is executed
+    and the reply carries only an error status. A frame whose sequence
+    number is that of the last frame executed is a retry by the master,
+    whose reply was lost: the last reply is replayed rather than the
+    command executed again, so that a retried read of change events or
+    captured samples loses none, and a retried write is not repeated.
+*/
+void receiveFrame( int byteCount ) {
+    clearInputQueue();
+    clearOutputQueue();
+    pendingCommand = NO_COMMAND;
+    byte sequence = 0;
+    byte crc = 0;
+    byte receivedCrc = 0;
+    for ( int i = 0; i < byteCount; i++ ) {
+        byte b = Wire.read();
+        if ( i == byteCount - 1 ) {
+            receivedCrc = b;
+        } else {
+            crc = crc8(crc, b);
+            if ( i == 0 ) {
+                sequence = b;
+            } else {
+                inputQueue.enqueue(b);
+            }
+        }
+    }
+    if ( byteCount < 4 ) {
+        clearInputQueue();
+        queueFrameError(sequence, FRAME_BAD_LENGTH);
+        return;
+    } else if ( crc != receivedCrc ) {
+        clearInputQueue();
+        queueFrameError(sequence, FRAME_BAD_CRC);
+        return;
+    } else if ( sequence == lastSequence ) {
+        clearInputQueue();
+        replayFrame();
+        return;
+    }
+    byte loByte = inputQueue.dequeue();
+    byte hiByte = inputQueue.dequeue();
+    int command = (int16_t)( loByte | ( hiByte << 8 ) );
+    if ( inputQueue.item_count() != payloadLength(command) ) {
+        clearInputQueue();
+        queueFrameError(sequence, FRAME_BAD_LENGTH);
+        return;
+    }
+    requestCount += 1;
+    if ( isEchoTest ) {
+        queueForOutput(command);
+    } else if ( isBlockCommand(command) ) {
+        handleBlockCommand(command);
+    } else {
+        queueForOutput(handleCommand(command));
+    }
+    lastSequence = sequence;
+    queueFrame(sequence, FRAME_OK);
+}
+
+/**
+    Frames the reply in the output queue: the sequence number of the
+    request and a byte of the status and the reply's length (shifted by
+    FRAME_LENGTH_SHIFT) precede it, and a CRC-8 of the whole follows, so
+    that the master may find the end of a reply shorter than it reads.
+    The framed reply is kept so that it may be replayed. A reply is at
+    most QUEUE_LENGTH - FRAME_OVERHEAD bytes.
+*/
+void queueFrame( byte sequence, byte status ) {
+    frameLength = 0;
+    frame[frameLength++] = sequence;
+    frame[frameLength++] = status;
+    while ( !outputQueue.isEmpty() && frameLength < QUEUE_LENGTH - 1 ) {
+        frame[frameLength++] = outputQueue.dequeue();
+    }
+    clearOutputQueue();
+    frame[1] = status | ( ( frameLength - 2 ) << FRAME_LENGTH_SHIFT );
+    byte crc = 0;
+    for ( int i = 0; i < frameLength; i++ ) {
+        crc = crc8(crc, frame[i]);
+    }
+    frame[frameLength++] = crc;
+    replayFrame();
+}
+
+/**
+    Queues a framed reply carrying only an error status, leaving the last
+    reply to be replayed.
+*/
+void queueFrameError( byte sequence, byte status ) {
+    outputQueue.enqueue(sequence);
+    outputQueue.enqueue(status);
+    outputQueue.enqueue(crc8(crc8(0, sequence), status));
+}
+
+/**
+    Queues the last framed reply again.
+*/
+void replayFrame() {
+    for ( int i = 0; i < frameLength; i++ ) {
+        outputQueue.enqueue(frame[i]);
+    }
+}
+
+/**
+    Returns the CRC-8 (polynomial 0x07, as SMBus) of the data byte
+    following the CRC of the bytes before it, 0 for the first byte.
+*/
+byte crc8( byte crc, byte data ) {
+    crc ^= data;
+    for ( int bit = 0; bit < 8; bit++ ) {
+        crc = ( crc & 0x80 ) ? ( crc << 1 ) ^ 0x07 : crc << 1;
+    }
+    return crc;
+}
+
+/**
+    Enables or disables framed mode. The reply to this command is framed
+    if the request was, i.e., when disabling but not when enabling.
+    Returns the framing state.
+*/
+int setFraming( boolean enabled ) {
+    isFramed = enabled;
+    lastSequence = -1;
+    frameLength = 0;
+    return isFramed ? 1 : 0;
+}
+
+/**
+    Returns true if the command is a block command, i.e., one whose
+    response is written directly to the output queue.
+*/
+boolean isBlockCommand( int command ) {
+    return command == CMD_READ_ALL_PINS
+            || command == CMD_READ_PINS
+            || command == CMD_SET_ANALOG_MODE
+            || command == CMD_SET_CHANGE_MASK
+            || command == CMD_READ_CHANGES
+            || command == CMD_START_CAPTURE
+            || command == CMD_READ_CAPTURE
+            || command == CMD_HANDSHAKE
+            || command == CMD_APPLY_PIN_MAP
+            || command == CMD_SET_FRAMING
+            || command == CMD_WRITE_OUTPUTS
+            || command == CMD_READ_PINS_GENERATION
+            || command == CMD_SET_SAMPLE_PERIOD
+            || command == CMD_CONFIGURE_COUNTER
+            || command == CMD_READ_COUNTERS;
+}
+
+/**
+    Returns the number of payload bytes that follow the two bytes of
+    the command. This is zero for all but some block commands.
+*/
+int payloadLength( int command ) {
+    if ( isEchoTest ) {
+        return 0;
+    }
+    switch ( command ) {
+        case CMD_READ_PINS:
+            return 2;
+        case CMD_SET_ANALOG_MODE:
+            return 3;
+        case CMD_SET_CHANGE_MASK:
+            return 2;
+        case CMD_START_CAPTURE:
+            return 3;
+        case CMD_APPLY_PIN_MAP:
+            return PIN_MAP_LENGTH;
+        case CMD_SET_FRAMING:
+            return 1;
+        case CMD_WRITE_OUTPUTS:
+            return 4;
+        case CMD_READ_PINS_GENERATION:
+            return 2;
+        case CMD_SET_SAMPLE_PERIOD:
+            return 2;
+        case CMD_CONFIGURE_COUNTER:
+            return 2;
+        case CMD_READ_COUNTERS:
+            return 3;
+        default:
+            return 0;
+    }
+}
+
+/**
+    Reads the pins (see readPinAssignments()) if they are due, as called
+    repeatedly by loop(), which otherwise never waits: the pins are read
+    every samplePeriod milliseconds. Should the loop fall behind (e.g., on
+    a long calculation of an analog mode) the samples missed are skipped
+    rather than taken in a burst, keeping to the period's phase. The loop
+    count is the number of samples taken.
+
+    The sample's time is that at which it was due rather than when the
+    pins were read, since the schedule keeps to the due times: the next
+    sample is then due one period after the sample's time, however long
+    the pins took to read (see CMD_READ_PINS_GENERATION).
+
+    The period and schedule may be set by the Wire callback (see
+    setSamplePeriod()), so they are read and advanced with interrupts
+    disabled.
+*/
+void serviceSampler() {
+    unsigned long now = millis();
+    noInterrupts(); // the period and schedule are set by the Wire callback
+    if ( (long) ( now - nextSampleMillis ) < 0 ) {
+        interrupts();
+        return;
+    }
+    if ( (long) ( now - nextSampleMillis ) >= (long) samplePeriod ) { // fell behind
+        nextSampleMillis += ( ( now - nextSampleMillis ) / samplePeriod ) * samplePeriod;
+    }
+    unsigned long dueMillis = nextSampleMillis;
+    nextSampleMillis += samplePeriod;
+    interrupts();
+    readPinAssignments(dueMillis);
+    loopCount += 1;
+}
+
+/**
+    Sets the period on which the pins are read, in milliseconds, of at
+    least MIN_SAMPLE_PERIOD_MS. The next sample is due one period after
+    the last. Returns the period, or UNRECOGNISED_COMMAND if too short.
+*/
+int setSamplePeriod( unsigned int period ) {
+    if ( period < MIN_SAMPLE_PERIOD_MS ) {
+        return UNRECOGNISED_COMMAND;
+    }
+    samplePeriod = period;
+    nextSampleMillis = sampleMillis + period;
+    isConfigChanged = true;
+    return period;
+}
+
+/**
+    Set the stored values for each assigned pin. For input pins
+    this reads the pins and stores their values, for output pins
+    this takes the set value and writes it to the pin.
+
+    If an input pin is selected by the change mask and its value (as
+    returned by getValueOf()) has changed, a change event is queued,
+    and the interrupt line raised to tell the master. As the Wire callback
+    also reads the queue, this is done with interrupts disabled.
+
+    Each call begins a new sample generation, recording the given time
+    (in millis()) as the sample's, so that the master may tell whether
+    the values have been refreshed since it last read them, and when they
+    will next be (see CMD_READ_PINS_GENERATION).
+
+    Nothing is written to the serial port here: see serviceVerbose().
+*/
+void readPinAssignments( unsigned long sampledMillis ) {
+    for ( int pin = 0; pin < pinsAssigned; pin++ ) {
+        int pinType = pinAssignments[pin];
+        boolean isNotify = pin < 16 && ( changeMask & ( 1 << pin ) );
+        int previousValue = isNotify ? getValueOf(pin) : 0;
+        if  (pinType ==  PIN_INPUT_DIGITAL || pinType == PIN_INPUT_COUNTER ) {
+            pinValues[pin] = digitalRead(pin);
+        } else if (pinType ==  PIN_INPUT_ANALOG ) {
+            int analogValue = readAnalogValue(pin);
+            adjustAutoRange(analogValue);
+            pinValues[pin] = analogValue;
+        } else if (pinType ==  PIN_INPUT_DIGITAL_PULLUP ) {
+            pinValues[pin] = !digitalRead(pin);
+        } else if (pinType ==  PIN_OUTPUT ) {
+            if ( pinValues[pin] == 0 ) {
+                digitalWrite(pin, LOW);
+            } else {
+                digitalWrite(pin, HIGH);
+            }
+        }
+        if ( isNotify && ( pinType == PIN_INPUT_DIGITAL || pinType == PIN_INPUT_DIGITAL_PULLUP
+                || pinType == PIN_INPUT_ANALOG || pinType == PIN_INPUT_COUNTER ) ) {
+            int value = getValueOf(pin);
+            if ( value != previousValue ) {
+                noInterrupts(); // the queue is also read and cleared by the Wire callback
+                queueChange(pin, value);
+                if ( !changeQueue.isEmpty() ) {
+                    digitalWrite(INTERRUPT_PIN, HIGH);
+                }
+                interrupts();
+            }
+        }
+    }
+    noInterrupts(); // both are read by the Wire callback
+    sampleGeneration += 1;
+    sampleMillis = sampledMillis;
+    interrupts();
+}
+
+/**
+    Writes the verbose status display, as called repeatedly by loop() if
+    isVerbose, and never by the sampler or the Wire callbacks. At most once
+    per VERBOSE_INTERVAL_MS this begins a display of a header line, then
+    each following call writes the line of one pin, so that no call writes
+    more than a line: the serial port blocks once its buffer is full, and
+    would otherwise delay the next sample or captured sample.
+*/
+void serviceVerbose() {
+    if ( verbosePin < 0 ) {
+        if ( millis() - lastVerboseMillis < VERBOSE_INTERVAL_MS ) {
+            return;
+        }
+        lastVerboseMillis = millis();
+        sprintf(buf, "\n[%05ld] %d pins read every %u ms%s", loopCount, pinsAssigned, samplePeriod,
+                isConfigChanged ? "; reconfigured." : ".");
+        isConfigChanged = false;
+        Serial.println(buf);
+        verbosePin = 0;
+    } else {
+        displayPin(verbosePin);
+        verbosePin += 1;
+        if ( verbosePin >= pinsAssigned ) {
+            verbosePin = -1;
+        }
+    }
+}
+
+/**
+    Displays the configured type and stored value of the pin.
+*/
+void displayPin( int pin ) {
+    switch ( pinAssignments[pin] ) {
+        case PIN_INPUT_DIGITAL:
+            sprintf(buf, "pin %2d : INPUT;       \tvalue: %4d", pin, pinValues[pin]);
+            break;
+        case PIN_INPUT_DIGITAL_PULLUP:
+            sprintf(buf, "pin %2d : INPUT_PULLUP;\tvalue: %4d", pin, pinValues[pin]);
+            break;
+        case PIN_INPUT_ANALOG:
+            sprintf(buf, "pin %2d : INPUT_ANALOG;\tvalue: %4d", pin, pinValues[pin]);
+            break;
+        case PIN_OUTPUT:
+            sprintf(buf, "pin %2d : OUTPUT;      \tvalue: %4d", pin, pinValues[pin]);
+            break;
+        case PIN_INPUT_COUNTER:
+            sprintf(buf, "pin %2d : COUNTER;     \tvalue: %4d", pin, pinValues[pin]);
+            break;
+        case PIN_UNUSED:
+            sprintf(buf, "pin %2d : UNUSED", pin);
+            break;
+        default:
+            sprintf(buf, "pin %2d : DEFAULT", pin);
+    }
+    Serial.println(buf);
+}
+
+/**
+    Display the configured types and stored values of all pins at once.
+*/
+void displayPinAssignments() {
+    sprintf(buf, "\n[%05ld] display pin assignments...", loopCount);
+    Serial.println(buf);
+    for ( int pin = 0; pin < pinsAssigned; pin++ ) {
+        displayPin(pin);
+    }
+}
+
+/**
+    Interprets the data as a command. If the data value is smaller than or
+    equal to the pin count the stored value for that pin is returned.
+
+    If the data value is larger than the pin count the offset indicates
+    its interpretation:
+
+      0-31:       return the output data for that pin assignment, -1 if the pin is not assigned
+      32-63:      set the pin (n-32) as an INPUT pin, return pin number
+      64-95:      set the pin (n-64) as an INPUT_PULLUP pin, return pin number
+      96-127:     set the pin (n-96) as an INPUT_ANALOG pin, return pin number
+      128-159:    set the pin (n-128) as an OUTPUT pin, return pin number
+      160-191:    write output for pin (n-160) to LOW, return 0
+      192-223:    write output for pin (n-192) to HIGH, return 1
+      224:        echo input
+      225:        set request count to zero
+      226:        return request count
+      227:        set loop count to zero
+      228:        return loop count
+      229:        clear queues, return 0
+      230:        return IR analog minimum range
+      231:        return IR analog maximum range
+      232:        disable auto-ranging, return 0
+      233:        enable auto-ranging, return 1
+      234:        block: return the value of each assigned pin (see handleBlockCommand())
+      235:        block: return the value of each pin in the payload's pin mask
+      236:        block: set the analog mode of the pin in the payload, return pin
+      237:        block: set the change mask to the payload's pin mask, return mask
+      238:        block: return the pending change events
+      240-255:    error values
+      256:        block: start capturing the pin in the payload, return pin
+      257:        stop capturing, return the number of samples still buffered
+      258:        block: return the captured samples
+      259:        block: return the protocol and firmware versions and configuration hash
+      260:        block: apply the pin map in the payload, return pins changed and configuration hash
+      261:        block: enable or disable framed mode (see receiveFrame()), return the framing state
+      262:        block: write the output pins in the payload's pin mask, return the pins written
+      263:        block: return the sample generation and age, then the value of each pin in the payload's pin mask
+      264:        block: set the sample period to the payload's milliseconds, return the period
+      265:        block: count the edges of the pin in the payload, return pin
+      266:        block: return (and optionally reset) the counters of the pins in the payload's pin mask
+*/
+int handleCommand( int data ) {
+    if ( data >= 0 && data < 32 ) { // 0-31:  return the output data for that pin assignment, -1 if the pin is not assigned
+        return getValueOf(data);
+    } else if ( inRange(data, 32, 64) ) { //              32-63:  set the pin (n-32) as an PIN_INPUT_DIGITAL pin, return pin number
+        int pin = data - 32;
+        setPinAssignment(pin, PIN_INPUT_DIGITAL);
+        return pin;
+    } else if ( inRange(data, 64, 96) ) { //              64-95:  set the pin (n-64) as an PIN_INPUT_DIGITAL_PULLUP pin, return pin number
+        int pin = data - 64;
+        setPinAssignment(pin, PIN_INPUT_DIGITAL_PULLUP);
+        return pin;
+    } else if ( inRange(data, 96, 128) ) { //             64-95:  set the pin (n-64) as an PIN_INPUT_ANALOG pin, return pin number
+        int pin = data - 96;
+        setPinAssignment(pin, PIN_INPUT_ANALOG);
+        return pin;
+    } else if ( inRange(data, 128, 160)  ) { //         128-159:  set the pin (n-96) as an OUTPUT pin, return pin number
+        int pin = data - 128;
+        setPinAssignment(pin, PIN_OUTPUT);
+        return pin;
+    } else if ( inRange(data, 160, 192) ) { //          160-191:  write output for pin (n-160) to LOW, return 0
+        int pin = data - 160;
+        digitalWrite(pin, LOW);
+        return 0;
+    } else if ( inRange(data, 192, 224) ) { //          192-223:  write output for pin (n-192) to HIGH, return 1
+        int pin = data - 192;
+        digitalWrite(pin, HIGH);
+        return 1;
+    } else if ( data == CMD_ECHO_INPUT ) { //           224:      echo input
+        return data;
+    } else if ( data == CMD_CLEAR_REQUEST_COUNT ) { //  225:      clear request count, return 0
+        requestCount = 0;
+        return requestCount;
+    } else if ( data == CMD_RETURN_REQUEST_COUNT ) { // 226:      return request count
+        return requestCount;
+    } else if ( data == CMD_CLEAR_LOOP_COUNT ) { //     227:      clear loop count, return 0
+        loopCount = 0;
+        return loopCount;
+    } else if ( data == CMD_RETURN_LOOP_COUNT ) { //    228:      return loop count
+        return loopCount;
+    } else if ( data == CMD_CLEAR_QUEUES ) { //         229:      clear queues, return 0
+        pendingCommand = NO_COMMAND;
+        clearInputQueue();
+        clearOutputQueue();
+        return 0;
+    } else if ( data == CMD_RETURN_ANALOG_MIN_RANGE ) { //  230:  return analog minimum range
+        return analogMin;
+    } else if ( data == CMD_RETURN_ANALOG_MAX_RANGE ) { //  231:  return analog maximum range
+        return analogMax;
+    } else if ( data == CMD_DISABLE_AUTORANGE ) { //    232:      disable auto-ranging, return 0
+        isAutoRange  = false;
+        resetRange();
+        return 0;
+    } else if ( data == CMD_ENABLE_AUTORANGE ) { //     233:      enable auto-ranging, return 1
+        isAutoRange  = true;
+        resetRange();
+        return 1;
+    } else if ( data == CMD_STOP_CAPTURE ) { //         257:      stop capture, return samples buffered
+        return stopCapture();
+    } else if ( inRange(data, 240, 256) ) { //      240-255:      error values
+        return data;
+    } else { //                                        else:      unrecognised command error
+        return UNRECOGNISED_COMMAND;
+    }
+}
+
+/**
+    Handles a block command, dequeuing its payload (if any) from the input
+    queue and writing its response directly to the output queue, which
+    has room for sixteen 2 byte values:
+
+      234:        the value of each of the assigned pins (0 to pinsAssigned-1),
+                  in pin order, as returned by getValueOf()
+      235:        payload: a 2 byte pin mask (LSB, MSB), where bit n selects
+                  pin n. Returns the value of each selected pin, in pin order,
+                  as returned by getValueOf()
+      236:        payload: pin, mode and parameter bytes. Returns the result
+                  of setAnalogMode()
+      237:        payload: a 2 byte pin mask (LSB, MSB) selecting the pins whose
+                  changes are queued (see setChangeMask()). Returns the mask
+      238:        the change events (see readChanges())
+      256:        payload: pin, then the capture period in microseconds as
+                  2 bytes (LSB, MSB). Returns the result of startCapture()
+      258:        the captured samples (see readCapture())
+      262:        payload: a 2 byte pin mask then 2 bytes of levels (LSB, MSB),
+                  where bit n selects and sets the level of pin n. Returns
+                  the result of writeOutputs()
+      263:        payload: a 2 byte pin mask (LSB, MSB). Returns the sample
+                  generation (see readPinAssignments()), the milliseconds
+                  since it was due (at most 65535), then as 235 the
+                  value of each selected pin
+      264:        payload: the sample period in milliseconds, 2 bytes (LSB,
+                  MSB). Returns the result of setSamplePeriod()
+      265:        payload: pin and edges bytes. Returns the result of
+                  configureCounter()
+      266:        payload: a 2 byte pin mask (LSB, MSB), then 1 to reset the
+                  counts as they are read, otherwise 0. Returns the counters
+                  (see readCounters())
+*/
+void handleBlockCommand( int command ) {
+    if ( command == CMD_READ_ALL_PINS ) {
+        for ( int pin = 0; pin < pinsAssigned; pin++ ) {
+            queueForOutput(getValueOf(pin));
+        }
+    } else if ( command == CMD_READ_PINS ) {
+        unsigned int mask = inputQueue.dequeue();
+        mask |= ( inputQueue.dequeue() << 8 );
+        for ( int pin = 0; pin < 16; pin++ ) {
+            if ( mask & ( 1 << pin ) ) {
+                queueForOutput(getValueOf(pin));
+            }
+        }
+    } else if ( command == CMD_SET_ANALOG_MODE ) {
+        int pin = inputQueue.dequeue();
+        int mode = inputQueue.dequeue();
+        int parameter = inputQueue.dequeue();
+        queueForOutput(setAnalogMode(pin, mode, parameter));
+    } else if ( command == CMD_SET_CHANGE_MASK ) {
+        unsigned int mask = inputQueue.dequeue();
+        mask |= ( inputQueue.dequeue() << 8 );
+        setChangeMask(mask);
+        queueForOutput(changeMask);
+    } else if ( command == CMD_READ_CHANGES ) {
+        readChanges();
+    } else if ( command == CMD_START_CAPTURE ) {
+        int pin = inputQueue.dequeue();
+        unsigned int period = inputQueue.dequeue();
+        period |= ( inputQueue.dequeue() << 8 );
+        queueForOutput(startCapture(pin, period));
+    } else if ( command == CMD_READ_CAPTURE ) {
+        readCapture();
+    } else if ( command == CMD_HANDSHAKE ) {
+        queueForOutput(PROTOCOL_VERSION);
+        queueForOutput(FIRMWARE_VERSION);
+        queueForOutput(configHash());
+    } else if ( command == CMD_APPLY_PIN_MAP ) {
+        byte pinMap[PIN_MAP_LENGTH];
+        for ( int i = 0; i < PIN_MAP_LENGTH; i++ ) {
+            pinMap[i] = inputQueue.dequeue();
+        }
+        queueForOutput(applyPinMap(pinMap));
+        queueForOutput(configHash());
+    } else if ( command == CMD_SET_FRAMING ) {
+        queueForOutput(setFraming(inputQueue.dequeue() != 0));
+    } else if ( command == CMD_WRITE_OUTPUTS ) {
+        unsigned int mask = inputQueue.dequeue();
+        mask |= ( inputQueue.dequeue() << 8 );
+        unsigned int levels = inputQueue.dequeue();
+        levels |= ( inputQueue.dequeue() << 8 );
+        queueForOutput(writeOutputs(mask, levels));
+    } else if ( command == CMD_READ_PINS_GENERATION ) {
+        unsigned int mask = inputQueue.dequeue();
+        mask |= ( inputQueue.dequeue() << 8 );
+        unsigned long age = millis() - sampleMillis;
+        queueForOutput(sampleGeneration);
+        queueForOutput(age < 0xFFFFUL ? (unsigned int) age : 0xFFFF);
+        for ( int pin = 0; pin < 16; pin++ ) {
+            if ( mask & ( 1 << pin ) ) {
+                queueForOutput(getValueOf(pin));
+            }
+        }
+    } else if ( command == CMD_SET_SAMPLE_PERIOD ) {
+        unsigned int period = inputQueue.dequeue();
+        period |= ( inputQueue.dequeue() << 8 );
+        queueForOutput(setSamplePeriod(period));
+    } else if ( command == CMD_CONFIGURE_COUNTER ) {
+        int pin = inputQueue.dequeue();
+        int edges = inputQueue.dequeue();
+        queueForOutput(configureCounter(pin, edges));
+    } else if ( command == CMD_READ_COUNTERS ) {
+        unsigned int mask = inputQueue.dequeue();
+        mask |= ( inputQueue.dequeue() << 8 );
+        readCounters(mask, inputQueue.dequeue() != 0);
+    }
+}
+
+/**
+    Sets the mask of pins (bit n for pin n, pins 0-15) whose changes are
+    queued as events, discarding any events already queued and lowering
+    the interrupt line.
+*/
+void setChangeMask( unsigned int mask ) {
+    changeMask = mask;
+    while ( !changeQueue.isEmpty() ) {
+        changeQueue.dequeue();
+    }
+    isChangeLost = false;
+    pinMode(INTERRUPT_PIN, OUTPUT);
+    digitalWrite(INTERRUPT_PIN, LOW);
+}
+
+/**
+    Queues a change event for the pin. If the queue is full the event is
+    dropped, and the loss reported with the next read of the events.
+    Must be called with interrupts disabled, as the queue is shared with
+    the Wire callback (see readChanges()).
+*/
+void queueChange( int pin, int value ) {
+    if ( !changeQueue.enqueue(( pin << CHANGE_PIN_SHIFT ) | ( value & CHANGE_VALUE_MASK )) ) {
+        isChangeLost = true;
+    }
+}
+
+/**
+    Writes up to CHANGE_BATCH queued change events to the output queue,
+    preceded by a 2 byte header: the number of events (LSB), and flags
+    (MSB) of CHANGES_PENDING if more events remain queued and CHANGES_LOST
+    if any events were dropped since the last read. Each event is written
+    as a 2 byte ( pin << 10 ) | value. The interrupt line is lowered once
+    the queue is empty.
+*/
+void readChanges() {
+    int count = min(changeQueue.item_count(), CHANGE_BATCH);
+    int flags = isChangeLost ? CHANGES_LOST : 0;
+    isChangeLost = false;
+    if ( changeQueue.item_count() > count ) {
+        flags |= CHANGES_PENDING;
+    }
+    queueForOutput(count | ( flags << 8 ));
+    for ( int i = 0; i < count; i++ ) {
+        queueForOutput(changeQueue.dequeue());
+    }
+    if ( changeQueue.isEmpty() ) {
+        digitalWrite(INTERRUPT_PIN, LOW);
+    }
+}
+
+/**
+    Starts capturing the input pin every 'period' microseconds into the
+    capture buffer, discarding any samples already buffered. Analog pins
+    are captured as raw 10 bit values regardless of their analog mode.
+    Returns the pin, or UNRECOGNISED_COMMAND if the pin is not an input
+    or the period is shorter than CAPTURE_MIN_PERIOD.
+*/
+int startCapture( int pin, unsigned int period ) {
+    if ( pin >= pinsAssigned || period < CAPTURE_MIN_PERIOD
+            || !( pinAssignments[pin] == PIN_INPUT_DIGITAL || pinAssignments[pin] == PIN_INPUT_DIGITAL_PULLUP
+                || pinAssignments[pin] == PIN_INPUT_ANALOG ) ) {
+        return UNRECOGNISED_COMMAND;
+    }
+    captureHead = 0;
+    captureCount = 0;
+    captureOverflowed = 0;
+    captureMissed = 0;
+    capturePeriod = period;
+    nextCaptureMicros = micros();
+    capturePin = pin;
+    return pin;
+}
+
+/**
+    Stops capturing, returning the number of samples still buffered,
+    which may be read as usual.
+*/
+int stopCapture() {
+    capturePin = -1;
+    return captureCount;
+}
+
+/**
+    Takes a sample of the capture pin if one is due, called repeatedly
+    from loop() in place of a delay. If the loop was held up for longer
+    than a period the sample times missed are counted. If the buffer is
+    full the sample is dropped and counted as overflowed.
+
+    The capture is started, stopped and read by the Wire callback, so its
+    schedule and counts are updated with interrupts disabled. A sample
+    taken while the capture was stopped (or moved to another pin) is
+    dropped.
+*/
+void serviceCapture() {
+    unsigned long now = micros();
+    noInterrupts(); // the capture is started, stopped and read by the Wire callback
+    int pin = capturePin;
+    if ( pin < 0 || (long) ( now - nextCaptureMicros ) < 0 ) {
+        interrupts();
+        return;
+    }
+    unsigned long late = ( now - nextCaptureMicros ) / capturePeriod;
+    if ( late > 0 ) {
+        captureMissed = min(captureMissed + late, 255UL);
+        nextCaptureMicros += late * capturePeriod;
+    }
+    nextCaptureMicros += capturePeriod;
+    interrupts();
+    int value;
+    if ( pinAssignments[pin] == PIN_INPUT_ANALOG ) {
+        value = analogRead(pin);
+    } else if ( pinAssignments[pin] == PIN_INPUT_DIGITAL_PULLUP ) {
+        value = !digitalRead(pin);
+    } else {
+        value = digitalRead(pin);
+    }
+    unsigned long sample = ( ( now & CAPTURE_TICK_MASK ) << CAPTURE_VALUE_BITS ) | ( value & CHANGE_VALUE_MASK );
+    noInterrupts(); // the buffer is drained by the Wire callback
+    if ( capturePin != pin ) { // stopped, or started on another pin, meanwhile
+        interrupts();
+        return;
+    }
+    if ( captureCount < CAPTURE_LENGTH ) {
+        captureBuffer[( captureHead + captureCount ) % CAPTURE_LENGTH] = sample;
+        captureCount++;
+    } else if ( captureOverflowed < 255 ) {
+        captureOverflowed++;
+    }
+    interrupts();
+}
+
+/**
+    Writes up to CAPTURE_BATCH captured samples to the output queue,
+    oldest first, preceded by a 4 byte header: the number of samples,
+    flags (CAPTURE_RUNNING, and CAPTURE_PENDING if more samples remain
+    buffered), and the number of samples overflowed and sample times
+    missed since the last read (each saturating at 255). Each sample is
+    written as 4 bytes (LSB first) of ( tick << 10 ) | value, where the
+    tick is the low 22 bits of micros() when the sample was taken. In
+    framed mode one sample fewer is written, leaving room for the framing.
+*/
+void readCapture() {
+    int count = min(captureCount, isFramed ? CAPTURE_BATCH - 1 : CAPTURE_BATCH);
+    int flags = capturePin >= 0 ? CAPTURE_RUNNING : 0;
+    if ( captureCount > count ) {
+        flags |= CAPTURE_PENDING;
+    }
+    queueForOutput(count | ( flags << 8 ));
+    queueForOutput(captureOverflowed | ( captureMissed << 8 ));
+    captureOverflowed = 0;
+    captureMissed = 0;
+    for ( int i = 0; i < count; i++ ) {
+        unsigned long sample = captureBuffer[captureHead];
+        captureHead = ( captureHead + 1 ) % CAPTURE_LENGTH;
+        captureCount--;
+        queueForOutput(sample & 0xFFFF);
+        queueForOutput(sample >> 16);
+    }
+}
+
+/**
+    Counts the edges of the pin (see countEdge()), discarding any count
+    it already has: rising, falling or both edges according to the edges
+    byte (COUNT_RISING, COUNT_FALLING or COUNT_BOTH), with its internal
+    pullup enabled if COUNT_PULLUP is also set. The edges are counted by
+    the pin's external interrupt, so that no edge is missed however fast
+    the pulses relative to the sample period. The pin's value is then its
+    level as last sampled. Returns the pin, or UNRECOGNISED_COMMAND if the
+    pin has no external interrupt (or is one of the Wire's), the edges are
+    invalid, or all MAX_COUNTERS counters are in use.
+*/
+int configureCounter( int pin, int edges ) {
+    if ( pin >= pinsAssigned || pin == SDA || pin == SCL || digitalPinToInterrupt(pin) == NOT_AN_INTERRUPT
+            || ( edges & COUNT_BOTH ) == 0 || ( edges & ~( COUNT_BOTH | COUNT_PULLUP ) ) != 0 ) {
+        return UNRECOGNISED_COMMAND;
+    }
+    stopCounter(pin);
+    int slot = 0;
+    while ( slot < MAX_COUNTERS && counterPins[slot] >= 0 ) {
+        slot++;
+    }
+    if ( slot == MAX_COUNTERS ) {
+        return UNRECOGNISED_COMMAND;
+    }
+    setPinAssignment(pin, ( edges & COUNT_PULLUP ) ? PIN_INPUT_DIGITAL_PULLUP : PIN_INPUT_DIGITAL);
+    pinAssignments[pin] = PIN_INPUT_COUNTER;
+    counterCounts[slot] = 0;
+    counterPeriods[slot] = 0;
+    counterIsTimed[slot] = false;
+    counterPins[slot] = pin;
+    void (*isr)() = slot == 0 ? countEdge0 : slot == 1 ? countEdge1 : countEdge2;
+    int mode = ( edges & COUNT_BOTH ) == COUNT_BOTH ? CHANGE : ( edges & COUNT_RISING ) ? RISING : FALLING;
+    attachInterrupt(digitalPinToInterrupt(pin), isr, mode);
+    return pin;
+}
+
+/**
+    Stops the counter of the pin, if it has one, freeing it.
+*/
+void stopCounter( int pin ) {
+    for ( int slot = 0; slot < MAX_COUNTERS; slot++ ) {
+        if ( counterPins[slot] == pin ) {
+            detachInterrupt(digitalPinToInterrupt(pin));
+            counterPins[slot] = -1;
+        }
+    }
+}
+
+/**
+    Counts an edge of the pin of the counter, as called by its interrupt
+    (via countEdge0() etc., as attachInterrupt() takes no argument). The
+    count is 32 bits, wrapping, and the period between this and the last
+    edge is kept in microseconds.
+*/
+void countEdge( byte slot ) {
+    unsigned long now = micros();
+    if ( counterIsTimed[slot] ) {
+        counterPeriods[slot] = now - counterLastMicros[slot];
+    }
+    counterLastMicros[slot] = now;
+    counterIsTimed[slot] = true;
+    counterCounts[slot]++;
+}
+
+void countEdge0() { countEdge(0); }
+void countEdge1() { countEdge(1); }
+void countEdge2() { countEdge(2); }
+
+/**
+    Writes the counters of the pins (0-15) selected by the mask to the
+    output queue, in pin order, preceded by a 6 byte header: the mask of
+    the pins whose counters follow, which omits any selected pin that is
+    not counting and any beyond the first COUNTER_BATCH (one fewer in
+    framed mode), then micros() as 4 bytes (LSB first). Each counter is
+    written as its count then its period (see countEdge()), each as 4
+    bytes (LSB first). If 'reset' is true each count is reset as it is
+    read, with interrupts held off so that no edge is lost between the
+    two.
+*/
+void readCounters( unsigned int mask, boolean reset ) {
+    int batch = isFramed ? COUNTER_BATCH - 1 : COUNTER_BATCH;
+    unsigned long counts[COUNTER_BATCH];
+    unsigned long periods[COUNTER_BATCH];
+    unsigned int read = 0;
+    int count = 0;
+#if defined(__AVR__)
+    uint8_t oldSREG = SREG; // interrupts are off in the Wire callback: restore rather than enable them
+    cli();
+#else
+    noInterrupts();
+#endif
+    for ( int pin = 0; pin < 16 && count < batch; pin++ ) {
+        if ( ( mask & ( 1 << pin ) ) && pinAssignments[pin] == PIN_INPUT_COUNTER ) {
+            for ( int slot = 0; slot < MAX_COUNTERS; slot++ ) {
+                if ( counterPins[slot] == pin ) {
+                    counts[count] = counterCounts[slot];
+                    periods[count] = counterPeriods[slot];
+                    if ( reset ) {
+                        counterCounts[slot] = 0;
+                    }
+                    read |= 1 << pin;
+                    count++;
+                }
+            }
+        }
+    }
+#if defined(__AVR__)
+    SREG = oldSREG;
+#else
+    interrupts();
+#endif
+    unsigned long now = micros();
+    queueForOutput(read);
+    queueForOutput(now & 0xFFFF);
+    queueForOutput(now >> 16);
+    for ( int i = 0; i < count; i++ ) {
+        queueForOutput(counts[i] & 0xFFFF);
+        queueForOutput(counts[i] >> 16);
+        queueForOutput(periods[i] & 0xFFFF);
+        queueForOutput(periods[i] >> 16);
+    }
+}
+
+/**
+    Sets the analog mode of the pin, which determines how its value is
+    read by readAnalogValue() and returned by getValueOf(). The mode takes
+    effect while the pin is assigned as PIN_INPUT_ANALOG. Returns the pin,
+    or UNRECOGNISED_COMMAND if the pin, mode or parameter is out of range.
+*/
+int setAnalogMode( int pin, int mode, int parameter ) {
+    if ( pin >= pinsAssigned ) {
+        return UNRECOGNISED_COMMAND;
+    }
+    switch ( mode ) {
+        case ANALOG_MODE_SCALED:
+        case ANALOG_MODE_RAW:
+            parameter = 1;
+            break;
+        case ANALOG_MODE_AVERAGE:
+            if ( !inRange(parameter, 1, MAX_AVERAGE_SAMPLES + 1) ) {
+                return UNRECOGNISED_COMMAND;
+            }
+            break;
+        case ANALOG_MODE_MEDIAN:
+            if ( !inRange(parameter, 1, MAX_MEDIAN_SAMPLES + 1) ) {
+                return UNRECOGNISED_COMMAND;
+            }
+            break;
+        case ANALOG_MODE_EMA:
+            if ( !inRange(parameter, 1, MAX_EMA_SHIFT + 1) ) {
+                return UNRECOGNISED_COMMAND;
+            }
+            break;
+        default:
+            return UNRECOGNISED_COMMAND;
+    }
+    analogModes[pin] = mode;
+    analogParameters[pin] = parameter;
+    emaValues[pin] = -1;
+    isConfigChanged = true;
+    return pin;
+}
+
+/**
+    Reads the analog pin according to its analog mode, returning a 10 bit
+    value: a single sample for ANALOG_MODE_SCALED and ANALOG_MODE_RAW, the
+    mean or median of several samples taken in succession, or the updated
+    exponential moving average of one sample per call.
+*/
+int readAnalogValue( int pin ) {
+    int mode = analogModes[pin];
+    int n = analogParameters[pin];
+    if ( mode == ANALOG_MODE_AVERAGE ) {
+        long sum = 0;
+        for ( int i = 0; i < n; i++ ) {
+            sum += analogRead(pin);
+        }
+        return ( sum + n / 2 ) / n;
+    } else if ( mode == ANALOG_MODE_MEDIAN ) {
+        int samples[MAX_MEDIAN_SAMPLES];
+        for ( int i = 0; i < n; i++ ) { // insertion sort as we go
+            int sample = analogRead(pin);
+            int j = i;
+            while ( j > 0 && samples[j - 1] > sample ) {
+                samples[j] = samples[j - 1];
+                j--;
+            }
+            samples[j] = sample;
+        }
+        return samples[n / 2];
+    } else if ( mode == ANALOG_MODE_EMA ) {
+        int scaled = analogRead(pin) << EMA_SCALE_SHIFT;
+        if ( emaValues[pin] < 0 ) {
+            emaValues[pin] = scaled;
+        } else {
+            emaValues[pin] += ( scaled - emaValues[pin] ) >> n;
+        }
+        return ( emaValues[pin] + ( 1 << ( EMA_SCALE_SHIFT - 1 ) ) ) >> EMA_SCALE_SHIFT;
+    } else {
+        return analogRead(pin);
+    }
+}
+
+/*
+    If the pin is any kind of input pin, return its value, otherwise PIN_ASSIGNED_AS_OUTPUT
+    (an error value).
+
+    If the pin is assigned as an analog pin its value may exceed the one byte limit. If the
+    isConstrainAnalogValue flag is true and the pin's analog mode is ANALOG_MODE_SCALED its
+    value will be either fixed-range or auto-range constrained to fit within 0 and 255;
+    otherwise the full 10 bit value is returned.
+*/
+int getValueOf( int pin ) {
+    if ( pinAssignments[pin] == PIN_INPUT_DIGITAL
+            || pinAssignments[pin] == PIN_INPUT_DIGITAL_PULLUP
+            || pinAssignments[pin] == PIN_INPUT_COUNTER ) {
+        return pinValues[pin]; // return the output data for the pin
+    } else if ( pinAssignments[pin] == PIN_INPUT_ANALOG ) {
+        if ( isConstrainAnalogValue && analogModes[pin] == ANALOG_MODE_SCALED ) {
+            // constrain values (which go up to about 685 on a Sharp IR sensor) within a 0-255 range
+            return constrainAnalogValue(pinValues[pin]);
+        } else {
+            return pinValues[pin];
+        }
+    } else if ( pinAssignments[pin] == PIN_UNUSED ) {
+        return PIN_UNASSIGNED;
+    } else {
+        return PIN_ASSIGNED_AS_OUTPUT;
+    }
+}
+
+/**
+    Set the assignment for the specified pin to PIN_UNUSED, PIN_INPUT, PIN_INPUT_PULLUP, or PIN_OUTPUT.
+    If the pin was counting its edges the counter is stopped.
+*/
+void setPinAssignment(int pin, int assignment) {
+    stopCounter(pin);
+    // keep record of assignment
+    pinAssignments[pin] = assignment;
+    // now assign Arduino pin accordingly
+    switch ( assignment ) {
+        case PIN_INPUT_ANALOG:
+        case PIN_INPUT_DIGITAL:
+        case PIN_UNUSED: // there is no disable pinMode()
+            pinMode(pin, INPUT);
+            break;
+        case PIN_INPUT_DIGITAL_PULLUP:
+            pinMode(pin, INPUT_PULLUP);
+            break;
+        case PIN_OUTPUT:
+            pinMode(pin, OUTPUT);
+            break;
+    }
+    isConfigChanged = true; // shown by the next verbose status display
+}
+
+/**
+    Writes the levels of the pins 0-15 selected by the mask in a single
+    command, in place of one write command per pin. Pins not assigned as
+    outputs are skipped. The stored value of each pin written is set, so
+    that readPinAssignments() maintains its level.
+
+    On AVR the pins are written by one read-modify-write of the output
+    register of each port with interrupts disabled, so that pins sharing
+    a port change at the same instant, and pins on different ports within
+    a few cycles of one another. Elsewhere they are written in turn by
+    digitalWrite(). Returns the mask of the pins written.
+*/
+unsigned int writeOutputs( unsigned int mask, unsigned int levels ) {
+    unsigned int written = 0;
+    for ( int pin = 0; pin < 16 && pin < pinsAssigned; pin++ ) {
+        if ( ( mask & ( 1 << pin ) ) && pinAssignments[pin] == PIN_OUTPUT ) {
+            pinValues[pin] = ( levels & ( 1 << pin ) ) ? HIGH : LOW;
+            written |= 1 << pin;
+        }
+    }
+#if defined(__AVR__)
+    volatile uint8_t *ports[16];
+    uint8_t highBits[16];
+    uint8_t lowBits[16];
+    int portCount = 0;
+    for ( int pin = 0; pin < 16; pin++ ) {
+        if ( written & ( 1 << pin ) ) {
+            volatile uint8_t *port = portOutputRegister(digitalPinToPort(pin));
+            int i = 0;
+            while ( i < portCount && ports[i] != port ) {
+                i++;
+            }
+            if ( i == portCount ) {
+                ports[i] = port;
+                highBits[i] = lowBits[i] = 0;
+                portCount++;
+            }
+            if ( pinValues[pin] == HIGH ) {
+                highBits[i] |= digitalPinToBitMask(pin);
+            } else {
+                lowBits[i] |= digitalPinToBitMask(pin);
+            }
+        }
+    }
+    uint8_t oldSREG = SREG;
+    cli();
+    for ( int i = 0; i < portCount; i++ ) {
+        *ports[i] = ( *ports[i] & ~lowBits[i] ) | highBits[i];
+    }
+    SREG = oldSREG;
+#else
+    for ( int pin = 0; pin < 16; pin++ ) {
+        if ( written & ( 1 << pin ) ) {
+            digitalWrite(pin, pinValues[pin]);
+        }
+    }
+#endif
+    return written;
+}
+
+/**
+    Applies a pin map, the assignment of each of the pins 0-9 held as a
+    nibble (the low nibble of each byte for the even pin), as a single
+    command in place of one configure command per pin. Only those pins
+    whose assignment differs are set. Returns the number of pins changed,
+    or UNRECOGNISED_COMMAND (changing none) if any assignment is invalid.
+*/
+int applyPinMap( byte pinMap[] ) {
+    for ( int pin = 0; pin < PIN_MAP_LENGTH * 2; pin++ ) {
+        int assignment = ( pinMap[pin / 2] >> ( ( pin % 2 ) * 4 ) ) & 0x0F;
+        if ( assignment < PIN_INPUT_DIGITAL || assignment > PIN_UNUSED ) {
+            return UNRECOGNISED_COMMAND;
+        }
+    }
+    int changed = 0;
+    for ( int pin = 0; pin < PIN_MAP_LENGTH * 2; pin++ ) {
+        int assignment = ( pinMap[pin / 2] >> ( ( pin % 2 ) * 4 ) ) & 0x0F;
+        if ( pinAssignments[pin] != assignment ) {
+            setPinAssignment(pin, assignment);
+            changed++;
+        }
+    }
+    return changed;
+}
+
+/**
+    Returns a CRC-16 (CCITT) of the assignments of the pins 0-9, which the
+    master compares with that of its pin map to skip configuring a slave
+    that is already configured, e.g., upon a restart of the master.
+*/
+unsigned int configHash() {
+    uint16_t crc = 0xFFFF;
+    for ( int pin = 0; pin < PIN_MAP_LENGTH * 2; pin++ ) {
+        crc ^= (uint16_t) ( pinAssignments[pin] & 0xFF ) << 8;
+        for ( int bit = 0; bit < 8; bit++ ) {
+            crc = ( crc & 0x8000 ) ? ( crc << 1 ) ^ 0x1021 : crc << 1;
+        }
+    }
+    return crc;
+}
+
+/**
+    Sets the pin assignments for all to -1 (unused).
+*/
+void resetPinAssignments() {
+    for ( int i = 0; i < pinsAssigned; i++ ) {
+        pinAssignments[i] = PIN_UNUSED;
+    }
+}
+
+/**
+    Sets the pin state values for all to -2 (error value).
+*/
+void resetPinValues() {
+    for ( int i = 0; i < pinsAssigned; i++ ) {
+        pinValues[i] = INIT_VALUE;
+        analogModes[i] = ANALOG_MODE_SCALED;
+        analogParameters[i] = 1;
+        emaValues[i] = -1;
+    }
+}
+
+/**
+    Enqueues the int value to the output queue.
+*/
+void queueForOutput( int data ) {
+    outputQueue.enqueue(lowByte(data));
+    outputQueue.enqueue(highByte(data));
+}
+
+
+/**
+    Clears the contents of the input queue.
+*/
+void clearInputQueue() {
+    while ( !inputQueue.isEmpty() ) {
+        inputQueue.dequeue();
+    }
+}
+
+/**
+    Clears the contents of the output queue.
+*/
+void clearOutputQueue() {
+    while ( !outputQueue.isEmpty() ) {
+        outputQueue.dequeue();
+    }
+}
+
+/**
+    Constrains the analog value between 0 and 255.
+    This uses either a manually set range or auto-ranging if enabled.
+*/
+int constrainAnalogValue( int value ) {
+    return constrain( (( value - analogMin ) / ( analogMax )) * 255.0 , 0, 255 );
+}
+
+/**
+    The minimum and maximum values are either fixed (when 'isAutoRange' is
+    false) or dynamically adjusted based on observed values. Fixing the
+    values will necessarily also limit the range of the returned values,
+    reflecting limitations in, for example, the measured physical distance.
+
+    But auto-ranging can also be problematic, in that glitches in the min/max
+    range can set their values to extremes that causes a flattening of the
+    scale. For example, if the minimum value "accidentally" gets set too low
+    the maximum value (255) for the closest range will never get returned,
+    so the robot will think it's further away from an obstacle than it
+    actually is ("objects in mirror are closer than they appear").
+*/
+void adjustAutoRange( int rawAnalogValue ) {
+    if ( isAutoRange ) { // then auto-adjust range
+        analogMin = min(analogMin, rawAnalogValue);
+        analogMax = max(analogMax, rawAnalogValue);
+    }
+}
+
+/**
+    Reset the auto-range values to their defaults.
+*/
+void resetRange() {
+    analogMin = analogMinDefault;
+    analogMax = analogMaxDefault;
+}
+
+/**
+    Returns true if the value is within the range minimum < value < maximum.
+    Note this is inclusive of the minimum, exclusive of the maximum.
+*/
+boolean inRange(int value, int minimum, int maximum) {
+    return ((minimum <= value) && (value < maximum));
+}
+
+//       1         2         3         4         5         6         7         8
+//345678901234567890123456789012345678901234567890123456789012345678901234567890
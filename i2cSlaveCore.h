@@ -0,0 +1,234 @@
+/*
+    Copyright 2020 by Murray Altheim. All rights reserved. This file is part of
+    the Raspberry Pi Master to Arduino Slave (pimaster2ardslave) project and is
+    released under the MIT License. Please see the LICENSE file included as part
+    of this package.
+
+      author:   Murray Altheim
+      created:  2020-05-18
+      modified: 2020-05-25
+
+    The protocol core of the i2cSlave sketch: its constants, state, and the
+    Wire callbacks and command handling. This is compiled by the Arduino IDE
+    alongside i2cSlave.ino, and natively on Linux against the mock Wire,
+    ArduinoQueue and pin functions found in the host directory, so that the
+    same code can be run as a stand-in slave (see the Makefile in the host directory).
+
+    See i2cSlave.ino for a description of the protocol.
+*/
+
+#ifndef I2C_SLAVE_CORE_H
+#define I2C_SLAVE_CORE_H
+
+#include <Arduino.h>
+#include <Wire.h>
+#include <ArduinoQueue.h> // see i2cSlave.ino for installation
+
+#define SLAVE_I2C_ADDRESS         0x08
+#define LOOP_DELAY_MS             1000   // the default sample period (see CMD_SET_SAMPLE_PERIOD)
+#define MIN_SAMPLE_PERIOD_MS         5
+#define VERBOSE_INTERVAL_MS       1000   // the least interval between verbose status displays
+#define QUEUE_LENGTH                32   // matches the Wire library's BUFFER_LENGTH
+#define NO_COMMAND                  -1   // no command pending
+#define INTERRUPT_PIN               12   // held HIGH while change events are pending
+#define CHANGE_QUEUE_LENGTH         16   // change events held awaiting the master
+#define CHANGE_BATCH                 7   // change events returned per CMD_READ_CHANGES
+#define CAPTURE_LENGTH              64   // capacity of the capture ring buffer, in samples
+#define CAPTURE_BATCH                7   // samples returned per CMD_READ_CAPTURE
+#define MAX_COUNTERS                 3   // edge counters, each on a pin with an external interrupt
+#define COUNTER_BATCH                3   // counters returned per CMD_READ_COUNTERS
+#define PIN_MAP_LENGTH               5   // payload bytes of CMD_APPLY_PIN_MAP: a nibble per pin 0-9
+#define PROTOCOL_VERSION             2   // incremented on any incompatible change to the protocol
+#define FRAME_OVERHEAD               3   // bytes added to a reply by framing: sequence, status and CRC
+#define FRAME_LENGTH_SHIFT           2   // the reply length is carried above the status in its byte
+#define FIRMWARE_VERSION        0x0100   // major, minor
+
+// errors ........................................
+#define UNDEFINED_ERROR            255   // returned on error
+#define UNRECOGNISED_COMMAND       254   // returned on communications error
+#define TOO_MUCH_DATA              253   // returned on communications error
+#define PIN_ASSIGNED_AS_INPUT      252   // configuration error
+#define PIN_ASSIGNED_AS_OUTPUT     251   // configuration error
+#define PIN_UNASSIGNED             250   // configuration error
+#define EMPTY_QUEUE                249   // returned on error
+#define INIT_VALUE                   0   // initial pin value; may be error
+
+// pin types .....................................
+const int PIN_INPUT_DIGITAL        = 2;  // default
+const int PIN_OUTPUT               = 3;
+const int PIN_INPUT_DIGITAL_PULLUP = 4;  // inverted: low(0) is on
+const int PIN_INPUT_ANALOG         = 5;
+const int PIN_UNUSED               = 6;
+const int PIN_INPUT_COUNTER        = 7;  // set by CMD_CONFIGURE_COUNTER, not by a pin map
+
+// commands ......................................
+const int CMD_ECHO_INPUT           = 224;
+const int CMD_CLEAR_REQUEST_COUNT  = 225;
+const int CMD_RETURN_REQUEST_COUNT = 226;
+const int CMD_CLEAR_LOOP_COUNT     = 227;
+const int CMD_RETURN_LOOP_COUNT    = 228;
+const int CMD_CLEAR_QUEUES         = 229;
+const int CMD_RETURN_ANALOG_MIN_RANGE = 230;
+const int CMD_RETURN_ANALOG_MAX_RANGE = 231;
+const int CMD_DISABLE_AUTORANGE    = 232;
+const int CMD_ENABLE_AUTORANGE     = 233;
+const int CMD_READ_ALL_PINS        = 234; // block: returns 2 bytes for each of the assigned pins
+const int CMD_READ_PINS            = 235; // block: 2 byte pin mask payload, returns 2 bytes per pin
+const int CMD_SET_ANALOG_MODE      = 236; // block: 3 byte payload (pin, mode, parameter), returns pin
+const int CMD_SET_CHANGE_MASK      = 237; // block: 2 byte pin mask payload, returns mask
+const int CMD_READ_CHANGES         = 238; // block: returns a 2 byte header then up to CHANGE_BATCH events
+
+// extended commands (256 and above) .............
+const int CMD_START_CAPTURE        = 256; // block: 3 byte payload (pin, period in µs LSB, MSB), returns pin
+const int CMD_STOP_CAPTURE         = 257; // returns the number of samples still buffered
+const int CMD_READ_CAPTURE         = 258; // block: returns a 4 byte header then up to CAPTURE_BATCH samples
+const int CMD_HANDSHAKE            = 259; // block: returns the protocol and firmware versions and configuration hash
+const int CMD_APPLY_PIN_MAP        = 260; // block: PIN_MAP_LENGTH byte payload, returns pins changed and configuration hash
+const int CMD_SET_FRAMING          = 261; // block: 1 byte payload (0 or 1), returns the framing state
+const int CMD_WRITE_OUTPUTS        = 262; // block: 2 byte pin mask and 2 byte levels payload, returns pins written
+const int CMD_READ_PINS_GENERATION = 263; // block: 2 byte pin mask payload, returns the sample generation and age then 2 bytes per pin
+const int CMD_SET_SAMPLE_PERIOD    = 264; // block: 2 byte period in milliseconds payload (LSB, MSB), returns the period
+const int CMD_CONFIGURE_COUNTER    = 265; // block: 2 byte payload (pin, edges), returns pin
+const int CMD_READ_COUNTERS        = 266; // block: 2 byte pin mask and 1 byte reset payload, returns a 6 byte header then 8 bytes per counter
+
+// change events .................................
+const int CHANGES_PENDING          = 0x01; // header flag: more events remain queued
+const int CHANGES_LOST             = 0x02; // header flag: events were dropped since the last read
+const int CHANGE_PIN_SHIFT         = 10;   // an event is ( pin << 10 ) | value
+const int CHANGE_VALUE_MASK        = 0x3FF;
+
+// capture .......................................
+const int CAPTURE_RUNNING          = 0x01; // header flag: capture is running
+const int CAPTURE_PENDING          = 0x02; // header flag: more samples remain buffered
+const int CAPTURE_VALUE_BITS       = 10;   // a sample is ( tick << 10 ) | value, in 4 bytes
+const unsigned long CAPTURE_TICK_MASK = 0x3FFFFFUL; // ticks are the low 22 bits of micros()
+const unsigned int CAPTURE_MIN_PERIOD = 500; // µs
+
+// counters ......................................
+const int COUNT_RISING             = 0x01; // edges: count rising edges
+const int COUNT_FALLING            = 0x02; // edges: count falling edges
+const int COUNT_BOTH               = 0x03; // edges: count both
+const int COUNT_PULLUP             = 0x04; // edges flag: enable the pin's internal pullup
+
+// framing .......................................
+const int FRAME_OK                 = 0;    // reply status: the command was executed (or replayed)
+const int FRAME_BAD_CRC            = 1;    // reply status: the request's CRC did not match
+const int FRAME_BAD_LENGTH         = 2;    // reply status: the request's length did not suit its command
+const int FRAME_NO_REPLY           = 3;    // reply status: a read without a request
+
+// analog modes ..................................
+const int ANALOG_MODE_SCALED       = 0;  // default: one sample, scaled to 0-255
+const int ANALOG_MODE_RAW          = 1;  // one sample, full 10 bit resolution
+const int ANALOG_MODE_AVERAGE      = 2;  // mean of N samples (parameter: N, 1-16)
+const int ANALOG_MODE_MEDIAN       = 3;  // median of N samples (parameter: N, 1-9)
+const int ANALOG_MODE_EMA          = 4;  // exponential moving average (parameter: k, alpha = 1/2^k, 1-6)
+const int MAX_AVERAGE_SAMPLES      = 16;
+const int MAX_MEDIAN_SAMPLES       = 9;
+const int MAX_EMA_SHIFT            = 6;
+const int EMA_SCALE_SHIFT          = 4;  // the EMA is held in sixteenths
+
+// constants .....................................
+extern int pinsAssigned;
+
+// flags/configuration ...........................
+extern boolean isVerbose;
+extern boolean isEchoTest;
+extern boolean isFramed;
+extern boolean isAutoRange;
+extern boolean isConstrainAnalogValue;
+extern float analogMinDefault;
+extern float analogMin;
+extern float analogMaxDefault;
+extern float analogMax;
+
+// variables .....................................
+extern ArduinoQueue<byte> inputQueue;
+extern ArduinoQueue<byte> outputQueue;
+extern ArduinoQueue<int> changeQueue;
+extern unsigned int changeMask;
+extern boolean isChangeLost;
+extern unsigned long captureBuffer[CAPTURE_LENGTH];
+extern volatile byte captureHead;
+extern volatile byte captureCount;
+extern int capturePin;
+extern unsigned int capturePeriod;
+extern unsigned long nextCaptureMicros;
+extern byte captureOverflowed;
+extern byte captureMissed;
+extern int counterPins[MAX_COUNTERS];
+extern volatile unsigned long counterCounts[MAX_COUNTERS];
+extern volatile unsigned long counterPeriods[MAX_COUNTERS];
+extern volatile unsigned long counterLastMicros[MAX_COUNTERS];
+extern volatile boolean counterIsTimed[MAX_COUNTERS];
+extern int pendingCommand;
+extern int lastSequence;
+extern byte frame[QUEUE_LENGTH];
+extern byte frameLength;
+extern int pinAssignments[32];
+extern int pinValues[32];
+extern byte analogModes[32];
+extern byte analogParameters[32];
+extern int emaValues[32];
+extern long loopCount;
+extern uint16_t sampleGeneration;
+extern unsigned long sampleMillis;
+extern unsigned int samplePeriod;
+extern unsigned long nextSampleMillis;
+extern unsigned long lastVerboseMillis;
+extern int verbosePin;
+extern boolean isConfigChanged;
+extern long requestCount;
+extern char buf[100];
+
+// functions ...................................................................
+
+void requestData();
+void receiveData(int byteCount);
+void receiveFrame(int byteCount);
+void queueFrame(byte sequence, byte status);
+void queueFrameError(byte sequence, byte status);
+void replayFrame();
+byte crc8(byte crc, byte data);
+int setFraming(boolean enabled);
+boolean isBlockCommand(int command);
+int payloadLength(int command);
+void serviceSampler();
+int setSamplePeriod(unsigned int period);
+void readPinAssignments(unsigned long sampledMillis);
+void serviceVerbose();
+void displayPin(int pin);
+void displayPinAssignments();
+int handleCommand(int data);
+void handleBlockCommand(int command);
+int setAnalogMode(int pin, int mode, int parameter);
+void setChangeMask(unsigned int mask);
+void queueChange(int pin, int value);
+void readChanges();
+int startCapture(int pin, unsigned int period);
+int stopCapture();
+void serviceCapture();
+void readCapture();
+int configureCounter(int pin, int edges);
+void stopCounter(int pin);
+void countEdge(byte slot);
+void countEdge0();
+void countEdge1();
+void countEdge2();
+void readCounters(unsigned int mask, boolean reset);
+int readAnalogValue(int pin);
+int getValueOf(int pin);
+void setPinAssignment(int pin, int assignment);
+unsigned int writeOutputs(unsigned int mask, unsigned int levels);
+int applyPinMap(byte pinMap[]);
+unsigned int configHash();
+void resetPinAssignments();
+void resetPinValues();
+void queueForOutput(int data);
+void clearInputQueue();
+void clearOutputQueue();
+int constrainAnalogValue(int value);
+void adjustAutoRange(int rawAnalogValue);
+void resetRange();
+boolean inRange(int value, int minimum, int maximum);
+
+#endif
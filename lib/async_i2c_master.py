@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 by Murray Altheim. All rights reserved. This file is part
+# of the pimaster2ardslave project and is released under the MIT Licence;
+# please see the LICENSE file included as part of this package.
+#
+# author:   Murray Altheim
+# created:  2020-05-14
+# modified: 2020-05-24
+#
+# An asyncio front end to the I2cMaster.
+#
+
+import asyncio, queue, threading
+
+from lib.logger import Logger
+from lib.protocol import CMD_CLEAR_REQUEST_COUNT, CMD_RETURN_REQUEST_COUNT, CMD_CLEAR_LOOP_COUNT, \
+        CMD_RETURN_LOOP_COUNT, CMD_CLEAR_QUEUES, CMD_RETURN_ANALOG_MIN_RANGE, CMD_RETURN_ANALOG_MAX_RANGE, \
+        CMD_DISABLE_AUTORANGE, CMD_ENABLE_AUTORANGE
+
+_STOP = object()
+
+# ..............................................................................
+class AsyncI2cMaster():
+    '''
+        Provides awaitable equivalents of the I2cMaster's methods. Rather than a
+        thread hop per call (as with run_in_executor()) requests from any number
+        of coroutines are put on a queue served by a single bus thread, which
+        executes them in order and hands back every result it has completed
+        since last waking in a single callback to the event loop. Bus access is
+        therefore serialised, and the event loop never blocks on the bus.
+
+        The instance is bound to the event loop on which it is first awaited.
+
+        Parameters:
+          master:     the I2cMaster to wrap
+          level:      the log level, e.g., Level.INFO
+    '''
+    def __init__(self, master, level):
+        self._log = Logger('async-i²cmaster', level)
+        self._master = master
+        self._requests = queue.SimpleQueue()
+        self._loop = None
+        self._thread = None
+        self._mutex = threading.Lock()
+
+    @property
+    def master(self):
+        return self._master
+
+    # ..........................................................................
+    def _call(self, function, *args):
+        '''
+            Queues the function for execution on the bus thread, returning a
+            future for its result.
+        '''
+        _loop = asyncio.get_running_loop()
+        if self._thread is None:
+            with self._mutex:
+                if self._thread is None:
+                    self._loop = _loop
+                    self._thread = threading.Thread(target=self._run, name='async-i2c', daemon=True)
+                    self._thread.start()
+        elif _loop is not self._loop:
+            raise RuntimeError('AsyncI2cMaster is bound to a different event loop.')
+        _future = _loop.create_future()
+        self._requests.put(( _future, function, args ))
+        return _future
+
+    # ..........................................................................
+    def _run(self):
+        _requests = self._requests
+        while True:
+            _batch = [ _requests.get() ]
+            while True: # drain whatever else has arrived, without waiting
+                try:
+                    _batch.append(_requests.get_nowait())
+                except queue.Empty:
+                    break
+            _results = []
+            _stopping = False
+            for _request in _batch:
+                if _request is _STOP:
+                    _stopping = True
+                    continue
+                _future, _function, _args = _request
+                try:
+                    _results.append(( _future, _function(*_args), None ))
+                except Exception as e:
+                    _results.append(( _future, None, e ))
+            if _results:
+                try:
+                    self._loop.call_soon_threadsafe(_resolve, _results)
+                except RuntimeError: # the loop has been closed
+                    pass
+            if _stopping:
+                break
+
+    # ..........................................................................
+    async def close(self):
+        '''
+            Completes any queued requests and stops the bus thread. This does not
+            close the wrapped I2cMaster.
+        '''
+        if self._thread is not None:
+            self._requests.put(_STOP)
+            await asyncio.get_running_loop().run_in_executor(None, self._thread.join)
+            self._thread = None
+            self._loop = None
+            self._log.debug('closed.')
+
+    # I2cMaster equivalents ....................................................
+
+    async def get_input_from_pin(self, pinPlusOffset):
+        return await self._call(self._master.get_input_from_pin, pinPlusOffset)
+
+    async def set_output_on_pin(self, pin, value):
+        return await self._call(self._master.set_output_on_pin, pin, value)
+
+    async def set_outputs(self, outputs):
+        return await self._call(self._master.set_outputs, outputs)
+
+    async def read_pins(self, pins=None):
+        return await self._call(self._master.read_pins, pins)
+
+    async def configure_pin_as_digital_input(self, pin):
+        return await self._call(self._master.configure_pin_as_digital_input, pin)
+
+    async def configure_pin_as_digital_input_pullup(self, pin):
+        return await self._call(self._master.configure_pin_as_digital_input_pullup, pin)
+
+    async def configure_pin_as_analog_input(self, pin):
+        return await self._call(self._master.configure_pin_as_analog_input, pin)
+
+    async def configure_pin_as_output(self, pin):
+        return await self._call(self._master.configure_pin_as_output, pin)
+
+    async def set_analog_mode(self, pin, mode, parameter=1):
+        return await self._call(self._master.set_analog_mode, pin, mode, parameter)
+
+    async def handshake(self):
+        return await self._call(self._master.handshake)
+
+    async def apply_pin_map(self, pin_map, force=False):
+        return await self._call(self._master.apply_pin_map, pin_map, force)
+
+    async def set_framing(self, enabled):
+        return await self._call(self._master.set_framing, enabled)
+
+    # counter and range commands (225-233) .....................................
+
+    async def clear_request_count(self):
+        return await self.get_input_from_pin(CMD_CLEAR_REQUEST_COUNT)
+
+    async def get_request_count(self):
+        return await self.get_input_from_pin(CMD_RETURN_REQUEST_COUNT)
+
+    async def clear_loop_count(self):
+        return await self.get_input_from_pin(CMD_CLEAR_LOOP_COUNT)
+
+    async def get_loop_count(self):
+        return await self.get_input_from_pin(CMD_RETURN_LOOP_COUNT)
+
+    async def clear_queues(self):
+        return await self.get_input_from_pin(CMD_CLEAR_QUEUES)
+
+    async def get_analog_min_range(self):
+        return await self.get_input_from_pin(CMD_RETURN_ANALOG_MIN_RANGE)
+
+    async def get_analog_max_range(self):
+        return await self.get_input_from_pin(CMD_RETURN_ANALOG_MAX_RANGE)
+
+    async def disable_autorange(self):
+        return await self.get_input_from_pin(CMD_DISABLE_AUTORANGE)
+
+    async def enable_autorange(self):
+        return await self.get_input_from_pin(CMD_ENABLE_AUTORANGE)
+
+
+# ..............................................................................
+def _resolve(results):
+    '''
+        Runs on the event loop, completing a batch of futures.
+    '''
+    for _future, _result, _error in results:
+        if _future.cancelled():
+            continue
+        if _error is not None:
+            _future.set_exception(_error)
+        else:
+            _future.set_result(_result)
+
+#EOF
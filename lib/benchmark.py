@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 by Murray Altheim. All rights reserved. This file is part
+# of the pimaster2ardslave project and is released under the MIT Licence;
+# please see the LICENSE file included as part of this package.
+#
+# author:   Murray Altheim
+# created:  2020-05-10
+# modified: 2020-05-14
+#
+# A small harness for measuring the throughput and latency of I2cMaster
+# calls, typically against a SimulatedPi (see lib/slave_simulator.py).
+#
+
+import time
+from collections import namedtuple
+from colorama import init, Fore, Style
+init()
+
+from lib.logger import Logger
+
+BenchmarkResult = namedtuple('BenchmarkResult', [ 'label', 'iterations', 'elapsed', 'rate', 'mean', 'p50', 'p99',
+        'daemon_calls', 'bus_transactions', 'modelled' ])
+BenchmarkResult.__doc__ = '''
+    The result of one measurement. 'rate' is in calls per second; 'mean', 'p50',
+    'p99' and 'modelled' (the SimulatedPi's modelled time per call) are in
+    seconds; 'daemon_calls' and 'bus_transactions' are per call. The last
+    three are None if no SimulatedPi was provided.
+'''
+
+# ..............................................................................
+class Benchmark():
+    '''
+        Measures the wall-clock latency of repeated calls to a function.
+
+        Parameters:
+          level:      the log level, e.g., Level.INFO
+          pi:         an optional SimulatedPi whose counters are also reported
+    '''
+    def __init__(self, level, pi=None):
+        self._log = Logger('benchmark', level)
+        self._pi = pi
+        self._results = []
+
+    @property
+    def results(self):
+        return self._results
+
+    # ..........................................................................
+    def measure(self, label, function, iterations=1000, warmup=50):
+        '''
+            Calls the function 'warmup' times unmeasured, then 'iterations'
+            times measured, returning (and retaining) a BenchmarkResult.
+        '''
+        for _ in range(warmup):
+            function()
+        if self._pi is not None:
+            self._pi.reset_counters()
+        _latencies = [ 0.0 ] * iterations
+        _clock = time.perf_counter
+        _start = _clock()
+        for i in range(iterations):
+            _t0 = _clock()
+            function()
+            _latencies[i] = _clock() - _t0
+        _elapsed = _clock() - _start
+        return self.record(label, _latencies, _elapsed)
+
+    # ..........................................................................
+    def reset(self):
+        '''
+            Resets the SimulatedPi's counters (if any) prior to a measurement
+            made outside of measure(), to be completed by a call to record().
+        '''
+        if self._pi is not None:
+            self._pi.reset_counters()
+
+    # ..........................................................................
+    def record(self, label, latencies, elapsed):
+        '''
+            Returns (and retains) a BenchmarkResult from a list of per-call
+            latencies and the total elapsed time, e.g., as measured by a caller
+            making concurrent calls. The rate is calculated from the elapsed time.
+        '''
+        _iterations = len(latencies)
+        _latencies = sorted(latencies)
+        if self._pi is not None:
+            _daemon_calls = self._pi.daemon_calls / _iterations
+            _bus_transactions = self._pi.bus_transactions / _iterations
+            _modelled = self._pi.simulated_time / _iterations
+        else:
+            _daemon_calls = _bus_transactions = _modelled = None
+        _result = BenchmarkResult(label, _iterations, elapsed, _iterations / elapsed, elapsed / _iterations,
+                percentile(_latencies, 50), percentile(_latencies, 99), _daemon_calls, _bus_transactions, _modelled)
+        self._results.append(_result)
+        self.report(_result)
+        return _result
+
+    # ..........................................................................
+    def report(self, result):
+        '''
+            Writes a single result line to the log.
+        '''
+        _line = '{:<42} {:>9.1f}/s  p50: {:>8.1f}µs  p99: {:>8.1f}µs'.format(
+                result.label, result.rate, result.p50 * 1e6, result.p99 * 1e6)
+        if result.daemon_calls is not None:
+            _line += Style.DIM + '  daemon: {:.1f}  bus: {:.1f}  modelled: {:>7.1f}µs'.format(
+                    result.daemon_calls, result.bus_transactions, result.modelled * 1e6)
+        self._log.info(_line)
+
+
+    # ..........................................................................
+    def compare(self, baseline, result):
+        '''
+            Logs the speedup of a result over a baseline, returning the ratio
+            of their p50 latencies (and of their modelled times if available).
+        '''
+        _ratio = baseline.p50 / result.p50
+        _line = '{} vs {}: {:.2f}x faster (p50), {:.2f}x the rate'.format(result.label, baseline.label, _ratio, result.rate / baseline.rate)
+        if result.modelled:
+            _ratio = baseline.modelled / result.modelled
+            _line += ', {:.2f}x faster (modelled)'.format(_ratio)
+        self._log.info(Fore.GREEN + _line)
+        return _ratio
+
+
+# ..............................................................................
+def percentile(ordered, pct):
+    '''
+        Returns the nearest-rank percentile of an already sorted sequence.
+    '''
+    if not ordered:
+        return 0.0
+    _rank = max(1, int(round(pct / 100.0 * len(ordered))))
+    return ordered[min(_rank, len(ordered)) - 1]
+
+#EOF
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 by Murray Altheim. All rights reserved. This file is part
+# of the pimaster2ardslave project and is released under the MIT Licence;
+# please see the LICENSE file included as part of this package.
+#
+# author:   Murray Altheim
+# created:  2020-05-22
+# modified: 2020-05-22
+#
+# Sensor calibration by precomputed lookup tables, so that converting an
+# analog reading (or a NumPy array of them, or a capture stream) to a
+# physical value such as a distance is a single vectorised index, e.g.:
+#
+#   _calibration = Calibration.from_file('sharp_ir.cal')
+#   _sensor = CalibratedSensor(_master, 8, _calibration)
+#   _distance = _sensor.read()
+#
+# This requires numpy:
+#
+#   % sudo pip3 install numpy
+#
+
+import time
+import numpy
+
+from lib.logger import Logger, Level
+from lib.protocol import CMD_RETURN_ANALOG_MIN_RANGE, CMD_RETURN_ANALOG_MAX_RANGE, \
+        CMD_DISABLE_AUTORANGE, CMD_ENABLE_AUTORANGE
+
+RAW_VALUES    = 1024  # a 10 bit analog reading
+SCALED_VALUES = 256   # an analog reading scaled by the slave to 0-255
+CACHE_SIZE    = 16    # scaled tables cached per calibration
+
+# ..............................................................................
+class Calibration():
+    '''
+        A calibration curve of a sensor, given as ( raw, value ) points where
+        'raw' is a 10 bit analog reading and 'value' the physical value
+        measured at that reading, between which values are interpolated
+        linearly (and beyond which they are held at the end points).
+
+        The curve is precomputed as a table of all 1024 raw readings. A table
+        of the 256 scaled readings depends upon the slave's analog range, so
+        is built on demand for each range and cached.
+    '''
+    def __init__(self, points, name=None):
+        _points = sorted(points)
+        if len(_points) < 2:
+            raise ValueError('a calibration requires at least two points.')
+        self.name = name
+        self._raw = numpy.array([ _point[0] for _point in _points ], dtype=numpy.float64)
+        self._values = numpy.array([ _point[1] for _point in _points ], dtype=numpy.float64)
+        self.raw_table = numpy.interp(numpy.arange(RAW_VALUES), self._raw, self._values)
+        self.raw_table.flags.writeable = False
+        self._scaled_tables = {}
+
+    # ..........................................................................
+    @classmethod
+    def from_file(cls, path):
+        '''
+            Reads a calibration file of one 'raw value' pair per line, separated
+            by whitespace or a comma. Blank lines and comments (from a '#') are
+            ignored.
+        '''
+        _points = []
+        with open(path) as _file:
+            for _number, _line in enumerate(_file, 1):
+                _line = _line.split('#', 1)[0].replace(',', ' ').strip()
+                if not _line:
+                    continue
+                _fields = _line.split()
+                if len(_fields) != 2:
+                    raise ValueError('{}, line {:d}: expected a raw reading and a value.'.format(path, _number))
+                _points.append(( float(_fields[0]), float(_fields[1]) ))
+        return cls(_points, name=path)
+
+    # ..........................................................................
+    def scaled_table(self, analog_min, analog_max):
+        '''
+            Returns the table of the 256 scaled readings returned by the slave
+            for the given analog range, the inverse of its constrainAnalogValue()
+            taken at the middle of each step. The readings 0 and 255 are also
+            returned for any raw reading beyond the range.
+        '''
+        _key = ( analog_min, analog_max )
+        _table = self._scaled_tables.get(_key)
+        if _table is None:
+            if analog_max <= 0:
+                raise ValueError('invalid analog range: {}-{}.'.format(analog_min, analog_max))
+            _raw = analog_min + ( numpy.arange(SCALED_VALUES) + 0.5 ) * analog_max / 255.0
+            _table = numpy.interp(numpy.clip(_raw, 0, RAW_VALUES - 1), self._raw, self._values)
+            _table.flags.writeable = False
+            if len(self._scaled_tables) >= CACHE_SIZE:
+                del self._scaled_tables[next(iter(self._scaled_tables))] # the oldest
+            self._scaled_tables[_key] = _table
+        return _table
+
+    # ..........................................................................
+    def convert_raw(self, readings):
+        '''
+            Converts a raw reading or an array of them.
+        '''
+        return _lookup(self.raw_table, readings)
+
+    # ..........................................................................
+    def convert_scaled(self, readings, analog_min, analog_max):
+        '''
+            Converts a scaled reading or an array of them, as returned by the
+            slave with the given analog range.
+        '''
+        return _lookup(self.scaled_table(analog_min, analog_max), readings)
+
+
+# ..............................................................................
+class CalibratedSensor():
+    '''
+        A calibrated analog input pin on the slave, which converts the readings
+        of the pin using the lookup table for the slave's current analog range.
+
+        The range is read from the slave (230, 231) when first needed. If auto-
+        range is enabled, or its state is unknown, the range is re-read once it
+        is older than 'range_interval' seconds, and the table rebuilt (or taken
+        from the calibration's cache) if it has changed. Enabling or disabling
+        auto-range via set_auto_range() resets the range on the slave and so
+        invalidates the table.
+
+        Parameters:
+          master:          the I2cMaster of the slave
+          pin:             the analog input pin
+          calibration:     the Calibration of the sensor on the pin
+          raw:             True if the pin's analog mode returns 10 bit values
+                           (any but ANALOG_MODE_SCALED), to which the analog
+                           range does not apply
+          range_interval:  the maximum age of the range while auto-ranging
+          clock:           the clock by which the range is aged
+          level:           the log level
+    '''
+    def __init__(self, master, pin, calibration, raw=False, range_interval=1.0, clock=time.monotonic, level=Level.INFO):
+        self._log = Logger('calibrated-{:d}'.format(pin), level)
+        self._master = master
+        self.pin = pin
+        self.calibration = calibration
+        self.raw = raw
+        self.range_interval = range_interval
+        self._clock = clock
+        self.auto_range = None     # unknown until set_auto_range() is called
+        self.analog_range = None   # ( min, max ) as last read from the slave
+        self.range_changes = 0
+        self._range_time = 0.0
+        self._table = None
+
+    # ..........................................................................
+    def set_auto_range(self, enabled):
+        '''
+            Enables or disables auto-range on the slave (233, 232), which in
+            either case resets the slave's range to its defaults.
+        '''
+        self._master.get_input_from_pin(CMD_ENABLE_AUTORANGE if enabled else CMD_DISABLE_AUTORANGE)
+        self.auto_range = enabled
+        self.invalidate()
+
+    # ..........................................................................
+    def invalidate(self):
+        '''
+            Forces the range to be re-read from the slave before the next
+            conversion, e.g., should it have been changed by another master.
+        '''
+        self.analog_range = None
+
+    # ..........................................................................
+    def table(self):
+        '''
+            Returns the lookup table for the slave's current range, reading the
+            range from the slave if it is unknown or (while auto-ranging) stale.
+        '''
+        if self.raw:
+            return self.calibration.raw_table
+        if self.analog_range is None or ( self.auto_range is not False
+                and self._clock() - self._range_time > self.range_interval ):
+            _range = ( self._master.get_input_from_pin(CMD_RETURN_ANALOG_MIN_RANGE),
+                    self._master.get_input_from_pin(CMD_RETURN_ANALOG_MAX_RANGE) )
+            self._range_time = self._clock()
+            if _range != self.analog_range:
+                if self.analog_range is not None:
+                    self.range_changes += 1
+                self._log.debug('analog range of pin {:d} is {:d}-{:d}.', self.pin, _range[0], _range[1])
+                self.analog_range = _range
+                self._table = self.calibration.scaled_table(*_range)
+        return self._table
+
+    # ..........................................................................
+    def convert(self, readings):
+        '''
+            Converts a reading of the pin, or an array of them (e.g., a column
+            of values from I2cMaster.read_pins() or a Sampler).
+        '''
+        return _lookup(self.table(), readings)
+
+    # ..........................................................................
+    def read(self):
+        '''
+            Reads the pin and returns its converted value.
+        '''
+        return self.convert(self._master.get_input_from_pin(self.pin))
+
+    # ..........................................................................
+    def convert_capture(self, blocks):
+        '''
+            Converts each CaptureBlock of a capture of the pin (as yielded by
+            I2cMaster.stream_capture()), yielding blocks whose values are
+            converted. Captured readings are always raw.
+        '''
+        for _block in blocks:
+            yield _block._replace(values=self.calibration.convert_raw(_block.values))
+
+
+# ..............................................................................
+def _lookup(table, readings):
+    '''
+        Returns the table entry for a reading, or an array of the entries for
+        an array of readings. Readings beyond the table (e.g., error codes in
+        a raw reading) are held at its end.
+    '''
+    if numpy.ndim(readings) == 0:
+        return float(table[min(max(int(readings), 0), len(table) - 1)])
+    return numpy.take(table, numpy.asarray(readings, dtype=numpy.intp), mode='clip')
+
+#EOF
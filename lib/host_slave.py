@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 by Murray Altheim. All rights reserved. This file is part
+# of the pimaster2ardslave project and is released under the MIT Licence;
+# please see the LICENSE file included as part of this package.
+#
+# author:   Murray Altheim
+# created:  2020-05-18
+# modified: 2020-05-21
+#
+# A stand-in slave running the sketch's own protocol code (i2cSlaveCore.cpp)
+# compiled natively for the host, which may be used in place of a
+# SimulatedSlave, e.g.:
+#
+#   _slave  = HostSlave()
+#   _pi     = SimulatedPi({ 0x08: _slave })
+#   _master = I2cMaster(0x08, Level.INFO, pi=_pi)
+#
+# The executable is built by 'make -C host'.
+#
+
+import os, threading, subprocess
+
+from lib.protocol import PIN_COUNT
+
+HOST_EXECUTABLE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'host', 'i2c_slave_host')
+
+# ..............................................................................
+class HostSlave():
+    '''
+        Drives the host build of the slave core over a pipe (see the
+        description of the requests in host/slave_host.cpp). This provides
+        the same methods as a SimulatedSlave for use by a SimulatedPi, plus
+        the time spent in each Wire callback, measured within the process.
+
+        Unlike the SimulatedSlave there is no lazy loop(): the sketch's loop()
+        is only run when loop() is called, so the slave is equivalent to a
+        SimulatedSlave with a 'loop_delay_ms' of None. Analog values must be
+        ints rather than callables, though set_analog_sequence() provides
+        varying values.
+
+        Parameters:
+          executable:  the path to the executable, default HOST_EXECUTABLE
+          echo_test:   equivalent to the sketch's 'isEchoTest' flag
+          verbose:     if True the sketch's serial output is written to stderr
+    '''
+    def __init__(self, executable=HOST_EXECUTABLE, echo_test=False, verbose=False):
+        if not os.path.exists(executable):
+            raise FileNotFoundError('no host slave executable at {}; build it via:\n\n  % make -C host\n'.format(executable))
+        _args = [ executable, '-v' ] if verbose else [ executable ]
+        self._process = subprocess.Popen(_args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True, bufsize=1)
+        self._mutex = threading.Lock()
+        self.isr_count   = 0
+        self.receive_ns  = 0  # time spent in the last onReceive callback
+        self.request_ns  = 0  # time spent in the last onRequest callback
+        self._echo_test = False
+        if echo_test:
+            self.echo_test = True
+
+    def _call(self, request):
+        with self._mutex:
+            self._process.stdin.write(request + '\n')
+            self._process.stdin.flush()
+            _reply = self._process.stdout.readline()
+        if not _reply:
+            raise IOError('host slave exited with code {}.'.format(self._process.poll()))
+        return _reply.split()
+
+    @property
+    def echo_test(self):
+        return self._echo_test
+
+    @echo_test.setter
+    def echo_test(self, enabled):
+        self._call('e {:d}'.format(1 if enabled else 0))
+        self._echo_test = enabled
+
+    # hardware side ............................................................
+
+    def set_input(self, pin, level):
+        self._call('i {:d} {:d}'.format(pin, 1 if level else 0))
+
+    def set_analog(self, pin, value):
+        self._call('a {:d} {:d}'.format(pin, int(value)))
+
+    def set_analog_sequence(self, pin, values):
+        '''
+            Sets up to 32 raw values presented to an analog pin in turn, one per
+            sample, repeating. A call to set_analog() replaces the sequence.
+        '''
+        self._call('n {:d} '.format(pin) + ' '.join('{:d}'.format(int(v)) for v in values))
+
+    def get_output(self, pin):
+        return int(self._call('o {:d}'.format(pin))[0])
+
+    # sketch ...................................................................
+
+    def loop(self):
+        self._call('l')
+
+    def advance(self, micros):
+        '''
+            Advances the slave's micros() clock by the given number of
+            microseconds, taking any capture samples that fall due.
+        '''
+        self._call('t {:d}'.format(micros))
+
+    def state(self):
+        '''
+            Returns the state in the form of SimulatedSlave.state().
+        '''
+        _fields = self._call('s')
+        _header = tuple(int(v) for v in _fields[:-PIN_COUNT])
+        _pins = [ tuple(int(v) for v in _field.split(':')) for _field in _fields[-PIN_COUNT:] ]
+        return _header, _pins
+
+    def request_data(self):
+        self.isr_count += 1
+        _reply = self._call('r')
+        self.request_ns = int(_reply[0])
+        return bytearray(int(b, 16) for b in _reply[1:])
+
+    def receive_data(self, data):
+        self.isr_count += 1
+        _reply = self._call('w ' + ' '.join('{:02x}'.format(b) for b in data))
+        self.receive_ns = int(_reply[0])
+
+    # ..........................................................................
+    def close(self):
+        if self._process.poll() is None:
+            self._process.stdin.write('q\n')
+            self._process.stdin.close()
+            self._process.wait()
+            self._process.stdout.close()
+
+#EOF
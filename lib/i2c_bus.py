@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 by Murray Altheim. All rights reserved. This file is part
+# of the pimaster2ardslave project and is released under the MIT Licence;
+# please see the LICENSE file included as part of this package.
+#
+# author:   Murray Altheim
+# created:  2020-05-15
+# modified: 2020-05-25
+#
+# A manager for an I²C bus shared by several Arduino slaves.
+#
+
+import sys, time, heapq, itertools, threading
+from colorama import init, Fore, Style
+init()
+
+from lib.logger import Logger
+from lib.i2c_master import I2cMaster
+from lib.protocol import CMD_READ_ALL_PINS, CMD_READ_PINS, CMD_SET_ANALOG_MODE, CMD_SET_CHANGE_MASK, \
+        CMD_READ_CHANGES, CMD_START_CAPTURE, CMD_READ_CAPTURE, \
+        CMD_APPLY_PIN_MAP, CMD_SET_FRAMING, CMD_WRITE_OUTPUTS, CMD_READ_PINS_GENERATION, CMD_SET_SAMPLE_PERIOD, \
+        CMD_CONFIGURE_COUNTER, CMD_READ_COUNTERS, OFFSET_CONFIGURE_INPUT
+
+# priorities ....................................
+PRIORITY_HIGH   = 0   # pin reads, e.g., obstacle and bumper sensors
+PRIORITY_NORMAL = 1   # configuration and output writes
+PRIORITY_LOW    = 2   # telemetry and housekeeping (224-233)
+
+# ..............................................................................
+class I2cBus():
+    '''
+        Owns a single connection (by default via pigpio) for an I²C bus and hands out I2cMaster
+        handles for the devices on it. Every transaction of those masters is
+        executed from a single queue by a dedicated bus thread, in order of
+        priority, then deadline (earliest first), then arrival. A transaction
+        whose deadline has passed before it reaches the bus is not sent, and
+        raises a TimeoutError in its caller.
+
+        Unless otherwise specified, a transaction's priority is determined from
+        its command by priority_of().
+
+        Parameters:
+          level:      the log level, e.g., Level.INFO
+          number:     the I²C bus number (default 1)
+          pi:         an optional pigpio.pi() (or compatible, e.g., a SimulatedPi)
+                      to use in place of a newly-created one
+          transport:  an optional function of the bus number and a device address
+                      returning the transport of each master, e.g., I2cDevTransport
+                      (see lib/i2c_transport.py), in place of the pi's. A pi is then
+                      only required for change events
+    '''
+    def __init__(self, level, number=1, pi=None, transport=None):
+        self._log = Logger('i²cbus-{:d}'.format(number), level)
+        self._level = level
+        self._number = number
+        self._transport = transport
+        self._transports = []
+        self._owns_pi = pi is None and transport is None
+        if pi is not None or transport is not None:
+            self._pi = pi
+        else:
+            try:
+                import pigpio
+                self._pi = pigpio.pi()
+            except ImportError as ie:
+                self._log.error('failed to import pigpio: {}. You may need to install it via:\n\n  % sudo pip3 install pigpio\n'.format(ie))
+                sys.exit(1)
+            except Exception as e:
+                self._log.error('failed to instantiate pi: {}'.format(e))
+                sys.exit(2)
+        self._masters = {}
+        self._queue = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._usage = {}
+        self._started = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name='i2cbus-{:d}'.format(number), daemon=True)
+        self._thread.start()
+        self._log.info('ready.')
+
+    @property
+    def pi(self):
+        return self._pi
+
+    @property
+    def number(self):
+        return self._number
+
+    # ..........................................................................
+    def get_master(self, device_id):
+        '''
+            Returns the I2cMaster for the device at the given address, creating
+            it upon first request.
+        '''
+        _master = self._masters.get(device_id)
+        if _master is None:
+            if self._transport is not None:
+                self._transports.append(self._transport(self._number, device_id))
+                _master = I2cMaster(device_id, self._level, bus=self, transport=self._transports[-1])
+            else:
+                _master = I2cMaster(device_id, self._level, bus=self)
+            self._masters[device_id] = _master
+            self._usage[device_id] = _Usage()
+        return _master
+
+    # ..........................................................................
+    def execute(self, device_id, command, function, args=(), priority=None, deadline=None):
+        '''
+            Queues the function for execution on the bus thread, blocking until
+            it has completed and returning its result (or raising its exception).
+
+            Parameters:
+              device_id:  the address of the device being addressed, for accounting
+              command:    the command being sent, used to determine the priority
+              function:   the function to execute, with arguments 'args'
+              priority:   PRIORITY_HIGH, PRIORITY_NORMAL or PRIORITY_LOW (or any
+                          int; lower runs first), overriding priority_of(command)
+              deadline:   if not None, the time (in seconds from now) by which the
+                          transaction must have reached the bus
+        '''
+        if threading.current_thread() is self._thread: # reentrant call
+            return function(*args)
+        if priority is None:
+            priority = priority_of(command)
+        _deadline = time.monotonic() + deadline if deadline is not None else float('inf')
+        _request = _Request(device_id, function, args, _deadline)
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('I²C bus {:d} is closed.'.format(self._number))
+            heapq.heappush(self._queue, ( priority, _deadline, next(self._sequence), _request ))
+            self._condition.notify()
+        _request.done.wait()
+        if _request.error is not None:
+            raise _request.error
+        return _request.result
+
+    # ..........................................................................
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue and not self._closed:
+                    self._condition.wait()
+                if not self._queue: # closed and drained
+                    return
+                _request = heapq.heappop(self._queue)[3]
+            _usage = self._usage.get(_request.device_id)
+            if _usage is None:
+                _usage = self._usage.setdefault(_request.device_id, _Usage())
+            _start = time.monotonic()
+            _usage.waiting += _start - _request.queued
+            if _start > _request.deadline:
+                _usage.missed += 1
+                _request.error = TimeoutError('transaction for device 0x{:02X} missed its deadline by {:.1f}ms.'.format(
+                        _request.device_id, ( _start - _request.deadline ) * 1000.0))
+            else:
+                try:
+                    _request.result = _request.function(*_request.args)
+                except Exception as e:
+                    _request.error = e
+                _usage.busy += time.monotonic() - _start
+                _usage.transactions += 1
+            _request.done.set()
+
+    # ..........................................................................
+    def utilisation(self):
+        '''
+            Returns a dict keyed by device address, each value a dict of the
+            device's transaction count, time spent on the bus (seconds), share
+            of the elapsed time spent on the bus, mean queue wait (seconds)
+            and count of missed deadlines, since the bus was created or
+            reset_utilisation() was last called.
+        '''
+        _elapsed = max(time.monotonic() - self._started, 1e-9)
+        _result = {}
+        for _device_id, _usage in sorted(self._usage.items()):
+            _count = _usage.transactions + _usage.missed
+            _result[_device_id] = {
+                'transactions': _usage.transactions,
+                'busy':         _usage.busy,
+                'utilisation':  _usage.busy / _elapsed,
+                'mean_wait':    _usage.waiting / _count if _count else 0.0,
+                'missed':       _usage.missed
+            }
+        return _result
+
+    # ..........................................................................
+    def reset_utilisation(self):
+        for _device_id in self._usage:
+            self._usage[_device_id] = _Usage()
+        self._started = time.monotonic()
+
+    # ..........................................................................
+    def log_utilisation(self):
+        for _device_id, _usage in self.utilisation().items():
+            self._log.info('0x{:02X}: '.format(_device_id) + Fore.CYAN + Style.BRIGHT + '{:5.1f}%'.format(_usage['utilisation'] * 100.0)
+                    + Style.NORMAL + ' of bus; {:d} transactions; mean wait {:.2f}ms; {:d} missed deadlines.'.format(
+                    _usage['transactions'], _usage['mean_wait'] * 1000.0, _usage['missed']))
+
+    # ..........................................................................
+    def close(self):
+        '''
+            Closes each of the masters, completes any queued transactions and
+            stops the bus thread. Any transports the bus created are closed, and
+            if it created its pigpio connection that is also stopped.
+        '''
+        if self._closed:
+            return
+        for _master in self._masters.values():
+            _master.close()
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        for _transport in self._transports:
+            _transport.close()
+        if self._owns_pi:
+            self._pi.stop()
+        self._log.info('closed.')
+
+
+# ..............................................................................
+def priority_of(command):
+    '''
+        Returns the default priority of a command: reading pins (or change
+        events, or edge counters) is high priority, configuration, writing outputs and capture
+        normal, and the echo, counter and range commands (224-233) low.
+    '''
+    if 0 <= command < OFFSET_CONFIGURE_INPUT or command == CMD_READ_ALL_PINS or command == CMD_READ_PINS \
+            or command == CMD_READ_CHANGES or command == CMD_READ_PINS_GENERATION or command == CMD_READ_COUNTERS:
+        return PRIORITY_HIGH
+    elif command < 224 or command == CMD_SET_ANALOG_MODE or command == CMD_SET_CHANGE_MASK \
+            or CMD_START_CAPTURE <= command <= CMD_READ_CAPTURE or command == CMD_APPLY_PIN_MAP \
+            or command == CMD_SET_FRAMING or command == CMD_WRITE_OUTPUTS or command == CMD_SET_SAMPLE_PERIOD \
+            or command == CMD_CONFIGURE_COUNTER:
+        return PRIORITY_NORMAL
+    else:
+        return PRIORITY_LOW
+
+
+# ..............................................................................
+class _Request():
+    __slots__ = [ 'device_id', 'function', 'args', 'deadline', 'queued', 'done', 'result', 'error' ]
+
+    def __init__(self, device_id, function, args, deadline):
+        self.device_id = device_id
+        self.function  = function
+        self.args      = args
+        self.deadline  = deadline
+        self.queued    = time.monotonic()
+        self.done      = threading.Event()
+        self.result    = None
+        self.error     = None
+
+
+# ..............................................................................
+class _Usage():
+    __slots__ = [ 'transactions', 'busy', 'waiting', 'missed' ]
+
+    def __init__(self):
+        self.transactions = 0
+        self.busy         = 0.0
+        self.waiting      = 0.0
+        self.missed       = 0
+
+#EOF
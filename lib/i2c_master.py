@@ -7,18 +7,60 @@
 #
 # author:   Murray Altheim
 # created:  2020-04-30
-# modified: 2020-05-04
+# modified: 2020-05-25
 #
-# This requires installation of pigpio, e.g.:
+# This requires installation of pigpio (unless another transport is used,
+# see lib/i2c_transport.py), e.g.:
 #
 #   % sudo pip3 install pigpio
 #
+# and for capture(), of numpy:
+#
+#   % sudo pip3 install numpy
+#
 
-import sys, time, traceback, itertools
+import sys, time, traceback, itertools, threading
+from array import array
+from collections import namedtuple
 from colorama import init, Fore, Style
 init()
 
 from lib.logger import Logger, Level
+from lib.sampler import Sampler, Snapshot
+from lib.i2c_stats import I2cStats
+from lib.i2c_transport import PigpioTransport
+from lib.recorder import Recorder, RecordingTransport
+from lib.read_cache import ReadCache, invalidates
+from lib.protocol import UNDEFINED_ERROR, CMD_RETURN_REQUEST_COUNT, CMD_RETURN_LOOP_COUNT, \
+        CMD_RETURN_ANALOG_MIN_RANGE, CMD_RETURN_ANALOG_MAX_RANGE, OFFSET_CONFIGURE_INPUT, CMD_READ_ALL_PINS, CMD_READ_PINS, \
+        CMD_SET_ANALOG_MODE, ANALOG_MODE_SCALED, ANALOG_MODE_RAW, ANALOG_MODE_AVERAGE, ANALOG_MODE_MEDIAN, \
+        ANALOG_MODE_EMA, MAX_AVERAGE_SAMPLES, MAX_MEDIAN_SAMPLES, MAX_EMA_SHIFT, \
+        CMD_SET_CHANGE_MASK, CMD_READ_CHANGES, CHANGE_BATCH, CHANGES_PENDING, CHANGES_LOST, \
+        CHANGE_PIN_SHIFT, CHANGE_VALUE_MASK, GPIO_INPUT, PUD_DOWN, RISING_EDGE, \
+        CMD_START_CAPTURE, CMD_STOP_CAPTURE, CMD_READ_CAPTURE, CAPTURE_BATCH, CAPTURE_PENDING, \
+        CAPTURE_VALUE_BITS, CAPTURE_TICK_MASK, CAPTURE_MIN_PERIOD, CAPTURE_LENGTH, \
+        CMD_HANDSHAKE, CMD_APPLY_PIN_MAP, PIN_MAP_LENGTH, PIN_MAP_NAMES, PIN_UNUSED, PROTOCOL_VERSION, \
+        UNRECOGNISED_COMMAND, config_hash, CMD_SET_FRAMING, FRAME_OK, FRAME_BAD_LENGTH, FRAME_OVERHEAD, FRAME_LENGTH_SHIFT, FRAME_STATUS_MASK, \
+        FRAME_STATUS_NAMES, crc8, CMD_WRITE_OUTPUTS, CMD_READ_PINS_GENERATION, LOOP_DELAY_MS, \
+        CMD_SET_SAMPLE_PERIOD, MIN_SAMPLE_PERIOD_MS, PINS_ASSIGNED, BLOCK_PIN_COUNT, QUEUE_LENGTH, \
+        CMD_CONFIGURE_COUNTER, CMD_READ_COUNTERS, COUNT_RISING, COUNT_FALLING, COUNT_BOTH, COUNT_PULLUP, COUNTER_BATCH
+
+# a block of captured samples: NumPy arrays of the timestamps (in seconds from
+# the first sample of the capture) and values, with the number of samples
+# dropped by the slave as its buffer was full, and of sample times it missed.
+CaptureBlock = namedtuple('CaptureBlock', [ 'timestamps', 'values', 'overflowed', 'missed' ])
+_DRAIN_READS = CAPTURE_LENGTH // ( CAPTURE_BATCH - 1 ) + 1 # a framed read carries one fewer sample
+
+# the reply to a handshake: the slave's protocol version, firmware version
+# (major, minor in the MSB and LSB) and the hash of its pin assignments.
+Handshake = namedtuple('Handshake', [ 'protocol_version', 'firmware_version', 'config_hash' ])
+
+# the reading of an edge counter: the edges counted (since the last reset),
+# the period between the last two edges in µs (0 until two have been
+# counted), and the slave's micros() when read.
+Count = namedtuple('Count', [ 'count', 'period', 'micros' ])
+
+FRAME_RETRIES = 3 # the number of times a framed transaction is retried
 
 # ..............................................................................
 class I2cMaster():
@@ -28,26 +70,73 @@ class I2cMaster():
         Parameters:
           device_id:  the I²C address over which the master and slave communicate
           level:      the log level, e.g., Level.INFO
+          pi:         an optional pigpio.pi() (or compatible, e.g., a SimulatedPi)
+                      to use in place of a newly-created one
+          bus:        an optional I2cBus, whose connection and scheduler are used
+                      (normally provided by I2cBus.get_master())
+          transport:  an optional transport (see lib/i2c_transport.py) over which
+                      to reach the slave, in place of a PigpioTransport of the pi.
+                      A pi is then only required for change events. The caller
+                      remains responsible for closing the transport, whereas
+                      the master closes a transport it created (see close())
     '''
-    def __init__(self, device_id, level):
+    def __init__(self, device_id, level, pi=None, bus=None, transport=None):
         super().__init__()
         self._log = Logger('i²cmaster-0x{:02x}'.format(device_id), level)
         self._device_id = device_id
+        self._bus = bus
         self._log.debug('initialising to communicate over I²C address 0x{:02X}...'.format(device_id))
-        try:
-            import pigpio
-            self._pi = pigpio.pi()
-            self._log.debug('imported pigpio.')
-        except ImportError as ie:
-            self._log.error('failed to import pigpio: {}. You may need to install it via:\n\n  % sudo pip3 install pigpio\n'.format(ie))
-            sys.exit(1)
-        except Exception as e:
-            self._log.error('failed to instantiate pi: {}'.format(ie))
-            sys.exit(2)
-        self._handle = self._pi.i2c_open(1, device_id) # open device at address 0x08 on bus 1
-        self._log.debug('pigpio configured successfully for I²C device at address 0x{:02X} with handle {:d}.'.format(device_id, self._handle))
+        if bus is not None:
+            self._pi = bus.pi
+            self._log.debug('using connection of I²C bus {:d}.'.format(bus.number))
+        elif pi is not None or transport is not None:
+            self._pi = pi
+            self._log.debug('using provided pi: {}.'.format(type(pi).__name__))
+        else:
+            try:
+                import pigpio
+                self._pi = pigpio.pi()
+                self._log.debug('imported pigpio.')
+            except ImportError as ie:
+                self._log.error('failed to import pigpio: {}. You may need to install it via:\n\n  % sudo pip3 install pigpio\n'.format(ie))
+                sys.exit(1)
+            except Exception as e:
+                self._log.error('failed to instantiate pi: {}'.format(e))
+                sys.exit(2)
+        self._owns_transport = transport is None
+        if transport is None:
+            transport = PigpioTransport(self._pi, bus.number if bus else 1, device_id) # open device at address 0x08 on bus 1
+        self._transport = transport
+        self._log.debug('configured successfully for I²C device at address 0x{:02X} via {}.'.format(device_id, transport))
         self._counter = itertools.count()
         self._loop_count = 0  # currently only used in testing
+        self._bus_lock = threading.RLock()
+        self._legacy_owner = None # the thread between its write_i2c_data() and read_i2c_data()
+        self._flights = {}        # the transactions in flight that others may join, by request
+        self._flights_lock = threading.Lock()
+        self._epoch = 0           # incremented by each request that others may not join
+        self.coalesced_count = 0
+        self._level = level
+        self._snapshot = Snapshot()
+        self._sampler = None
+        self._stats = I2cStats()
+        self._legacy_commands = [] # the legacy write_i2c_data() commands awaiting read_i2c_data()
+        self._reporter = None
+        self._subscribers = {}
+        self._change_mask = 0
+        self._subscribers_lock = threading.Lock() # over the subscribers and the change mask set upon the slave
+        self._interrupt = None
+        self._events_lock = threading.Lock()
+        self.interrupt_count = 0
+        self.lost_change_count = 0
+        self._framed = False
+        self._sequence = itertools.count()
+        self.frame_error_count = 0
+        self.retry_count = 0
+        self._cache = None
+        self._sample_period_ms = LOOP_DELAY_MS
+        self._counter_resets = {} # the slave's micros() when each counter was last reset, by pin
+        self._counter_carries = {} # counts reset by the slave but not returned (see read_counters()), by pin
         self._closed = False
         self._log.info('ready.')
 
@@ -56,13 +145,25 @@ class I2cMaster():
     def read_i2c_data(self):
         '''
             Read two bytes (LSB, MSB) from the I²C device at the specified handle, returning the value as an int.
+            Following write_i2c_data() in the same thread, this sends the command written and reads its reply
+            with exclusive use of the device (on an I2cBus, as a single job of the bus thread), then releases
+            the master to other threads.
         '''
-        ( byte_count, byte_array) = self._pi.i2c_read_device(self._handle, 2)
+        if self._legacy_owner is threading.current_thread():
+            try:
+                _commands = self._legacy_commands
+                self._legacy_commands = []
+                ( byte_count, byte_array) = self._exclusively(_commands[-1], self._write_and_read, ( _commands, ))
+            finally:
+                self._legacy_owner = None
+                self._bus_lock.release()
+        else:
+            ( byte_count, byte_array) = self._exclusively(None, self._write_and_read, ( [], ))
         low_byte  = byte_array[0]
         high_byte = byte_array[1]
         _data = low_byte
         _data += ( high_byte << 8 )
-        self._log.debug(Fore.BLUE + 'read {:d} bytes: hi: {:08b};\t lo: {:08b};\t read data: {}'.format(byte_count, high_byte, low_byte, _data))
+        self._log.debug(Fore.BLUE + 'read {:d} bytes: hi: {:08b};\t lo: {:08b};\t read data: {}', byte_count, high_byte, low_byte, _data)
         return _data
 
 
@@ -70,11 +171,314 @@ class I2cMaster():
     def write_i2c_data(self, data):
         '''
             Write an int as two bytes (LSB, MSB) to the I²C device at the specified handle.
+            Not available in framed mode.
+
+            The master is then held by the calling thread until its read_i2c_data(),
+            which sends the command along with reading the reply, so that no other
+            thread's transaction intervenes, whether or not the master is on an
+            I2cBus. Any error in sending the command is therefore raised by
+            read_i2c_data(), which must follow.
+        '''
+        self._check_open()
+        if self._framed:
+            raise IOError('write_i2c_data() is not available in framed mode.')
+        if self._legacy_owner is not threading.current_thread():
+            self._bus_lock.acquire()
+            self._legacy_owner = threading.current_thread()
+        self._legacy_commands.append(data)
+
+
+    # ..........................................................................
+    def _exclusively(self, command, function, args):
+        '''
+            Calls the function with exclusive use of the device: on a bus as a
+            job of the bus thread (at the command's priority), otherwise under
+            the bus lock.
+        '''
+        if self._bus is not None:
+            return self._bus.execute(self._device_id, command, function, args)
+        with self._bus_lock:
+            return function(*args)
+
+
+    # ..........................................................................
+    def _write_and_read(self, commands):
+        '''
+            Performs read_i2c_data(), writing the commands of write_i2c_data()
+            (each as two single byte writes) then reading the two byte reply.
+            The caller must have exclusive use of the bus.
+        '''
+        self._check_open()
+        _start = time.perf_counter()
+        for data in commands:
+            self._stats.count_request(data)
+            if not coalesces(data):
+                with self._flights_lock:
+                    self._epoch += 1
+            if self._cache is not None and invalidates(data):
+                self._cache.invalidate()
+            byteArray = [ data & 0xFF, ( data >> 8 ) & 0xFF ]
+            self._transport.write_byte(byteArray[0])
+            self._transport.write_byte(byteArray[1])
+            self._log.debug(Fore.BLACK + 'sent 2 bytes: hi: {:08b};\t lo: {:08b};\t sent data: {}', byteArray[1], byteArray[0], data)
+        ( byte_count, byte_array) = self._transport.read_device(2)
+        if commands:
+            self._stats.record(commands[-1], time.perf_counter() - _start, byte_array)
+        return byte_count, byte_array
+
+
+    # ..........................................................................
+    def transact(self, data, count=2, priority=None, deadline=None):
+        '''
+            Writes the list of bytes and reads 'count' bytes of reply as a single
+            I²C transaction (a write and a read joined by a repeated start), in
+            a single call to the pigpio daemon, returning the reply as a bytearray.
+
+            If the master belongs to an I2cBus the transaction is scheduled by the
+            bus, at the given priority (by default determined by the command) and
+            optionally with a deadline, in seconds from now, by which it must have
+            been sent (see I2cBus.execute()).
+
+            This may be called from any number of threads. A read without a
+            deadline (see coalesces()) joins any identical read already in
+            flight rather than making its own: that read's single transaction
+            answers every thread waiting on it, as if they had all made it.
+            Once any request that is not a read has been made, later reads no
+            longer join those begun before it, so that a thread that writes an
+            output (say) then reads it back, reads its own write.
+        '''
+        _command = data[0] | ( data[1] << 8 )
+        if deadline is not None or not coalesces(_command):
+            with self._flights_lock:
+                self._epoch += 1
+            return self._transact(_command, data, count, priority, deadline)
+        _key = ( bytes(data), count )
+        with self._flights_lock:
+            _flight = self._flights.get(_key)
+            if _flight is not None and _flight.epoch == self._epoch:
+                self.coalesced_count += 1
+                _leader = False
+            else:
+                _flight = self._flights[_key] = _Flight(self._epoch)
+                _leader = True
+        if not _leader:
+            _flight.done.wait()
+            if _flight.error is not None:
+                raise _flight.error
+            return bytearray(_flight.result)
+        try:
+            _flight.result = self._transact(_command, data, count, priority, None)
+            return bytearray(_flight.result)
+        except Exception as e:
+            _flight.error = e
+            raise
+        finally:
+            with self._flights_lock:
+                if self._flights.get(_key) is _flight:
+                    del self._flights[_key]
+            _flight.done.set()
+
+
+    # ..........................................................................
+    def _transact(self, command, data, count, priority, deadline):
+        '''
+            Performs the transaction for transact().
+        '''
+        if self._bus is not None:
+            return self._bus.execute(self._device_id, command, self._zip, ( command, data, count ), priority, deadline)
+        else:
+            with self._bus_lock:
+                return self._zip(command, data, count)
+
+
+    # ..........................................................................
+    def _zip(self, command, data, count):
+        '''
+            Performs the transaction for transact(), recording its metrics and
+            maintaining the read cache (if enabled), which is invalidated by
+            a command that may change the values of the pins, and updated by
+            the reply to a read of the sample generation. The caller must have
+            exclusive use of the bus.
+        '''
+        self._check_open()
+        self._stats.count_request(command)
+        _cache = self._cache
+        if _cache is None:
+            return self._zip_framed(command, data, count) if self._framed else self._zip_unframed(command, data, count)
+        if invalidates(command):
+            _cache.invalidate()
+        _start = _cache.clock()
+        byte_array = self._zip_framed(command, data, count) if self._framed else self._zip_unframed(command, data, count)
+        if command == CMD_READ_PINS_GENERATION:
+            _cache.update(_start, byte_array[0] | ( byte_array[1] << 8 ), byte_array[2] | ( byte_array[3] << 8 ),
+                    data[2] | ( data[3] << 8 ), [ byte_array[i] | ( byte_array[i + 1] << 8 ) for i in range(4, count - 1, 2) ])
+        return byte_array
+
+
+    # ..........................................................................
+    def _zip_unframed(self, command, data, count):
+        '''
+            Performs the transaction for _zip() in the default, unframed mode.
+        '''
+        _start = time.perf_counter()
+        try:
+            ( byte_count, byte_array ) = self._transport.zip(data, count)
+        except Exception:
+            self._stats.record_failure(command)
+            raise
+        if byte_count != count:
+            self._stats.record_failure(command)
+            raise IOError('expected {:d} bytes from I²C transaction, read {:d}.'.format(count, byte_count))
+        self._stats.record(command, time.perf_counter() - _start, byte_array)
+        return byte_array
+
+
+    # ..........................................................................
+    def _zip_framed(self, command, data, count):
+        '''
+            Performs the transaction for _zip() in framed mode: the request is
+            sent as a frame with the next sequence number and its reply is
+            unframed. A transaction whose reply is corrupted or reports an
+            error is retried with the same sequence number, up to FRAME_RETRIES
+            times: the slave replays its last reply rather than executing the
+            command again, so that a command is executed exactly once. Raises
+            an IOError if the retries are exhausted.
+        '''
+        _sequence = next(self._sequence) & 0xFF
+        _frame = [ _sequence ] + data
+        _frame.append(crc8(_frame))
+        _count = count + FRAME_OVERHEAD
+        _start = time.perf_counter()
+        for _attempt in range(FRAME_RETRIES + 1):
+            if _attempt:
+                self.retry_count += 1
+            try:
+                ( byte_count, byte_array ) = self._transport.zip(_frame, _count)
+            except Exception as e:
+                self._log.warning('framed transaction {:d} failed: {}', _sequence, e)
+                continue
+            _length = byte_array[1] >> FRAME_LENGTH_SHIFT if byte_count == _count else count + 1
+            _status = byte_array[1] & FRAME_STATUS_MASK if byte_count == _count else None
+            if _length > count or byte_array[0] != _sequence or crc8(byte_array[:2 + _length]) != byte_array[2 + _length]:
+                self.frame_error_count += 1
+                self._log.warning('framed transaction {:d} returned a corrupted reply.', _sequence)
+            elif _status != FRAME_OK:
+                # the slave did not execute the command
+                self.frame_error_count += 1
+                self._log.warning('framed transaction {:d} returned {}.', _sequence, FRAME_STATUS_NAMES[_status])
+                if _status == FRAME_BAD_LENGTH:
+                    break # retrying will not help
+            else:
+                # as unframed, a reply shorter than requested is padded as read from an idle bus
+                _reply = byte_array[2:2 + _length] + bytearray([ 0xFF ] * ( count - _length ))
+                self._stats.record(command, time.perf_counter() - _start, _reply)
+                return _reply
+        self._stats.record_failure(command)
+        raise IOError('framed transaction {:d} (command {:d}) failed.'.format(_sequence, command))
+
+
+    # ..........................................................................
+    def set_framing(self, enabled):
+        '''
+            Enables or disables framed mode (261). In framed mode each request
+            carries a sequence number and a CRC-8, and each reply the sequence
+            number, a status and a CRC-8, so that a corrupted transaction is
+            detected and retried (see _zip_framed()) rather than returning a
+            wrong value. This costs three bytes per reply and one retry per
+            corrupted transaction; a block reply may carry one fewer value.
+
+            261:        enable or disable framed mode, return the framing state
+        '''
+        if self._bus is not None:
+            self._bus.execute(self._device_id, CMD_SET_FRAMING, self._set_framing, ( enabled, ))
+        else:
+            with self._bus_lock:
+                self._set_framing(enabled)
+
+
+    # ..........................................................................
+    def _set_framing(self, enabled):
+        '''
+            Performs set_framing(), switching the master's framing along with
+            the slave's. The caller must have exclusive use of the bus.
+        '''
+        if enabled == self._framed:
+            return
+        byte_array = self._zip(CMD_SET_FRAMING, [ CMD_SET_FRAMING & 0xFF, CMD_SET_FRAMING >> 8, 1 if enabled else 0 ], 2)
+        if byte_array[0] != ( 1 if enabled else 0 ) or byte_array[1] != 0:
+            raise IOError('failed to {} framed mode; returned: {:d}, {:d}.'.format('enable' if enabled else 'disable', byte_array[0], byte_array[1]))
+        self._framed = enabled
+        self._sequence = itertools.count()
+        self._log.info('framed mode {}.', 'enabled' if enabled else 'disabled')
+
+
+    # ..........................................................................
+    @property
+    def framed(self):
+        return self._framed
+
+
+    # ..........................................................................
+    def set_sample_period(self, period_ms):
+        '''
+            Sets the period (MIN_SAMPLE_PERIOD_MS-65535ms) on which the slave
+            reads its pins, by default LOOP_DELAY_MS, and so the staleness of
+            the values returned by get_input_from_pin() and read_pins(): a
+            value is on average half a period old, at most a whole period.
+            A shorter period costs the slave more of its time reading pins
+            (an analog pin in a filtered mode takes several samples per read),
+            leaving less for capture and the Wire callbacks. The read cache
+            (if enabled) follows the new period.
+
+            264:        set the sample period in milliseconds, return the period
+        '''
+        if not MIN_SAMPLE_PERIOD_MS <= period_ms <= 0xFFFF:
+            raise ValueError('sample period {}ms out of range.'.format(period_ms))
+        if self._bus is not None:
+            self._bus.execute(self._device_id, CMD_SET_SAMPLE_PERIOD, self._set_sample_period, ( period_ms, ))
+        else:
+            with self._bus_lock:
+                self._set_sample_period(period_ms)
+
+
+    # ..........................................................................
+    def _set_sample_period(self, period_ms):
+        '''
+            Performs set_sample_period(), switching the read cache's period
+            along with the slave's. The caller must have exclusive use of the
+            bus.
         '''
-        byteArray = [ data, ( data >> 8 ) ]
-        self._pi.i2c_write_byte(self._handle, byteArray[0])
-        self._pi.i2c_write_byte(self._handle, byteArray[1])
-        self._log.debug(Fore.BLACK + 'sent 2 bytes: hi: {:08b};\t lo: {:08b};\t sent data: {}'.format(byteArray[1], byteArray[0], data))
+        byte_array = self._zip(CMD_SET_SAMPLE_PERIOD, [ CMD_SET_SAMPLE_PERIOD & 0xFF, CMD_SET_SAMPLE_PERIOD >> 8,
+                period_ms & 0xFF, period_ms >> 8 ], 2)
+        _received_data = byte_array[0] | ( byte_array[1] << 8 )
+        if _received_data != period_ms:
+            raise IOError('failed to set sample period {:d}ms; returned: {:d}.'.format(period_ms, _received_data))
+        self._sample_period_ms = period_ms
+        if self._cache is not None:
+            self._cache.set_period(period_ms)
+        self._log.info('sample period set to {:d}ms.', period_ms)
+
+
+    # ..........................................................................
+    @property
+    def sample_period(self):
+        '''
+            Returns the slave's sample period (ms), as last set by this master.
+        '''
+        return self._sample_period_ms
+
+
+    # ..........................................................................
+    def send_command(self, data, priority=None, deadline=None):
+        '''
+            Sends an int as a two byte (LSB, MSB) command and returns the two
+            byte reply as an int, in a single transaction. The priority and
+            deadline are as for transact().
+        '''
+        byte_array = self.transact([ data & 0xFF, ( data >> 8 ) & 0xFF ], 2, priority, deadline)
+        _data = byte_array[0] | ( byte_array[1] << 8 )
+        self._log.debug(Fore.BLUE + 'sent: {}; hi: {:08b};\t lo: {:08b};\t read data: {}', data, byte_array[1], byte_array[0], _data)
+        return _data
 
 
     # ..........................................................................
@@ -82,10 +486,12 @@ class I2cMaster():
         '''
             Sends a message to the pin (which should already include an offset if
             this is intended to return a non-pin value), returning the result.
+            If the read cache is enabled a read of pins 0-15 is made through it.
         '''
-        self.write_i2c_data(pinPlusOffset)
-        _received_data  = self.read_i2c_data()
-        self._log.debug('received response from pin {:d} of {:>5.2f}.'.format(pinPlusOffset, _received_data))
+        if self._cache is not None and 0 <= pinPlusOffset < BLOCK_PIN_COUNT:
+            return self._read_cached([ pinPlusOffset ])[0]
+        _received_data  = self.send_command(pinPlusOffset)
+        self._log.debug('received response from pin {:d} of {:>5.2f}.', pinPlusOffset, _received_data)
         return _received_data
 
 
@@ -97,16 +503,766 @@ class I2cMaster():
             This returns the response from the Arduino.
         '''
         if value is True:
-            self.write_i2c_data(pin + 192)
-            self._log.debug('set pin {:d} as HIGH.'.format(pin))
+            _received_data  = self.send_command(pin + 192)
+            self._log.debug('set pin {:d} as HIGH.', pin)
         else:
-            self.write_i2c_data(pin + 160)
-            self._log.debug('set pin {:d} as LOW.'.format(pin))
-        _received_data  = self.read_i2c_data()
-        self._log.debug('received response on pin {:d} of {:>5.2f}.'.format(pin, _received_data))
+            _received_data  = self.send_command(pin + 160)
+            self._log.debug('set pin {:d} as LOW.', pin)
+        self._log.debug('received response on pin {:d} of {:>5.2f}.', pin, _received_data)
         return _received_data
 
 
+    # ..........................................................................
+    def set_outputs(self, outputs):
+        '''
+            Sets several output pins (0-15) true (HIGH) or false (LOW) in a
+            single command (262), given as a dict of levels keyed by pin
+            number, e.g., { 4: True, 5: False, 7: True }. The slave writes the
+            pins together rather than one per transaction, so that they change
+            without visible skew. The pins must have already been configured
+            as OUTPUT; any that are not are left unchanged, and a warning is
+            logged. Returns the mask of the pins written.
+
+            262:        write the output pins in the pin mask, return the pins written
+        '''
+        _mask = _levels = 0
+        for _pin, _value in outputs.items():
+            if not 0 <= _pin < BLOCK_PIN_COUNT:
+                raise ValueError('pin {} out of range for setting outputs.'.format(_pin))
+            _mask |= 1 << _pin
+            if _value:
+                _levels |= 1 << _pin
+        if not _mask:
+            return 0
+        byte_array = self.transact([ CMD_WRITE_OUTPUTS & 0xFF, CMD_WRITE_OUTPUTS >> 8,
+                _mask & 0xFF, _mask >> 8, _levels & 0xFF, _levels >> 8 ])
+        _written = byte_array[0] | ( byte_array[1] << 8 )
+        if _written & ~_mask:
+            raise IOError('failed to set outputs {:016b}; returned: {:d}'.format(_mask, _written))
+        if _written != _mask:
+            self._log.warning('pins not configured as outputs were not set: {}',
+                    [ _pin for _pin in range(BLOCK_PIN_COUNT) if _mask & ~_written & ( 1 << _pin ) ])
+        self._log.debug('set outputs {:016b} as {:016b}.', _written, _levels & _written)
+        return _written
+
+
+    # ..........................................................................
+    def read_pins(self, pins=None):
+        '''
+            Returns the values of several input pins from a single block read,
+            rather than a write-then-read round trip per pin. The values are
+            returned in an array indexed by pin number, just long enough to hold
+            the highest requested pin; the entries of pins not requested are set
+            to UNDEFINED_ERROR. Each value is as would be returned by calling
+            get_input_from_pin() for that pin, including any error values.
+
+            If 'pins' is None the values of all of the slave's assigned pins are
+            returned (234), otherwise those of the listed pins (235), which must
+            each be within the range 0-15. In framed mode at most 14 pins may
+            be read at once.
+
+            If the read cache is enabled the pins are read through it, unless
+            they are too many for a read of the sample generation (more than
+            14, or 12 in framed mode).
+        '''
+        if self._cache is not None:
+            _pins = range(PINS_ASSIGNED) if pins is None else sorted(set(pins))
+            if 0 < len(_pins) <= self._cached_pin_limit() and 0 <= _pins[0] and _pins[-1] < BLOCK_PIN_COUNT:
+                _values = array('H', [ UNDEFINED_ERROR ]) * ( _pins[-1] + 1 )
+                for _pin, _value in zip(_pins, self._read_cached(_pins)):
+                    _values[_pin] = _value
+                return _values
+        if pins is None:
+            _pins = range(PINS_ASSIGNED)
+            _command = [ CMD_READ_ALL_PINS, 0 ]
+        else:
+            _pins = sorted(set(pins))
+            if not _pins:
+                return array('H')
+            _mask = 0
+            for _pin in _pins:
+                if not 0 <= _pin < BLOCK_PIN_COUNT:
+                    raise ValueError('pin {} out of range for block read.'.format(_pin))
+                _mask |= 1 << _pin
+            if self._framed and 2 * len(_pins) > QUEUE_LENGTH - FRAME_OVERHEAD:
+                raise ValueError('too many pins for a block read in framed mode: {:d}.'.format(len(_pins)))
+            _command = [ CMD_READ_PINS, 0, _mask & 0xFF, _mask >> 8 ]
+        byte_array = self.transact(_command, 2 * len(_pins))
+        _values = array('H', [ UNDEFINED_ERROR ]) * ( _pins[-1] + 1 )
+        for i, _pin in enumerate(_pins):
+            _values[_pin] = byte_array[2 * i] | ( byte_array[2 * i + 1] << 8 )
+        if self._log.debug_enabled:
+            self._log.debug('read {:d} pins in {:d} bytes: {}', len(_pins), len(byte_array), _values.tolist())
+        return _values
+
+
+    # ..........................................................................
+    def set_read_cache(self, enabled, loop_delay_ms=None, clock=time.monotonic):
+        '''
+            Enables or disables the read cache (see lib/read_cache.py). The
+            slave only reads its pins once per loop, so that a repeated read of
+            a pin before its next loop would return the same value: with the
+            cache enabled, reads of pins 0-15 by get_input_from_pin() and
+            read_pins() are made by a block read (263) whose reply carries the
+            slave's sample generation and its age, and until the slave is next
+            due to read its pins (by its 'loop_delay_ms') a repeated read is
+            served from the cache without touching the bus; by default this is
+            the sample period last set (see set_sample_period()). A read that misses
+            also refreshes the other pins read through the cache, so that a
+            set of pins read in turn costs one transaction per loop.
+
+            The cache is invalidated whenever the master configures a pin,
+            writes an output or changes the analog range, so it is only valid
+            if this is the only master doing so. Its hits and misses are
+            counted in stats().
+
+            263:        return the sample generation and age, then the value of each pin in the payload's pin mask
+        '''
+        if enabled:
+            _cache = ReadCache(self._sample_period_ms if loop_delay_ms is None else loop_delay_ms, clock)
+        else:
+            _cache = None
+        if self._bus is not None:
+            from lib.i2c_bus import PRIORITY_NORMAL # the bus module imports this one
+            self._bus.execute(self._device_id, None, setattr, ( self, '_cache', _cache ), PRIORITY_NORMAL)
+        else:
+            with self._bus_lock:
+                self._cache = _cache
+        self._log.info('read cache {}.', 'enabled' if enabled else 'disabled')
+
+
+    # ..........................................................................
+    def _cached_pin_limit(self):
+        '''
+            Returns the most pins that a read of the sample generation can
+            return: its reply has a two value header.
+        '''
+        return ( QUEUE_LENGTH - ( FRAME_OVERHEAD if self._framed else 0 ) ) // 2 - 2
+
+
+    # ..........................................................................
+    def _read_cached(self, pins):
+        '''
+            Returns a list of the values of the pins (0-15, in order), from
+            the read cache if current, otherwise by a read of the sample
+            generation (263) that updates the cache, counting the hit or miss.
+        '''
+        _cache = self._cache
+        _values = _cache.get(pins)
+        if _values is not None:
+            self._stats.count_cache(True)
+            return _values
+        self._stats.count_cache(False)
+        _mask = _cache.mask(pins, self._cached_pin_limit())
+        byte_array = self.transact([ CMD_READ_PINS_GENERATION & 0xFF, CMD_READ_PINS_GENERATION >> 8, _mask & 0xFF, _mask >> 8 ],
+                4 + 2 * bin(_mask).count('1'))
+        _read = {}
+        _offset = 4
+        for _pin in range(BLOCK_PIN_COUNT):
+            if _mask & ( 1 << _pin ):
+                _read[_pin] = byte_array[_offset] | ( byte_array[_offset + 1] << 8 )
+                _offset += 2
+        if self._log.debug_enabled:
+            self._log.debug('read {:d} pins of sample generation {:d}: {}', len(_read), byte_array[0] | ( byte_array[1] << 8 ), _read)
+        return [ _read[_pin] for _pin in pins ]
+
+
+    # ..........................................................................
+    def start_sampling(self, rates):
+        '''
+            Starts a background thread that reads each pin at its own rate, given
+            as a dict of rates (in Hz) keyed by pin number, e.g., { 8: 50, 6: 10 }.
+            The pins should already be configured. Any existing sampling is first
+            stopped.
+
+            The latest value of each pin is then available from get_sample()
+            without waiting on the bus.
+        '''
+        self.stop_sampling()
+        self._sampler = Sampler(self, rates, self._snapshot, self._level)
+        self._sampler.start()
+
+
+    # ..........................................................................
+    def stop_sampling(self):
+        '''
+            Stops background sampling, if running. The last sampled values remain
+            available from get_sample().
+        '''
+        if self._sampler is not None:
+            self._sampler.stop()
+            self._sampler = None
+
+
+    # ..........................................................................
+    def get_sample(self, pin):
+        '''
+            Returns a tuple of the most recently sampled value of the pin and its
+            time.monotonic() timestamp, or None if the pin hasn't been sampled.
+            This never touches the bus nor waits on a lock.
+        '''
+        return self._snapshot.read(pin)
+
+
+    # ..........................................................................
+    @property
+    def snapshot(self):
+        '''
+            Returns the Snapshot into which background sampling publishes.
+        '''
+        return self._snapshot
+
+
+    # ..........................................................................
+    def subscribe(self, pin, callback):
+        '''
+            Calls callback(pin, value) whenever the value of the input pin (0-15)
+            changes, as detected by the slave on its loop. The pin should already
+            be configured. Events are only delivered once start_events() has been
+            called, and callbacks are called from pigpio's callback thread, so
+            should return promptly.
+        '''
+        if not 0 <= pin < BLOCK_PIN_COUNT:
+            raise ValueError('pin {} out of range for change events.'.format(pin))
+        with self._subscribers_lock:
+            self._subscribers.setdefault(pin, []).append(callback)
+            if not self._change_mask & ( 1 << pin ):
+                self._set_change_mask(self._change_mask | ( 1 << pin ))
+
+
+    # ..........................................................................
+    def unsubscribe(self, pin, callback=None):
+        '''
+            Removes the callback for the pin, or if None, all of its callbacks.
+        '''
+        with self._subscribers_lock:
+            _callbacks = self._subscribers.get(pin, [])
+            if callback is None:
+                _callbacks.clear()
+            elif callback in _callbacks:
+                _callbacks.remove(callback)
+            if not _callbacks and self._change_mask & ( 1 << pin ):
+                self._subscribers.pop(pin, None)
+                self._set_change_mask(self._change_mask & ~( 1 << pin ))
+
+
+    # ..........................................................................
+    def _set_change_mask(self, mask):
+        '''
+            Sets the change mask upon the slave. The caller must hold the
+            subscribers lock, so that concurrent changes to the mask are not
+            lost.
+        '''
+        byte_array = self.transact([ CMD_SET_CHANGE_MASK, 0, mask & 0xFF, mask >> 8 ])
+        _received_data = byte_array[0] | ( byte_array[1] << 8 )
+        if _received_data == mask:
+            self._change_mask = mask
+            self._log.debug('set change mask {:016b}.', mask)
+        else:
+            self._log.error('failed to set change mask {:016b}; returned: {:d}', mask, _received_data)
+
+
+    # ..........................................................................
+    def start_events(self, gpio):
+        '''
+            Registers a pigpio callback on the rising edge of the GPIO wired to
+            the slave's interrupt line (INTERRUPT_PIN), upon which the pending
+            change events are read and dispatched to the subscribers. The bus
+            is then idle unless an input changes.
+        '''
+        self.stop_events()
+        if self._pi is None:
+            raise RuntimeError('change events require a pi for GPIO.')
+        self._pi.set_mode(gpio, GPIO_INPUT)
+        self._pi.set_pull_up_down(gpio, PUD_DOWN)
+        self._interrupt = self._pi.callback(gpio, RISING_EDGE, self._on_interrupt)
+        if self._pi.read(gpio): # already pending
+            self.dispatch_changes()
+        self._log.info('listening for change events on GPIO {:d}.', gpio)
+
+
+    # ..........................................................................
+    def stop_events(self):
+        if self._interrupt is not None:
+            self._interrupt.cancel()
+            self._interrupt = None
+
+
+    # ..........................................................................
+    def _on_interrupt(self, gpio, level, tick):
+        self.interrupt_count += 1
+        try:
+            self.dispatch_changes()
+        except Exception as e:
+            self._log.error('error handling change events: {}', e)
+
+
+    # ..........................................................................
+    def read_changes(self):
+        '''
+            Reads up to CHANGE_BATCH pending change events in a single block
+            read (238), returning a list of ( pin, value ) tuples in the order
+            the changes occurred and the header flags (CHANGES_PENDING if more
+            remain, CHANGES_LOST if the slave's queue overflowed).
+        '''
+        byte_array = self.transact([ CMD_READ_CHANGES, 0 ], 2 + 2 * CHANGE_BATCH)
+        _count = byte_array[0]
+        _flags = byte_array[1]
+        if _count > CHANGE_BATCH: # not a header, e.g., an error
+            raise IOError('unexpected change event header: {:d}, {:d}.'.format(_count, _flags))
+        _changes = []
+        for i in range(2, 2 + 2 * _count, 2):
+            _event = byte_array[i] | ( byte_array[i + 1] << 8 )
+            _changes.append(( _event >> CHANGE_PIN_SHIFT, _event & CHANGE_VALUE_MASK ))
+        return _changes, _flags
+
+
+    # ..........................................................................
+    def dispatch_changes(self):
+        '''
+            Reads the pending change events until none remain, calling the
+            subscribers of each pin. If the slave reports that events were
+            lost then, once the remaining events have been dispatched, the
+            subscribed pins are re-read and their subscribers called with the
+            current values. Returns the number of events dispatched.
+        '''
+        _dispatched = 0
+        _lost = False
+        with self._events_lock:
+            while True:
+                _changes, _flags = self.read_changes()
+                for _pin, _value in _changes:
+                    self._notify(_pin, _value)
+                _dispatched += len(_changes)
+                _lost = _lost or _flags & CHANGES_LOST
+                if not _flags & CHANGES_PENDING:
+                    break
+            if _lost:
+                self.lost_change_count += 1
+                self._log.warning('change events were lost; re-reading subscribed pins.')
+                with self._subscribers_lock:
+                    _pins = list(self._subscribers)
+                _values = self.read_pins(_pins)
+                for _pin in _pins:
+                    self._notify(_pin, _values[_pin])
+        return _dispatched
+
+
+    # ..........................................................................
+    def _notify(self, pin, value):
+        self._log.debug('pin {:d} changed to {:d}.', pin, value)
+        with self._subscribers_lock: # a copy, as subscribers may change meanwhile
+            _callbacks = list(self._subscribers.get(pin, ()))
+        for _callback in _callbacks:
+            try:
+                _callback(pin, value)
+            except Exception as e:
+                self._log.error('error in change callback for pin {:d}: {}', pin, e)
+
+
+    # ..........................................................................
+    def read_capture(self):
+        '''
+            Reads up to CAPTURE_BATCH captured samples (one fewer in framed
+            mode) in a single block read (258), returning the samples as bytes (4 per sample, LSB first),
+            the header flags (CAPTURE_RUNNING, and CAPTURE_PENDING if more
+            remain buffered), and the number of samples overflowed and sample
+            times missed since the last read.
+        '''
+        _batch = CAPTURE_BATCH - 1 if self._framed else CAPTURE_BATCH
+        byte_array = self.transact([ CMD_READ_CAPTURE & 0xFF, CMD_READ_CAPTURE >> 8 ], 4 + 4 * _batch)
+        _count = byte_array[0]
+        _flags = byte_array[1]
+        if _count > _batch: # not a header, e.g., an error
+            raise IOError('unexpected capture header: {:d}, {:d}.'.format(_count, _flags))
+        return bytes(byte_array[4:4 + 4 * _count]), _flags, byte_array[2], byte_array[3]
+
+
+    # ..........................................................................
+    def stream_capture(self, pin, rate, duration):
+        '''
+            Captures an input pin on the slave at 'rate' samples per second
+            (at most 2000) for 'duration' seconds, yielding a CaptureBlock for
+            each drain of the slave's buffer. The slave samples the pin on a
+            fixed period into its buffer with a timestamp, so the timing of the
+            samples does not depend upon that of the bus; the buffer is drained
+            at intervals of a third of its capacity. Analog pins are captured
+            as raw 10 bit values.
+
+            Each block read carries 7 samples in about 3.4ms on a 100kHz bus,
+            so that rates approaching the maximum require a 400kHz bus. Any
+            samples lost, whether dropped by the slave because its buffer
+            was full or missed because its loop was held up, are counted in
+            the block in which they were reported, and leave a corresponding
+            gap in its timestamps.
+
+            256:        start capture of a pin, return pin number
+            257:        stop capture, return number of samples buffered
+            258:        read captured samples (see read_capture())
+
+            This requires numpy.
+        '''
+        try:
+            import numpy
+        except ImportError as ie:
+            self._log.error('failed to import numpy: {}. You may need to install it via:\n\n  % sudo pip3 install numpy\n'.format(ie))
+            raise
+        _period = int(round(1e6 / rate))
+        if not CAPTURE_MIN_PERIOD <= _period <= 0xFFFF:
+            raise ValueError('capture rate {}Hz out of range.'.format(rate))
+        _interval = _period * CAPTURE_LENGTH / 3e6
+        byte_array = self.transact([ CMD_START_CAPTURE & 0xFF, CMD_START_CAPTURE >> 8, pin, _period & 0xFF, _period >> 8 ])
+        _received_data = byte_array[0] | ( byte_array[1] << 8 )
+        if pin != _received_data:
+            raise IOError('failed to start capture of pin {:d}; returned: {:d}'.format(pin, _received_data))
+        self._log.info('capturing pin {:d} every {:d}µs for {:.1f}s...', pin, _period, duration)
+        _end = time.perf_counter() + duration
+        _stopped = False
+        _last_tick = None
+        _elapsed = 0 # µs from the first sample to the last tick
+        try:
+            while True:
+                _remaining = _end - time.perf_counter()
+                if _remaining <= 0.0:
+                    self.send_command(CMD_STOP_CAPTURE)
+                    _stopped = True
+                _chunks = []
+                _overflowed = _missed = 0
+                for _ in range(_DRAIN_READS): # at most a buffer's worth, should the bus not keep up
+                    _data, _flags, _block_overflowed, _block_missed = self.read_capture()
+                    _chunks.append(_data)
+                    _overflowed += _block_overflowed
+                    _missed += _block_missed
+                    if not _flags & CAPTURE_PENDING:
+                        break
+                _samples = numpy.frombuffer(b''.join(_chunks), dtype='<u4')
+                if len(_samples) or _overflowed or _missed:
+                    _ticks = ( _samples >> CAPTURE_VALUE_BITS ).astype(numpy.int64)
+                    if len(_ticks):
+                        if _last_tick is None:
+                            _last_tick = _ticks[0]
+                        # the ticks wrap every 4.19s: accumulate their differences
+                        _offsets = numpy.cumsum(numpy.diff(_ticks, prepend=_last_tick) & CAPTURE_TICK_MASK) + _elapsed
+                        _last_tick = _ticks[-1]
+                        _elapsed = _offsets[-1]
+                    else:
+                        _offsets = numpy.zeros(0, dtype=numpy.int64)
+                    yield CaptureBlock(_offsets / 1e6, ( _samples & CHANGE_VALUE_MASK ).astype(numpy.uint16), _overflowed, _missed)
+                if _stopped:
+                    break
+                time.sleep(min(_interval, max(_remaining, 0.0)))
+        finally:
+            if not _stopped:
+                self.send_command(CMD_STOP_CAPTURE)
+
+
+    # ..........................................................................
+    def capture(self, pin, rate, duration):
+        '''
+            Captures an input pin on the slave as stream_capture(), returning a
+            single CaptureBlock of the whole capture. This requires numpy.
+        '''
+        _blocks = list(self.stream_capture(pin, rate, duration))
+        import numpy
+        _block = CaptureBlock(numpy.concatenate([ _block.timestamps for _block in _blocks ] or [ numpy.zeros(0) ]),
+                numpy.concatenate([ _block.values for _block in _blocks ] or [ numpy.zeros(0, dtype=numpy.uint16) ]),
+                sum(_block.overflowed for _block in _blocks), sum(_block.missed for _block in _blocks))
+        if _block.overflowed or _block.missed:
+            self._log.warning('captured {:d} samples of pin {:d}; {:d} overflowed, {:d} missed.', len(_block.values), pin, _block.overflowed, _block.missed)
+        else:
+            self._log.info('captured {:d} samples of pin {:d}.', len(_block.values), pin)
+        return _block
+
+
+    # ..........................................................................
+    def configure_pin_as_counter(self, pin, edges=COUNT_BOTH, pullup=False):
+        '''
+            Has the slave count the edges of an input pin in its interrupt, so
+            that no edge is missed however fast the pulses (e.g., of a wheel
+            encoder) relative to its sample period or the polling of the pin:
+            its rising or falling edges (COUNT_RISING, COUNT_FALLING) or both
+            (COUNT_BOTH), optionally with its internal pullup enabled. Only a
+            pin with an external interrupt not used by the Wire can count (on
+            a Micro or Leonardo pins 0, 1 and 7), and at most MAX_COUNTERS
+            at once. The pin's value is then its level, as for an input, and
+            assigning it otherwise stops its counter.
+
+            Raises an IOError if the slave refuses the pin.
+
+            265:        count the edges of a pin, return pin number
+        '''
+        if edges not in ( COUNT_RISING, COUNT_FALLING, COUNT_BOTH ):
+            raise ValueError('unrecognised edges: {}'.format(edges))
+        if not 0 <= pin < BLOCK_PIN_COUNT:
+            raise ValueError('pin {} out of range for counting.'.format(pin))
+        byte_array = self.transact([ CMD_CONFIGURE_COUNTER & 0xFF, CMD_CONFIGURE_COUNTER >> 8, pin,
+                edges | ( COUNT_PULLUP if pullup else 0 ) ])
+        _received_data = byte_array[0] | ( byte_array[1] << 8 )
+        if pin != _received_data:
+            raise IOError('failed to configure pin {:d} as a counter; returned: {:d}'.format(pin, _received_data))
+        self._counter_resets.pop(pin, None)
+        self._counter_carries.pop(pin, None)
+        self._log.info('configured pin {:d} as a counter of edges {:d}.', pin, edges)
+
+
+    # ..........................................................................
+    def read_counters(self, pins, reset=True):
+        '''
+            Returns a dict of the Count of each of the listed counter pins
+            (0-15), read (and by default reset, without losing an edge
+            between the two) by a single block read (266) of up to three
+            counters, or two in framed mode; more are read in turn.
+
+            Raises an IOError if any of the pins is not counting. As the slave
+            will already have reset the counters it did read (in this or an
+            earlier batch), their counts are then carried into the next read
+            of each pin, so that no edge is lost.
+
+            266:        return (and optionally reset) the counters of the pins in the pin mask
+        '''
+        _pins = sorted(set(pins))
+        for _pin in _pins:
+            if not 0 <= _pin < BLOCK_PIN_COUNT:
+                raise ValueError('pin {} out of range for reading counters.'.format(_pin))
+        _batch = COUNTER_BATCH - 1 if self._framed else COUNTER_BATCH
+        _counts = {}
+        try:
+            for i in range(0, len(_pins), _batch):
+                _mask = 0
+                for _pin in _pins[i:i + _batch]:
+                    _mask |= 1 << _pin
+                byte_array = self.transact([ CMD_READ_COUNTERS & 0xFF, CMD_READ_COUNTERS >> 8, _mask & 0xFF, _mask >> 8,
+                        1 if reset else 0 ], 6 + 8 * len(_pins[i:i + _batch]))
+                _read = byte_array[0] | ( byte_array[1] << 8 )
+                _micros = int.from_bytes(byte_array[2:6], 'little')
+                _offset = 6
+                for _pin in _pins[i:i + _batch]: # only those read follow, in pin order
+                    if _read & ( 1 << _pin ):
+                        _counts[_pin] = Count(int.from_bytes(byte_array[_offset:_offset + 4], 'little'),
+                                int.from_bytes(byte_array[_offset + 4:_offset + 8], 'little'), _micros)
+                        _offset += 8
+                if _read != _mask:
+                    raise IOError('pins not configured as counters: {}'.format(
+                            [ _pin for _pin in range(BLOCK_PIN_COUNT) if _mask & ~_read & ( 1 << _pin ) ]))
+        except Exception:
+            if reset:
+                for _pin, _count in _counts.items():
+                    _carried = self._counter_carries.get(_pin)
+                    self._counter_carries[_pin] = _count._replace(count=_count.count + _carried.count) if _carried else _count
+            raise
+        for _pin, _count in _counts.items():
+            _carried = self._counter_carries.get(_pin)
+            if _carried:
+                _counts[_pin] = _count._replace(count=_count.count + _carried.count)
+            if reset:
+                self._counter_carries.pop(_pin, None)
+                self._counter_resets[_pin] = _count.micros
+        if self._log.debug_enabled:
+            self._log.debug('read {:d} counters: {}', len(_counts), _counts)
+        return _counts
+
+
+    # ..........................................................................
+    def read_counter_rates(self, pins, edges_per_revolution=None):
+        '''
+            Reads and resets the listed counter pins as read_counters(),
+            returning a dict of the rate of each (see counter_rate()) since
+            its last reset, in edges per second or, given the edges counted
+            per revolution (e.g., 40 for an encoder disc of 20 slots whose
+            counter counts both edges), in revolutions per minute. Called once
+            per control cycle this costs a single transaction for up to three
+            counters.
+        '''
+        _since = { _pin: self._counter_resets.get(_pin) for _pin in pins }
+        _scale = 60.0 / edges_per_revolution if edges_per_revolution else 1.0
+        return { _pin: counter_rate(_count, _since[_pin]) * _scale for _pin, _count in self.read_counters(pins).items() }
+
+
+    # ..........................................................................
+    def start_recording(self, path, clock=time.monotonic):
+        '''
+            Starts recording each transaction of the master (its timestamp by
+            the given clock, address, command, the bytes written and read, and
+            latency) to a binary file, which may be replayed through a
+            simulated slave by a Replayer (see lib/recorder.py). Any existing
+            recording is first stopped. Returns the Recorder.
+        '''
+        self.stop_recording()
+        _recorder = Recorder(path, clock, self._level)
+        self._swap_transport(RecordingTransport(self._transport, _recorder, lambda: self._framed))
+        return _recorder
+
+
+    # ..........................................................................
+    def stop_recording(self):
+        '''
+            Stops recording, if recording, closing the file.
+        '''
+        if isinstance(self._transport, RecordingTransport):
+            _recording = self._transport
+            self._swap_transport(_recording.transport)
+            _recording._recorder.close()
+
+
+    # ..........................................................................
+    def _swap_transport(self, transport):
+        '''
+            Replaces the transport between transactions.
+        '''
+        if self._bus is not None:
+            from lib.i2c_bus import PRIORITY_NORMAL # the bus module imports this one
+            self._bus.execute(self._device_id, None, setattr, ( self, '_transport', transport ), PRIORITY_NORMAL)
+        else:
+            with self._bus_lock:
+                self._transport = transport
+
+
+    # ..........................................................................
+    def stats(self):
+        '''
+            Returns a snapshot dict of the transaction metrics: the number of
+            requests sent; for each command class (read_pin, configure,
+            write_output, counter) the count, mean, p50, p99 and maximum
+            latency and the latency histogram; counts of each error code
+            returned by the slave; the number of lost and duplicated
+            transactions found by reconcile_requests(); and the hits, misses
+            and hit rate of the read cache. See I2cStats.
+        '''
+        return self._stats.snapshot()
+
+
+    # ..........................................................................
+    def reset_stats(self):
+        self._stats.reset()
+
+
+    # ..........................................................................
+    def reconcile_requests(self):
+        '''
+            Compares the master's count of requests sent with the slave's request
+            count (226), recording any difference as lost or duplicated
+            transactions, and returning the difference (None upon the first call,
+            which only establishes the baseline). Only meaningful if this is the
+            only master talking to the slave.
+
+            The request and the new baseline are made with exclusive use of the
+            bus, so that no other thread's transaction is counted between them.
+        '''
+        if self._bus is not None:
+            _difference = self._bus.execute(self._device_id, CMD_RETURN_REQUEST_COUNT, self._reconcile_requests)
+        else:
+            with self._bus_lock:
+                _difference = self._reconcile_requests()
+        if _difference:
+            self._log.warning('slave request count differs from master by {:+d}.', _difference)
+        return _difference
+
+
+    # ..........................................................................
+    def _reconcile_requests(self):
+        '''
+            Performs reconcile_requests(). The caller must have exclusive use
+            of the bus.
+        '''
+        byte_array = self._zip(CMD_RETURN_REQUEST_COUNT, [ CMD_RETURN_REQUEST_COUNT & 0xFF, CMD_RETURN_REQUEST_COUNT >> 8 ], 2)
+        return self._stats.reconcile(byte_array[0] | ( byte_array[1] << 8 ))
+
+
+    # ..........................................................................
+    def start_stats_reporting(self, interval=10.0, reconcile=True):
+        '''
+            Starts a thread that every 'interval' seconds reconciles the request
+            counts (if 'reconcile' is True) and logs a one-line summary of the
+            transaction metrics.
+        '''
+        self.stop_stats_reporting()
+        _stop_event = threading.Event()
+        def _report():
+            if reconcile:
+                self.reconcile_requests()
+            while not _stop_event.wait(interval):
+                try:
+                    if reconcile:
+                        self.reconcile_requests()
+                    self._log.info(self._stats.summary())
+                except Exception as e:
+                    self._log.error('error reporting statistics: {}', e)
+        self._reporter = ( threading.Thread(target=_report, name='i2c-stats', daemon=True), _stop_event )
+        self._reporter[0].start()
+
+
+    # ..........................................................................
+    def stop_stats_reporting(self):
+        if self._reporter is not None:
+            _thread, _stop_event = self._reporter
+            _stop_event.set()
+            _thread.join()
+            self._reporter = None
+
+
+    # ..........................................................................
+    def handshake(self):
+        '''
+            Returns the slave's Handshake.
+
+            259:        return protocol and firmware versions and configuration hash
+        '''
+        byte_array = self.transact([ CMD_HANDSHAKE & 0xFF, CMD_HANDSHAKE >> 8 ], 6)
+        _handshake = Handshake(*( byte_array[i] | ( byte_array[i + 1] << 8 ) for i in range(0, 6, 2) ))
+        self._log.debug('handshake: protocol {:d}; firmware {:d}.{:d}; configuration hash 0x{:04X}.', _handshake.protocol_version,
+                _handshake.firmware_version >> 8, _handshake.firmware_version & 0xFF, _handshake.config_hash)
+        return _handshake
+
+
+    # ..........................................................................
+    def apply_pin_map(self, pin_map, force=False):
+        '''
+            Configures the slave's pins 0-9 from a pin map, a dict of pin
+            number to one of 'input', 'input_pullup', 'analog', 'output' or
+            'unused', e.g.:
+
+              { 5: 'output', 6: 'input_pullup', 8: 'analog' }
+
+            Pins not in the map are set as unused. The map is sent as a single
+            command (260) in place of one configure command per pin. Unless
+            'force' is True a handshake is made first, and if the hash of the
+            slave's pin assignments matches that of the map (e.g., following a
+            restart of the master) the configuration is skipped. Note that the
+            hash covers only the pin assignments, not the analog modes.
+
+            Returns True if the slave was configured, False if this was skipped.
+            Raises an IOError if the slave's protocol version differs or the
+            slave rejects the map.
+
+            259:        return protocol and firmware versions and configuration hash
+            260:        apply pin map, return pins changed and configuration hash
+        '''
+        _assignments = [ PIN_UNUSED ] * ( PIN_MAP_LENGTH * 2 )
+        for _pin, _name in pin_map.items():
+            if not 0 <= _pin < len(_assignments):
+                raise ValueError('pin {} out of range for pin map.'.format(_pin))
+            if _name not in PIN_MAP_NAMES:
+                raise ValueError('unrecognised assignment of pin {:d}: {}'.format(_pin, _name))
+            _assignments[_pin] = PIN_MAP_NAMES[_name]
+        _hash = config_hash(_assignments)
+        if not force:
+            _handshake = self.handshake()
+            if _handshake.protocol_version != PROTOCOL_VERSION:
+                raise IOError('slave protocol version {:d} differs from the master\'s {:d}; the sketch requires updating.'.format(
+                        _handshake.protocol_version, PROTOCOL_VERSION))
+            if _handshake.config_hash == _hash:
+                self._log.info('slave already configured (hash 0x{:04X}); skipped configuration.', _hash)
+                return False
+        _pin_map = [ _assignments[i] | ( _assignments[i + 1] << 4 ) for i in range(0, len(_assignments), 2) ]
+        byte_array = self.transact([ CMD_APPLY_PIN_MAP & 0xFF, CMD_APPLY_PIN_MAP >> 8 ] + _pin_map, 4)
+        _changed = byte_array[0] | ( byte_array[1] << 8 )
+        _received_hash = byte_array[2] | ( byte_array[3] << 8 )
+        if _changed == UNRECOGNISED_COMMAND or _received_hash != _hash:
+            raise IOError('failed to apply pin map; returned: {:d}, hash 0x{:04X}.'.format(_changed, _received_hash))
+        self._log.info('applied pin map: {:d} pins changed (hash 0x{:04X}).', _changed, _hash)
+        return True
+
+
     # ..........................................................................
     def configure_pin_as_digital_input(self, pin):
         '''
@@ -116,13 +1272,12 @@ class I2cMaster():
 
             32-63:      set the pin (n-32) as an INPUT pin, return pin number
         '''
-        self._log.debug('configuring pin {:d} for INPUT...'.format(pin))
-        self.write_i2c_data(pin + 32)
-        _received_data  = self.read_i2c_data()
+        self._log.debug('configuring pin {:d} for INPUT...', pin)
+        _received_data = self.send_command(pin + 32)
         if pin == _received_data:
-            self._log.info('configured pin {:d} for INPUT; returned: {:>5.2f}'.format(pin, _received_data))
+            self._log.info('configured pin {:d} for INPUT; returned: {:>5.2f}', pin, _received_data)
         else:
-            self._log.error('failed to configure pin {:d} for INPUT; returned: {:>5.2f}'.format(pin, _received_data))
+            self._log.error('failed to configure pin {:d} for INPUT; returned: {:>5.2f}', pin, _received_data)
 
 
     # ..........................................................................
@@ -135,13 +1290,12 @@ class I2cMaster():
 
             64-95:      set the pin (n-64) as an INPUT_PULLUP pin, return pin number
         '''
-        self._log.debug('configuring pin {:d} for INPUT_PULLUP'.format(pin))
-        self.write_i2c_data(pin + 64)
-        _received_data  = self.read_i2c_data()
+        self._log.debug('configuring pin {:d} for INPUT_PULLUP', pin)
+        _received_data = self.send_command(pin + 64)
         if pin == _received_data:
-            self._log.info('configured pin {:d} for INPUT_PULLUP; returned: {:>5.2f}'.format(pin, _received_data))
+            self._log.info('configured pin {:d} for INPUT_PULLUP; returned: {:>5.2f}', pin, _received_data)
         else:
-            self._log.error('failed to configure pin {:d} for INPUT_PULLUP; returned: {:>5.2f}'.format(pin, _received_data))
+            self._log.error('failed to configure pin {:d} for INPUT_PULLUP; returned: {:>5.2f}', pin, _received_data)
 
 
     # ..........................................................................
@@ -154,13 +1308,53 @@ class I2cMaster():
 
             96-127:     set the pin (n-96) as an INPUT_ANALOG pin, return pin number
         '''
-        self._log.debug('configuring pin {:d} for OUTPUT...'.format(pin))
-        self.write_i2c_data(pin + 96)
-        _received_data = self.read_i2c_data()
+        self._log.debug('configuring pin {:d} for OUTPUT...', pin)
+        _received_data = self.send_command(pin + 96)
         if pin == _received_data:
-            self._log.info('configured pin {:d} for OUTPUT; returned: {:>5.2f}'.format(pin, _received_data))
+            self._log.info('configured pin {:d} for OUTPUT; returned: {:>5.2f}', pin, _received_data)
         else:
-            self._log.error('failed to configure pin {:d} for OUTPUT; returned: {:>5.2f}'.format(pin, _received_data))
+            self._log.error('failed to configure pin {:d} for OUTPUT; returned: {:>5.2f}', pin, _received_data)
+
+
+    # ..........................................................................
+    def set_analog_mode(self, pin, mode, parameter=1):
+        '''
+            Sets how the slave reads an analog input pin, and so the value then
+            returned by get_input_from_pin() or read_pins() for that pin. Each
+            of the filtered modes is applied on the slave, once per loop, so
+            that a single read returns a denoised 10 bit value:
+
+              ANALOG_MODE_SCALED:   one sample, scaled to 0-255 (the default)
+              ANALOG_MODE_RAW:      one sample, 0-1023
+              ANALOG_MODE_AVERAGE:  the mean of 'parameter' (1-16) samples
+              ANALOG_MODE_MEDIAN:   the median of 'parameter' (1-9) samples
+              ANALOG_MODE_EMA:      an exponential moving average of one sample
+                                    per loop, where alpha is 1/2^parameter (1-6)
+
+            The parameter is ignored for the single sample modes. The mode may
+            be set before or after the pin is configured as an analog input.
+
+            236:        set the analog mode of a pin, return pin number
+        '''
+        if mode == ANALOG_MODE_SCALED or mode == ANALOG_MODE_RAW:
+            parameter = _maximum = 1
+        elif mode == ANALOG_MODE_AVERAGE:
+            _maximum = MAX_AVERAGE_SAMPLES
+        elif mode == ANALOG_MODE_MEDIAN:
+            _maximum = MAX_MEDIAN_SAMPLES
+        elif mode == ANALOG_MODE_EMA:
+            _maximum = MAX_EMA_SHIFT
+        else:
+            raise ValueError('unrecognised analog mode: {}'.format(mode))
+        if not 1 <= parameter <= _maximum:
+            raise ValueError('parameter {} out of range for analog mode {:d}.'.format(parameter, mode))
+        self._log.debug('setting pin {:d} analog mode {:d} ({:d})...', pin, mode, parameter)
+        byte_array = self.transact([ CMD_SET_ANALOG_MODE, 0, pin, mode, parameter ])
+        _received_data = byte_array[0] | ( byte_array[1] << 8 )
+        if pin == _received_data:
+            self._log.info('set pin {:d} analog mode {:d} ({:d}).', pin, mode, parameter)
+        else:
+            self._log.error('failed to set pin {:d} analog mode {:d} ({:d}); returned: {:d}', pin, mode, parameter, _received_data)
 
 
     # ..........................................................................
@@ -173,32 +1367,57 @@ class I2cMaster():
 
             128-159:    set the pin (n-128) as an OUTPUT pin, return pin number
         '''
-        self._log.debug('configuring pin {:d} for OUTPUT...'.format(pin))
-        self.write_i2c_data(pin + 128)
-        _received_data = self.read_i2c_data()
+        self._log.debug('configuring pin {:d} for OUTPUT...', pin)
+        _received_data = self.send_command(pin + 128)
         if pin == _received_data:
-            self._log.info('configured pin {:d} for OUTPUT; returned: {:>5.2f}'.format(pin, _received_data))
+            self._log.info('configured pin {:d} for OUTPUT; returned: {:>5.2f}', pin, _received_data)
         else:
-            self._log.error('failed to configure pin {:d} for OUTPUT; returned: {:>5.2f}'.format(pin, _received_data))
+            self._log.error('failed to configure pin {:d} for OUTPUT; returned: {:>5.2f}', pin, _received_data)
 
 
     # ..........................................................................
     def close(self):
         '''
-            Doesn't close the I²C device (which isn't necessary) but rather discards the
-            existing handle so that the instance of the class can no longer be used.
+            Stops any sampling, stats reporting, change events and recording,
+            and closes the transport if the master created it (releasing its
+            pigpio I²C handle), after which the master can no longer be used:
+            any further transaction raises a RuntimeError. On a bus this waits
+            for the transactions already queued at a higher priority.
         '''
-        self._log.debug('closing I²C device at handle {}...'.format(self._handle))
+        self._log.debug('closing I²C device via {}...'.format(self._transport))
+        self.stop_sampling()
+        self.stop_stats_reporting()
+        self.stop_events()
+        self.stop_recording()
         if not self._closed:
             try:
-                self._closed = True
-#               self._pi.i2c_close(self._handle) # close device
-                self._handle = None
-                self._log.debug('I²C device at handle {} closed.'.format(self._handle))
+                if self._bus is not None:
+                    from lib.i2c_bus import PRIORITY_LOW # the bus module imports this one
+                    self._bus.execute(self._device_id, None, self._close, (), PRIORITY_LOW)
+                else:
+                    with self._bus_lock:
+                        self._close()
+                self._log.debug('I²C device via {} closed.'.format(self._transport))
             except Exception as e:
                 self._log.error('error closing master: {}'.format(e))
         else:
-            self._log.debug('I²C device at handle {} closed.'.format(self._handle))
+            self._log.debug('I²C device via {} closed.'.format(self._transport))
+
+
+    # ..........................................................................
+    def _close(self):
+        '''
+            Performs close(). The caller must have exclusive use of the bus.
+        '''
+        self._closed = True
+        if self._owns_transport:
+            self._transport.close() # close device
+
+
+    # ..........................................................................
+    def _check_open(self):
+        if self._closed:
+            raise RuntimeError('I²C master 0x{:02X} is closed.'.format(self._device_id))
 
 
     # tests ====================================================================
@@ -224,7 +1443,7 @@ class I2cMaster():
                 else:
                     self._log.info('echo succeeded: {} == {}'.format(_data_to_send, _received_data))
 
-            self._pi.i2c_close(self._handle) # close device
+            self._transport.close() # close device
             self._log.info('echo test complete.')
         except Exception as e:
             self._log.error('error in echo test: {}'.format(e))
@@ -370,4 +1589,50 @@ class I2cMaster():
 #           self._log.info('complete.')
 
 
+# ..............................................................................
+class _Flight():
+    '''
+        A transaction in flight, whose result (or exception) is shared by the
+        threads that joined it. The epoch is that of the master when it began.
+    '''
+    __slots__ = [ 'epoch', 'done', 'result', 'error' ]
+
+    def __init__(self, epoch):
+        self.epoch  = epoch
+        self.done   = threading.Event()
+        self.result = None
+        self.error  = None
+
+
+# ..............................................................................
+def counter_rate(count, since=None):
+    '''
+        Returns the rate (Hz) of the edges of a Count read with a reset: its
+        count over the interval since the slave's micros() at the previous
+        reset ('since'), allowing for micros() wrapping. If 'since' is None,
+        e.g., for the first read of a counter, the rate is that of the last
+        period between edges, zero if none. As a count is whole, at a low
+        rate relative to the interval the rate of the last period may be
+        the steadier of the two: 1e6 / count.period.
+    '''
+    if since is None:
+        return 1e6 / count.period if count.period else 0.0
+    _interval = ( count.micros - since ) & 0xFFFFFFFF
+    return count.count * 1e6 / _interval if _interval else 0.0
+
+
+# ..............................................................................
+def coalesces(command):
+    '''
+        Returns True if the command is a read that changes nothing on the
+        slave, so that concurrent identical requests may share a single
+        transaction: reading a pin (0-31), the block reads of pins, and
+        returning the request and loop counts and the analog range.
+    '''
+    return 0 <= command < OFFSET_CONFIGURE_INPUT or command == CMD_READ_ALL_PINS or command == CMD_READ_PINS \
+            or command == CMD_READ_PINS_GENERATION or command == CMD_RETURN_REQUEST_COUNT \
+            or command == CMD_RETURN_LOOP_COUNT or command == CMD_RETURN_ANALOG_MIN_RANGE \
+            or command == CMD_RETURN_ANALOG_MAX_RANGE
+
+
 #EOF
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 by Murray Altheim. All rights reserved. This file is part
+# of the pimaster2ardslave project and is released under the MIT Licence;
+# please see the LICENSE file included as part of this package.
+#
+# author:   Murray Altheim
+# created:  2020-05-17
+# modified: 2020-05-25
+#
+# Transaction metrics for the I2cMaster: per-command-class latency
+# histograms, counts of the error codes returned by the slave, the result
+# of reconciling the master's request count with the slave's, and the hits
+# and misses of the read cache.
+#
+
+from array import array
+
+from lib.protocol import ERROR_NAMES, OFFSET_CONFIGURE_INPUT, OFFSET_WRITE_LOW, CMD_ECHO_INPUT, \
+        CMD_CLEAR_REQUEST_COUNT, CMD_READ_ALL_PINS, CMD_READ_PINS, CMD_SET_ANALOG_MODE, \
+        CMD_SET_CHANGE_MASK, CMD_READ_CHANGES, CMD_START_CAPTURE, CMD_STOP_CAPTURE, CMD_READ_CAPTURE, \
+        CMD_APPLY_PIN_MAP, CMD_SET_FRAMING, CMD_WRITE_OUTPUTS, CMD_READ_PINS_GENERATION, \
+        CMD_SET_SAMPLE_PERIOD, CMD_CONFIGURE_COUNTER, CMD_READ_COUNTERS
+
+# command classes ...............................
+READ_PIN     = 0   # 0-31, and the block reads (including change events, capture and edge counters)
+CONFIGURE    = 1   # 32-159, setting the analog mode, change mask, pin map, framing and sample period, starting and stopping capture, configuring counters
+WRITE_OUTPUT = 2   # 160-223, and the masked write (262)
+COUNTER      = 3   # 224 and above: echo, counter and range commands
+CLASS_NAMES  = [ 'read_pin', 'configure', 'write_output', 'counter' ]
+
+BUCKETS      = 24  # log2 microsecond buckets: <1µs, 1µs, 2-3µs, 4-7µs ... ≥4.2s
+IO_ERROR     = 'IO_ERROR'
+
+# ..............................................................................
+class I2cStats():
+    '''
+        Accumulates transaction metrics. Each of the record methods is cheap
+        enough (an array increment or two) to be left enabled in production;
+        the summary is only calculated when snapshot() is called.
+
+        Latencies are held in histograms of power-of-two microsecond buckets,
+        so the percentiles reported by snapshot() are the upper bound of the
+        bucket in which the percentile falls.
+
+        Error codes are only counted in the replies of commands returning pin
+        values, a pin or an error code (see error_offset()), since the others
+        may legitimately return any value: a count, a mask, a period or a hash.
+        Note that a scaled analog reading of 249-255 is indistinguishable from
+        an error code, and will be counted as one.
+    '''
+    def __init__(self):
+        self.reset()
+
+    # ..........................................................................
+    def reset(self):
+        self._histograms = [ array('L', [ 0 ]) * BUCKETS for _ in CLASS_NAMES ]
+        self._counts     = array('L', [ 0 ]) * len(CLASS_NAMES)
+        self._totals     = array('d', [ 0.0 ]) * len(CLASS_NAMES)
+        self._maxima     = array('d', [ 0.0 ]) * len(CLASS_NAMES)
+        self._errors     = {}
+        self.requests    = 0       # commands sent by the master
+        self._expected   = None    # the slave's request count we expect, once known
+        self.lost        = 0
+        self.duplicated  = 0
+        self.reconciliations = 0
+        self.cache_hits  = 0
+        self.cache_misses = 0
+
+    # ..........................................................................
+    def count_request(self, command):
+        '''
+            Counts a command sent to the slave, which the slave will count in
+            its own request count. A CMD_CLEAR_REQUEST_COUNT resets the count
+            we expect of the slave to zero.
+        '''
+        self.requests += 1
+        if command == CMD_CLEAR_REQUEST_COUNT:
+            self._expected = 0
+        elif self._expected is not None:
+            self._expected = ( self._expected + 1 ) & 0xFFFF
+
+    # ..........................................................................
+    def record(self, command, latency, reply):
+        '''
+            Records the latency (in seconds) of a completed transaction and any
+            error codes within its reply, a bytearray of 2 byte (LSB, MSB) values.
+        '''
+        _class = command_class(command)
+        _bucket = int(latency * 1e6).bit_length()
+        self._histograms[_class][_bucket if _bucket < BUCKETS else BUCKETS - 1] += 1
+        self._counts[_class] += 1
+        self._totals[_class] += latency
+        if latency > self._maxima[_class]:
+            self._maxima[_class] = latency
+        _offset = error_offset(command)
+        if _offset is not None:
+            for i in range(_offset, len(reply) - 1, 2):
+                if reply[i] >= 249 and reply[i + 1] == 0:
+                    self._errors[reply[i]] = self._errors.get(reply[i], 0) + 1
+
+    # ..........................................................................
+    def record_failure(self, command):
+        '''
+            Records a transaction that failed with an exception.
+        '''
+        self._errors[IO_ERROR] = self._errors.get(IO_ERROR, 0) + 1
+
+    # ..........................................................................
+    def count_cache(self, hit):
+        '''
+            Counts a read through the read cache as a hit (served locally) or
+            a miss (read from the slave).
+        '''
+        if hit:
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+
+    # ..........................................................................
+    def reconcile(self, slave_count):
+        '''
+            Compares the request count returned by the slave (in reply to a
+            CMD_RETURN_REQUEST_COUNT, which the slave has already counted) with
+            the count we expect. A shortfall is counted as lost transactions, a
+            surplus as duplicated ones. The first call only sets the baseline.
+            Returns the difference (slave minus expected), or None.
+        '''
+        self.reconciliations += 1
+        _expected = self._expected
+        self._expected = slave_count & 0xFFFF
+        if _expected is None:
+            return None
+        _difference = ( slave_count - _expected ) & 0xFFFF
+        if _difference >= 0x8000:
+            _difference -= 0x10000
+        if _difference > 0:
+            self.duplicated += _difference
+        elif _difference < 0:
+            self.lost -= _difference
+        return _difference
+
+    # ..........................................................................
+    def snapshot(self):
+        '''
+            Returns the current metrics as a dict. Times are in microseconds.
+        '''
+        _classes = {}
+        for i, _name in enumerate(CLASS_NAMES):
+            _count = self._counts[i]
+            _histogram = self._histograms[i].tolist()
+            _classes[_name] = {
+                'count':     _count,
+                'mean_us':   self._totals[i] / _count * 1e6 if _count else 0.0,
+                'p50_us':    _percentile(_histogram, _count, 0.50),
+                'p99_us':    _percentile(_histogram, _count, 0.99),
+                'max_us':    self._maxima[i] * 1e6,
+                'histogram': _histogram
+            }
+        return {
+            'requests':   self.requests,
+            'classes':    _classes,
+            'errors':     { ERROR_NAMES.get(_code, _code): _count for _code, _count in self._errors.items() },
+            'lost':       self.lost,
+            'duplicated': self.duplicated,
+            'reconciliations': self.reconciliations,
+            'cache': {
+                'hits':     self.cache_hits,
+                'misses':   self.cache_misses,
+                'hit_rate': _hit_rate(self.cache_hits, self.cache_misses)
+            }
+        }
+
+    # ..........................................................................
+    def summary(self):
+        '''
+            Returns the metrics as a single line, suitable for periodic logging.
+        '''
+        _snapshot = self.snapshot()
+        _parts = [ 'requests: {:d}'.format(_snapshot['requests']) ]
+        for _name, _class in _snapshot['classes'].items():
+            if _class['count']:
+                _parts.append('{}: {:d} p50 {:.0f}µs p99 {:.0f}µs'.format(_name, _class['count'], _class['p50_us'], _class['p99_us']))
+        if _snapshot['errors']:
+            _parts.append('errors: ' + ', '.join('{}={:d}'.format(_name, _count) for _name, _count in sorted(_snapshot['errors'].items(), key=str)))
+        _parts.append('lost: {:d}; duplicated: {:d}'.format(_snapshot['lost'], _snapshot['duplicated']))
+        if self.cache_hits or self.cache_misses:
+            _parts.append('cache: {:d} hits, {:d} misses ({:.0%})'.format(self.cache_hits, self.cache_misses,
+                    _hit_rate(self.cache_hits, self.cache_misses)))
+        return '; '.join(_parts)
+
+
+# ..............................................................................
+def command_class(command):
+    if 0 <= command < OFFSET_CONFIGURE_INPUT or command == CMD_READ_ALL_PINS or command == CMD_READ_PINS \
+            or command == CMD_READ_CHANGES or command == CMD_READ_CAPTURE or command == CMD_READ_PINS_GENERATION \
+            or command == CMD_READ_COUNTERS:
+        return READ_PIN
+    elif OFFSET_CONFIGURE_INPUT <= command < OFFSET_WRITE_LOW or command == CMD_SET_ANALOG_MODE \
+            or command == CMD_SET_CHANGE_MASK or command == CMD_START_CAPTURE or command == CMD_STOP_CAPTURE \
+            or command == CMD_APPLY_PIN_MAP or command == CMD_SET_FRAMING or command == CMD_SET_SAMPLE_PERIOD \
+            or command == CMD_CONFIGURE_COUNTER:
+        return CONFIGURE
+    elif OFFSET_WRITE_LOW <= command < CMD_ECHO_INPUT or command == CMD_WRITE_OUTPUTS:
+        return WRITE_OUTPUT
+    else:
+        return COUNTER
+
+
+def error_offset(command):
+    '''
+        Returns the offset within the reply to the command from which its 2 byte
+        values may be error codes, or None if the reply cannot hold one: pin
+        reads, configuration and output writes, the block pin reads (past the
+        sample generation and age of a CMD_READ_PINS_GENERATION), and the block
+        commands returning a pin or the framing state. Change events, capture
+        samples, edge counts, masks, periods and hashes are not scanned.
+    '''
+    if 0 <= command < CMD_ECHO_INPUT or command == CMD_READ_ALL_PINS or command == CMD_READ_PINS \
+            or command == CMD_SET_ANALOG_MODE or command == CMD_START_CAPTURE or command == CMD_SET_FRAMING \
+            or command == CMD_CONFIGURE_COUNTER:
+        return 0
+    elif command == CMD_READ_PINS_GENERATION:
+        return 4
+    else:
+        return None
+
+
+def _hit_rate(hits, misses):
+    return hits / ( hits + misses ) if hits + misses else 0.0
+
+
+def _percentile(histogram, count, fraction):
+    '''
+        Returns the upper bound (in microseconds) of the bucket containing the
+        percentile.
+    '''
+    if not count:
+        return 0.0
+    _target = fraction * count
+    _cumulative = 0
+    for _bucket, _n in enumerate(histogram):
+        _cumulative += _n
+        if _cumulative >= _target:
+            return float(1 << _bucket)
+    return float(1 << ( BUCKETS - 1 ))
+
+#EOF
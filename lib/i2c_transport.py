@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 by Murray Altheim. All rights reserved. This file is part
+# of the pimaster2ardslave project and is released under the MIT Licence;
+# please see the LICENSE file included as part of this package.
+#
+# author:   Murray Altheim
+# created:  2020-05-24
+# modified: 2020-05-24
+#
+# The transports by which an I2cMaster reaches its slave. Each provides the
+# same three I²C operations on a single device: a write and a read joined by
+# a repeated start (zip()), and the separate writes and reads of the legacy
+# protocol. The available transports are:
+#
+#   PigpioTransport:   via the pigpio daemon, over a socket. Given a
+#                      SimulatedPi in place of a pigpio.pi() this is also the
+#                      simulator's transport.
+#   I2cDevTransport:   directly via the kernel's /dev/i2c-N device, by the
+#                      I2C_RDWR ioctl, which requires neither the daemon nor
+#                      pigpio, only that the i2c-dev module be loaded, e.g.:
+#
+#                        % sudo modprobe i2c-dev
+#
+# Either may be selected by name via create_transport(). GPIO (as used by
+# change events) is not part of a transport and still requires a pi.
+#
+
+import os, ctypes, fcntl
+
+from lib.protocol import ZIP_END, ZIP_READ, ZIP_WRITE, I2C_RDWR, I2C_M_RD
+
+TRANSPORTS = [ 'pigpio', 'i2c-dev' ]
+
+class I2cMsg(ctypes.Structure):
+    _fields_ = [ ( 'addr', ctypes.c_uint16 ), ( 'flags', ctypes.c_uint16 ), ( 'len', ctypes.c_uint16 ),
+            ( 'buf', ctypes.POINTER(ctypes.c_uint8) ) ]
+
+class I2cRdwrIoctlData(ctypes.Structure):
+    _fields_ = [ ( 'msgs', ctypes.POINTER(I2cMsg) ), ( 'nmsgs', ctypes.c_uint32 ) ]
+
+
+# ..............................................................................
+class PigpioTransport():
+    '''
+        A transport via a pigpio.pi() (or compatible, e.g., a SimulatedPi), by
+        a call to the pigpio daemon per operation.
+
+        Parameters:
+          pi:       the pigpio.pi()
+          bus:      the I²C bus number
+          address:  the I²C address of the device
+    '''
+    def __init__(self, pi, bus, address):
+        self._pi = pi
+        self.bus = bus
+        self.address = address
+        self._handle = pi.i2c_open(bus, address)
+
+    def __repr__(self):
+        return 'pigpio handle {:d}'.format(self._handle)
+
+    def zip(self, data, count):
+        '''
+            Writes the list of bytes then reads 'count' bytes, joined by a
+            repeated start, returning a tuple of the byte count and a bytearray.
+        '''
+        return self._pi.i2c_zip(self._handle, [ ZIP_WRITE, len(data) ] + data + [ ZIP_READ, count, ZIP_END ])
+
+    def write_byte(self, byte_val):
+        self._pi.i2c_write_byte(self._handle, byte_val)
+
+    def read_device(self, count):
+        '''
+            Returns a tuple of the byte count and a bytearray.
+        '''
+        return self._pi.i2c_read_device(self._handle, count)
+
+    def close(self):
+        self._pi.i2c_close(self._handle)
+
+
+# ..............................................................................
+class I2cDevTransport():
+    '''
+        A transport directly via the kernel's /dev/i2c-N device: each operation
+        is a single I2C_RDWR ioctl of one or two messages, which the adapter
+        sends as one transaction, joining two messages by a repeated start.
+
+        The file descriptor and ioctl function may be provided, e.g., to test
+        against a SimulatedI2cDev in place of the device. The kernel's i2c-stub
+        module provides a device for testing without hardware, though it only
+        models SMBus registers rather than the slave's protocol.
+
+        Parameters:
+          bus:      the I²C bus number, opening /dev/i2c-<bus>
+          address:  the I²C address of the device
+          fd:       an optional open file descriptor to use in place of the device
+          ioctl:    the ioctl function, by default fcntl.ioctl
+    '''
+    def __init__(self, bus, address, fd=None, ioctl=fcntl.ioctl):
+        self.bus = bus
+        self.address = address
+        self._owns_fd = fd is None
+        self._fd = os.open('/dev/i2c-{:d}'.format(bus), os.O_RDWR) if fd is None else fd
+        self._ioctl = ioctl
+        self._msgs = ( I2cMsg * 2 )()
+        self._ioctl_data = I2cRdwrIoctlData(self._msgs, 0)
+
+    def __repr__(self):
+        return '/dev/i2c-{:d} fd {}'.format(self.bus, self._fd)
+
+    def _transfer(self, write, count):
+        '''
+            Performs an I2C_RDWR of a write of the bytes (if not None) then a
+            read of 'count' bytes (if not zero), returning the bytes read.
+        '''
+        _n = 0
+        if write is not None:
+            _buffer = ( ctypes.c_uint8 * len(write) ).from_buffer_copy(bytes(write))
+            self._msgs[_n] = I2cMsg(self.address, 0, len(write), _buffer)
+            _n += 1
+        _read = ( ctypes.c_uint8 * count )()
+        if count:
+            self._msgs[_n] = I2cMsg(self.address, I2C_M_RD, count, _read)
+            _n += 1
+        self._ioctl_data.nmsgs = _n
+        self._ioctl(self._fd, I2C_RDWR, self._ioctl_data)
+        return bytearray(_read)
+
+    def zip(self, data, count):
+        '''
+            Writes the list of bytes then reads 'count' bytes, joined by a
+            repeated start, returning a tuple of the byte count and a bytearray.
+        '''
+        _read = self._transfer(data, count)
+        return len(_read), _read
+
+    def write_byte(self, byte_val):
+        self._transfer([ byte_val & 0xFF ], 0)
+
+    def read_device(self, count):
+        '''
+            Returns a tuple of the byte count and a bytearray.
+        '''
+        _read = self._transfer(None, count)
+        return len(_read), _read
+
+    def close(self):
+        if self._owns_fd and self._fd is not None:
+            os.close(self._fd)
+        self._fd = None
+
+
+# ..............................................................................
+def create_transport(name, bus, address, pi=None):
+    '''
+        Returns a transport by name, one of TRANSPORTS. The pigpio transport
+        uses the given pi, which is required.
+    '''
+    if name == 'pigpio':
+        if pi is None:
+            raise ValueError('the pigpio transport requires a pi.')
+        return PigpioTransport(pi, bus, address)
+    elif name == 'i2c-dev':
+        return I2cDevTransport(bus, address)
+    raise ValueError('unrecognised transport: {}; expected one of: {}'.format(name, ', '.join(TRANSPORTS)))
+
+#EOF
@@ -8,7 +8,8 @@
 # See: robots.org.nz
 #
 
-import logging, traceback, threading
+import logging, traceback, threading, queue, atexit
+from logging.handlers import QueueHandler, QueueListener
 from enum import Enum
 from colorama import init, Fore, Style
 init()
@@ -25,39 +26,109 @@ class Logger:
        A general-purpose logging facility based upon the Python
        logging library, tailored to look a bit like Java's Log4j,
        but with nicely-colored, formatted output.
+
+       Each method accepts either a complete message or a format
+       string plus arguments, e.g., debug('read {:d} bytes', count).
+       In the latter form nothing is formatted unless the level is
+       enabled, so disabled debug calls cost little more than the
+       call itself. Records are passed to a queue and written to
+       the console by a background thread, so that console I/O
+       never blocks the caller; formatting of the arguments is also
+       deferred to that thread, so they should not be mutated after
+       the call.
     '''
     def __init__(self, name, level):
         # create logger
         self.__log = logging.getLogger(name)
         self.__log.propagate = False
-        self._mutex = threading.Lock()
         if not self.__log.handlers:
             self.__log.setLevel(level.value)
-            # create console handler and set level
-            sh = logging.StreamHandler()
-            sh.setLevel(level.value)
-            # create formatter
-            sh.setFormatter(logging.Formatter('%(name)s ' + ( ' '*(16-len(name)) ) + ' : %(message)s'))
-            self.__log.addHandler(sh)
-
-    def debug(self,message):
-        with self._mutex:
-            self.__log.debug(Fore.BLACK + "DEBUG : " + message + Style.RESET_ALL)
-
-    def info(self,message):
-        with self._mutex:
-            self.__log.info(Fore.CYAN + "INFO  : " + message + Style.RESET_ALL)
-
-    def warning(self,message):
-        with self._mutex:
-            self.__log.warning(Fore.YELLOW + "WARN  : " + message + Style.RESET_ALL)
-
-    def error(self,message):
-        with self._mutex:
-            self.__log.error(Fore.RED + Style.NORMAL + "ERROR : " + Style.BRIGHT + message + Style.RESET_ALL)
-
-    def critical(self,message):
-        with self._mutex:
-            self.__log.critical(Fore.WHITE + "FATAL : " + Style.BRIGHT + message + Style.RESET_ALL)
+            self.__log.addHandler(_DeferredQueueHandler(_queue))
+            _start_listener()
+
+    @property
+    def debug_enabled(self):
+        '''
+           Returns True if debug messages will be logged, so that callers
+           may avoid any work spent only on building debug messages.
+        '''
+        return self.__log.isEnabledFor(logging.DEBUG)
+
+    def debug(self, message, *args):
+        if self.__log.isEnabledFor(logging.DEBUG):
+            self.__log.debug(_Message(Fore.BLACK + "DEBUG : ", message, args))
+
+    def info(self, message, *args):
+        if self.__log.isEnabledFor(logging.INFO):
+            self.__log.info(_Message(Fore.CYAN + "INFO  : ", message, args))
+
+    def warning(self, message, *args):
+        if self.__log.isEnabledFor(logging.WARN):
+            self.__log.warning(_Message(Fore.YELLOW + "WARN  : ", message, args))
+
+    def error(self, message, *args):
+        if self.__log.isEnabledFor(logging.ERROR):
+            self.__log.error(_Message(Fore.RED + Style.NORMAL + "ERROR : " + Style.BRIGHT, message, args))
+
+    def critical(self, message, *args):
+        if self.__log.isEnabledFor(logging.CRITICAL):
+            self.__log.critical(_Message(Fore.WHITE + "FATAL : " + Style.BRIGHT, message, args))
+
+    @staticmethod
+    def flush():
+        '''
+           Blocks until all queued records have been written to the console.
+        '''
+        if _listener is not None:
+            _stop_listener()
+            _start_listener()
+
+class _Message:
+    '''
+       A message whose formatting is deferred until it is written.
+    '''
+    __slots__ = [ 'prefix', 'message', 'args' ]
+
+    def __init__(self, prefix, message, args):
+        self.prefix  = prefix
+        self.message = message
+        self.args    = args
+
+    def __str__(self):
+        if self.args:
+            return self.prefix + self.message.format(*self.args) + Style.RESET_ALL
+        return self.prefix + self.message + Style.RESET_ALL
+
+class _DeferredQueueHandler(QueueHandler):
+    '''
+       A QueueHandler that enqueues the record as-is, rather than
+       formatting it on the calling thread.
+    '''
+    def prepare(self, record):
+        return record
+
+# the queue and the console writer shared by all loggers .......................
+
+_queue = queue.SimpleQueue()
+_console = logging.StreamHandler()
+_console.setFormatter(logging.Formatter('%(name)-16s  : %(message)s'))
+_listener = None
+_listener_mutex = threading.Lock()
+
+def _start_listener():
+    global _listener
+    with _listener_mutex:
+        if _listener is None:
+            _listener = QueueListener(_queue, _console)
+            _listener.start()
+
+def _stop_listener():
+    global _listener
+    with _listener_mutex:
+        if _listener is not None:
+            _listener.stop() # writes any queued records before returning
+            _listener = None
+
+atexit.register(_stop_listener)
 
 #EOF
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 by Murray Altheim. All rights reserved. This file is part
+# of the pimaster2ardslave project and is released under the MIT Licence;
+# please see the LICENSE file included as part of this package.
+#
+# author:   Murray Altheim
+# created:  2020-05-10
+# modified: 2020-05-25
+#
+# Constants of the I²C protocol spoken between the Raspberry Pi master and
+# the Arduino slave. These mirror the #define and const declarations found
+# in i2cSlaveCore.h, which remains the canonical definition: if you change
+# one be sure to change the other.
+#
+
+# errors ........................................
+UNDEFINED_ERROR             = 255   # returned on error
+UNRECOGNISED_COMMAND        = 254   # returned on communications error
+TOO_MUCH_DATA               = 253   # returned on communications error
+PIN_ASSIGNED_AS_INPUT       = 252   # configuration error
+PIN_ASSIGNED_AS_OUTPUT      = 251   # configuration error
+PIN_UNASSIGNED              = 250   # configuration error
+EMPTY_QUEUE                 = 249   # returned on error
+INIT_VALUE                  =   0   # initial pin value; may be error
+
+ERROR_NAMES = {
+    UNDEFINED_ERROR:        'UNDEFINED_ERROR',
+    UNRECOGNISED_COMMAND:   'UNRECOGNISED_COMMAND',
+    TOO_MUCH_DATA:          'TOO_MUCH_DATA',
+    PIN_ASSIGNED_AS_INPUT:  'PIN_ASSIGNED_AS_INPUT',
+    PIN_ASSIGNED_AS_OUTPUT: 'PIN_ASSIGNED_AS_OUTPUT',
+    PIN_UNASSIGNED:         'PIN_UNASSIGNED',
+    EMPTY_QUEUE:            'EMPTY_QUEUE'
+}
+
+# pin types .....................................
+PIN_INPUT_DIGITAL           = 2     # default
+PIN_OUTPUT                  = 3
+PIN_INPUT_DIGITAL_PULLUP    = 4     # inverted: low(0) is on
+PIN_INPUT_ANALOG            = 5
+PIN_UNUSED                  = 6
+PIN_INPUT_COUNTER           = 7     # set by CMD_CONFIGURE_COUNTER, not by a pin map
+
+# command offsets ...............................
+OFFSET_READ_PIN             = 0     # 0-31:    return the value of pin n
+OFFSET_CONFIGURE_INPUT      = 32    # 32-63:   set pin (n-32) as INPUT
+OFFSET_CONFIGURE_PULLUP     = 64    # 64-95:   set pin (n-64) as INPUT_PULLUP
+OFFSET_CONFIGURE_ANALOG     = 96    # 96-127:  set pin (n-96) as INPUT_ANALOG
+OFFSET_CONFIGURE_OUTPUT     = 128   # 128-159: set pin (n-128) as OUTPUT
+OFFSET_WRITE_LOW            = 160   # 160-191: write output for pin (n-160) LOW
+OFFSET_WRITE_HIGH           = 192   # 192-223: write output for pin (n-192) HIGH
+
+# commands ......................................
+CMD_ECHO_INPUT              = 224
+CMD_CLEAR_REQUEST_COUNT     = 225
+CMD_RETURN_REQUEST_COUNT    = 226
+CMD_CLEAR_LOOP_COUNT        = 227
+CMD_RETURN_LOOP_COUNT       = 228
+CMD_CLEAR_QUEUES            = 229
+CMD_RETURN_ANALOG_MIN_RANGE = 230
+CMD_RETURN_ANALOG_MAX_RANGE = 231
+CMD_DISABLE_AUTORANGE       = 232
+CMD_ENABLE_AUTORANGE        = 233
+CMD_READ_ALL_PINS           = 234   # block: returns 2 bytes for each assigned pin
+CMD_READ_PINS               = 235   # block: 2 byte pin mask payload, returns 2 bytes per pin
+CMD_SET_ANALOG_MODE         = 236   # block: 3 byte payload (pin, mode, parameter), returns pin
+CMD_SET_CHANGE_MASK         = 237   # block: 2 byte pin mask payload, returns mask
+CMD_READ_CHANGES            = 238   # block: returns a 2 byte header then up to CHANGE_BATCH events
+
+# extended commands .............................
+CMD_START_CAPTURE           = 256   # block: 3 byte payload (pin, period in µs LSB, MSB), returns pin
+CMD_STOP_CAPTURE            = 257   # returns the number of samples still buffered
+CMD_READ_CAPTURE            = 258   # block: returns a 4 byte header then up to CAPTURE_BATCH samples
+CMD_HANDSHAKE               = 259   # block: returns the protocol and firmware versions and configuration hash
+CMD_APPLY_PIN_MAP           = 260   # block: PIN_MAP_LENGTH byte payload, returns pins changed and configuration hash
+CMD_SET_FRAMING             = 261   # block: 1 byte payload (0 or 1), returns the framing state
+CMD_WRITE_OUTPUTS           = 262   # block: 2 byte pin mask and 2 byte levels payload, returns pins written
+CMD_READ_PINS_GENERATION    = 263   # block: 2 byte pin mask payload, returns the sample generation and age then 2 bytes per pin
+CMD_SET_SAMPLE_PERIOD       = 264   # block: 2 byte period in ms payload (LSB, MSB), returns the period
+CMD_CONFIGURE_COUNTER       = 265   # block: 2 byte payload (pin, edges), returns pin
+CMD_READ_COUNTERS           = 266   # block: 2 byte pin mask and 1 byte reset payload, returns a 6 byte header then 8 bytes per counter
+
+# analog modes ..................................
+ANALOG_MODE_SCALED          = 0     # default: one sample, scaled to 0-255
+ANALOG_MODE_RAW             = 1     # one sample, full 10 bit resolution
+ANALOG_MODE_AVERAGE         = 2     # mean of N samples (parameter: N, 1-16)
+ANALOG_MODE_MEDIAN          = 3     # median of N samples (parameter: N, 1-9)
+ANALOG_MODE_EMA             = 4     # exponential moving average (parameter: k, alpha = 1/2^k, 1-6)
+MAX_AVERAGE_SAMPLES         = 16
+MAX_MEDIAN_SAMPLES          = 9
+MAX_EMA_SHIFT               = 6
+EMA_SCALE_SHIFT             = 4     # the EMA is held in sixteenths
+
+# change events .................................
+CHANGES_PENDING             = 0x01  # header flag: more events remain queued
+CHANGES_LOST                = 0x02  # header flag: events were dropped since the last read
+CHANGE_PIN_SHIFT            = 10    # an event is ( pin << 10 ) | value
+CHANGE_VALUE_MASK           = 0x3FF
+CHANGE_QUEUE_LENGTH         = 16    # change events held awaiting the master
+CHANGE_BATCH                = 7     # change events returned per CMD_READ_CHANGES
+INTERRUPT_PIN               = 12    # slave pin held HIGH while change events are pending
+
+# capture .......................................
+CAPTURE_RUNNING             = 0x01  # header flag: capture is running
+CAPTURE_PENDING             = 0x02  # header flag: more samples remain buffered
+CAPTURE_VALUE_BITS          = 10    # a sample is ( tick << 10 ) | value, in 4 bytes
+CAPTURE_TICK_MASK           = 0x3FFFFF # ticks are the low 22 bits of micros()
+CAPTURE_MIN_PERIOD          = 500   # µs, i.e., a maximum rate of 2kHz
+CAPTURE_LENGTH              = 64    # capacity of the slave's capture buffer, in samples
+CAPTURE_BATCH               = 7     # samples returned per CMD_READ_CAPTURE
+
+# counters ......................................
+COUNT_RISING                = 0x01  # edges: count rising edges
+COUNT_FALLING               = 0x02  # edges: count falling edges
+COUNT_BOTH                  = 0x03  # edges: count both
+COUNT_PULLUP                = 0x04  # edges flag: enable the pin's internal pullup
+MAX_COUNTERS                = 3     # edge counters, each on a pin with an external interrupt
+COUNTER_BATCH               = 3     # counters returned per CMD_READ_COUNTERS
+COUNTER_PINS                = ( 0, 1, 7 ) # pins of the slave (a Micro) with an external interrupt not used by the Wire
+
+# pin maps ......................................
+PIN_MAP_LENGTH              = 5     # payload bytes of CMD_APPLY_PIN_MAP: a nibble per pin 0-9
+PIN_MAP_NAMES = {
+    'input':        PIN_INPUT_DIGITAL,
+    'input_pullup': PIN_INPUT_DIGITAL_PULLUP,
+    'analog':       PIN_INPUT_ANALOG,
+    'output':       PIN_OUTPUT,
+    'unused':       PIN_UNUSED
+}
+PROTOCOL_VERSION            = 2     # incremented on any incompatible change to the protocol
+FIRMWARE_VERSION            = 0x0100 # of the sketch: major, minor
+
+# framing .......................................
+FRAME_OK                    = 0     # reply status: the command was executed (or replayed)
+FRAME_BAD_CRC               = 1     # reply status: the request's CRC did not match
+FRAME_BAD_LENGTH            = 2     # reply status: the request's length did not suit its command
+FRAME_NO_REPLY              = 3     # reply status: a read without a request
+FRAME_OVERHEAD              = 3     # bytes added to a reply by framing: sequence, status and CRC
+FRAME_LENGTH_SHIFT          = 2     # the reply length is carried above the status in its byte
+FRAME_STATUS_MASK           = 0x03
+FRAME_STATUS_NAMES = { FRAME_BAD_CRC: 'BAD_CRC', FRAME_BAD_LENGTH: 'BAD_LENGTH', FRAME_NO_REPLY: 'NO_REPLY' }
+
+# constants .....................................
+SLAVE_I2C_ADDRESS           = 0x08
+LOOP_DELAY_MS               = 1000  # the slave's default sample period (ms)
+MIN_SAMPLE_PERIOD_MS        = 5
+PIN_COUNT                   = 32    # size of the slave's pin arrays
+PINS_ASSIGNED               = 10    # number of pins the slave services
+QUEUE_LENGTH                = 32    # capacity of the slave's queues (Wire's BUFFER_LENGTH)
+BLOCK_PIN_COUNT             = 16    # pins addressable by a block command's pin mask
+NO_COMMAND                  = -1    # no command pending
+
+# pigpio i2c_zip() command codes ................
+ZIP_END                     = 0
+ZIP_READ                    = 6
+ZIP_WRITE                   = 7
+
+# i2c-dev ioctl constants (linux/i2c-dev.h, linux/i2c.h)
+I2C_RDWR                    = 0x0707
+I2C_M_RD                    = 0x0001
+
+# pigpio GPIO constants .........................
+GPIO_INPUT                  = 0     # set_mode()
+PUD_DOWN                    = 1     # set_pull_up_down()
+RISING_EDGE                 = 0     # callback()
+FALLING_EDGE                = 1
+EITHER_EDGE                 = 2
+
+# ..............................................................................
+def config_hash(assignments):
+    '''
+        Returns the configuration hash of a list of the assignments of pins
+        0-9, as the slave's configHash(): a CRC-16 (CCITT).
+    '''
+    _crc = 0xFFFF
+    for _assignment in assignments:
+        _crc ^= ( _assignment & 0xFF ) << 8
+        for _ in range(8):
+            _crc = ( ( _crc << 1 ) ^ 0x1021 if _crc & 0x8000 else _crc << 1 ) & 0xFFFF
+    return _crc
+
+
+def crc8(data, crc=0):
+    '''
+        Returns the CRC-8 (polynomial 0x07, as SMBus) of the bytes, continuing
+        from the given CRC, as the slave's crc8().
+    '''
+    for _byte in data:
+        crc ^= _byte
+        for _ in range(8):
+            crc = ( ( crc << 1 ) ^ 0x07 if crc & 0x80 else crc << 1 ) & 0xFF
+    return crc
+
+#EOF
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 by Murray Altheim. All rights reserved. This file is part
+# of the pimaster2ardslave project and is released under the MIT Licence;
+# please see the LICENSE file included as part of this package.
+#
+# author:   Murray Altheim
+# created:  2020-05-25
+# modified: 2020-05-25
+#
+# A read cache for the I2cMaster. The slave only reads its pins once per
+# sample period (LOOP_DELAY_MS unless set by the master), so that until its next loop repeated reads of
+# a pin return the same value. Reads through the cache use a block read
+# (263) whose reply carries the slave's sample generation (incremented each
+# time its pins are read) and the age of the sample, from which the master
+# knows when the slave will next read its pins; until then a repeated read
+# is served locally. This is normally used via I2cMaster.set_read_cache()
+# rather than directly.
+#
+
+import time, threading
+from array import array
+
+from lib.protocol import BLOCK_PIN_COUNT, LOOP_DELAY_MS, OFFSET_CONFIGURE_INPUT, CMD_ECHO_INPUT, \
+        CMD_DISABLE_AUTORANGE, CMD_ENABLE_AUTORANGE, CMD_SET_ANALOG_MODE, CMD_APPLY_PIN_MAP, CMD_WRITE_OUTPUTS, \
+        CMD_SET_SAMPLE_PERIOD, CMD_CONFIGURE_COUNTER
+
+# ..............................................................................
+class ReadCache():
+    '''
+        The values of the slave's pins 0-15 from the latest sample generation
+        read, all of which expire when the slave is next due to read its
+        pins: the time of the sample (the start of the transaction less the
+        sample's age, so never later than the slave's own time) plus the
+        sample period. The slave never samples early, so a value is never
+        held past the next sample, though if the slave's loop runs late the
+        values may expire early. A reply of a newer generation
+        discards the values of the older.
+
+        The cache is only valid if this is the only master configuring the
+        slave and writing its outputs, as it is invalidated when the master
+        itself sends such a command (see invalidates()).
+
+        Parameters:
+          loop_delay_ms:  the slave's sample period, LOOP_DELAY_MS unless set
+          clock:          the clock by which values expire
+    '''
+    def __init__(self, loop_delay_ms=LOOP_DELAY_MS, clock=time.monotonic):
+        self._period     = loop_delay_ms / 1000.0
+        self.clock       = clock
+        self._lock       = threading.Lock()
+        self._values     = array('H', [ 0 ]) * BLOCK_PIN_COUNT
+        self._valid      = 0     # mask of the pins holding values of the current generation
+        self._read       = 0     # mask of the pins read through the cache since enabled
+        self._generation = None
+        self._expiry     = 0.0
+
+    # ..........................................................................
+    def get(self, pins):
+        '''
+            Returns a list of the cached values of the pins, or None if any
+            of them is not cached or the values have expired.
+        '''
+        _mask = _mask_of(pins)
+        with self._lock:
+            self._read |= _mask
+            if self._valid & _mask != _mask or self.clock() >= self._expiry:
+                return None
+            return [ self._values[_pin] for _pin in pins ]
+
+    # ..........................................................................
+    def mask(self, pins, limit):
+        '''
+            Returns the pin mask to read upon a miss of the pins: that of the
+            pins, plus those previously read through the cache so that they
+            are refreshed together, unless that would exceed 'limit' pins.
+        '''
+        _mask = _mask_of(pins)
+        with self._lock:
+            _refresh = _mask | self._read
+        return _refresh if bin(_refresh).count('1') <= limit else _mask
+
+    # ..........................................................................
+    def update(self, start, generation, age_ms, mask, values):
+        '''
+            Caches the values of the pins in the mask, in pin order, read in
+            a transaction begun at 'start' (by the cache's clock) whose reply
+            was of the given sample generation and age.
+        '''
+        with self._lock:
+            if generation != self._generation:
+                self._generation = generation
+                self._valid = 0
+            self._expiry = start - ( age_ms + 1 ) / 1000.0 + self._period # the age is in whole milliseconds
+            _values = iter(values)
+            for _pin in range(BLOCK_PIN_COUNT):
+                if mask & ( 1 << _pin ):
+                    self._values[_pin] = next(_values)
+            self._valid |= mask
+
+    # ..........................................................................
+    def set_period(self, period_ms):
+        '''
+            Sets the slave's sample period, as it changes, invalidating the
+            values cached.
+        '''
+        with self._lock:
+            self._period = period_ms / 1000.0
+            self._valid = 0
+
+    # ..........................................................................
+    def invalidate(self):
+        with self._lock:
+            self._valid = 0
+
+    # ..........................................................................
+    @property
+    def generation(self):
+        '''
+            Returns the slave's sample generation as of the latest read, or
+            None if none has been read.
+        '''
+        return self._generation
+
+
+# ..............................................................................
+def invalidates(command):
+    '''
+        Returns True if the command may change the values returned for the
+        pins before the slave's next loop: configuring a pin (including by
+        the analog mode, a pin map or as a counter), writing an output, changing the
+        analog range, or changing the sample period (and so when the next
+        loop is due).
+    '''
+    return OFFSET_CONFIGURE_INPUT <= command < CMD_ECHO_INPUT or command == CMD_DISABLE_AUTORANGE \
+            or command == CMD_ENABLE_AUTORANGE or command == CMD_SET_ANALOG_MODE or command == CMD_APPLY_PIN_MAP \
+            or command == CMD_WRITE_OUTPUTS or command == CMD_SET_SAMPLE_PERIOD or command == CMD_CONFIGURE_COUNTER
+
+
+def _mask_of(pins):
+    _mask = 0
+    for _pin in pins:
+        _mask |= 1 << _pin
+    return _mask
+
+#EOF
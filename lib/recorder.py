@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 by Murray Altheim. All rights reserved. This file is part
+# of the pimaster2ardslave project and is released under the MIT Licence;
+# please see the LICENSE file included as part of this package.
+#
+# author:   Murray Altheim
+# created:  2020-05-24
+# modified: 2020-05-24
+#
+# Recording and replay of the I²C transactions of an I2cMaster, so that a
+# session seen in the field may be reproduced without hardware. A session
+# is recorded via I2cMaster.start_recording() into a binary file of fixed
+# size records, preallocated in blocks so that appending a record never
+# waits on the filesystem to find space:
+#
+#   header:  magic 'I2CR', version, record size (2 bytes each, the last two
+#            LSB first), then the wall clock time at the start of the
+#            recording (a double)
+#   record:  see RECORD below, the unused records that follow the last being
+#            zero
+#
+# A Replayer memory-maps the file and feeds the writes of each transaction
+# to a SimulatedSlave (or HostSlave), comparing its replies with those that
+# were recorded, either as fast as possible or in real time.
+#
+
+import os, mmap, time, struct, threading
+from collections import namedtuple
+
+from lib.logger import Logger, Level
+
+MAGIC          = b'I2CR'
+VERSION        = 1
+HEADER         = struct.Struct('<4sHHd')
+RECORD_BYTES   = 36   # the bytes written or read held per record
+# timestamp (s), latency (ns), command, address, operation, bytes written, bytes read, written, read
+RECORD         = struct.Struct('<dIHBBBB{:d}s{:d}s'.format(RECORD_BYTES, RECORD_BYTES))
+BLOCK_RECORDS  = 4096 # records preallocated at a time
+
+# operations ....................................
+OP_ZIP         = 1    # a write and a read joined by a repeated start
+OP_WRITE       = 2
+OP_READ        = 3
+OP_FAILED      = 0x80 # flag: the transaction raised an exception
+
+# a recorded transaction: the timestamp (seconds, from the recorder's clock),
+# latency (seconds), address, command (None for a legacy read), operation,
+# the bytes written and read, and whether the transaction failed.
+Record = namedtuple('Record', [ 'timestamp', 'latency', 'address', 'command', 'operation', 'written', 'read', 'failed' ])
+
+# the result of a replay: the number of transactions replayed and of those
+# whose replies differed from the recording, the mismatches counted by
+# command, and the elapsed (wall clock) time.
+ReplayResult = namedtuple('ReplayResult', [ 'transactions', 'mismatches', 'mismatched_commands', 'elapsed' ])
+
+# ..............................................................................
+class Recorder():
+    '''
+        Appends transactions to a recording file, preallocating BLOCK_RECORDS
+        records at a time. Writes are buffered; the file is complete once
+        close() has been called, though a recording cut short (e.g., by a
+        crash) is readable up to its last buffered write.
+
+        Parameters:
+          path:       the file to create (replacing any existing file)
+          clock:      the clock by which records are timestamped
+          level:      the log level
+    '''
+    def __init__(self, path, clock=time.monotonic, level=Level.INFO):
+        self._log = Logger('recorder', level)
+        self.path = path
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._file = open(path, 'w+b')
+        self._file.write(HEADER.pack(MAGIC, VERSION, RECORD.size, time.time()))
+        self._buffer = bytearray(RECORD.size)
+        self._allocated = 0
+        self.count = 0
+        self._allocate()
+        self._log.info('recording to {}...', path)
+
+    def _allocate(self):
+        self._allocated += BLOCK_RECORDS
+        _size = HEADER.size + self._allocated * RECORD.size
+        try:
+            os.posix_fallocate(self._file.fileno(), 0, _size)
+        except (AttributeError, OSError): # not supported by the platform or filesystem
+            os.ftruncate(self._file.fileno(), _size)
+
+    # ..........................................................................
+    def record(self, timestamp, latency, address, command, operation, written, read):
+        '''
+            Appends a transaction. Bytes beyond RECORD_BYTES are not recorded.
+        '''
+        with self._lock:
+            if self._file is None:
+                return
+            if self.count == self._allocated:
+                self._allocate()
+            RECORD.pack_into(self._buffer, 0, timestamp, min(int(latency * 1e9), 0xFFFFFFFF), 0xFFFF if command is None else command & 0xFFFF,
+                    address, operation, min(len(written), RECORD_BYTES), min(len(read), RECORD_BYTES), bytes(written), bytes(read))
+            self._file.write(self._buffer)
+            self.count += 1
+
+    def clock(self):
+        return self._clock()
+
+    # ..........................................................................
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+                self._log.info('recorded {:d} transactions to {}.', self.count, self.path)
+
+
+# ..............................................................................
+class RecordingTransport():
+    '''
+        A transport (see lib/i2c_transport.py) that records each transaction
+        of the transport it wraps, as installed by I2cMaster.start_recording().
+
+        Parameters:
+          transport:  the wrapped transport
+          recorder:   the Recorder
+          framed:     a function returning True while the master is in framed
+                      mode, in which the command follows a sequence number
+    '''
+    def __init__(self, transport, recorder, framed=lambda: False):
+        self.transport = transport
+        self._recorder = recorder
+        self._framed = framed
+
+    def __repr__(self):
+        return 'recording {}'.format(self.transport)
+
+    def _call(self, operation, command, written, function, *args):
+        _timestamp = self._recorder.clock()
+        _start = time.perf_counter()
+        try:
+            _result = function(*args)
+        except Exception:
+            self._recorder.record(_timestamp, time.perf_counter() - _start, self.transport.address, command,
+                    operation | OP_FAILED, written, b'')
+            raise
+        self._recorder.record(_timestamp, time.perf_counter() - _start, self.transport.address, command, operation,
+                written, _result[1] if _result is not None else b'')
+        return _result
+
+    def zip(self, data, count):
+        _offset = 1 if self._framed() else 0
+        _command = data[_offset] | ( data[_offset + 1] << 8 ) if len(data) > _offset + 1 else None
+        return self._call(OP_ZIP, _command, data, self.transport.zip, data, count)
+
+    def write_byte(self, byte_val):
+        return self._call(OP_WRITE, byte_val, [ byte_val ], self.transport.write_byte, byte_val)
+
+    def read_device(self, count):
+        return self._call(OP_READ, None, b'', self.transport.read_device, count)
+
+    def close(self):
+        self.transport.close()
+
+
+# ..............................................................................
+class Replayer():
+    '''
+        A recording, memory-mapped. The Replayer is a sequence of its Records
+        and may replay them through simulated slaves.
+
+        Parameters:
+          path:       the recording file
+          level:      the log level
+    '''
+    def __init__(self, path, level=Level.INFO):
+        self._log = Logger('replayer', level)
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        _magic, _version, _record_size, self.start_time = HEADER.unpack_from(self._mmap, 0)
+        if _magic != MAGIC or _version != VERSION or _record_size != RECORD.size:
+            self.close()
+            raise ValueError('{} is not a version {:d} recording.'.format(path, VERSION))
+        self._count = self._find_count()
+
+    def _find_count(self):
+        '''
+            Returns the number of records, finding the first unused (zero)
+            record by a binary search of the preallocated records.
+        '''
+        _low, _high = 0, ( len(self._mmap) - HEADER.size ) // RECORD.size
+        while _low < _high:
+            _middle = ( _low + _high ) // 2
+            if self._mmap[HEADER.size + _middle * RECORD.size + 15] != 0: # the operation
+                _low = _middle + 1
+            else:
+                _high = _middle
+        return _low
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if not -self._count <= index < self._count:
+            raise IndexError('record {} out of range.'.format(index))
+        _timestamp, _latency, _command, _address, _operation, _written_count, _read_count, _written, _read = \
+                RECORD.unpack_from(self._mmap, HEADER.size + ( index % self._count ) * RECORD.size)
+        return Record(_timestamp, _latency / 1e9, _address, None if _command == 0xFFFF else _command, _operation & ~OP_FAILED,
+                _written[:_written_count], _read[:_read_count], bool(_operation & OP_FAILED))
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self[i]
+
+    # ..........................................................................
+    def replay(self, slaves, realtime=False, advance=None):
+        '''
+            Replays the recording through the slaves, a dict of SimulatedSlave
+            (or HostSlave) keyed by I²C address: the bytes written by each
+            transaction are received by the slave at its address, and the
+            bytes read are requested from it and compared with those recorded.
+            Failed transactions are skipped. Returns a ReplayResult.
+
+            If 'realtime' each transaction is replayed at its recorded time
+            relative to the first; otherwise as fast as possible, and if
+            'advance' is given it is called with the recorded time (seconds)
+            between each transaction and the next, e.g., to advance the
+            VirtualClock of the slaves so that their loops run as they did.
+        '''
+        _mismatches = 0
+        _mismatched_commands = {}
+        _transactions = 0
+        _start = time.perf_counter()
+        _first = _previous = None
+        for _record in self:
+            if _first is None:
+                _first = _previous = _record.timestamp
+            if realtime:
+                _delay = _start + ( _record.timestamp - _first ) - time.perf_counter()
+                if _delay > 0.0:
+                    time.sleep(_delay)
+            elif advance is not None and _record.timestamp > _previous:
+                advance(_record.timestamp - _previous)
+            _previous = _record.timestamp
+            if _record.failed:
+                continue
+            _slave = slaves.get(_record.address)
+            if _slave is None:
+                raise ValueError('no slave at address 0x{:02X} to replay to.'.format(_record.address))
+            if _record.operation != OP_READ:
+                _slave.receive_data(_record.written)
+            if _record.operation != OP_WRITE:
+                _read = _slave.request_data()[:len(_record.read)]
+                _read.extend([ 0xFF ] * ( len(_record.read) - len(_read) ))
+                if _read != _record.read:
+                    _mismatches += 1
+                    _mismatched_commands[_record.command] = _mismatched_commands.get(_record.command, 0) + 1
+                    self._log.debug('transaction {:d} (command {}) replied {} rather than {}.', _transactions, _record.command,
+                            list(_read), list(_record.read))
+            _transactions += 1
+        _result = ReplayResult(_transactions, _mismatches, _mismatched_commands, time.perf_counter() - _start)
+        self._log.info('replayed {:d} transactions in {:.1f}ms; {:d} mismatched.', _transactions, _result.elapsed * 1000.0, _mismatches)
+        return _result
+
+    # ..........................................................................
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+            self._file.close()
+
+#EOF
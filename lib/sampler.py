@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 by Murray Altheim. All rights reserved. This file is part
+# of the pimaster2ardslave project and is released under the MIT Licence;
+# please see the LICENSE file included as part of this package.
+#
+# author:   Murray Altheim
+# created:  2020-05-13
+# modified: 2020-05-25
+#
+# A background sampling engine for the I2cMaster, which reads each pin at
+# its own rate on a dedicated bus thread and publishes the results into a
+# Snapshot that can be read without touching the bus. This is normally used
+# via I2cMaster.start_sampling() rather than directly.
+#
+
+import time, heapq, threading, traceback
+from array import array
+
+from lib.logger import Logger
+from lib.protocol import PIN_COUNT, BLOCK_PIN_COUNT
+
+SPIN_LIMIT = 1000   # the retries of a seqlock read before checking that the writer is alive
+
+# ..............................................................................
+class Snapshot():
+    '''
+        The latest value and timestamp of each pin, held in preallocated arrays
+        indexed by pin number. There is a single writer (the sampler thread);
+        readers never block or take a lock but instead use a per-pin sequence
+        number (a seqlock): the writer makes it odd while updating a pin, and
+        a reader retries if it saw an odd or changed sequence number.
+
+        The arrays of values ('H'), timestamps ('d') and sequence numbers ('Q')
+        may be provided, e.g., as memoryviews of shared memory (see
+        lib/sensor_hub.py), otherwise they are allocated.
+    '''
+    def __init__(self, values=None, timestamps=None, sequence=None):
+        self._values     = array('H', [ 0 ]) * PIN_COUNT if values is None else values
+        self._timestamps = array('d', [ 0.0 ]) * PIN_COUNT if timestamps is None else timestamps
+        self._sequence   = array('Q', [ 0 ]) * PIN_COUNT if sequence is None else sequence
+
+    def publish(self, pin, value, timestamp):
+        '''
+            Sets the value and timestamp of a pin. Only to be called by the
+            (single) writer.
+        '''
+        self._sequence[pin] += 1
+        try:
+            self._values[pin] = value
+            self._timestamps[pin] = timestamp
+        finally: # never left odd, which readers would wait on
+            self._sequence[pin] += 1
+
+    def read(self, pin):
+        '''
+            Returns a tuple of the latest value of the pin and its timestamp
+            (in time.monotonic() seconds), or None if the pin has never been
+            sampled.
+
+            Every SPIN_LIMIT retries the reader yields to the writer, having
+            checked that it is still alive (see writer_alive()): if it is not,
+            this raises a RuntimeError rather than wait on it forever.
+        '''
+        _sequence = self._sequence
+        _retries = 0
+        while True:
+            _before = _sequence[pin]
+            if not _before & 1:
+                _value = self._values[pin]
+                _timestamp = self._timestamps[pin]
+                if _sequence[pin] == _before:
+                    return ( _value, _timestamp ) if _before else None
+            _retries += 1
+            if _retries >= SPIN_LIMIT:
+                if not self.writer_alive():
+                    raise RuntimeError('the writer of pin {:d} is no longer running.'.format(pin))
+                time.sleep(0)
+                _retries = 0
+
+    def sequence(self, pin):
+        '''
+            Returns the number of times the pin has been published (times two),
+            which a reader may use to detect a new sample without reading it.
+        '''
+        return self._sequence[pin]
+
+    def writer_alive(self):
+        '''
+            Returns True if the writer may still complete a publish. The writer
+            of a Snapshot is a thread of this process, so it is assumed to be.
+        '''
+        return True
+
+
+# ..............................................................................
+class Sampler():
+    '''
+        Reads pins at individual rates on a dedicated thread, publishing the
+        results into a Snapshot. Pins falling due within 'batch_window' seconds
+        of one another are read together in a single block read.
+
+        Parameters:
+          master:       the I2cMaster used to read the pins
+          rates:        a dict of sample rates (in Hz) keyed by pin number
+          snapshot:     the Snapshot to publish into
+          level:        the log level, e.g., Level.INFO
+          batch_window: the window (in seconds) within which due pins are batched
+    '''
+    def __init__(self, master, rates, snapshot, level, batch_window=0.002):
+        self._log = Logger('sampler', level)
+        for _pin, _hz in rates.items():
+            if not 0 <= _pin < PIN_COUNT:
+                raise ValueError('pin {} out of range.'.format(_pin))
+            if _hz <= 0:
+                raise ValueError('sample rate for pin {} must be positive.'.format(_pin))
+        self._master   = master
+        self._periods  = { _pin: 1.0 / _hz for _pin, _hz in rates.items() }
+        self._snapshot = snapshot
+        self._batch_window = batch_window
+        self._stop_event = threading.Event()
+        self._thread   = None
+        self.sample_count  = 0
+        self.overrun_count = 0
+        self.error_count   = 0
+
+    @property
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    # ..........................................................................
+    def start(self):
+        if self.is_running:
+            raise RuntimeError('sampler already running.')
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='sampler', daemon=True)
+        self._thread.start()
+        self._log.info('sampling {:d} pins.'.format(len(self._periods)))
+
+    # ..........................................................................
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            self._log.info('stopped: {:d} samples, {:d} overruns, {:d} errors.'.format(
+                    self.sample_count, self.overrun_count, self.error_count))
+
+    # ..........................................................................
+    def _run(self):
+        _now = time.monotonic()
+        _schedule = [ ( _now, _pin ) for _pin in sorted(self._periods) ]
+        heapq.heapify(_schedule)
+        while not self._stop_event.is_set():
+            _due = _schedule[0][0]
+            _wait = _due - time.monotonic()
+            if _wait > 0.0 and self._stop_event.wait(_wait):
+                break
+            # gather every pin due within the batch window
+            _pins = []
+            while _schedule and _schedule[0][0] <= _due + self._batch_window:
+                _pins.append(heapq.heappop(_schedule)[1])
+            try:
+                self._sample(_pins)
+            except Exception as e:
+                self.error_count += 1
+                self._log.error('error sampling pins {}: {}'.format(_pins, e))
+                traceback.print_exc()
+            _now = time.monotonic()
+            for _pin in _pins:
+                _next = _due + self._periods[_pin]
+                if _next < _now: # we've fallen behind: skip rather than burst
+                    self.overrun_count += 1
+                    _next = _now + self._periods[_pin]
+                heapq.heappush(_schedule, ( _next, _pin ))
+
+    # ..........................................................................
+    def _sample(self, pins):
+        _block = [ _pin for _pin in pins if _pin < BLOCK_PIN_COUNT ]
+        if len(_block) > 1:
+            _values = self._master.read_pins(_block)
+            _timestamp = time.monotonic()
+            for _pin in _block:
+                self._snapshot.publish(_pin, _values[_pin], _timestamp)
+        else:
+            _block = []
+        for _pin in pins:
+            if _pin not in _block:
+                _value = self._master.get_input_from_pin(_pin)
+                self._snapshot.publish(_pin, _value, time.monotonic())
+        self.sample_count += len(pins)
+
+#EOF
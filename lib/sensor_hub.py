@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 by Murray Altheim. All rights reserved. This file is part
+# of the pimaster2ardslave project and is released under the MIT Licence;
+# please see the LICENSE file included as part of this package.
+#
+# author:   Murray Altheim
+# created:  2020-05-25
+# modified: 2020-05-25
+#
+# A sensor hub, sharing the readings of one slave among any number of
+# processes. The slave's queue protocol allows only one master, so a single
+# hub process owns the I2cMaster: it samples the configured pins (see
+# lib/sampler.py) into a block of shared memory, from which a HubClient in
+# any other process reads them without a system call or any bus traffic,
+# and it performs the output and configuration commands that clients send
+# it over a local Unix socket. The block is laid out as:
+#
+#   header:     magic 'I2CH', version, pin count (2 bytes each), the hub's
+#               process id and the mask of the pins it samples (4 bytes each)
+#   sequences:  a seqlock sequence number per pin (8 bytes each)
+#   timestamps: the time.monotonic() of each pin's latest sample (a double)
+#   values:     the latest value of each pin (2 bytes each)
+#
+# The socket is created in a directory private to the user ($XDG_RUNTIME_DIR,
+# or else a directory of the user's own in the temporary directory), along
+# with a key file readable only by the user, from which clients read the
+# random key by which the hub authenticates them. As commands and replies
+# are pickled, the hub and its clients refuse a directory that is not the
+# user's alone.
+#
+# To run a hub from the command line, e.g.:
+#
+#   % python3 -m lib.sensor_hub 5=output 6=input:10 8=analog:50
+#
+# which configures pin 5 as an output, and samples pin 6 at 10Hz and the
+# analog input on pin 8 at 50Hz.
+#
+
+import os, sys, time, stat, struct, tempfile, threading
+from multiprocessing import shared_memory, resource_tracker
+from multiprocessing.connection import Listener, Client
+
+from lib.logger import Logger, Level
+from lib.sampler import Snapshot, Sampler
+from lib.protocol import PIN_COUNT, SLAVE_I2C_ADDRESS
+
+HUB_NAME       = 'pimaster2ardslave'            # the name of the shared memory block
+HUB_SOCKET     = 'pimaster2ardslave.sock'       # the hub's Unix socket, in the hub directory
+KEY_SUFFIX     = '.key'                         # of the key file, beside the socket
+KEY_LENGTH     = 32
+MAGIC          = b'I2CH'
+VERSION        = 1
+HEADER         = struct.Struct('<4sHHII')
+
+# the I2cMaster methods a client may have the hub perform
+FORWARDED = ( 'set_output_on_pin', 'set_outputs', 'configure_pin_as_digital_input',
+        'configure_pin_as_digital_input_pullup', 'configure_pin_as_analog_input', 'configure_pin_as_output',
+        'set_analog_mode', 'apply_pin_map', 'set_sample_period', 'handshake' )
+
+# the exceptions a client re-raises by name, any other as a RuntimeError
+_EXCEPTIONS = { 'ValueError': ValueError, 'OSError': OSError, 'TimeoutError': TimeoutError }
+
+# ..............................................................................
+def hub_directory():
+    '''
+        Returns the directory private to the user in which the hub's socket
+        and key file are created: $XDG_RUNTIME_DIR if set, otherwise a
+        directory of the user's own in the temporary directory, created
+        (mode 0700) if necessary.
+    '''
+    _directory = os.environ.get('XDG_RUNTIME_DIR')
+    if not _directory:
+        _directory = os.path.join(tempfile.gettempdir(), 'pimaster2ardslave-{:d}'.format(os.getuid()))
+        try:
+            os.mkdir(_directory, 0o700)
+        except FileExistsError:
+            pass
+    return _directory
+
+
+def hub_address():
+    '''
+        Returns the default path of the hub's socket.
+    '''
+    return os.path.join(hub_directory(), HUB_SOCKET)
+
+
+def _check_private(address):
+    '''
+        Raises a PermissionError unless the directory of the socket is owned
+        by the user and closed to others, so that no other user can create
+        or replace the socket or its key file.
+    '''
+    _directory = os.path.dirname(os.path.abspath(address))
+    _stat = os.lstat(_directory)
+    if not stat.S_ISDIR(_stat.st_mode) or _stat.st_uid != os.getuid() or _stat.st_mode & 0o077:
+        raise PermissionError('{} is not a directory private to the user.'.format(_directory))
+
+
+def _read_key(address):
+    with open(address + KEY_SUFFIX, 'rb') as _file:
+        return _file.read()
+
+
+# ..............................................................................
+class SharedSnapshot(Snapshot):
+    '''
+        A Snapshot (see lib/sampler.py) held in a named block of shared memory,
+        so that it may be read from other processes. There is a single writer
+        (the hub's sampler thread); readers never block, using the Snapshot's
+        per-pin seqlock. Only the creator publishes, and only it unlinks the
+        block on close(). Should the hub die while publishing a pin, a read of
+        the pin raises a RuntimeError rather than wait on it forever.
+
+        Parameters:
+          name:       the name of the shared memory block
+          create:     if True create the block (replacing any left behind by a
+                      hub that did not close), otherwise attach to it
+          pin_mask:   when creating, the mask of the pins to be sampled
+    '''
+    def __init__(self, name=HUB_NAME, create=False, pin_mask=0):
+        _size = HEADER.size + PIN_COUNT * ( 8 + 8 + 2 )
+        self._create = create
+        if create:
+            try:
+                self._shm = shared_memory.SharedMemory(name, create=True, size=_size)
+            except FileExistsError:
+                _stale = shared_memory.SharedMemory(name)
+                _stale.close()
+                _stale.unlink()
+                self._shm = shared_memory.SharedMemory(name, create=True, size=_size)
+            HEADER.pack_into(self._shm.buf, 0, MAGIC, VERSION, PIN_COUNT, os.getpid(), pin_mask)
+        else:
+            self._shm = shared_memory.SharedMemory(name)
+            # the resource tracker of an attaching process would otherwise unlink the block on its exit
+            resource_tracker.unregister(self._shm._name, 'shared_memory')
+            _magic, _version, _pin_count, _, _ = HEADER.unpack_from(self._shm.buf, 0)
+            if _magic != MAGIC or _version != VERSION or _pin_count != PIN_COUNT:
+                self._shm.close()
+                raise ValueError('{} is not a version {:d} sensor hub.'.format(name, VERSION))
+        _offset = HEADER.size
+        _sequence   = self._shm.buf[_offset:_offset + 8 * PIN_COUNT].cast('Q')
+        _offset += 8 * PIN_COUNT
+        _timestamps = self._shm.buf[_offset:_offset + 8 * PIN_COUNT].cast('d')
+        _offset += 8 * PIN_COUNT
+        _values     = self._shm.buf[_offset:_offset + 2 * PIN_COUNT].cast('H')
+        Snapshot.__init__(self, _values, _timestamps, _sequence)
+
+    @property
+    def hub_pid(self):
+        return HEADER.unpack_from(self._shm.buf, 0)[3]
+
+    @property
+    def pin_mask(self):
+        '''
+            Returns the mask of the pins the hub samples.
+        '''
+        return HEADER.unpack_from(self._shm.buf, 0)[4]
+
+    def writer_alive(self):
+        '''
+            Returns True if the hub's process is still running.
+        '''
+        try:
+            os.kill(self.hub_pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError: # running, as another user
+            pass
+        return True
+
+    def close(self):
+        if self._shm is None:
+            return
+        # the views must be released before the block can be closed
+        for _view in ( self._sequence, self._timestamps, self._values ):
+            _view.release()
+        self._shm.close()
+        if self._create:
+            self._shm.unlink()
+        self._shm = None
+
+
+# ..............................................................................
+class SensorHub():
+    '''
+        Owns an I2cMaster, sampling each pin at its own rate into a
+        SharedSnapshot and performing the commands sent by HubClients over a
+        Unix socket (each connection is served by its own thread, the master
+        serialising their transactions with the sampler's).
+
+        Parameters:
+          master:     the I2cMaster, whose pins should already be configured
+          rates:      a dict of sample rates (in Hz) keyed by pin number
+          level:      the log level, e.g., Level.INFO
+          name:       the name of the shared memory block
+          address:    the path of the Unix socket, in a directory private to
+                      the user, by default in hub_directory()
+          authkey:    the key by which clients are authenticated, by default
+                      random, and written to the key file beside the socket
+    '''
+    def __init__(self, master, rates, level, name=HUB_NAME, address=None, authkey=None):
+        self._log = Logger('sensor-hub', level)
+        self._master = master
+        self._address = address if address is not None else hub_address()
+        self._authkey = authkey if authkey is not None else os.urandom(KEY_LENGTH)
+        _mask = 0
+        for _pin in rates:
+            _mask |= 1 << _pin
+        self._snapshot = SharedSnapshot(name, create=True, pin_mask=_mask)
+        try:
+            self._sampler = Sampler(master, rates, self._snapshot, level)
+        except ValueError:
+            self._snapshot.close()
+            raise
+        self._pins = sorted(rates)
+        self._listener = None
+        self._thread = None
+        self._closed = False
+        self.command_count = 0
+        self.client_count = 0
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    # ..........................................................................
+    def start(self):
+        _check_private(self._address)
+        if os.path.exists(self._address): # left behind by a hub that did not close
+            os.remove(self._address)
+        _umask = os.umask(0o077) # the socket and key file are created closed to others
+        try:
+            with open(os.open(self._address + KEY_SUFFIX, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as _file:
+                _file.write(self._authkey)
+            self._listener = Listener(self._address, family='AF_UNIX', authkey=self._authkey)
+        finally:
+            os.umask(_umask)
+        self._thread = threading.Thread(target=self._accept, name='sensor-hub', daemon=True)
+        self._thread.start()
+        self._sampler.start()
+        self._log.info('sharing pins {} on {}.', self._pins, self._address)
+
+    def _accept(self):
+        while not self._closed:
+            try:
+                _connection = self._listener.accept()
+            except Exception as e:
+                if not self._closed:
+                    self._log.warning('failed to accept a client: {}', e)
+                continue
+            if self._closed:
+                _connection.close()
+                break
+            self.client_count += 1
+            threading.Thread(target=self._serve, args=( _connection, ), name='sensor-hub-client', daemon=True).start()
+
+    def _serve(self, connection):
+        '''
+            Performs each command received on the connection, replying with
+            ( 'ok', result ) or ( 'error', exception name, message ).
+        '''
+        with connection:
+            while not self._closed:
+                try:
+                    _method, _args, _kwargs = connection.recv()
+                except (EOFError, OSError):
+                    break
+                if _method not in FORWARDED:
+                    connection.send(( 'error', 'ValueError', 'method {} is not forwarded by the hub.'.format(_method) ))
+                    continue
+                try:
+                    _result = getattr(self._master, _method)(*_args, **_kwargs)
+                    self.command_count += 1
+                    connection.send(( 'ok', _result ))
+                except Exception as e:
+                    self._log.warning('{} from a client failed: {}', _method, e)
+                    connection.send(( 'error', type(e).__name__, str(e) ))
+
+    # ..........................................................................
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._sampler.stop()
+        if self._listener is not None:
+            try: # wake the accepting thread
+                Client(self._address, family='AF_UNIX', authkey=self._authkey).close()
+            except Exception:
+                pass
+            self._thread.join()
+            self._listener.close()
+            try:
+                os.remove(self._address + KEY_SUFFIX)
+            except FileNotFoundError:
+                pass
+        self._snapshot.close()
+        self._log.info('closed: {:d} clients, {:d} commands.', self.client_count, self.command_count)
+
+
+# ..............................................................................
+class HubClient():
+    '''
+        A client of a SensorHub, reading the sampled pins from its shared memory
+        and having it perform output and configuration commands (see FORWARDED),
+        which raise any exception they raise in the hub. The socket is only
+        connected on the first command.
+
+        Parameters:
+          name:       the name of the hub's shared memory block
+          address:    the path of the hub's Unix socket, by default in
+                      hub_directory()
+          authkey:    the key by which the hub authenticates clients, by
+                      default read from the key file beside the socket
+    '''
+    def __init__(self, name=HUB_NAME, address=None, authkey=None):
+        self._snapshot = SharedSnapshot(name)
+        self._address = address if address is not None else hub_address()
+        self._authkey = authkey
+        self._connection = None
+        self._lock = threading.Lock()
+
+    @property
+    def pins(self):
+        '''
+            Returns a list of the pins the hub samples.
+        '''
+        _mask = self._snapshot.pin_mask
+        return [ _pin for _pin in range(PIN_COUNT) if _mask & ( 1 << _pin ) ]
+
+    def get_sample(self, pin):
+        '''
+            Returns a tuple of the most recently sampled value of the pin and its
+            time.monotonic() timestamp, or None if the pin hasn't been sampled.
+        '''
+        return self._snapshot.read(pin)
+
+    def sequence(self, pin):
+        return self._snapshot.sequence(pin)
+
+    # ..........................................................................
+    def call(self, method, *args, **kwargs):
+        '''
+            Has the hub call the method of its I2cMaster, returning the result.
+        '''
+        with self._lock:
+            if self._connection is None:
+                _check_private(self._address)
+                if self._authkey is None:
+                    self._authkey = _read_key(self._address)
+                self._connection = Client(self._address, family='AF_UNIX', authkey=self._authkey)
+            self._connection.send(( method, args, kwargs ))
+            _reply = self._connection.recv()
+        if _reply[0] == 'ok':
+            return _reply[1]
+        raise _EXCEPTIONS.get(_reply[1], RuntimeError)(_reply[2])
+
+    def set_output_on_pin(self, pin, value):
+        return self.call('set_output_on_pin', pin, value)
+
+    def set_outputs(self, outputs):
+        return self.call('set_outputs', outputs)
+
+    def set_analog_mode(self, pin, mode, parameter=1):
+        return self.call('set_analog_mode', pin, mode, parameter)
+
+    def apply_pin_map(self, pin_map, force=False):
+        return self.call('apply_pin_map', pin_map, force)
+
+    def set_sample_period(self, period_ms):
+        return self.call('set_sample_period', period_ms)
+
+    # ..........................................................................
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+        self._snapshot.close()
+
+
+# ..............................................................................
+def main(argv):
+    '''
+        Runs a hub until interrupted. Each argument configures a pin, as
+        'pin=type' or 'pin=type:rate', where the type is that of a pin map
+        (see I2cMaster.apply_pin_map()) and the rate in Hz, if given, that at
+        which the hub samples it.
+    '''
+    from lib.i2c_master import I2cMaster
+    _pin_map = {}
+    _rates = {}
+    for _arg in argv:
+        _pin, _, _spec = _arg.partition('=')
+        _type, _, _rate = _spec.partition(':')
+        _pin_map[int(_pin)] = _type
+        if _rate:
+            _rates[int(_pin)] = float(_rate)
+    _master = I2cMaster(SLAVE_I2C_ADDRESS, Level.INFO)
+    _hub = None
+    try:
+        _master.apply_pin_map(_pin_map)
+        _hub = SensorHub(_master, _rates, Level.INFO)
+        _hub.start()
+        while True:
+            time.sleep(1.0)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if _hub is not None:
+            _hub.close()
+        _master.close()
+
+
+if __name__== "__main__":
+    main(sys.argv[1:])
+
+#EOF
@@ -0,0 +1,1280 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 by Murray Altheim. All rights reserved. This file is part
+# of the pimaster2ardslave project and is released under the MIT Licence;
+# please see the LICENSE file included as part of this package.
+#
+# author:   Murray Altheim
+# created:  2020-05-10
+# modified: 2020-05-25
+#
+# A pure-Python model of the i2cSlave.ino sketch, plus a stand-in for the
+# pigpio.pi() object so that an I2cMaster can be driven without a Raspberry
+# Pi or an Arduino, e.g.:
+#
+#   _slave  = SimulatedSlave()
+#   _pi     = SimulatedPi({ 0x08: _slave })
+#   _master = I2cMaster(0x08, Level.INFO, pi=_pi)
+#
+
+import time, errno, queue, random, itertools, threading
+from collections import deque
+
+from lib.protocol import *
+
+# ..............................................................................
+class VirtualClock():
+    '''
+        A manually-advanced clock, callable like time.monotonic(). When provided
+        to both a SimulatedSlave and a (non-realtime) SimulatedPi the modelled
+        bus, daemon and ISR costs advance the clock rather than wall time, so
+        that timing-dependent behaviour is deterministic.
+    '''
+    def __init__(self, start=0.0):
+        self._now = start
+        self._mutex = threading.Lock()
+
+    def __call__(self):
+        return self._now
+
+    def advance(self, seconds):
+        with self._mutex:
+            self._now += seconds
+
+
+# ..............................................................................
+class TimingModel():
+    '''
+        The cost model used by the SimulatedPi.
+
+        Parameters:
+          bus_hz:     the I²C clock rate (default 100kHz)
+          daemon_s:   the cost of one pigpiod socket round trip, in seconds
+          isr_s:      the time spent in one slave Wire callback, in seconds
+          ioctl_s:    the cost of one I2C_RDWR ioctl (see SimulatedI2cDev), in
+                      seconds
+          realtime:   if True the modelled costs are spent in wall time,
+                      otherwise they are only accounted (and advance a
+                      VirtualClock if one is in use)
+    '''
+    def __init__(self, bus_hz=100000, daemon_s=0.00015, isr_s=0.00002, ioctl_s=0.00003, realtime=True):
+        self.bus_hz   = bus_hz
+        self.daemon_s = daemon_s
+        self.isr_s    = isr_s
+        self.ioctl_s  = ioctl_s
+        self.realtime = realtime
+
+    def bus_time(self, byte_count, segments=1):
+        '''
+            Returns the time on the wire of a transaction of 'segments' messages
+            (joined by repeated starts) carrying 'byte_count' data bytes: a start
+            and nine-bit address frame per segment, nine bits per data byte and
+            a final stop.
+        '''
+        _bits = segments * 10 + byte_count * 9 + 1
+        return _bits / self.bus_hz
+
+    def spend(self, seconds):
+        '''
+            Blocks for the given time if realtime. Sleeping alone overshoots by
+            tens of microseconds on Linux, so the tail is spent spinning.
+        '''
+        if not self.realtime or seconds <= 0.0:
+            return
+        _end = time.perf_counter() + seconds
+        if seconds > 0.0002:
+            time.sleep(seconds - 0.0001)
+        while time.perf_counter() < _end:
+            pass
+
+
+# ..............................................................................
+class ArduinoQueue():
+    '''
+        A fixed-capacity FIFO with the semantics of Einar Arnason's ArduinoQueue:
+        enqueuing to a full queue silently drops the item, dequeuing from an
+        empty queue returns the default value (zero).
+    '''
+    def __init__(self, capacity):
+        self._capacity = capacity
+        self._items = deque()
+
+    def enqueue(self, item):
+        if len(self._items) >= self._capacity:
+            return False
+        self._items.append(item)
+        return True
+
+    def dequeue(self):
+        if not self._items:
+            return 0
+        return self._items.popleft()
+
+    def is_empty(self):
+        return not self._items
+
+    def item_count(self):
+        return len(self._items)
+
+
+# ..............................................................................
+class SimulatedSlave():
+    '''
+        A model of the i2cSlave.ino sketch. The method names follow those of
+        the sketch (receiveData() becomes receive_data(), etc.) and each is
+        intended to behave identically, including its quirks, so please keep
+        the two in step (test_differential.py compares this with the sketch's
+        own i2cSlaveCore.cpp, built for the host).
+
+        Rather than using a thread, the sketch's loop() is run lazily: each
+        Wire callback (or a call to service()) first performs any loop()
+        iterations that would have occurred since the last one. Where the
+        slave must act without any bus traffic (e.g., to raise its interrupt
+        line) start() runs service() from a thread, as the Arduino would.
+
+        An output pin may be wired to a callable (see SimulatedPi.connect())
+        that is called with the new level whenever it changes.
+
+        Parameters:
+          clock:          a callable returning seconds, default time.monotonic
+          loop_delay_ms:  the initial sample period, between loop() iterations
+                          (LOOP_DELAY_MS), as set by set_sample_period(); if
+                          None loop() is only run when called explicitly
+          echo_test:      equivalent to the sketch's 'isEchoTest' flag
+    '''
+    def __init__(self, clock=time.monotonic, loop_delay_ms=LOOP_DELAY_MS, echo_test=False):
+        self._clock          = clock
+        self._loop_delay     = loop_delay_ms / 1000.0 if loop_delay_ms is not None else None
+        self.echo_test       = echo_test
+        self.pins_assigned   = PINS_ASSIGNED
+        self.is_auto_range   = False
+        self.is_constrain_analog_value = True
+        self.analog_min_default = 70.0
+        self.analog_min      = self.analog_min_default
+        self.analog_max_default = 600.0
+        self.analog_max      = self.analog_max_default
+        self._input_queue    = ArduinoQueue(QUEUE_LENGTH)
+        self._output_queue   = ArduinoQueue(QUEUE_LENGTH)
+        self._change_queue   = ArduinoQueue(CHANGE_QUEUE_LENGTH)
+        self.change_mask     = 0
+        self.is_change_lost  = False
+        self._capture_queue  = ArduinoQueue(CAPTURE_LENGTH)
+        self.capture_pin     = -1
+        self.capture_period  = 0
+        self.capture_overflowed = 0
+        self.capture_missed  = 0
+        self._next_capture   = 0
+        self.counter_pins    = [ -1 ] * MAX_COUNTERS
+        self.counter_counts  = [ 0 ] * MAX_COUNTERS
+        self.counter_periods = [ 0 ] * MAX_COUNTERS
+        self._counter_last_micros = [ 0 ] * MAX_COUNTERS
+        self._counter_is_timed = [ False ] * MAX_COUNTERS
+        self._counter_edges  = [ 0 ] * MAX_COUNTERS
+        self._pending_command = NO_COMMAND
+        self.is_framed       = False
+        self.last_sequence   = -1
+        self._frame          = bytearray()
+        self.pin_assignments = [ 0 ] * PIN_COUNT
+        self.pin_values      = [ INIT_VALUE ] * PIN_COUNT
+        self.analog_modes    = [ ANALOG_MODE_SCALED ] * PIN_COUNT
+        self.analog_parameters = [ 0 ] * PIN_COUNT
+        self.ema_values      = [ 0 ] * PIN_COUNT
+        self.levels          = [ 0 ] * PIN_COUNT   # electrical level of each pin
+        self.analog          = [ 0 ] * PIN_COUNT   # raw analog value (or callable) of each pin
+        self.loop_count      = 0
+        self.sample_generation = 0
+        self.sample_millis   = 0
+        self.sample_period   = loop_delay_ms if loop_delay_ms is not None else LOOP_DELAY_MS
+        self.request_count   = 0
+        self.isr_count       = 0
+        self._next_loop      = None
+        self._wires          = {}
+        self._mutex          = threading.RLock()
+        self._thread         = None
+        self.setup()
+
+    # hardware side ............................................................
+
+    def set_input(self, pin, level):
+        '''
+            Sets the electrical level (0 or 1) presented to a digital pin. If
+            the pin is counting its edges and the level changes on an edge it
+            counts, the edge is counted at once, as by the pin's interrupt.
+        '''
+        _level = 1 if level else 0
+        if self.levels[pin] == _level:
+            return
+        self.levels[pin] = _level
+        if pin in self.counter_pins:
+            _slot = self.counter_pins.index(pin)
+            if self._counter_edges[_slot] & ( COUNT_RISING if _level else COUNT_FALLING ):
+                with self._mutex:
+                    self.count_edge(_slot)
+
+    def set_analog(self, pin, value):
+        '''
+            Sets the raw (0-1023) value presented to an analog pin. This may
+            also be a callable accepting the clock time and returning a value,
+            which is called for each sample.
+        '''
+        self.analog[pin] = value
+
+    def set_analog_sequence(self, pin, values):
+        '''
+            Sets raw values presented to an analog pin in turn, one per sample,
+            repeating, as does HostSlave.set_analog_sequence().
+        '''
+        _values = itertools.cycle([ int(v) for v in values ])
+        self.analog[pin] = lambda t: next(_values)
+
+    def get_output(self, pin):
+        '''
+            Returns the level last written to the pin.
+        '''
+        return self.levels[pin]
+
+    def digital_read(self, pin):
+        return self.levels[pin]
+
+    def digital_write(self, pin, value):
+        _level = 1 if value else 0
+        if self.levels[pin] != _level:
+            self.levels[pin] = _level
+            _wire = self._wires.get(pin)
+            if _wire is not None:
+                _wire(_level)
+
+    def wire(self, pin, function):
+        '''
+            Calls the function with the new level of the output pin whenever
+            it changes, or if the function is None, disconnects the pin.
+        '''
+        if function is None:
+            self._wires.pop(pin, None)
+        else:
+            self._wires[pin] = function
+
+    def analog_read(self, pin, t=None):
+        _value = self.analog[pin]
+        if callable(_value):
+            _value = _value(self._clock() if t is None else t)
+        return max(0, min(1023, int(_value)))
+
+    # sketch ...................................................................
+
+    def setup(self):
+        self.reset_pin_assignments()
+        self.reset_pin_values()
+        self.set_change_mask(0)
+        self._next_loop = self._clock()
+
+    def start(self):
+        '''
+            Starts a thread calling service() once per loop delay, so that
+            loop() runs without any bus traffic.
+        '''
+        if self._thread is None and self._loop_delay is not None:
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name='simulated-slave', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._running = False
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while self._running:
+            self.service()
+            time.sleep(self._loop_delay)
+
+    def micros(self):
+        return int(round(self._clock() * 1e6))
+
+    def millis(self):
+        return self.micros() // 1000
+
+    def service(self):
+        '''
+            Takes any capture samples that are due, then performs any loop()
+            iterations that are due. If the slave has fallen more than one
+            iteration behind, the skipped iterations are counted but the pins
+            are only read once. With a 'loop_delay_ms' of None this does
+            nothing: loop() and service_capture() must be called directly.
+        '''
+        if self._loop_delay is None:
+            return
+        with self._mutex:
+            self.service_capture()
+            _now = self._clock()
+            if _now < self._next_loop:
+                return
+            _behind = int(( _now - self._next_loop ) / self._loop_delay)
+            if _behind > 0:
+                self.loop_count += _behind
+                self._next_loop += _behind * self._loop_delay
+            self.loop()
+            self.sample_millis = int(round(self._next_loop * 1e6)) // 1000 # when the sketch would have read the pins
+            self._next_loop += self._loop_delay
+
+    def loop(self):
+        self.read_pin_assignments()
+        self.loop_count += 1
+
+    def state(self):
+        '''
+            Returns the state compared by the differential tests: a tuple of the
+            loop and request counts, analog range, auto-range flag, pending
+            command, change mask, queued change count, change lost flag,
+            interrupt line, capture pin, buffered sample count, overflowed
+            and missed counts, framing state, last sequence number, sample
+            generation and sample period, the pin, count and period of each
+            counter, then a list of ( assignment, value, analog mode ) for each pin.
+        '''
+        return ( self.loop_count, self.request_count, int(self.analog_min), int(self.analog_max),
+                1 if self.is_auto_range else 0, self._pending_command, self.change_mask,
+                self._change_queue.item_count(), 1 if self.is_change_lost else 0, self.levels[INTERRUPT_PIN],
+                self.capture_pin, self._capture_queue.item_count(), self.capture_overflowed, self.capture_missed,
+                1 if self.is_framed else 0, self.last_sequence, self.sample_generation, self.sample_period ) \
+                + tuple(itertools.chain.from_iterable(zip(self.counter_pins, self.counter_counts, self.counter_periods))), \
+                [ ( self.pin_assignments[pin], self.pin_values[pin], self.analog_modes[pin] ) for pin in range(PIN_COUNT) ]
+
+    def request_data(self):
+        '''
+            Returns the bytes written to the Wire in response to a request.
+        '''
+        with self._mutex:
+            self.isr_count += 1
+            self.service()
+            if self._output_queue.is_empty():
+                if self.is_framed:
+                    self.queue_frame_error(0, FRAME_NO_REPLY)
+                else:
+                    self.queue_for_output(EMPTY_QUEUE)
+            _data = bytearray()
+            while not self._output_queue.is_empty():
+                _data.append(self._output_queue.dequeue())
+            return _data
+
+    def receive_data(self, data):
+        '''
+            Receives the bytes of one write transaction.
+        '''
+        with self._mutex:
+            self.isr_count += 1
+            self.service()
+            if self.is_framed:
+                self.receive_frame(data)
+                return
+            for b in data:
+                self._input_queue.enqueue(b)
+                self._output_queue.enqueue(b)
+            if self._pending_command == NO_COMMAND and self._input_queue.item_count() >= 2:
+                _lo_byte = self._input_queue.dequeue()
+                _hi_byte = self._input_queue.dequeue()
+                self._pending_command = _to_int16(_lo_byte | ( _hi_byte << 8 ))
+            if self._pending_command != NO_COMMAND \
+                    and self._input_queue.item_count() >= self.payload_length(self._pending_command):
+                self.request_count += 1
+                _input_data = self._pending_command
+                self._pending_command = NO_COMMAND
+                self.clear_output_queue()
+                if self.echo_test:
+                    self.queue_for_output(_input_data)
+                elif self.is_block_command(_input_data):
+                    self.handle_block_command(_input_data)
+                else:
+                    self.queue_for_output(self.handle_command(_input_data))
+                if not self._input_queue.is_empty():
+                    self.clear_input_queue()
+                    self.clear_output_queue()
+                    self.queue_for_output(TOO_MUCH_DATA)
+
+    def receive_frame(self, data):
+        '''
+            Receives a frame, the whole of one write in framed mode, as the
+            sketch's receiveFrame().
+        '''
+        self.clear_input_queue()
+        self.clear_output_queue()
+        self._pending_command = NO_COMMAND
+        _sequence = data[0] if len(data) > 1 else 0
+        for b in data[1:-1]:
+            self._input_queue.enqueue(b)
+        if len(data) < 4:
+            self.clear_input_queue()
+            self.queue_frame_error(_sequence, FRAME_BAD_LENGTH)
+            return
+        elif crc8(data[:-1]) != data[-1]:
+            self.clear_input_queue()
+            self.queue_frame_error(_sequence, FRAME_BAD_CRC)
+            return
+        elif _sequence == self.last_sequence:
+            self.clear_input_queue()
+            self.replay_frame()
+            return
+        _lo_byte = self._input_queue.dequeue()
+        _hi_byte = self._input_queue.dequeue()
+        _command = _to_int16(_lo_byte | ( _hi_byte << 8 ))
+        if self._input_queue.item_count() != self.payload_length(_command):
+            self.clear_input_queue()
+            self.queue_frame_error(_sequence, FRAME_BAD_LENGTH)
+            return
+        self.request_count += 1
+        if self.echo_test:
+            self.queue_for_output(_command)
+        elif self.is_block_command(_command):
+            self.handle_block_command(_command)
+        else:
+            self.queue_for_output(self.handle_command(_command))
+        self.last_sequence = _sequence
+        self.queue_frame(_sequence, FRAME_OK)
+
+    def queue_frame(self, sequence, status):
+        self._frame = bytearray([ sequence, status ])
+        while not self._output_queue.is_empty() and len(self._frame) < QUEUE_LENGTH - 1:
+            self._frame.append(self._output_queue.dequeue())
+        self.clear_output_queue()
+        self._frame[1] = status | ( ( len(self._frame) - 2 ) << FRAME_LENGTH_SHIFT )
+        self._frame.append(crc8(self._frame))
+        self.replay_frame()
+
+    def queue_frame_error(self, sequence, status):
+        for b in ( sequence, status, crc8([ sequence, status ]) ):
+            self._output_queue.enqueue(b)
+
+    def replay_frame(self):
+        for b in self._frame:
+            self._output_queue.enqueue(b)
+
+    def set_framing(self, enabled):
+        self.is_framed = enabled
+        self.last_sequence = -1
+        self._frame = bytearray()
+        return 1 if enabled else 0
+
+    def is_block_command(self, command):
+        return command == CMD_READ_ALL_PINS \
+                or command == CMD_READ_PINS \
+                or command == CMD_SET_ANALOG_MODE \
+                or command == CMD_SET_CHANGE_MASK \
+                or command == CMD_READ_CHANGES \
+                or command == CMD_START_CAPTURE \
+                or command == CMD_READ_CAPTURE \
+                or command == CMD_HANDSHAKE \
+                or command == CMD_APPLY_PIN_MAP \
+                or command == CMD_SET_FRAMING \
+                or command == CMD_WRITE_OUTPUTS \
+                or command == CMD_READ_PINS_GENERATION \
+                or command == CMD_SET_SAMPLE_PERIOD \
+                or command == CMD_CONFIGURE_COUNTER \
+                or command == CMD_READ_COUNTERS
+
+    def payload_length(self, command):
+        if self.echo_test:
+            return 0
+        if command == CMD_READ_PINS:
+            return 2
+        elif command == CMD_SET_ANALOG_MODE:
+            return 3
+        elif command == CMD_SET_CHANGE_MASK:
+            return 2
+        elif command == CMD_START_CAPTURE:
+            return 3
+        elif command == CMD_APPLY_PIN_MAP:
+            return PIN_MAP_LENGTH
+        elif command == CMD_SET_FRAMING:
+            return 1
+        elif command == CMD_WRITE_OUTPUTS:
+            return 4
+        elif command == CMD_READ_PINS_GENERATION:
+            return 2
+        elif command == CMD_SET_SAMPLE_PERIOD:
+            return 2
+        elif command == CMD_CONFIGURE_COUNTER:
+            return 2
+        elif command == CMD_READ_COUNTERS:
+            return 3
+        return 0
+
+    def read_pin_assignments(self):
+        for pin in range(self.pins_assigned):
+            _pin_type = self.pin_assignments[pin]
+            _notify = pin < BLOCK_PIN_COUNT and self.change_mask & ( 1 << pin )
+            _previous_value = self.get_value_of(pin) if _notify else 0
+            if _pin_type == PIN_INPUT_DIGITAL or _pin_type == PIN_INPUT_COUNTER:
+                self.pin_values[pin] = self.digital_read(pin)
+            elif _pin_type == PIN_INPUT_ANALOG:
+                _analog_value = self.read_analog_value(pin)
+                self.adjust_auto_range(_analog_value)
+                self.pin_values[pin] = _analog_value
+            elif _pin_type == PIN_INPUT_DIGITAL_PULLUP:
+                self.pin_values[pin] = 0 if self.digital_read(pin) else 1
+            elif _pin_type == PIN_OUTPUT:
+                self.digital_write(pin, self.pin_values[pin] != 0)
+            if _notify and ( _pin_type == PIN_INPUT_DIGITAL or _pin_type == PIN_INPUT_DIGITAL_PULLUP
+                    or _pin_type == PIN_INPUT_ANALOG or _pin_type == PIN_INPUT_COUNTER ):
+                _value = self.get_value_of(pin)
+                if _value != _previous_value:
+                    self.queue_change(pin, _value)
+        if not self._change_queue.is_empty():
+            self.digital_write(INTERRUPT_PIN, True)
+        self.sample_generation = ( self.sample_generation + 1 ) & 0xFFFF
+        self.sample_millis = self.millis()
+
+    def handle_command(self, data):
+        if 0 <= data < 32:
+            return self.get_value_of(data)
+        elif _in_range(data, 32, 64):
+            _pin = data - 32
+            self.set_pin_assignment(_pin, PIN_INPUT_DIGITAL)
+            return _pin
+        elif _in_range(data, 64, 96):
+            _pin = data - 64
+            self.set_pin_assignment(_pin, PIN_INPUT_DIGITAL_PULLUP)
+            return _pin
+        elif _in_range(data, 96, 128):
+            _pin = data - 96
+            self.set_pin_assignment(_pin, PIN_INPUT_ANALOG)
+            return _pin
+        elif _in_range(data, 128, 160):
+            _pin = data - 128
+            self.set_pin_assignment(_pin, PIN_OUTPUT)
+            return _pin
+        elif _in_range(data, 160, 192):
+            self.digital_write(data - 160, False)
+            return 0
+        elif _in_range(data, 192, 224):
+            self.digital_write(data - 192, True)
+            return 1
+        elif data == CMD_ECHO_INPUT:
+            return data
+        elif data == CMD_CLEAR_REQUEST_COUNT:
+            self.request_count = 0
+            return self.request_count
+        elif data == CMD_RETURN_REQUEST_COUNT:
+            return self.request_count
+        elif data == CMD_CLEAR_LOOP_COUNT:
+            self.loop_count = 0
+            return self.loop_count
+        elif data == CMD_RETURN_LOOP_COUNT:
+            return self.loop_count
+        elif data == CMD_CLEAR_QUEUES:
+            self._pending_command = NO_COMMAND
+            self.clear_input_queue()
+            self.clear_output_queue()
+            return 0
+        elif data == CMD_RETURN_ANALOG_MIN_RANGE:
+            return int(self.analog_min)
+        elif data == CMD_RETURN_ANALOG_MAX_RANGE:
+            return int(self.analog_max)
+        elif data == CMD_DISABLE_AUTORANGE:
+            self.is_auto_range = False
+            self.reset_range()
+            return 0
+        elif data == CMD_ENABLE_AUTORANGE:
+            self.is_auto_range = True
+            self.reset_range()
+            return 1
+        elif data == CMD_STOP_CAPTURE:
+            return self.stop_capture()
+        elif _in_range(data, 240, 256):
+            return data
+        else:
+            return UNRECOGNISED_COMMAND
+
+    def handle_block_command(self, command):
+        if command == CMD_READ_ALL_PINS:
+            for pin in range(self.pins_assigned):
+                self.queue_for_output(self.get_value_of(pin))
+        elif command == CMD_READ_PINS:
+            _mask = self._input_queue.dequeue()
+            _mask |= self._input_queue.dequeue() << 8
+            for pin in range(16):
+                if _mask & ( 1 << pin ):
+                    self.queue_for_output(self.get_value_of(pin))
+        elif command == CMD_SET_ANALOG_MODE:
+            _pin = self._input_queue.dequeue()
+            _mode = self._input_queue.dequeue()
+            _parameter = self._input_queue.dequeue()
+            self.queue_for_output(self.set_analog_mode(_pin, _mode, _parameter))
+        elif command == CMD_SET_CHANGE_MASK:
+            _mask = self._input_queue.dequeue()
+            _mask |= self._input_queue.dequeue() << 8
+            self.set_change_mask(_mask)
+            self.queue_for_output(self.change_mask)
+        elif command == CMD_READ_CHANGES:
+            self.read_changes()
+        elif command == CMD_START_CAPTURE:
+            _pin = self._input_queue.dequeue()
+            _period = self._input_queue.dequeue()
+            _period |= self._input_queue.dequeue() << 8
+            self.queue_for_output(self.start_capture(_pin, _period))
+        elif command == CMD_READ_CAPTURE:
+            self.read_capture()
+        elif command == CMD_HANDSHAKE:
+            self.queue_for_output(PROTOCOL_VERSION)
+            self.queue_for_output(FIRMWARE_VERSION)
+            self.queue_for_output(self.config_hash())
+        elif command == CMD_APPLY_PIN_MAP:
+            _pin_map = [ self._input_queue.dequeue() for _ in range(PIN_MAP_LENGTH) ]
+            self.queue_for_output(self.apply_pin_map(_pin_map))
+            self.queue_for_output(self.config_hash())
+        elif command == CMD_SET_FRAMING:
+            self.queue_for_output(self.set_framing(self._input_queue.dequeue() != 0))
+        elif command == CMD_WRITE_OUTPUTS:
+            _mask = self._input_queue.dequeue()
+            _mask |= self._input_queue.dequeue() << 8
+            _levels = self._input_queue.dequeue()
+            _levels |= self._input_queue.dequeue() << 8
+            self.queue_for_output(self.write_outputs(_mask, _levels))
+        elif command == CMD_READ_PINS_GENERATION:
+            _mask = self._input_queue.dequeue()
+            _mask |= self._input_queue.dequeue() << 8
+            self.queue_for_output(self.sample_generation)
+            self.queue_for_output(min(self.millis() - self.sample_millis, 0xFFFF))
+            for pin in range(16):
+                if _mask & ( 1 << pin ):
+                    self.queue_for_output(self.get_value_of(pin))
+        elif command == CMD_SET_SAMPLE_PERIOD:
+            _period = self._input_queue.dequeue()
+            _period |= self._input_queue.dequeue() << 8
+            self.queue_for_output(self.set_sample_period(_period))
+        elif command == CMD_CONFIGURE_COUNTER:
+            _pin = self._input_queue.dequeue()
+            _edges = self._input_queue.dequeue()
+            self.queue_for_output(self.configure_counter(_pin, _edges))
+        elif command == CMD_READ_COUNTERS:
+            _mask = self._input_queue.dequeue()
+            _mask |= self._input_queue.dequeue() << 8
+            self.read_counters(_mask, self._input_queue.dequeue() != 0)
+
+    def set_sample_period(self, period):
+        '''
+            Sets the period (ms) on which loop() reads the pins, the next
+            read falling due one period after the last, as does the sketch.
+        '''
+        if period < MIN_SAMPLE_PERIOD_MS:
+            return UNRECOGNISED_COMMAND
+        self.sample_period = period
+        if self._loop_delay is not None:
+            self._loop_delay = period / 1000.0
+            self._next_loop = ( self.sample_millis + period ) / 1000.0
+        return period
+
+    def configure_counter(self, pin, edges):
+        '''
+            Counts the edges of the pin, as the sketch's configureCounter(),
+            on the pins of COUNTER_PINS.
+        '''
+        if pin >= self.pins_assigned or pin not in COUNTER_PINS \
+                or not edges & COUNT_BOTH or edges & ~( COUNT_BOTH | COUNT_PULLUP ):
+            return UNRECOGNISED_COMMAND
+        self.stop_counter(pin)
+        if -1 not in self.counter_pins:
+            return UNRECOGNISED_COMMAND
+        _slot = self.counter_pins.index(-1)
+        self.set_pin_assignment(pin, PIN_INPUT_DIGITAL_PULLUP if edges & COUNT_PULLUP else PIN_INPUT_DIGITAL)
+        self.pin_assignments[pin] = PIN_INPUT_COUNTER
+        self.counter_counts[_slot] = 0
+        self.counter_periods[_slot] = 0
+        self._counter_is_timed[_slot] = False
+        self._counter_edges[_slot] = edges & COUNT_BOTH
+        self.counter_pins[_slot] = pin
+        return pin
+
+    def stop_counter(self, pin):
+        if pin in self.counter_pins:
+            self.counter_pins[self.counter_pins.index(pin)] = -1
+
+    def count_edge(self, slot):
+        _now = self.micros() & 0xFFFFFFFF
+        if self._counter_is_timed[slot]:
+            self.counter_periods[slot] = ( _now - self._counter_last_micros[slot] ) & 0xFFFFFFFF
+        self._counter_last_micros[slot] = _now
+        self._counter_is_timed[slot] = True
+        self.counter_counts[slot] = ( self.counter_counts[slot] + 1 ) & 0xFFFFFFFF
+
+    def read_counters(self, mask, reset):
+        _batch = COUNTER_BATCH - 1 if self.is_framed else COUNTER_BATCH
+        _read = 0
+        _counters = []
+        for pin in range(16):
+            if len(_counters) < _batch and mask & ( 1 << pin ) and self.pin_assignments[pin] == PIN_INPUT_COUNTER \
+                    and pin in self.counter_pins:
+                _slot = self.counter_pins.index(pin)
+                _counters.append(( self.counter_counts[_slot], self.counter_periods[_slot] ))
+                if reset:
+                    self.counter_counts[_slot] = 0
+                _read |= 1 << pin
+        _now = self.micros() & 0xFFFFFFFF
+        self.queue_for_output(_read)
+        self.queue_for_output(_now & 0xFFFF)
+        self.queue_for_output(_now >> 16)
+        for _count, _period in _counters:
+            self.queue_for_output(_count & 0xFFFF)
+            self.queue_for_output(_count >> 16)
+            self.queue_for_output(_period & 0xFFFF)
+            self.queue_for_output(_period >> 16)
+
+    def start_capture(self, pin, period):
+        if pin >= self.pins_assigned or period < CAPTURE_MIN_PERIOD \
+                or self.pin_assignments[pin] not in ( PIN_INPUT_DIGITAL, PIN_INPUT_DIGITAL_PULLUP, PIN_INPUT_ANALOG ):
+            return UNRECOGNISED_COMMAND
+        while not self._capture_queue.is_empty():
+            self._capture_queue.dequeue()
+        self.capture_overflowed = 0
+        self.capture_missed = 0
+        self.capture_period = period
+        self._next_capture = self.micros()
+        self.capture_pin = pin
+        return pin
+
+    def stop_capture(self):
+        self.capture_pin = -1
+        return self._capture_queue.item_count()
+
+    def service_capture(self):
+        '''
+            Takes each capture sample that has fallen due, at the time it fell
+            due. Since the sketch samples from loop() in place of a delay, the
+            simulated slave never misses a sample time.
+        '''
+        if self.capture_pin < 0:
+            return
+        _now = self.micros()
+        while self._next_capture <= _now:
+            _tick = self._next_capture
+            self._next_capture += self.capture_period
+            _pin_type = self.pin_assignments[self.capture_pin]
+            if _pin_type == PIN_INPUT_ANALOG:
+                _value = self.analog_read(self.capture_pin, _tick / 1e6)
+            elif _pin_type == PIN_INPUT_DIGITAL_PULLUP:
+                _value = 0 if self.digital_read(self.capture_pin) else 1
+            else:
+                _value = self.digital_read(self.capture_pin)
+            _sample = ( ( _tick & CAPTURE_TICK_MASK ) << CAPTURE_VALUE_BITS ) | ( _value & CHANGE_VALUE_MASK )
+            if not self._capture_queue.enqueue(_sample) and self.capture_overflowed < 255:
+                self.capture_overflowed += 1
+
+    def read_capture(self):
+        _count = min(self._capture_queue.item_count(), CAPTURE_BATCH - 1 if self.is_framed else CAPTURE_BATCH)
+        _flags = CAPTURE_RUNNING if self.capture_pin >= 0 else 0
+        if self._capture_queue.item_count() > _count:
+            _flags |= CAPTURE_PENDING
+        self.queue_for_output(_count | ( _flags << 8 ))
+        self.queue_for_output(self.capture_overflowed | ( self.capture_missed << 8 ))
+        self.capture_overflowed = 0
+        self.capture_missed = 0
+        for _ in range(_count):
+            _sample = self._capture_queue.dequeue()
+            self.queue_for_output(_sample & 0xFFFF)
+            self.queue_for_output(_sample >> 16)
+
+    def set_change_mask(self, mask):
+        self.change_mask = mask
+        while not self._change_queue.is_empty():
+            self._change_queue.dequeue()
+        self.is_change_lost = False
+        self.digital_write(INTERRUPT_PIN, False)
+
+    def queue_change(self, pin, value):
+        if not self._change_queue.enqueue(( pin << CHANGE_PIN_SHIFT ) | ( value & CHANGE_VALUE_MASK )):
+            self.is_change_lost = True
+
+    def read_changes(self):
+        _count = min(self._change_queue.item_count(), CHANGE_BATCH)
+        _flags = CHANGES_LOST if self.is_change_lost else 0
+        self.is_change_lost = False
+        if self._change_queue.item_count() > _count:
+            _flags |= CHANGES_PENDING
+        self.queue_for_output(_count | ( _flags << 8 ))
+        for _ in range(_count):
+            self.queue_for_output(self._change_queue.dequeue())
+        if self._change_queue.is_empty():
+            self.digital_write(INTERRUPT_PIN, False)
+
+    def set_analog_mode(self, pin, mode, parameter):
+        if pin >= self.pins_assigned:
+            return UNRECOGNISED_COMMAND
+        if mode == ANALOG_MODE_SCALED or mode == ANALOG_MODE_RAW:
+            parameter = 1
+        elif mode == ANALOG_MODE_AVERAGE:
+            if not _in_range(parameter, 1, MAX_AVERAGE_SAMPLES + 1):
+                return UNRECOGNISED_COMMAND
+        elif mode == ANALOG_MODE_MEDIAN:
+            if not _in_range(parameter, 1, MAX_MEDIAN_SAMPLES + 1):
+                return UNRECOGNISED_COMMAND
+        elif mode == ANALOG_MODE_EMA:
+            if not _in_range(parameter, 1, MAX_EMA_SHIFT + 1):
+                return UNRECOGNISED_COMMAND
+        else:
+            return UNRECOGNISED_COMMAND
+        self.analog_modes[pin] = mode
+        self.analog_parameters[pin] = parameter
+        self.ema_values[pin] = -1
+        return pin
+
+    def read_analog_value(self, pin):
+        _mode = self.analog_modes[pin]
+        _n = self.analog_parameters[pin]
+        if _mode == ANALOG_MODE_AVERAGE:
+            _sum = 0
+            for _ in range(_n):
+                _sum += self.analog_read(pin)
+            return ( _sum + _n // 2 ) // _n
+        elif _mode == ANALOG_MODE_MEDIAN:
+            return sorted(self.analog_read(pin) for _ in range(_n))[_n // 2]
+        elif _mode == ANALOG_MODE_EMA:
+            _scaled = self.analog_read(pin) << EMA_SCALE_SHIFT
+            if self.ema_values[pin] < 0:
+                self.ema_values[pin] = _scaled
+            else:
+                self.ema_values[pin] += ( _scaled - self.ema_values[pin] ) >> _n
+            return ( self.ema_values[pin] + ( 1 << ( EMA_SCALE_SHIFT - 1 ) ) ) >> EMA_SCALE_SHIFT
+        else:
+            return self.analog_read(pin)
+
+    def get_value_of(self, pin):
+        _pin_type = self.pin_assignments[pin]
+        if _pin_type == PIN_INPUT_DIGITAL or _pin_type == PIN_INPUT_DIGITAL_PULLUP or _pin_type == PIN_INPUT_COUNTER:
+            return self.pin_values[pin]
+        elif _pin_type == PIN_INPUT_ANALOG:
+            if self.is_constrain_analog_value and self.analog_modes[pin] == ANALOG_MODE_SCALED:
+                return self.constrain_analog_value(self.pin_values[pin])
+            else:
+                return self.pin_values[pin]
+        elif _pin_type == PIN_UNUSED:
+            return PIN_UNASSIGNED
+        else:
+            return PIN_ASSIGNED_AS_OUTPUT
+
+    def set_pin_assignment(self, pin, assignment):
+        self.stop_counter(pin)
+        self.pin_assignments[pin] = assignment
+
+    def write_outputs(self, mask, levels):
+        _written = 0
+        for pin in range(min(BLOCK_PIN_COUNT, self.pins_assigned)):
+            if mask & ( 1 << pin ) and self.pin_assignments[pin] == PIN_OUTPUT:
+                self.pin_values[pin] = 1 if levels & ( 1 << pin ) else 0
+                _written |= 1 << pin
+        for pin in range(BLOCK_PIN_COUNT):
+            if _written & ( 1 << pin ):
+                self.digital_write(pin, self.pin_values[pin])
+        return _written
+
+    def apply_pin_map(self, pin_map):
+        _assignments = [ ( pin_map[pin // 2] >> ( ( pin % 2 ) * 4 ) ) & 0x0F for pin in range(PIN_MAP_LENGTH * 2) ]
+        if any(_assignment < PIN_INPUT_DIGITAL or _assignment > PIN_UNUSED for _assignment in _assignments):
+            return UNRECOGNISED_COMMAND
+        _changed = 0
+        for pin, _assignment in enumerate(_assignments):
+            if self.pin_assignments[pin] != _assignment:
+                self.set_pin_assignment(pin, _assignment)
+                _changed += 1
+        return _changed
+
+    def config_hash(self):
+        return config_hash(self.pin_assignments[:PIN_MAP_LENGTH * 2])
+
+    def reset_pin_assignments(self):
+        for i in range(self.pins_assigned):
+            self.pin_assignments[i] = PIN_UNUSED
+
+    def reset_pin_values(self):
+        for i in range(self.pins_assigned):
+            self.pin_values[i] = INIT_VALUE
+            self.analog_modes[i] = ANALOG_MODE_SCALED
+            self.analog_parameters[i] = 1
+            self.ema_values[i] = -1
+
+    def queue_for_output(self, data):
+        self._output_queue.enqueue(data & 0xFF)
+        self._output_queue.enqueue(( data >> 8 ) & 0xFF)
+
+    def clear_input_queue(self):
+        while not self._input_queue.is_empty():
+            self._input_queue.dequeue()
+
+    def clear_output_queue(self):
+        while not self._output_queue.is_empty():
+            self._output_queue.dequeue()
+
+    def constrain_analog_value(self, value):
+        return int(max(0.0, min(255.0, (( value - self.analog_min ) / self.analog_max ) * 255.0)))
+
+    def adjust_auto_range(self, raw_analog_value):
+        if self.is_auto_range:
+            self.analog_min = min(self.analog_min, raw_analog_value)
+            self.analog_max = max(self.analog_max, raw_analog_value)
+
+    def reset_range(self):
+        self.analog_min = self.analog_min_default
+        self.analog_max = self.analog_max_default
+
+
+# ..............................................................................
+class FaultInjector():
+    '''
+        Injects faults into the transactions of a SimulatedPi, each with its
+        own probability per transaction, from a seeded random number generator
+        so that a run may be repeated. The counters 'corrupted_writes',
+        'corrupted_reads', 'dropped_writes' and 'truncated_reads' record the
+        faults injected.
+
+        Parameters:
+          corrupt_write:  the probability of flipping a bit of a written byte
+          corrupt_read:   the probability of flipping a bit of a read byte
+          drop_write:     the probability of a write not reaching the slave
+          truncate_read:  the probability of the slave ceasing to drive the
+                          bus partway through a read, its remaining bytes
+                          being read as 0xFF
+          seed:           the seed of the random number generator
+    '''
+    def __init__(self, corrupt_write=0.0, corrupt_read=0.0, drop_write=0.0, truncate_read=0.0, seed=1):
+        self.corrupt_write = corrupt_write
+        self.corrupt_read  = corrupt_read
+        self.drop_write    = drop_write
+        self.truncate_read = truncate_read
+        self._random = random.Random(seed)
+        self.corrupted_writes = 0
+        self.corrupted_reads  = 0
+        self.dropped_writes   = 0
+        self.truncated_reads  = 0
+
+    def write(self, data):
+        '''
+            Returns the bytes as received by the slave, or None if dropped.
+        '''
+        if self._random.random() < self.drop_write:
+            self.dropped_writes += 1
+            return None
+        if data and self._random.random() < self.corrupt_write:
+            self.corrupted_writes += 1
+            return self._flip(data)
+        return data
+
+    def read(self, data):
+        '''
+            Returns the bytes as read by the master.
+        '''
+        if data and self._random.random() < self.truncate_read:
+            self.truncated_reads += 1
+            _length = self._random.randrange(len(data))
+            data = data[:_length] + bytearray([ 0xFF ] * ( len(data) - _length ))
+        if data and self._random.random() < self.corrupt_read:
+            self.corrupted_reads += 1
+            data = self._flip(data)
+        return data
+
+    def _flip(self, data):
+        _data = bytearray(data)
+        _data[self._random.randrange(len(_data))] ^= 1 << self._random.randrange(8)
+        return bytes(_data) if isinstance(data, bytes) else _data
+
+
+# ..............................................................................
+class SimulatedPi():
+    '''
+        A stand-in for the pigpio.pi() object, implementing the subset of its
+        I²C and GPIO API used by I2cMaster. Each call is charged one daemon round trip
+        plus the modelled bus and slave ISR time, and is atomic with respect
+        to other threads (as is a call into pigpiod), though a sequence of
+        calls is not.
+
+        The counters 'daemon_calls', 'bus_transactions', 'bus_bytes' and
+        'simulated_time' accumulate over the lifetime of the instance and may
+        be cleared with reset_counters().
+
+        Parameters:
+          slaves:   a dict of SimulatedSlave instances keyed by I²C address
+          timing:   the TimingModel, default a realtime 100kHz bus
+          clock:    an optional VirtualClock advanced by modelled costs when
+                    the timing model is not realtime
+          faults:   an optional FaultInjector applied to each i2c_zip()
+    '''
+    def __init__(self, slaves=None, timing=None, clock=None, faults=None):
+        self._slaves  = dict(slaves) if slaves else {}
+        self._timing  = timing if timing is not None else TimingModel()
+        self._clock   = clock
+        self._faults  = faults
+        self._handles = {}
+        self._next_handle = 0
+        self._mutex   = threading.Lock()
+        self._gpio_levels = {}
+        self._callbacks = []
+        self._events  = None   # queue of edges for the callback thread
+        self.connected = True
+        self.reset_counters()
+
+    @property
+    def timing(self):
+        return self._timing
+
+    @property
+    def open_handles(self):
+        '''
+            Returns the number of I²C handles opened and not yet closed.
+        '''
+        return len(self._handles)
+
+    def add_slave(self, address, slave):
+        self._slaves[address] = slave
+
+    def reset_counters(self):
+        self.daemon_calls     = 0
+        self.bus_transactions = 0
+        self.bus_bytes        = 0
+        self.simulated_time   = 0.0
+
+    def _charge(self, byte_count, segments=1, isr_calls=1):
+        _cost = self._timing.daemon_s + self._timing.bus_time(byte_count, segments) + isr_calls * self._timing.isr_s
+        self.daemon_calls     += 1
+        self.bus_transactions += 1
+        self.bus_bytes        += byte_count
+        self.simulated_time   += _cost
+        if self._timing.realtime:
+            self._timing.spend(_cost)
+        elif self._clock is not None:
+            self._clock.advance(_cost)
+
+    def _slave(self, handle, operation):
+        _address = self._handles.get(handle)
+        if _address is None:
+            raise IOError('bad handle: {}'.format(handle))
+        _slave = self._slaves.get(_address)
+        if _slave is None:
+            raise IOError('I2C {} failed: no device at address 0x{:02X}'.format(operation, _address))
+        return _slave
+
+    # pigpio API ...............................................................
+
+    def i2c_open(self, i2c_bus, i2c_address, i2c_flags=0):
+        with self._mutex:
+            self.daemon_calls += 1
+            _handle = self._next_handle
+            self._next_handle += 1
+            self._handles[_handle] = i2c_address
+            return _handle
+
+    def i2c_close(self, handle):
+        with self._mutex:
+            self.daemon_calls += 1
+            self._handles.pop(handle, None)
+            return 0
+
+    def i2c_write_byte(self, handle, byte_val):
+        with self._mutex:
+            _slave = self._slave(handle, 'write')
+            _slave.receive_data(bytes([ byte_val & 0xFF ]))
+            self._charge(1)
+            return 0
+
+    def i2c_write_device(self, handle, data):
+        with self._mutex:
+            _slave = self._slave(handle, 'write')
+            _slave.receive_data(bytes(data))
+            self._charge(len(data))
+            return 0
+
+    def i2c_read_device(self, handle, count):
+        '''
+            Returns a tuple of the byte count and a bytearray. As on the wire,
+            if the slave supplies fewer bytes than requested the remainder are
+            read as 0xFF; any surplus is discarded.
+        '''
+        with self._mutex:
+            _slave = self._slave(handle, 'read')
+            _data = _slave.request_data()[:count]
+            _data.extend([ 0xFF ] * ( count - len(_data) ))
+            self._charge(count)
+            return count, _data
+
+    def i2c_zip(self, handle, data):
+        '''
+            Executes a sequence of write (7) and read (6) operations terminated
+            by an end (0), as a single transaction whose messages are joined by
+            repeated starts. Returns a tuple of the byte count and a bytearray
+            of the bytes read.
+        '''
+        with self._mutex:
+            _slave = self._slave(handle, 'zip')
+            _read = bytearray()
+            _segments = 0
+            _byte_count = 0
+            i = 0
+            while i < len(data) and data[i] != ZIP_END:
+                _op = data[i]
+                _n = data[i + 1]
+                if _op == ZIP_WRITE:
+                    _data = bytes(data[i + 2:i + 2 + _n])
+                    if self._faults is not None:
+                        _data = self._faults.write(_data)
+                    if _data is not None:
+                        _slave.receive_data(_data)
+                    i += 2 + _n
+                elif _op == ZIP_READ:
+                    _data = _slave.request_data()[:_n]
+                    _data.extend([ 0xFF ] * ( _n - len(_data) ))
+                    if self._faults is not None:
+                        _data = self._faults.read(_data)
+                    _read.extend(_data)
+                    i += 2
+                else:
+                    raise ValueError('unsupported i2c_zip command: {}'.format(_op))
+                _segments += 1
+                _byte_count += _n
+            self._charge(_byte_count, segments=_segments, isr_calls=_segments)
+            return len(_read), _read
+
+    # GPIO .....................................................................
+
+    def connect(self, gpio, slave, pin=INTERRUPT_PIN):
+        '''
+            Wires the slave's output pin (by default its interrupt line) to the
+            Pi's GPIO, so that its level changes call any registered callbacks.
+        '''
+        self._gpio_levels[gpio] = slave.levels[pin]
+        slave.wire(pin, lambda level: self._set_level(gpio, level))
+
+    def _set_level(self, gpio, level):
+        if self._gpio_levels.get(gpio) == level:
+            return
+        self._gpio_levels[gpio] = level
+        if self._events is not None:
+            _clock = self._clock if self._clock is not None else time.monotonic
+            self._events.put(( gpio, level, int(_clock() * 1e6) & 0xFFFFFFFF ))
+
+    def set_mode(self, gpio, mode):
+        return 0
+
+    def set_pull_up_down(self, gpio, pud):
+        return 0
+
+    def read(self, gpio):
+        return self._gpio_levels.get(gpio, 0)
+
+    def callback(self, user_gpio, edge=RISING_EDGE, func=None):
+        '''
+            As pigpio, calls func(gpio, level, tick) on the given edge(s) of the
+            GPIO, from a single callback thread. Returns an object with a
+            cancel() method.
+        '''
+        _callback = _Callback(self, user_gpio, edge, func)
+        with self._mutex:
+            self._callbacks.append(_callback)
+            if self._events is None:
+                self._events = queue.SimpleQueue()
+                threading.Thread(target=self._dispatch, name='simulated-pi-callbacks', daemon=True).start()
+        return _callback
+
+    def _dispatch(self):
+        while True:
+            _event = self._events.get()
+            if _event is None:
+                return
+            _gpio, _level, _tick = _event
+            for _callback in list(self._callbacks):
+                if _callback.gpio == _gpio and ( _callback.edge == EITHER_EDGE
+                        or ( _callback.edge == RISING_EDGE ) == ( _level == 1 ) ):
+                    _callback.func(_gpio, _level, _tick)
+
+    def stop(self):
+        self.connected = False
+        if self._events is not None:
+            self._events.put(None)
+
+
+# ..............................................................................
+class SimulatedI2cDev():
+    '''
+        A stand-in for the kernel's /dev/i2c-N device, for an I2cDevTransport:
+        its ioctl() is passed in place of fcntl.ioctl, with any file descriptor,
+        and performs each I2C_RDWR upon the SimulatedSlave at the address of
+        each message, reading and writing the messages' buffers as would the
+        kernel. Each ioctl is charged the TimingModel's ioctl cost plus the
+        modelled bus and slave ISR time; the counters are as for SimulatedPi
+        (with no daemon calls), so that it may be given to a Benchmark.
+
+        Parameters:
+          slaves:   a dict of SimulatedSlave instances keyed by I²C address
+          timing:   the TimingModel, default a realtime 100kHz bus
+          clock:    an optional VirtualClock advanced by modelled costs when
+                    the timing model is not realtime
+    '''
+    def __init__(self, slaves=None, timing=None, clock=None):
+        self._slaves  = dict(slaves) if slaves else {}
+        self._timing  = timing if timing is not None else TimingModel()
+        self._clock   = clock
+        self._mutex   = threading.Lock()
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.daemon_calls     = 0
+        self.ioctl_calls      = 0
+        self.bus_transactions = 0
+        self.bus_bytes        = 0
+        self.simulated_time   = 0.0
+
+    def ioctl(self, fd, request, arg):
+        if request != I2C_RDWR:
+            raise OSError(errno.ENOTTY, 'unsupported ioctl: 0x{:04X}'.format(request))
+        with self._mutex:
+            _byte_count = 0
+            for i in range(arg.nmsgs):
+                _msg = arg.msgs[i]
+                _slave = self._slaves.get(_msg.addr)
+                if _slave is None:
+                    raise OSError(errno.EREMOTEIO, 'no device at address 0x{:02X}'.format(_msg.addr))
+                if _msg.flags & I2C_M_RD:
+                    _data = _slave.request_data()[:_msg.len]
+                    _data.extend([ 0xFF ] * ( _msg.len - len(_data) ))
+                    for j, b in enumerate(_data):
+                        _msg.buf[j] = b
+                else:
+                    _slave.receive_data(bytes(_msg.buf[:_msg.len]))
+                _byte_count += _msg.len
+            _cost = self._timing.ioctl_s + self._timing.bus_time(_byte_count, arg.nmsgs) + arg.nmsgs * self._timing.isr_s
+            self.ioctl_calls      += 1
+            self.bus_transactions += 1
+            self.bus_bytes        += _byte_count
+            self.simulated_time   += _cost
+            if self._timing.realtime:
+                self._timing.spend(_cost)
+            elif self._clock is not None:
+                self._clock.advance(_cost)
+        return 0
+
+
+# ..............................................................................
+class _Callback():
+    def __init__(self, pi, gpio, edge, func):
+        self._pi  = pi
+        self.gpio = gpio
+        self.edge = edge
+        self.func = func
+
+    def cancel(self):
+        if self in self._pi._callbacks:
+            self._pi._callbacks.remove(self)
+
+
+# ..............................................................................
+def _in_range(value, minimum, maximum):
+    '''
+        Inclusive of the minimum, exclusive of the maximum.
+    '''
+    return minimum <= value < maximum
+
+
+def _to_int16(value):
+    '''
+        Interprets the value as the sketch's 16 bit signed int.
+    '''
+    value &= 0xFFFF
+    return value - 0x10000 if value & 0x8000 else value
+
+#EOF
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 by Murray Altheim. All rights reserved. This file is part
+# of the pimaster2ardslave project and is released under the MIT Licence;
+# please see the LICENSE file included as part of this package.
+#
+# author:   Murray Altheim
+# created:  2020-05-19
+# modified: 2020-05-19
+#
+# This compares the analog modes on a simulated noisy Sharp IR sensor (a
+# steady 400 with gaussian noise and occasional spikes), displaying the
+# spread of the readings and the bus transactions spent on each, alongside
+# the current practice of averaging 16 polls of the raw value on the Pi.
+# It requires no hardware, nor pigpio.
+#
+
+import random, statistics
+
+from lib.logger import Level
+from lib.i2c_master import I2cMaster
+from lib.slave_simulator import SimulatedSlave, SimulatedPi, TimingModel, VirtualClock
+from lib.protocol import *
+
+_LOOP_DELAY_MS = 10
+_READINGS      = 200
+_PIN           = 8
+
+# ..............................................................................
+def _sensor(seed):
+    _random = random.Random(seed)
+    def _value(t):
+        _spike = _random.random()
+        if _spike < 0.02:
+            return 1023
+        elif _spike < 0.04:
+            return 0
+        return 400 + _random.gauss(0.0, 20.0)
+    return _value
+
+
+def _measure(mode, parameter, polls=1):
+    '''
+        Returns the readings and the transactions per reading, where each
+        reading is the mean of 'polls' reads, one per slave loop.
+    '''
+    _clock = VirtualClock()
+    _slave = SimulatedSlave(clock=_clock, loop_delay_ms=_LOOP_DELAY_MS)
+    _slave.set_analog(_PIN, _sensor(1))
+    _pi = SimulatedPi({ SLAVE_I2C_ADDRESS: _slave }, timing=TimingModel(realtime=False), clock=_clock)
+    _master = I2cMaster(SLAVE_I2C_ADDRESS, Level.WARN, pi=_pi)
+    try:
+        _master.configure_pin_as_analog_input(_PIN)
+        _master.set_analog_mode(_PIN, mode, parameter)
+        for _ in range(20): # let the EMA settle
+            _clock.advance(_LOOP_DELAY_MS / 1000.0)
+            _master.get_input_from_pin(_PIN)
+        _pi.reset_counters()
+        _readings = []
+        for _ in range(_READINGS):
+            _sum = 0
+            for _ in range(polls):
+                _clock.advance(_LOOP_DELAY_MS / 1000.0)
+                _sum += _master.get_input_from_pin(_PIN)
+            _readings.append(_sum / polls)
+        return _readings, _pi.bus_transactions / _READINGS
+    finally:
+        _master.close()
+
+
+# ..............................................................................
+def main():
+
+    _results = {}
+    for _label, _mode, _parameter, _polls in [
+            ( 'raw', ANALOG_MODE_RAW, 1, 1 ),
+            ( 'raw, 16 polls on Pi', ANALOG_MODE_RAW, 1, 16 ),
+            ( 'average of 16', ANALOG_MODE_AVERAGE, 16, 1 ),
+            ( 'median of 9', ANALOG_MODE_MEDIAN, 9, 1 ),
+            ( 'EMA, alpha 1/8', ANALOG_MODE_EMA, 3, 1 ) ]:
+        _readings, _transactions = _measure(_mode, _parameter, _polls)
+        _results[_label] = statistics.pstdev(_readings)
+        print('{:<22} mean {:6.1f}; stdev {:5.1f}; {:4.1f} transactions per reading.'.format(
+                _label, statistics.mean(_readings), _results[_label], _transactions))
+
+    assert _results['average of 16'] < _results['raw'] / 2
+    assert _results['median of 9'] < _results['raw'] / 2
+    assert _results['EMA, alpha 1/8'] < _results['raw'] / 2
+
+
+if __name__== "__main__":
+    main()
+
+#EOF
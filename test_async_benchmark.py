@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 by Murray Altheim. All rights reserved. This file is part
+# of the pimaster2ardslave project and is released under the MIT Licence;
+# please see the LICENSE file included as part of this package.
+#
+# author:   Murray Altheim
+# created:  2020-05-14
+# modified: 2020-05-14
+#
+# This benchmarks the AsyncI2cMaster against the synchronous I2cMaster
+# wrapped in run_in_executor(), with many coroutines reading pins from a
+# simulated Arduino slave. It requires no hardware, nor pigpio.
+#
+# This is run twice: once with the default timing model and once with the
+# bus and daemon costs set to zero, which exposes the dispatch overhead of
+# each approach.
+#
+
+import asyncio, time
+
+from lib.logger import Level
+from lib.i2c_master import I2cMaster
+from lib.async_i2c_master import AsyncI2cMaster
+from lib.slave_simulator import SimulatedSlave, SimulatedPi, TimingModel
+from lib.benchmark import Benchmark
+
+# ..............................................................................
+async def _run(call, coroutines, requests):
+    '''
+        Runs 'coroutines' coroutines each awaiting 'requests' calls, returning
+        a tuple of the per-call latencies and the total elapsed time.
+    '''
+    _latencies = []
+    async def _worker():
+        for _ in range(requests):
+            _t0 = time.perf_counter()
+            await call()
+            _latencies.append(time.perf_counter() - _t0)
+    _start = time.perf_counter()
+    await asyncio.gather(*[ _worker() for _ in range(coroutines) ])
+    return _latencies, time.perf_counter() - _start
+
+
+# ..............................................................................
+async def _compare(benchmark, master, label, coroutines, requests):
+    _loop = asyncio.get_running_loop()
+    _async_master = AsyncI2cMaster(master, Level.WARN)
+    try:
+        benchmark.reset()
+        _latencies, _elapsed = await _run(lambda: _loop.run_in_executor(None, master.get_input_from_pin, 8), coroutines, requests)
+        _executor = benchmark.record('{}: run_in_executor x{:d}'.format(label, coroutines), _latencies, _elapsed)
+        benchmark.reset()
+        _latencies, _elapsed = await _run(lambda: _async_master.get_input_from_pin(8), coroutines, requests)
+        _async = benchmark.record('{}: AsyncI2cMaster x{:d}'.format(label, coroutines), _latencies, _elapsed)
+        benchmark.compare(_executor, _async)
+    finally:
+        await _async_master.close()
+
+
+# ..............................................................................
+def main():
+
+    _device_id = 0x08  # must match Arduino's SLAVE_I2C_ADDRESS
+    _requests = 200
+
+    for _label, _timing in [ ( 'modelled', TimingModel() ),
+                             ( 'overhead', TimingModel(bus_hz=1e12, daemon_s=0.0, isr_s=0.0, realtime=False) ) ]:
+        _slave = SimulatedSlave()
+        _pi = SimulatedPi({ _device_id: _slave }, timing=_timing)
+        _master = I2cMaster(_device_id, Level.WARN, pi=_pi)
+        _benchmark = Benchmark(Level.INFO, pi=_pi)
+        try:
+            _master.configure_pin_as_analog_input(8)
+            _slave.set_analog(8, 400)
+            for _coroutines in [ 1, 8, 32 ]:
+                asyncio.run(_compare(_benchmark, _master, _label, _coroutines, _requests))
+        finally:
+            _master.close()
+
+
+if __name__== "__main__":
+    main()
+
+#EOF
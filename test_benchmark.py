@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 by Murray Altheim. All rights reserved. This file is part
+# of the pimaster2ardslave project and is released under the MIT Licence;
+# please see the LICENSE file included as part of this package.
+#
+# author:   Murray Altheim
+# created:  2020-05-10
+# modified: 2020-05-17
+#
+# This benchmarks the I2cMaster against a simulated Arduino slave, measuring
+# round trips per second and p50/p99 latency for reading and writing pins
+# and for the configure_* calls. It requires no hardware, nor pigpio.
+#
+# The timing model (I²C bus speed, pigpiod socket cost, slave ISR time) can
+# be adjusted below to suit your own setup.
+#
+
+import time
+
+from lib.logger import Level
+from lib.i2c_master import I2cMaster
+from lib.slave_simulator import SimulatedSlave, SimulatedPi, TimingModel
+from lib.benchmark import Benchmark
+from lib.i2c_stats import I2cStats
+
+# ..............................................................................
+def _legacy_command(master, data):
+    '''
+        A command sent as two single byte writes followed by a read, i.e.,
+        three daemon calls and three bus transactions.
+    '''
+    master.write_i2c_data(data)
+    return master.read_i2c_data()
+
+
+# ..............................................................................
+def main():
+
+    _device_id = 0x08  # must match Arduino's SLAVE_I2C_ADDRESS
+    _iterations = 500
+    _pins = [ 5, 6, 7, 8, 9 ]
+    _timing = TimingModel(bus_hz=100000, daemon_s=0.00015, isr_s=0.00002)
+
+    _slave = SimulatedSlave()
+    _pi = SimulatedPi({ _device_id: _slave }, timing=_timing)
+    _master = I2cMaster(_device_id, Level.WARN, pi=_pi)
+    _benchmark = Benchmark(Level.INFO, pi=_pi)
+
+    try:
+
+        _master.configure_pin_as_output(5)
+        _master.configure_pin_as_digital_input_pullup(6)
+        _master.configure_pin_as_analog_input(8)
+        _slave.set_analog(8, 400)
+
+        _benchmark.measure('get_input_from_pin(6)', lambda: _master.get_input_from_pin(6), _iterations)
+        _legacy = _benchmark.measure('write_i2c_data(8) + read_i2c_data()', lambda: _legacy_command(_master, 8), _iterations)
+        _single = _benchmark.measure('get_input_from_pin(8)', lambda: _master.get_input_from_pin(8), _iterations)
+        _benchmark.compare(_legacy, _single)
+        _benchmark.measure('get_input_from_pin(228)', lambda: _master.get_input_from_pin(228), _iterations)
+        _benchmark.measure('5 x get_input_from_pin()', lambda: [ _master.get_input_from_pin(p) for p in _pins ], _iterations // 5)
+        _benchmark.measure('read_pins(5 pins)', lambda: _master.read_pins(_pins), _iterations)
+        _benchmark.measure('read_pins()', lambda: _master.read_pins(), _iterations)
+        _benchmark.measure('set_output_on_pin(5, True)', lambda: _master.set_output_on_pin(5, True), _iterations)
+        _benchmark.measure('configure_pin_as_digital_input(7)', lambda: _master.configure_pin_as_digital_input(7), _iterations)
+        _benchmark.measure('configure_pin_as_digital_input_pullup(9)', lambda: _master.configure_pin_as_digital_input_pullup(9), _iterations)
+        _benchmark.measure('configure_pin_as_analog_input(8)', lambda: _master.configure_pin_as_analog_input(8), _iterations)
+        _benchmark.measure('configure_pin_as_output(5)', lambda: _master.configure_pin_as_output(5), _iterations)
+
+        _master.start_sampling({ 8: 50, 6: 10 })
+        time.sleep(0.1)
+        _benchmark.measure('get_sample(8) while sampling', lambda: _master.get_sample(8), _iterations * 100)
+        _master.stop_sampling()
+
+        # the per-transaction cost of recording metrics
+        _stats = I2cStats()
+        _reply = bytearray([ 140, 0 ])
+        _benchmark.measure('I2cStats.record()', lambda: _stats.record(8, 0.00076, _reply), _iterations * 100)
+
+    finally:
+        _master.close()
+
+
+if __name__== "__main__":
+    main()
+
+#EOF
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 by Murray Altheim. All rights reserved. This file is part
+# of the pimaster2ardslave project and is released under the MIT Licence;
+# please see the LICENSE file included as part of this package.
+#
+# author:   Murray Altheim
+# created:  2020-05-15
+# modified: 2020-05-25
+#
+# This tests an I2cBus shared by two simulated Arduino slaves (at 0x08 and
+# 0x09). Several threads flood the bus with low priority housekeeping
+# commands (each a different one, as identical reads in flight together
+# share a transaction) while another reads an obstacle sensor pin; the sensor reads
+# should wait far less than the housekeeping commands. It then displays
+# the bus utilisation of each device, and checks that the request counts
+# reconcile despite another thread's reads, and that a closed master releases
+# its handle and refuses further use. It requires no hardware, nor pigpio.
+#
+
+import time, threading
+
+from lib.logger import Level
+from lib.i2c_bus import I2cBus
+from lib.i2c_master import I2cMaster
+from lib.benchmark import percentile
+from lib.slave_simulator import SimulatedSlave, SimulatedPi, TimingModel
+from lib.protocol import CMD_RETURN_REQUEST_COUNT, CMD_RETURN_LOOP_COUNT, CMD_RETURN_ANALOG_MIN_RANGE, \
+        CMD_RETURN_ANALOG_MAX_RANGE
+
+_HOUSEKEEPING = [ CMD_RETURN_REQUEST_COUNT, CMD_RETURN_LOOP_COUNT, CMD_RETURN_ANALOG_MIN_RANGE, CMD_RETURN_ANALOG_MAX_RANGE ]
+
+# ..............................................................................
+def _poll(function, count, latencies):
+    for _ in range(count):
+        _t0 = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - _t0)
+
+
+# ..............................................................................
+def main():
+
+    _pi = SimulatedPi({ 0x08: SimulatedSlave(), 0x09: SimulatedSlave() })
+    _bus = I2cBus(Level.INFO, pi=_pi)
+
+    try:
+
+        _front = _bus.get_master(0x08)
+        _rear  = _bus.get_master(0x09)
+        _front.configure_pin_as_digital_input_pullup(6)
+        assert _pi.daemon_calls == 2 + 1 # two opens on the one connection, one transaction
+
+        _sensor_latencies = []
+        _housekeeping_latencies = []
+        _threads = [ threading.Thread(target=_poll, args=(lambda c=_command: _rear.get_input_from_pin(c), 100, _housekeeping_latencies))
+                for _command in _HOUSEKEEPING ]
+        _threads.append(threading.Thread(target=_poll, args=(lambda: _front.get_input_from_pin(6), 100, _sensor_latencies)))
+        _bus.reset_utilisation()
+        for _thread in _threads:
+            _thread.start()
+        for _thread in _threads:
+            _thread.join()
+
+        _sensor_latencies.sort()
+        _housekeeping_latencies.sort()
+        _sensor_p50 = percentile(_sensor_latencies, 50) * 1000.0
+        _housekeeping_p50 = percentile(_housekeeping_latencies, 50) * 1000.0
+        print('sensor p50: {:.2f}ms; housekeeping p50: {:.2f}ms'.format(_sensor_p50, _housekeeping_p50))
+        assert _sensor_p50 < _housekeeping_p50
+
+        # a deadline that cannot be met raises a TimeoutError
+        _threads = [ threading.Thread(target=_poll, args=(lambda c=_command: _rear.get_input_from_pin(c), 20, []))
+                for _command in _HOUSEKEEPING ]
+        for _thread in _threads:
+            _thread.start()
+        time.sleep(0.005)
+        try:
+            _rear.send_command(CMD_RETURN_LOOP_COUNT, deadline=0.0)
+            raise Exception('expected deadline to be missed.')
+        except TimeoutError as e:
+            print('deadline missed as expected: {}'.format(e))
+        for _thread in _threads:
+            _thread.join()
+
+        _bus.log_utilisation()
+        _utilisation = _bus.utilisation()
+        assert _utilisation[0x08]['transactions'] == 100
+        assert _utilisation[0x09]['transactions'] == 480
+        assert _utilisation[0x09]['missed'] == 1
+
+    finally:
+        _bus.close()
+
+    # the request counts reconcile while another thread reads the sensor (untimed,
+    # so that the threads interleave as closely as they can)
+    _pi = SimulatedPi({ 0x08: SimulatedSlave() }, timing=TimingModel(realtime=False))
+    _bus = I2cBus(Level.WARN, pi=_pi)
+    try:
+        _front = _bus.get_master(0x08)
+        _front.configure_pin_as_digital_input_pullup(6)
+        _stop_event = threading.Event()
+        def _read_sensor():
+            while not _stop_event.is_set():
+                _front.send_command(6)
+        _thread = threading.Thread(target=_read_sensor)
+        _thread.start()
+        _differences = [ _front.reconcile_requests() for _ in range(1000) ]
+        _stop_event.set()
+        _thread.join()
+        print('request counts reconciled {:d} times during sensor reads.'.format(len(_differences)))
+        assert not any(_differences[1:])
+    finally:
+        _bus.close()
+
+    # closing the bus closed its master, releasing its handle
+    assert _pi.open_handles == 0
+    try:
+        _front.send_command(6)
+        raise AssertionError('a closed master was used.')
+    except RuntimeError:
+        pass
+    _master = I2cMaster(0x08, Level.WARN, pi=_pi)
+    _master.close()
+    assert _pi.open_handles == 0
+    try:
+        _master.send_command(6)
+        raise AssertionError('a closed master was used.')
+    except RuntimeError as e:
+        print('a closed master was refused: {}'.format(e))
+
+
+if __name__== "__main__":
+    main()
+
+#EOF
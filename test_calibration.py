@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 by Murray Altheim. All rights reserved. This file is part
+# of the pimaster2ardslave project and is released under the MIT Licence;
+# please see the LICENSE file included as part of this package.
+#
+# author:   Murray Altheim
+# created:  2020-05-22
+# modified: 2020-05-22
+#
+# This tests the calibration of a simulated Sharp IR sensor on pin 8 from a
+# calibration file: a single reading at the slave's fixed range, a batch of
+# readings converted in one step (displaying its speed against converting
+# each reading in Python), the rebuilding of the table as auto-range widens
+# the slave's range, raw readings, and a capture stream. It requires numpy
+# but no hardware, nor pigpio.
+#
+
+import os, tempfile, time
+import numpy
+
+from lib.logger import Level
+from lib.i2c_master import I2cMaster, CaptureBlock
+from lib.calibration import Calibration, CalibratedSensor
+from lib.slave_simulator import SimulatedSlave, SimulatedPi, TimingModel, VirtualClock
+from lib.protocol import SLAVE_I2C_ADDRESS, ANALOG_MODE_RAW
+
+_PIN           = 8
+_LOOP_DELAY_MS = 10
+_BATCH         = 100000
+
+# a Sharp GP2Y0A21 (10-80cm), as raw reading and distance in cm
+_POINTS = [ ( 80, 80 ), ( 95, 70 ), ( 110, 60 ), ( 130, 50 ), ( 160, 40 ), ( 200, 30 ),
+        ( 245, 25 ), ( 300, 20 ), ( 390, 15 ), ( 480, 12 ), ( 600, 10 ) ]
+
+# ..............................................................................
+def main():
+
+    with tempfile.NamedTemporaryFile('w', suffix='.cal', delete=False) as _file:
+        _file.write('# raw, cm\n')
+        for _raw, _cm in _POINTS:
+            _file.write('{:d}, {:d}\n'.format(_raw, _cm))
+    try:
+        _calibration = Calibration.from_file(_file.name)
+    finally:
+        os.remove(_file.name)
+
+    _clock = VirtualClock()
+    _slave = SimulatedSlave(clock=_clock, loop_delay_ms=_LOOP_DELAY_MS)
+    _pi = SimulatedPi({ SLAVE_I2C_ADDRESS: _slave }, timing=TimingModel(realtime=False), clock=_clock)
+    _master = I2cMaster(SLAVE_I2C_ADDRESS, Level.WARN, pi=_pi)
+
+    def _loop():
+        _clock.advance(_LOOP_DELAY_MS / 1000.0)
+        _slave.service()
+
+    try:
+        _master.configure_pin_as_analog_input(_PIN)
+        _sensor = CalibratedSensor(_master, _PIN, _calibration, range_interval=0.5, clock=_clock, level=Level.WARN)
+
+        # a single reading at the fixed range
+        _sensor.set_auto_range(False)
+        _slave.set_analog(_PIN, 300)
+        _loop()
+        _distance = _sensor.read()
+        print('fixed range {}: raw 300 reads as {:.2f}cm (calibrated {:.2f}cm).'.format(_sensor.analog_range, _distance, _calibration.convert_raw(300)))
+        assert abs(_distance - 20.0) < 0.2
+
+        # a batch in one step, against a scalar conversion in Python
+        _readings = numpy.random.RandomState(1).randint(0, 256, _BATCH)
+        _start = time.perf_counter()
+        _distances = _sensor.convert(_readings)
+        _vectorised = time.perf_counter() - _start
+        _analog_min, _analog_max = _sensor.analog_range
+        _raw_points, _cm_points = zip(*_POINTS)
+        _start = time.perf_counter()
+        _scalar = [ float(numpy.interp(_analog_min + ( _reading + 0.5 ) * _analog_max / 255.0, _raw_points, _cm_points)) for _reading in _readings.tolist() ]
+        _python = time.perf_counter() - _start
+        print('{:d} readings: {:.2f}ms by table, {:.0f}ms one by one ({:.0f}x).'.format(_BATCH, _vectorised * 1000.0, _python * 1000.0, _python / _vectorised))
+        assert numpy.allclose(_distances, _scalar)
+
+        # auto-range widens the range: the table follows once the range is stale
+        _sensor.set_auto_range(True)
+        _sensor.read()
+        _slave.set_analog(_PIN, 40)  # nearer the end stop than the default minimum
+        _loop()
+        _slave.set_analog(_PIN, 700) # closer than the default maximum
+        _loop()
+        _clock.advance(0.6)
+        _distance = _sensor.read()
+        print('auto-range {}: raw 700 reads as {:.2f}cm; {:d} range change(s).'.format(_sensor.analog_range, _distance, _sensor.range_changes))
+        assert _sensor.analog_range == ( 40, 700 ) and _sensor.range_changes == 1
+        assert abs(_distance - 10.0) < 0.2
+
+        # raw readings are independent of the range
+        _master.set_analog_mode(_PIN, ANALOG_MODE_RAW)
+        _raw_sensor = CalibratedSensor(_master, _PIN, _calibration, raw=True)
+        _slave.set_analog(_PIN, 160)
+        _loop()
+        assert _raw_sensor.read() == 40.0
+
+        # a capture stream, converted block by block
+        _blocks = [ CaptureBlock(numpy.arange(7) / 1000.0, numpy.array([ 80, 95, 110, 130, 160, 200, 245 ], dtype=numpy.uint16), 0, 0) ]
+        _converted = list(_sensor.convert_capture(_blocks))
+        assert _converted[0].values.tolist() == [ 80.0, 70.0, 60.0, 50.0, 40.0, 30.0, 25.0 ]
+        print('raw and capture conversions match the calibration points.')
+
+    finally:
+        _master.close()
+
+
+if __name__== "__main__":
+    main()
+
+#EOF
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 by Murray Altheim. All rights reserved. This file is part
+# of the pimaster2ardslave project and is released under the MIT Licence;
+# please see the LICENSE file included as part of this package.
+#
+# author:   Murray Altheim
+# created:  2020-05-21
+# modified: 2020-05-21
+#
+# This tests capture: a simulated slave samples a 25Hz sine on an analog pin
+# at 1kHz, and the I2cMaster drains the samples by block reads. It checks
+# that the timestamps are evenly spaced and that the values follow the sine,
+# displaying the bus transactions spent per sample. It then stalls the
+# consumer of a 2kHz capture so that the slave's buffer overflows, checking
+# that the dropped samples are reported. It requires numpy but no hardware,
+# nor pigpio.
+#
+
+import math, time
+import numpy
+
+from lib.logger import Level
+from lib.i2c_master import I2cMaster
+from lib.slave_simulator import SimulatedSlave, SimulatedPi, TimingModel
+from lib.protocol import SLAVE_I2C_ADDRESS
+
+_PIN           = 8
+_LOOP_DELAY_MS = 5
+
+# ..............................................................................
+def _sine(t):
+    return 512 + 400 * math.sin(2.0 * math.pi * 25.0 * t)
+
+
+# ..............................................................................
+def main():
+
+    _slave = SimulatedSlave(loop_delay_ms=_LOOP_DELAY_MS)
+    _slave.set_analog(_PIN, _sine)
+    _pi = SimulatedPi({ SLAVE_I2C_ADDRESS: _slave }, timing=TimingModel(bus_hz=400000))
+    _master = I2cMaster(SLAVE_I2C_ADDRESS, Level.INFO, pi=_pi)
+
+    try:
+        _master.configure_pin_as_analog_input(_PIN)
+        _slave.start()
+
+        # a steady 1kHz capture
+        _pi.reset_counters()
+        _block = _master.capture(_PIN, 1000, 0.5)
+        _intervals = numpy.diff(_block.timestamps)
+        print('1kHz for 0.5s: {:d} samples; interval {:.3f}-{:.3f}ms; {:.2f} transactions per sample.'.format(
+                len(_block.values), _intervals.min() * 1000.0, _intervals.max() * 1000.0, _pi.bus_transactions / len(_block.values)))
+        assert 500 <= len(_block.values) <= 560 # the capture is stopped once the duration has elapsed
+        assert numpy.allclose(_intervals, 0.001)
+        assert _block.overflowed == 0 and _block.missed == 0
+        # the values follow the sine at their timestamps, whatever its phase
+        _omega_t = 2.0 * numpy.pi * 25.0 * _block.timestamps
+        _basis = numpy.column_stack([ numpy.ones(len(_omega_t)), numpy.sin(_omega_t), numpy.cos(_omega_t) ])
+        _fit = numpy.linalg.lstsq(_basis, _block.values, rcond=None)[0]
+        _error = numpy.abs(_block.values - _basis @ _fit)
+        print('largest difference from the sine: {:.1f}'.format(_error.max()))
+        assert _error.max() < 2.0
+
+        # a 2kHz capture whose consumer stalls for 100ms
+        _samples = _overflowed = 0
+        for i, _block in enumerate(_master.stream_capture(_PIN, 2000, 0.5)):
+            _samples += len(_block.values)
+            _overflowed += _block.overflowed
+            if i == 2:
+                time.sleep(0.1)
+        print('2kHz for 0.5s with a stall: {:d} samples; {:d} reported overflowed.'.format(_samples, _overflowed))
+        assert _overflowed > 0
+        assert 1000 <= _samples + _overflowed <= 1100
+
+    finally:
+        _slave.stop()
+        _master.close()
+        _pi.stop()
+
+
+if __name__== "__main__":
+    main()
+
+#EOF
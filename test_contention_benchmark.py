@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 by Murray Altheim. All rights reserved. This file is part
+# of the pimaster2ardslave project and is released under the MIT Licence;
+# please see the LICENSE file included as part of this package.
+#
+# author:   Murray Altheim
+# created:  2020-05-25
+# modified: 2020-05-25
+#
+# This benchmarks an I2cMaster shared by 1 to 16 threads reading a simulated
+# slave (with the default, realtime timing model), each thread either reading
+# the same pin, whose concurrent reads share a transaction, or a pin of its
+# own, which never do, displaying the throughput and latency of each and the
+# bus transactions per read. It then checks that threads making legacy
+# write_i2c_data() and read_i2c_data() pairs concurrently each read the reply
+# to their own command, as do pairs on an I2cBus among another thread's
+# transactions through the bus. It requires no hardware, nor pigpio.
+#
+
+import threading, time
+
+from lib.logger import Level
+from lib.i2c_master import I2cMaster
+from lib.i2c_bus import I2cBus
+from lib.slave_simulator import SimulatedSlave, SimulatedPi
+from lib.benchmark import Benchmark
+from lib.protocol import SLAVE_I2C_ADDRESS, CMD_RETURN_LOOP_COUNT
+
+_THREADS  = [ 1, 2, 4, 8, 16 ]
+_REQUESTS = 100
+
+# ..............................................................................
+def _run(threads, function):
+    '''
+        Runs 'threads' threads each calling function(index) _REQUESTS times,
+        returning a tuple of the per-call latencies and the total elapsed time.
+    '''
+    _latencies = []
+    _lock = threading.Lock()
+    _barrier = threading.Barrier(threads + 1)
+    def _worker(index):
+        _own = [ 0.0 ] * _REQUESTS
+        _barrier.wait()
+        for i in range(_REQUESTS):
+            _t0 = time.perf_counter()
+            function(index)
+            _own[i] = time.perf_counter() - _t0
+        with _lock:
+            _latencies.extend(_own)
+    _threads = [ threading.Thread(target=_worker, args=( i, )) for i in range(threads) ]
+    for _thread in _threads:
+        _thread.start()
+    _barrier.wait()
+    _start = time.perf_counter()
+    for _thread in _threads:
+        _thread.join()
+    return _latencies, time.perf_counter() - _start
+
+
+# ..............................................................................
+def main():
+
+    _slave = SimulatedSlave()
+    _slave.set_input(6, 1)
+    _slave.set_analog(8, 400)
+    _pi = SimulatedPi({ SLAVE_I2C_ADDRESS: _slave })
+    _master = I2cMaster(SLAVE_I2C_ADDRESS, Level.WARN, pi=_pi)
+    _benchmark = Benchmark(Level.INFO, pi=_pi)
+    try:
+        _master.apply_pin_map({ 5: 'output', 6: 'input', 7: 'input', 8: 'analog' })
+        _slave.loop() # so that the pins hold their values
+        _expected = _master.get_input_from_pin(8)
+        _values = []
+        for _threads in _THREADS:
+            _benchmark.reset()
+            _latencies, _elapsed = _run(_threads, lambda i: _values.append(_master.get_input_from_pin(8)))
+            _shared = _benchmark.record('same pin x{:d}'.format(_threads), _latencies, _elapsed)
+            _benchmark.reset()
+            _latencies, _elapsed = _run(_threads, lambda i: _master.get_input_from_pin(i))
+            _own = _benchmark.record('own pin x{:d}'.format(_threads), _latencies, _elapsed)
+            _benchmark.compare(_own, _shared)
+            if _threads >= 4:
+                assert _shared.bus_transactions < 0.5 and _shared.rate > _own.rate
+        assert _values.count(_expected) == len(_values)
+        print('{:d} reads joined another in flight.'.format(_master.coalesced_count))
+
+        # legacy pairs, each thread its own pin
+        _pins = [ 0, 6, 7, 8 ] * 2
+        _replies = {}
+        def _legacy(index):
+            _master.write_i2c_data(_pins[index])
+            _reply = _master.read_i2c_data()
+            if _reply != _slave.get_value_of(_pins[index]):
+                _replies[index] = _reply
+        _run(len(_pins), _legacy)
+        assert not _replies, 'legacy pairs read replies to other commands: {}'.format(_replies)
+        print('{:d} threads each read the replies to their own legacy commands.'.format(len(_pins)))
+
+    finally:
+        _master.close()
+
+    # legacy pairs on a bus, among other threads' transactions through the bus
+    _bus = I2cBus(Level.WARN, pi=_pi)
+    try:
+        _master = _bus.get_master(SLAVE_I2C_ADDRESS)
+        _stop_event = threading.Event()
+        def _housekeeping():
+            while not _stop_event.is_set():
+                _master.get_input_from_pin(CMD_RETURN_LOOP_COUNT)
+        _thread = threading.Thread(target=_housekeeping)
+        _thread.start()
+        _wrong = 0
+        for _ in range(200):
+            _master.write_i2c_data(6)
+            if _master.read_i2c_data() != _slave.get_value_of(6):
+                _wrong += 1
+        _stop_event.set()
+        _thread.join()
+        assert _wrong == 0, '{:d} legacy pairs on a bus read replies to other commands.'.format(_wrong)
+        print('legacy pairs on a bus read the replies to their own commands.')
+    finally:
+        _bus.close()
+
+
+if __name__== "__main__":
+    main()
+
+#EOF
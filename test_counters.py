@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 by Murray Altheim. All rights reserved. This file is part
+# of the pimaster2ardslave project and is released under the MIT Licence;
+# please see the LICENSE file included as part of this package.
+#
+# author:   Murray Altheim
+# created:  2020-05-25
+# modified: 2020-05-25
+#
+# This drives two simulated wheel encoders, whose edge rates vary from a
+# few to a few thousand per second, into pins of a simulated slave counting
+# their edges, with the first also wired to a polled digital input. A 50Hz
+# control loop polls the input and reads both counters once per cycle. It
+# checks that no edge was missed, unlike polling, that reading both counters
+# cost a single bus transaction per cycle, and that the rates (and RPM)
+# follow the encoders. It
+# then checks that a pin that cannot count is refused without losing the
+# edges counted by another, the counters in framed mode, and that a count
+# that looks like an error code is not counted as one in the transaction
+# metrics. It requires no hardware, nor pigpio.
+#
+
+import math
+
+from lib.logger import Level
+from lib.i2c_master import I2cMaster, counter_rate
+from lib.slave_simulator import SimulatedSlave, SimulatedPi, TimingModel, VirtualClock
+from lib.protocol import SLAVE_I2C_ADDRESS, COUNT_BOTH, COUNT_RISING
+
+_CYCLE_S    = 0.020   # the control loop
+_DURATION_S = 10.0
+_LEFT       = 7       # counting, as is...
+_RIGHT      = 0
+_POLLED     = 6       # ...this input, wired to the left encoder
+_EDGES_PER_REVOLUTION = 40 # a disc of 20 slots, counting both edges
+
+# ..............................................................................
+def _edge_rate(pin, t):
+    '''
+        Returns the edge rate (Hz) of the encoder at the time: the left
+        sweeping from about 20Hz to 3kHz and back, the right steady.
+    '''
+    if pin == _LEFT:
+        return 20.0 + 2980.0 * math.sin(math.pi * t / _DURATION_S) ** 2
+    return 400.0
+
+
+# ..............................................................................
+def main():
+
+    _clock = VirtualClock()
+    _slave = SimulatedSlave(clock=_clock, loop_delay_ms=10)
+    _pi = SimulatedPi({ SLAVE_I2C_ADDRESS: _slave }, timing=TimingModel(realtime=False), clock=_clock)
+    _master = I2cMaster(SLAVE_I2C_ADDRESS, Level.WARN, pi=_pi)
+    try:
+        _master.apply_pin_map({ _POLLED: 'input' })
+        _master.set_sample_period(10)
+        _master.configure_pin_as_counter(_LEFT)
+        _master.configure_pin_as_counter(_RIGHT, COUNT_BOTH, pullup=True)
+        _master.read_counters([ _LEFT, _RIGHT ]) # the start of the first interval
+        _pins = ( _LEFT, _RIGHT )
+        _levels = { _pin: 0 for _pin in _pins }
+        _next_edge = { _pin: _clock() + 1.0 / _edge_rate(_pin, 0.0) for _pin in _pins }
+        _edges = { _pin: 0 for _pin in _pins }
+        _counted = { _pin: 0 for _pin in _pins }
+        _polled = 0
+        _polled_level = 0
+        _errors = []
+        _start = _clock()
+        _pi.reset_counters()
+        _cycles = 0
+        while _clock() - _start < _DURATION_S:
+            _end = _start + ( _cycles + 1 ) * _CYCLE_S # on schedule, whatever the time spent on the bus
+            while True:
+                _pin = min(_pins, key=lambda p: _next_edge[p])
+                if _next_edge[_pin] > _end:
+                    break
+                _clock.advance(max(0.0, _next_edge[_pin] - _clock()))
+                _levels[_pin] ^= 1
+                _slave.set_input(_pin, _levels[_pin])
+                if _pin == _LEFT:
+                    _slave.set_input(_POLLED, _levels[_pin])
+                _edges[_pin] += 1
+                _next_edge[_pin] += 1.0 / _edge_rate(_pin, _clock() - _start)
+            _clock.advance(max(0.0, _end - _clock()))
+            _value = _master.get_input_from_pin(_POLLED)
+            if _value != _polled_level:
+                _polled += 1
+                _polled_level = _value
+            _counts = _master.read_counters(_pins)
+            for _pin in _pins:
+                _counted[_pin] += _counts[_pin].count
+            _rate = counter_rate(_counts[_LEFT], _since) if _cycles else None
+            if _rate is not None:
+                _interval = ( _counts[_LEFT].micros - _since ) / 1e6
+                # a count is whole, so within an edge of the true rate over the interval
+                _errors.append(abs(_rate - _edge_rate(_LEFT, _clock() - _start - _interval / 2.0)) * _interval)
+            _since = _counts[_LEFT].micros
+            _cycles += 1
+        _transactions = _pi.bus_transactions
+
+        print('{:d} control cycles in {:.0f}s: {:d} bus transactions.'.format(_cycles, _DURATION_S, _transactions))
+        for _pin in _pins:
+            print('pin {:d}: {:6d} edges; {:6d} counted.'.format(_pin, _edges[_pin], _counted[_pin]))
+            assert _counted[_pin] == _edges[_pin], 'pin {:d} missed edges.'.format(_pin)
+        print('pin {:d}: {:6d} edges seen by polling ({:.1%}).'.format(_POLLED, _polled, _polled / _edges[_LEFT]))
+        assert _polled < _edges[_LEFT] / 10
+        # each cycle polled a pin and read both counters
+        assert _transactions == 2 * _cycles
+        print('rate of pin {:d}: error mean {:.2f}, max {:.2f} edges per interval.'.format(
+                _LEFT, sum(_errors) / len(_errors), max(_errors)))
+        assert max(_errors) < 1.5
+
+        # the RPM of the steady wheel, whose first read (since its last reset) is from its period
+        _master.configure_pin_as_counter(_RIGHT, COUNT_BOTH)
+        _rpms = []
+        for _ in range(20):
+            _end = _clock() + _CYCLE_S
+            while _next_edge[_RIGHT] <= _end:
+                _clock.advance(max(0.0, _next_edge[_RIGHT] - _clock()))
+                _levels[_RIGHT] ^= 1
+                _slave.set_input(_RIGHT, _levels[_RIGHT])
+                _next_edge[_RIGHT] += 1.0 / _edge_rate(_RIGHT, 0.0)
+            _clock.advance(_end - _clock())
+            _rpms.append(_master.read_counter_rates([ _RIGHT ], _EDGES_PER_REVOLUTION)[_RIGHT])
+        _expected = _edge_rate(_RIGHT, 0.0) * 60.0 / _EDGES_PER_REVOLUTION
+        print('rpm of pin {:d}: {:.1f} from its period, then mean {:.1f} (expected {:.1f}).'.format(
+                _RIGHT, _rpms[0], sum(_rpms[1:]) / len(_rpms[1:]), _expected))
+        assert abs(_rpms[0] - _expected) < 0.01 * _expected
+        assert abs(sum(_rpms[1:]) / len(_rpms[1:]) - _expected) < 0.02 * _expected
+
+        # a pin without an interrupt
+        try:
+            _master.configure_pin_as_counter(4, COUNT_RISING)
+            raise AssertionError('pin 4 was configured as a counter.')
+        except IOError:
+            pass
+        for _ in range(4):
+            _levels[_LEFT] ^= 1
+            _slave.set_input(_LEFT, _levels[_LEFT])
+            _clock.advance(0.001)
+        try:
+            _master.read_counters([ _LEFT, _POLLED ])
+            raise AssertionError('pin {:d} was read as a counter.'.format(_POLLED))
+        except IOError:
+            pass
+        # the slave reset the counter it did read, whose count is carried into the next read
+        _levels[_LEFT] ^= 1
+        _slave.set_input(_LEFT, _levels[_LEFT])
+        assert _master.read_counters([ _LEFT ])[_LEFT].count == 5
+        print('a pin that cannot count was refused, without losing the edges of another.')
+
+        # framed, the counters are read in two transactions
+        _master.set_framing(True)
+        _master.configure_pin_as_counter(1)
+        for i in range(6):
+            _slave.set_input(1, ( i + 1 ) % 2)
+            _clock.advance(0.001)
+        _pi.reset_counters()
+        _counts = _master.read_counters([ _LEFT, _RIGHT, 1 ])
+        assert _pi.bus_transactions == 2 and _counts[1].count == 6 and _counts[1].period == 1000
+        _master.set_framing(False)
+        print('framed, three counters were read in two transactions.')
+
+        # a count that looks like an error code is not counted as one
+        _master.read_counters([ _LEFT, _RIGHT, 1 ])
+        _master.reset_stats()
+        for i in range(250):
+            _slave.set_input(1, ( i + 1 ) % 2)
+            _clock.advance(0.001)
+        assert _master.read_counters([ 1 ])[1].count == 250
+        assert not _master.stats()['errors'], 'errors: {}'.format(_master.stats()['errors'])
+        print('a count of 250 was not counted as an error.')
+
+    finally:
+        _master.close()
+
+
+if __name__== "__main__":
+    main()
+
+#EOF
@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 by Murray Altheim. All rights reserved. This file is part
+# of the pimaster2ardslave project and is released under the MIT Licence;
+# please see the LICENSE file included as part of this package.
+#
+# author:   Murray Altheim
+# created:  2020-05-18
+# modified: 2020-05-25
+#
+# This runs the same command sequences against the Python SimulatedSlave and
+# the host build of the sketch's own code (HostSlave), comparing every reply
+# and the slave state after each step, so that the simulator can be trusted
+# to behave as the sketch does. It runs a fixed sequence covering each
+# command and analog mode, a seeded random sequence (including malformed
+# writes, noisy analog inputs, the passing of time while capturing or
+# counting edges, and framed mode with corrupted, retried and malformed
+# frames), and
+# then the same I2cMaster session against both. Finally it displays the time
+# spent in the Wire callbacks of the host build for each class of command.
+#
+# This requires the host build ('make -C host') but no hardware, nor pigpio.
+#
+
+import sys, random
+
+from lib.logger import Level
+from lib.i2c_master import I2cMaster
+from lib.i2c_stats import CLASS_NAMES, command_class
+from lib.host_slave import HostSlave
+from lib.slave_simulator import SimulatedSlave, SimulatedPi, TimingModel, VirtualClock
+from lib.protocol import *
+
+# ..............................................................................
+class Differential():
+    '''
+        Applies each step to both slaves, raising an AssertionError at the
+        first difference.
+    '''
+    def __init__(self):
+        self._clock = VirtualClock()
+        self.simulated = SimulatedSlave(clock=self._clock, loop_delay_ms=None)
+        self.host = HostSlave()
+        self.steps = 0
+        self.isr_ns = { _name: [] for _name in CLASS_NAMES }
+
+    def _compare(self, description, simulated, host):
+        self.steps += 1
+        if simulated != host:
+            raise AssertionError('step {:d}, {}: simulated {} != host {}'.format(self.steps, description, simulated, host))
+        _simulated_state = self.simulated.state()
+        _host_state = self.host.state()
+        if _simulated_state != _host_state:
+            raise AssertionError('step {:d}, {}: simulated state {} != host state {}'.format(self.steps, description, _simulated_state, _host_state))
+
+    def write(self, data):
+        self.simulated.receive_data(bytes(data))
+        self.host.receive_data(bytes(data))
+        self._compare('write {}'.format(list(data)), None, None)
+
+    def read(self):
+        self._compare('read', self.simulated.request_data(), self.host.request_data())
+
+    def command(self, command, payload=(), sequence=None, corrupt=False):
+        '''
+            A write of the command and its payload, then a read of its reply.
+            If the slave is in framed mode the write is framed with the given
+            sequence number (by default the next), its CRC corrupted if
+            'corrupt' is True.
+        '''
+        _data = bytes([ command & 0xFF, ( command >> 8 ) & 0xFF ]) + bytes(payload)
+        if self.simulated.is_framed:
+            if sequence is None:
+                sequence = ( self.simulated.last_sequence + 1 ) & 0xFF
+            _data = bytes([ sequence ]) + _data
+            _data += bytes([ crc8(_data) ^ ( 0x01 if corrupt else 0x00 ) ])
+        self.simulated.receive_data(_data)
+        self.host.receive_data(_data)
+        _receive_ns = self.host.receive_ns
+        self._compare('write command {:d}'.format(command), None, None)
+        self._compare('reply to command {:d}'.format(command), self.simulated.request_data(), self.host.request_data())
+        self.isr_ns[CLASS_NAMES[command_class(command)]].append(_receive_ns + self.host.request_ns)
+
+    def loop(self):
+        self.simulated.loop()
+        self.host.loop()
+        self._compare('loop', None, None)
+
+    def advance(self, micros):
+        self._clock.advance(micros / 1e6)
+        self.simulated.service_capture()
+        self.host.advance(micros)
+        self._compare('advance {:d}µs'.format(micros), None, None)
+
+    def set_input(self, pin, level):
+        self.simulated.set_input(pin, level)
+        self.host.set_input(pin, level)
+        self._compare('set input {:d}'.format(pin), self.simulated.get_output(pin), self.host.get_output(pin))
+
+    def set_analog(self, pin, value):
+        self.simulated.set_analog(pin, value)
+        self.host.set_analog(pin, value)
+        self._compare('set analog {:d}'.format(pin), None, None)
+
+    def set_analog_sequence(self, pin, values):
+        self.simulated.set_analog_sequence(pin, values)
+        self.host.set_analog_sequence(pin, values)
+        self._compare('set analog sequence {:d}'.format(pin), None, None)
+
+    def close(self):
+        self.host.close()
+
+
+# ..............................................................................
+def run_fixed(_differential):
+    for pin in range(PINS_ASSIGNED):
+        _differential.command(OFFSET_READ_PIN + pin) # unassigned
+    _differential.command(OFFSET_CONFIGURE_INPUT + 1)
+    _differential.command(OFFSET_CONFIGURE_PULLUP + 2)
+    _differential.command(OFFSET_CONFIGURE_ANALOG + 3)
+    _differential.command(OFFSET_CONFIGURE_OUTPUT + 4)
+    _differential.set_input(1, 1)
+    _differential.set_input(2, 0)
+    _differential.set_analog(3, 412)
+    _differential.loop()
+    for pin in range(1, 5):
+        _differential.command(OFFSET_READ_PIN + pin)
+    _differential.command(OFFSET_WRITE_HIGH + 4)
+    _differential.command(OFFSET_WRITE_LOW + 4)
+    _differential.command(CMD_ECHO_INPUT)
+    _differential.command(CMD_ENABLE_AUTORANGE)
+    for _value in [ 12, 1023, 300 ]:
+        _differential.set_analog(3, _value)
+        _differential.loop()
+        _differential.command(OFFSET_READ_PIN + 3)
+    # analog modes, with a noisy sensor
+    _differential.set_analog_sequence(3, [ 400, 410, 395, 1023, 402, 0, 398, 405, 401 ])
+    for _mode, _parameter in [ ( ANALOG_MODE_RAW, 0 ), ( ANALOG_MODE_AVERAGE, 16 ), ( ANALOG_MODE_AVERAGE, 3 ),
+            ( ANALOG_MODE_MEDIAN, 9 ), ( ANALOG_MODE_MEDIAN, 4 ), ( ANALOG_MODE_EMA, 1 ), ( ANALOG_MODE_EMA, 6 ) ]:
+        _differential.command(CMD_SET_ANALOG_MODE, [ 3, _mode, _parameter ])
+        for _ in range(5):
+            _differential.loop()
+            _differential.command(OFFSET_READ_PIN + 3)
+    for _payload in [ [ 3, ANALOG_MODE_AVERAGE, 0 ], [ 3, ANALOG_MODE_AVERAGE, 17 ], [ 3, ANALOG_MODE_MEDIAN, 10 ],
+            [ 3, ANALOG_MODE_EMA, 7 ], [ 3, 5, 1 ], [ PINS_ASSIGNED, ANALOG_MODE_RAW, 1 ] ]:
+        _differential.command(CMD_SET_ANALOG_MODE, _payload) # out of range
+    _differential.command(CMD_SET_ANALOG_MODE, [ 3, ANALOG_MODE_SCALED, 0 ])
+    # change events, including an overflow of the change queue
+    _differential.command(CMD_SET_CHANGE_MASK, [ 0b00001110, 0 ])
+    _differential.command(CMD_READ_CHANGES)
+    for i in range(CHANGE_QUEUE_LENGTH + 3):
+        _differential.set_input(1, i % 2)
+        _differential.loop()
+        if i == 2:
+            _differential.command(CMD_READ_CHANGES)
+    for _ in range(4):
+        _differential.command(CMD_READ_CHANGES)
+    _differential.command(CMD_SET_CHANGE_MASK, [ 0, 0 ])
+    # capture of a digital and an analog pin, including an overflow
+    for _payload in [ [ 4, 0xE8, 0x03 ], [ 1, 0xF3, 0x01 ], [ PINS_ASSIGNED, 0xE8, 0x03 ] ]:
+        _differential.command(CMD_START_CAPTURE, _payload) # not an input, too fast, out of range
+    _differential.command(CMD_START_CAPTURE, [ 1, 0xE8, 0x03 ]) # every 1000µs
+    for i in range(12):
+        _differential.set_input(1, i % 3 == 0)
+        _differential.advance(730)
+    for _ in range(3):
+        _differential.command(CMD_READ_CAPTURE)
+    _differential.command(CMD_START_CAPTURE, [ 3, 0xF4, 0x01 ]) # every 500µs
+    _differential.advance(CAPTURE_LENGTH * 500 + 5000)
+    _differential.command(CMD_STOP_CAPTURE)
+    _differential.advance(5000)
+    for _ in range(CAPTURE_LENGTH // CAPTURE_BATCH + 2):
+        _differential.command(CMD_READ_CAPTURE)
+    # pin maps and the handshake
+    _differential.command(CMD_HANDSHAKE)
+    _differential.command(CMD_APPLY_PIN_MAP, [ 0x42, 0x35, 0x66, 0x63, 0x56 ])
+    _differential.command(CMD_HANDSHAKE)
+    _differential.command(CMD_APPLY_PIN_MAP, [ 0x42, 0x35, 0x66, 0x63, 0x56 ]) # unchanged
+    _differential.command(CMD_APPLY_PIN_MAP, [ 0x42, 0x35, 0x07, 0x63, 0x56 ]) # invalid
+    # outputs 4 and 5 (from the pin map) written together, and the inputs skipped
+    _differential.command(CMD_WRITE_OUTPUTS, [ 0b00111100, 0, 0b00010100, 0 ])
+    _differential.loop()
+    _differential.command(CMD_WRITE_OUTPUTS, [ 0b00110000, 0x80, 0b00100000, 0xFF ])
+    _differential.loop()
+    # the sample period, too short and then in range
+    _differential.command(CMD_SET_SAMPLE_PERIOD, [ MIN_SAMPLE_PERIOD_MS - 1, 0 ])
+    _differential.command(CMD_SET_SAMPLE_PERIOD, [ 0xF4, 0x01 ])
+    _differential.loop()
+    # edge counters: refused on pins without an interrupt, on the Wire's, and for invalid edges
+    for _payload in [ [ 4, COUNT_BOTH ], [ 2, COUNT_BOTH ], [ 3, COUNT_RISING ], [ PINS_ASSIGNED, COUNT_BOTH ],
+            [ 7, 0 ], [ 7, COUNT_PULLUP ], [ 7, 0x08 | COUNT_BOTH ] ]:
+        _differential.command(CMD_CONFIGURE_COUNTER, _payload)
+    _differential.command(CMD_CONFIGURE_COUNTER, [ 7, COUNT_RISING ])
+    _differential.command(CMD_CONFIGURE_COUNTER, [ 0, COUNT_BOTH | COUNT_PULLUP ])
+    _differential.command(CMD_CONFIGURE_COUNTER, [ 1, COUNT_FALLING ])
+    _differential.command(CMD_READ_COUNTERS, [ 0x83, 0x00, 0 ]) # none counted, no period
+    for i in range(11):
+        for _pin in ( 0, 1, 7 ):
+            _differential.set_input(_pin, i % 2)
+        _differential.advance(137 * ( i + 1 ))
+        if i == 5:
+            _differential.loop()
+            _differential.command(OFFSET_READ_PIN + 7)
+    _differential.command(CMD_READ_COUNTERS, [ 0x83, 0x00, 0 ])
+    _differential.command(CMD_READ_COUNTERS, [ 0x93, 0xFF, 1 ]) # and pins not counting, reset
+    _differential.command(CMD_READ_COUNTERS, [ 0x83, 0x00, 1 ]) # reset, keeping the periods
+    _differential.command(CMD_CONFIGURE_COUNTER, [ 7, COUNT_BOTH ]) # reconfigured, starting again
+    _differential.set_input(7, 1)
+    _differential.command(OFFSET_CONFIGURE_OUTPUT + 1) # stops its counter
+    _differential.set_input(1, 0)
+    _differential.command(CMD_READ_COUNTERS, [ 0x83, 0x00, 0 ])
+    _differential.command(CMD_RETURN_ANALOG_MIN_RANGE)
+    _differential.command(CMD_RETURN_ANALOG_MAX_RANGE)
+    _differential.command(CMD_DISABLE_AUTORANGE)
+    _differential.command(CMD_RETURN_REQUEST_COUNT)
+    _differential.command(CMD_CLEAR_REQUEST_COUNT)
+    _differential.command(CMD_RETURN_LOOP_COUNT)
+    _differential.command(CMD_CLEAR_LOOP_COUNT)
+    _differential.command(CMD_READ_ALL_PINS)
+    _differential.command(CMD_READ_PINS, [ 0b00011110, 0 ])
+    _differential.command(CMD_READ_PINS_GENERATION, [ 0b00011110, 0 ])
+    _differential.advance(1500)
+    _differential.command(CMD_READ_PINS_GENERATION, [ 0xFF, 0xFF ]) # more pins than the queue holds
+    _differential.command(CMD_CLEAR_QUEUES)
+    _differential.command(239) # unrecognised
+    _differential.command(250) # echoed
+    _differential.command(300) # an extended command not supported, unrecognised
+    _differential.command(0xFFFF) # -1 as a 16 bit int
+    # a block command whose payload arrives separately
+    _differential.write([ CMD_READ_PINS, 0 ])
+    _differential.read()
+    _differential.write([ 0x0E, 0x00 ])
+    _differential.read()
+    # surplus bytes, and a command split across writes
+    _differential.write([ OFFSET_READ_PIN + 1, 0, 7 ])
+    _differential.read()
+    _differential.write([ OFFSET_READ_PIN + 1 ])
+    _differential.write([ 0 ])
+    _differential.read()
+    _differential.read() # empty queue
+    # framed mode
+    _differential.command(CMD_SET_FRAMING, [ 1 ]) # the request to enable is not framed
+    _differential.command(OFFSET_READ_PIN + 1, sequence=1)
+    _differential.command(CMD_READ_PINS, [ 0x0E, 0x00 ], sequence=2)
+    _differential.command(CMD_RETURN_REQUEST_COUNT, sequence=2) # a retry: replays the reply to 235
+    _differential.command(CMD_RETURN_REQUEST_COUNT, sequence=3, corrupt=True)
+    _differential.command(CMD_RETURN_REQUEST_COUNT, sequence=3)
+    _differential.command(CMD_READ_PINS, sequence=4) # missing its payload
+    _differential.command(CMD_HANDSHAKE, [ 0 ], sequence=4) # a surplus byte
+    _differential.write([ 5, 0 ]) # too short
+    _differential.read()
+    _differential.read() # no request
+    _differential.command(CMD_READ_ALL_PINS, sequence=5) # a reply truncated by its frame
+    _differential.command(CMD_READ_CAPTURE, sequence=6)
+    _differential.command(CMD_READ_COUNTERS, [ 0x81, 0x00, 0 ], sequence=7) # one counter fewer than unframed
+    _differential.command(CMD_SET_FRAMING, [ 0 ], sequence=8)
+    _differential.command(CMD_RETURN_REQUEST_COUNT)
+
+
+def run_random(_differential, seed, steps):
+    _random = random.Random(seed)
+    for _ in range(steps):
+        _choice = _random.random()
+        if _choice < 0.50:
+            _command = _random.choice([ _random.randrange(0, 256), _random.randrange(0, 256),
+                    _random.randrange(0, 32), _random.randrange(224, 240), CMD_SET_ANALOG_MODE, CMD_SET_CHANGE_MASK, CMD_READ_CHANGES,
+                    CMD_START_CAPTURE, CMD_STOP_CAPTURE, CMD_READ_CAPTURE, CMD_HANDSHAKE, CMD_APPLY_PIN_MAP,
+                    CMD_SET_FRAMING, CMD_WRITE_OUTPUTS, CMD_READ_PINS_GENERATION, CMD_SET_SAMPLE_PERIOD,
+                    CMD_CONFIGURE_COUNTER, CMD_READ_COUNTERS, _random.randrange(0, 0x10000) ])
+            if _command == CMD_READ_PINS or _command == CMD_READ_PINS_GENERATION:
+                _payload = [ _random.randrange(0, 256) for _ in range(2) ]
+            elif _command == CMD_SET_SAMPLE_PERIOD:
+                _period = _random.choice([ 0, MIN_SAMPLE_PERIOD_MS - 1, MIN_SAMPLE_PERIOD_MS, 20, 1000, 0xFFFF ])
+                _payload = [ _period & 0xFF, _period >> 8 ]
+            elif _command == CMD_CONFIGURE_COUNTER:
+                _payload = [ _random.choice([ 0, 1, 7, _random.randrange(0, PINS_ASSIGNED + 1) ]), _random.randrange(0, 9) ]
+            elif _command == CMD_READ_COUNTERS:
+                _payload = [ _random.choice([ 0x83, 0x81, _random.randrange(0, 256) ]), _random.randrange(0, 256), _random.randrange(0, 2) ]
+            elif _command == CMD_SET_CHANGE_MASK:
+                _payload = [ _random.randrange(0, 256), _random.randrange(0, 256) ]
+            elif _command == CMD_START_CAPTURE:
+                _period = _random.choice([ 499, 500, 1000, 2500 ])
+                _payload = [ _random.randrange(0, PINS_ASSIGNED + 1), _period & 0xFF, _period >> 8 ]
+            elif _command == CMD_APPLY_PIN_MAP:
+                _payload = [ _random.choice([ 0x22, 0x34, 0x56, 0x65, 0x53, 0x66 ]) if _random.random() < 0.9
+                        else _random.randrange(0, 256) for _ in range(PIN_MAP_LENGTH) ]
+            elif _command == CMD_SET_ANALOG_MODE:
+                _payload = [ _random.randrange(0, PINS_ASSIGNED + 1), _random.randrange(0, 6), _random.randrange(0, 18) ]
+            elif _command == CMD_WRITE_OUTPUTS:
+                _payload = [ _random.randrange(0, 256) for _ in range(4) ]
+            elif _command == CMD_SET_FRAMING:
+                _payload = [ _random.choice([ 0, 0, 1, 2 ]) ]
+            else:
+                _payload = []
+            # in framed mode, frequent retries (repeated sequence numbers) and corrupted frames
+            _differential.command(_command, _payload, sequence=_random.randrange(0, 4), corrupt=_random.random() < 0.05)
+        elif _choice < 0.60:
+            _differential.write([ _random.randrange(0, 256) for _ in range(_random.randrange(0, QUEUE_LENGTH + 1)) ])
+        elif _choice < 0.70:
+            _differential.read()
+        elif _choice < 0.80:
+            _differential.loop()
+        elif _choice < 0.90:
+            _differential.set_input(_random.randrange(0, PINS_ASSIGNED), _random.randrange(0, 2))
+        elif _choice < 0.93:
+            _differential.advance(_random.randrange(0, 20000))
+        elif _choice < 0.97:
+            _differential.set_analog(_random.randrange(0, PINS_ASSIGNED), _random.randrange(0, 1024))
+        else:
+            _differential.set_analog_sequence(_random.randrange(0, PINS_ASSIGNED),
+                    [ _random.randrange(0, 1024) for _ in range(_random.randrange(1, 10)) ])
+
+
+def run_master(level):
+    '''
+        Runs an I2cMaster session against each slave, returning the results.
+    '''
+    _results = []
+    for _slave in [ SimulatedSlave(loop_delay_ms=None), HostSlave() ]:
+        _master = I2cMaster(SLAVE_I2C_ADDRESS, level, pi=SimulatedPi({ SLAVE_I2C_ADDRESS: _slave }, timing=TimingModel(realtime=False)))
+        try:
+            _master.configure_pin_as_digital_input(1)
+            _master.configure_pin_as_digital_input_pullup(2)
+            _master.configure_pin_as_analog_input(3)
+            _master.configure_pin_as_output(4)
+            _master.configure_pin_as_analog_input(5)
+            _master.set_analog_mode(5, ANALOG_MODE_MEDIAN, 5)
+            _slave.set_analog_sequence(5, [ 500, 0, 510, 1023, 505 ])
+            _slave.set_input(1, 1)
+            _slave.set_analog(3, 333)
+            _slave.loop()
+            _result = [ _master.get_input_from_pin(pin) for pin in range(1, 6) ]
+            _master.set_output_on_pin(4, True)
+            _result.append(_slave.get_output(4))
+            _master.configure_pin_as_output(6)
+            _result.append(_master.set_outputs({ 4: False, 6: True, 1: True }))
+            _slave.loop()
+            _result.append([ _slave.get_output(pin) for pin in ( 1, 4, 6 ) ])
+            _result.append(list(_master.read_pins([ 1, 2, 3, 5 ])))
+            _result.append(_master.get_input_from_pin(CMD_RETURN_REQUEST_COUNT))
+            _master.configure_pin_as_counter(7)
+            for i in range(5):
+                _slave.set_input(7, i % 2)
+            _result.append([ _master.read_counters([ 7 ])[7].count, _master.read_counters([ 7 ], reset=False)[7].count ])
+            _pin_map = { 1: 'input', 2: 'input_pullup', 3: 'analog', 4: 'output', 5: 'analog', 6: 'input' }
+            _result += [ _master.apply_pin_map(_pin_map), _master.apply_pin_map(_pin_map), tuple(_master.handshake()) ]
+            _master.set_framing(True)
+            _result.append([ _master.get_input_from_pin(pin) for pin in range(1, 6) ])
+            _result.append(list(_master.read_pins([ 1, 2, 3, 5 ])))
+            _result.append(_master.get_input_from_pin(CMD_RETURN_REQUEST_COUNT))
+            _master.set_framing(False)
+            _result.append(_master.get_input_from_pin(CMD_RETURN_REQUEST_COUNT))
+            _results.append(_result)
+        finally:
+            _master.close()
+            if isinstance(_slave, HostSlave):
+                _slave.close()
+    return _results
+
+
+# ..............................................................................
+def main():
+
+    _seed = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    _differential = Differential()
+    try:
+        run_fixed(_differential)
+        print('fixed sequence: {:d} steps matched.'.format(_differential.steps))
+        _fixed_steps = _differential.steps
+        run_random(_differential, _seed, 5000)
+        print('random sequence (seed {:d}): {:d} steps matched.'.format(_seed, _differential.steps - _fixed_steps))
+        _echo = Differential()
+        try:
+            _echo.simulated.echo_test = True
+            _echo.host.echo_test = True
+            run_random(_echo, _seed, 500)
+            print('echo test random sequence: {:d} steps matched.'.format(_echo.steps))
+        finally:
+            _echo.close()
+        for _name, _ns in _differential.isr_ns.items():
+            if _ns:
+                _ns.sort()
+                print('{:<12} {:5d} commands; callback time p50 {:6.0f}ns; max {:6.0f}ns (host, not AVR)'.format(
+                        _name, len(_ns), _ns[len(_ns) // 2], _ns[-1]))
+    finally:
+        _differential.close()
+
+    _simulated, _host = run_master(Level.WARN)
+    assert _simulated == _host, 'I2cMaster session differs: simulated {} != host {}'.format(_simulated, _host)
+    print('I2cMaster session matched: {}'.format(_host))
+
+
+if __name__== "__main__":
+    main()
+
+#EOF
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 by Murray Altheim. All rights reserved. This file is part
+# of the pimaster2ardslave project and is released under the MIT Licence;
+# please see the LICENSE file included as part of this package.
+#
+# author:   Murray Altheim
+# created:  2020-05-20
+# modified: 2020-05-25
+#
+# This tests change events: a simulated slave, running its loop every 5ms,
+# raises its interrupt line (wired to GPIO 17 of a simulated Pi) when a
+# subscribed input changes, and the I2cMaster's edge callback drains the
+# events and dispatches them to the subscribers. It checks that the bus is
+# idle while nothing changes, displays the latency from a change of input
+# to its callback, then overflows the slave's change queue to check that
+# the loss is reported and the subscribers resynchronised. Finally it checks
+# that threads subscribing at once each have their pin set in the slave's
+# change mask. It requires no hardware, nor pigpio.
+#
+
+import time, threading
+
+from lib.logger import Level
+from lib.i2c_master import I2cMaster
+from lib.benchmark import percentile
+from lib.slave_simulator import SimulatedSlave, SimulatedPi
+from lib.protocol import SLAVE_I2C_ADDRESS, CHANGE_QUEUE_LENGTH
+
+_GPIO          = 17
+_BUTTON_PIN    = 6
+_IR_PIN        = 7
+_LOOP_DELAY_MS = 5
+
+# ..............................................................................
+class _Recorder():
+    def __init__(self):
+        self.events = []
+        self.changed = threading.Event()
+
+    def __call__(self, pin, value):
+        self.events.append(( pin, value, time.perf_counter() ))
+        self.changed.set()
+
+
+# ..............................................................................
+def main():
+
+    _slave = SimulatedSlave(loop_delay_ms=_LOOP_DELAY_MS)
+    _pi = SimulatedPi({ SLAVE_I2C_ADDRESS: _slave })
+    _pi.connect(_GPIO, _slave)
+    _master = I2cMaster(SLAVE_I2C_ADDRESS, Level.INFO, pi=_pi)
+    _recorder = _Recorder()
+
+    try:
+        _master.configure_pin_as_digital_input_pullup(_BUTTON_PIN)
+        _master.configure_pin_as_digital_input(_IR_PIN)
+        _slave.set_input(_BUTTON_PIN, 1) # released
+        _master.subscribe(_BUTTON_PIN, _recorder)
+        _master.subscribe(_IR_PIN, _recorder)
+        _master.start_events(_GPIO)
+        _slave.start()
+
+        # nothing changes: the bus should be idle
+        time.sleep(0.1)
+        _pi.reset_counters()
+        time.sleep(0.5)
+        print('idle for 0.5s: {:d} bus transactions (polling at 100Hz would be 50).'.format(_pi.bus_transactions))
+        assert _pi.bus_transactions == 0
+
+        # press and release the button
+        _latencies = []
+        for i in range(40):
+            _recorder.changed.clear()
+            _recorder.events.clear()
+            _t0 = time.perf_counter()
+            _slave.set_input(_BUTTON_PIN, i % 2) # 0 is pressed
+            assert _recorder.changed.wait(1.0), 'no change event received.'
+            _pin, _value, _t1 = _recorder.events[0]
+            assert _pin == _BUTTON_PIN and _value == 1 - ( i % 2 )
+            _latencies.append(_t1 - _t0)
+            time.sleep(0.002)
+        _latencies.sort()
+        print('change to callback latency: p50 {:.2f}ms; max {:.2f}ms (slave loop every {:d}ms).'.format(
+                percentile(_latencies, 50) * 1000.0, _latencies[-1] * 1000.0, _LOOP_DELAY_MS))
+        print('{:d} interrupts; {:d} bus transactions.'.format(_master.interrupt_count, _pi.bus_transactions))
+
+        # overflow the slave's change queue while not listening
+        _master.stop_events()
+        _recorder.events.clear()
+        for i in range(CHANGE_QUEUE_LENGTH + 4):
+            _slave.set_input(_IR_PIN, 1 - ( i % 2 ))
+            time.sleep(_LOOP_DELAY_MS * 2.5 / 1000.0)
+        _slave.set_input(_IR_PIN, 1)
+        time.sleep(_LOOP_DELAY_MS * 2.5 / 1000.0)
+        _master.start_events(_GPIO) # the line is already high, so this drains
+        print('after overflow: {:d} events dispatched; lost reported {:d} time(s).'.format(len(_recorder.events), _master.lost_change_count))
+        assert _master.lost_change_count == 1
+        assert _recorder.events[-1][:2] == ( _IR_PIN, 1 )
+        assert _pi.read(_GPIO) == 0
+
+    finally:
+        _slave.stop()
+        _master.close()
+        _pi.stop()
+
+    # threads subscribing at once each set their pin in the change mask
+    _slave = SimulatedSlave()
+    _master = I2cMaster(SLAVE_I2C_ADDRESS, Level.WARN, pi=SimulatedPi({ SLAVE_I2C_ADDRESS: _slave }))
+    try:
+        for _trial in range(20):
+            _barrier = threading.Barrier(8)
+            def _subscribe(pin):
+                _barrier.wait()
+                _master.subscribe(pin, _recorder)
+            _threads = [ threading.Thread(target=_subscribe, args=( _pin, )) for _pin in range(8) ]
+            for _thread in _threads:
+                _thread.start()
+            for _thread in _threads:
+                _thread.join()
+            assert _slave.change_mask == 0xFF, 'trial {:d}: change mask {:08b}.'.format(_trial, _slave.change_mask)
+            # a change dispatched while subscribing
+            _unsubscriber = threading.Thread(target=lambda: [ _master.unsubscribe(_pin) for _pin in range(8) ])
+            _unsubscriber.start()
+            for _pin in range(8):
+                _master._notify(_pin, 1)
+            _unsubscriber.join()
+            assert _slave.change_mask == 0
+        print('8 threads subscribing at once set the change mask in each of 20 trials.')
+    finally:
+        _master.close()
+
+
+if __name__== "__main__":
+    main()
+
+#EOF
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 by Murray Altheim. All rights reserved. This file is part
+# of the pimaster2ardslave project and is released under the MIT Licence;
+# please see the LICENSE file included as part of this package.
+#
+# author:   Murray Altheim
+# created:  2020-05-23
+# modified: 2020-05-23
+#
+# This tests framed mode against a simulated bus that corrupts, drops and
+# truncates transactions. The same seeded faults are injected into a run of
+# pin reads and of change events without and then with framing: without it,
+# wrong values and events are silently accepted; with it, none are, every
+# command is executed exactly once on the slave, and every change event is
+# received exactly once despite the corrupted reads. It displays the faults
+# injected and the retries made. It requires no hardware, nor pigpio.
+#
+
+from lib.logger import Level
+from lib.i2c_master import I2cMaster
+from lib.slave_simulator import SimulatedSlave, SimulatedPi, TimingModel, FaultInjector
+from lib.protocol import SLAVE_I2C_ADDRESS, ANALOG_MODE_RAW
+
+_DIGITAL_PIN = 1
+_ANALOG_PIN  = 8
+_EVENT_PIN   = 6
+_READS       = 2000
+_CHANGES     = 500
+_FAULTS      = dict(corrupt_write=0.02, corrupt_read=0.05, drop_write=0.01, truncate_read=0.01)
+
+# ..............................................................................
+def _run(framed):
+    _slave = SimulatedSlave(loop_delay_ms=None)
+    _faults = FaultInjector(seed=7)
+    _master = I2cMaster(SLAVE_I2C_ADDRESS, Level.ERROR, pi=SimulatedPi({ SLAVE_I2C_ADDRESS: _slave },
+            timing=TimingModel(realtime=False), faults=_faults))
+    _events = []
+    try:
+        # configure without faults
+        _master.configure_pin_as_digital_input(_DIGITAL_PIN)
+        _master.configure_pin_as_analog_input(_ANALOG_PIN)
+        _master.set_analog_mode(_ANALOG_PIN, ANALOG_MODE_RAW)
+        _master.configure_pin_as_digital_input(_EVENT_PIN)
+        _master.subscribe(_EVENT_PIN, lambda pin, value: _events.append(value))
+        if framed:
+            _master.set_framing(True)
+        _slave.set_input(_DIGITAL_PIN, 1)
+        _slave.set_analog(_ANALOG_PIN, 555)
+        _slave.loop()
+        for _name, _probability in _FAULTS.items():
+            setattr(_faults, _name, _probability)
+
+        # pin reads
+        _requests = _slave.request_count
+        _wrong = _failed = 0
+        for i in range(_READS):
+            _pin, _expected = ( _DIGITAL_PIN, 1 ) if i % 2 else ( _ANALOG_PIN, 555 )
+            try:
+                if _master.get_input_from_pin(_pin) != _expected:
+                    _wrong += 1
+            except IOError:
+                _failed += 1
+        _executed = _slave.request_count - _requests
+
+        # change events, each read as it occurs
+        _wrong_events = 0
+        for i in range(_CHANGES):
+            _level = ( i + 1 ) % 2 # the pin starts low
+            _slave.set_input(_EVENT_PIN, _level)
+            _slave.loop()
+            _events.clear()
+            try:
+                _master.dispatch_changes()
+            except IOError:
+                _failed += 1
+            if _events != [ _level ]:
+                _wrong_events += 1
+
+        print('{:<10} {:4d} of {:d} reads wrong, {:3d} of {:d} change events wrong or lost, {:d} failed; {:d} commands executed for {:d} reads.'.format(
+                'framed:' if framed else 'unframed:', _wrong, _READS, _wrong_events, _CHANGES, _failed, _executed, _READS))
+        print('{:<10} faults injected: {:d} corrupted writes, {:d} corrupted reads, {:d} dropped writes, {:d} truncated reads; {:d} frame errors, {:d} retries.'.format(
+                '', _faults.corrupted_writes, _faults.corrupted_reads, _faults.dropped_writes, _faults.truncated_reads,
+                _master.frame_error_count, _master.retry_count))
+        return _wrong, _wrong_events, _failed, _executed
+    finally:
+        _master.close()
+
+
+# ..............................................................................
+def main():
+
+    _wrong, _wrong_events, _failed, _executed = _run(framed=False)
+    assert _wrong > 0 and _wrong_events > 0
+
+    _wrong, _wrong_events, _failed, _executed = _run(framed=True)
+    assert _wrong == 0 and _wrong_events == 0 and _failed == 0
+    assert _executed == _READS
+
+
+if __name__== "__main__":
+    main()
+
+#EOF
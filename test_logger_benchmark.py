@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 by Murray Altheim. All rights reserved. This file is part
+# of the pimaster2ardslave project and is released under the MIT Licence;
+# please see the LICENSE file included as part of this package.
+#
+# author:   Murray Altheim
+# created:  2020-05-16
+# modified: 2020-05-16
+#
+# This microbenchmark measures the per-call cost of a debug log call of the
+# kind made on the I²C hot path, comparing the original Logger (eagerly
+# formatted, synchronous console output behind a lock) with the current one
+# (lazily formatted, queued for output by a background thread), both with
+# debug disabled and enabled. While enabled the console is redirected to
+# /dev/null, so the enabled figures are a lower bound on what a terminal
+# would cost.
+#
+
+import os, sys, time, logging, threading
+from colorama import Fore, Style
+
+from lib.logger import Logger, Level
+from lib.benchmark import Benchmark
+
+# ..............................................................................
+class _SynchronousLogger():
+    '''
+        The Logger as it was, kept here for comparison.
+    '''
+    def __init__(self, name, level):
+        self.__log = logging.getLogger(name)
+        self.__log.propagate = False
+        self._mutex = threading.Lock()
+        if not self.__log.handlers:
+            self.__log.setLevel(level.value)
+            sh = logging.StreamHandler()
+            sh.setLevel(level.value)
+            sh.setFormatter(logging.Formatter('%(name)s ' + ( ' '*(16-len(name)) ) + ' : %(message)s'))
+            self.__log.addHandler(sh)
+
+    def debug(self,message):
+        with self._mutex:
+            self.__log.debug(Fore.BLACK + "DEBUG : " + message + Style.RESET_ALL)
+
+
+# ..............................................................................
+def _time(function, iterations):
+    _latencies = [ 0.0 ] * iterations
+    _clock = time.perf_counter
+    _start = _clock()
+    for i in range(iterations):
+        _t0 = _clock()
+        function()
+        _latencies[i] = _clock() - _t0
+    return _latencies, _clock() - _start
+
+
+# ..............................................................................
+def main():
+
+    _iterations = 20000
+    _benchmark = Benchmark(Level.INFO)
+    _byte_count, _high_byte, _low_byte, _data = 2, 0x05, 0x04, 1284
+
+    for _level in [ Level.INFO, Level.DEBUG ]:
+        _before = _SynchronousLogger('before-{}'.format(_level.name.lower()), _level)
+        _after  = Logger('after-{}'.format(_level.name.lower()), _level)
+        _eager  = lambda: _before.debug(Fore.BLUE + 'read {:d} bytes: hi: {:08b};\t lo: {:08b};\t read data: {}'.format(_byte_count, _high_byte, _low_byte, _data))
+        _lazy   = lambda: _after.debug(Fore.BLUE + 'read {:d} bytes: hi: {:08b};\t lo: {:08b};\t read data: {}', _byte_count, _high_byte, _low_byte, _data)
+
+        # redirect the console (stderr) to /dev/null while measuring
+        Logger.flush()
+        sys.stderr.flush()
+        _stderr = os.dup(2)
+        _devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(_devnull, 2)
+        try:
+            _eager_results = _time(_eager, _iterations)
+            _lazy_results  = _time(_lazy, _iterations)
+            _t0 = time.perf_counter()
+            Logger.flush()
+            _drain = time.perf_counter() - _t0
+        finally:
+            os.dup2(_stderr, 2)
+            os.close(_devnull)
+            os.close(_stderr)
+
+        _label = 'debug {}'.format('enabled' if _level is Level.DEBUG else 'disabled')
+        _baseline = _benchmark.record('{}: before'.format(_label), *_eager_results)
+        _result = _benchmark.record('{}: after'.format(_label), *_lazy_results)
+        _benchmark.compare(_baseline, _result)
+        if _level is Level.DEBUG:
+            print('background thread drained remaining records in {:.1f}ms.'.format(_drain * 1000.0))
+
+
+if __name__== "__main__":
+    main()
+
+#EOF
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 by Murray Altheim. All rights reserved. This file is part
+# of the pimaster2ardslave project and is released under the MIT Licence;
+# please see the LICENSE file included as part of this package.
+#
+# author:   Murray Altheim
+# created:  2020-05-24
+# modified: 2020-05-24
+#
+# This compares changing eight outputs of a simulated slave (an LED bar on
+# pins 2-9) one pin at a time with a single masked write, displaying the bus
+# transactions, modelled bus time and the skew between the first and last
+# pin to change in each case. It checks that the slave's loop maintains the
+# levels set by the masked write, and that a pin not configured as an output
+# is skipped. It requires no hardware, nor pigpio.
+#
+
+from lib.logger import Level
+from lib.i2c_master import I2cMaster
+from lib.slave_simulator import SimulatedSlave, SimulatedPi, TimingModel, VirtualClock
+from lib.protocol import SLAVE_I2C_ADDRESS
+
+_PINS = range(2, 10)
+
+# ..............................................................................
+def main():
+
+    _clock = VirtualClock()
+    _slave = SimulatedSlave(clock=_clock, loop_delay_ms=None)
+    _pi = SimulatedPi({ SLAVE_I2C_ADDRESS: _slave }, timing=TimingModel(realtime=False), clock=_clock)
+    _master = I2cMaster(SLAVE_I2C_ADDRESS, Level.WARN, pi=_pi)
+    _changes = {}
+    for _pin in _PINS:
+        _master.configure_pin_as_output(_pin)
+        _slave.wire(_pin, lambda level, pin=_pin: _changes.__setitem__(pin, _clock()))
+
+    def _report(label, start):
+        _times = sorted(_changes.values())
+        print('{:<18} {:2d} transactions; {:5.2f}ms; skew {:5.2f}ms.'.format(label, _pi.bus_transactions,
+                ( _clock() - start ) * 1000.0, ( _times[-1] - _times[0] ) * 1000.0))
+        return _times[-1] - _times[0]
+
+    try:
+        # one pin at a time
+        _changes.clear()
+        _pi.reset_counters()
+        _start = _clock()
+        for _pin in _PINS:
+            _master.set_output_on_pin(_pin, True)
+        _skew = _report('one pin at a time:', _start)
+        assert _pi.bus_transactions == len(_PINS) and _skew > 0.0
+
+        # a masked write
+        _changes.clear()
+        _pi.reset_counters()
+        _start = _clock()
+        _written = _master.set_outputs({ _pin: _pin % 2 == 0 for _pin in _PINS })
+        _skew = _report('masked write:', _start)
+        assert _pi.bus_transactions == 1 and _skew == 0.0
+        assert _written == sum(1 << _pin for _pin in _PINS)
+
+        # the loop maintains the levels written
+        _slave.loop()
+        assert [ _slave.get_output(_pin) for _pin in _PINS ] == [ 1 if _pin % 2 == 0 else 0 for _pin in _PINS ]
+
+        # an input is skipped
+        _master.configure_pin_as_digital_input(9)
+        _written = _master.set_outputs({ 8: False, 9: True })
+        _slave.loop()
+        assert _written == 1 << 8 and _slave.get_output(8) == 0 and _slave.get_output(9) == 0
+        print('levels maintained by the slave\'s loop; input pin skipped.')
+
+    finally:
+        _master.close()
+
+
+if __name__== "__main__":
+    main()
+
+#EOF
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 by Murray Altheim. All rights reserved. This file is part
+# of the pimaster2ardslave project and is released under the MIT Licence;
+# please see the LICENSE file included as part of this package.
+#
+# author:   Murray Altheim
+# created:  2020-05-22
+# modified: 2020-05-22
+#
+# This compares configuring a simulated slave one pin at a time with applying
+# a pin map, then restarts the master (a new I2cMaster on the same slave) to
+# check that the configuration is skipped, and restarts the slave to check
+# that it is not. It displays the bus transactions and modelled bus time of
+# each. It requires no hardware, nor pigpio.
+#
+
+from lib.logger import Level
+from lib.i2c_master import I2cMaster
+from lib.slave_simulator import SimulatedSlave, SimulatedPi, TimingModel, VirtualClock
+from lib.protocol import SLAVE_I2C_ADDRESS, PIN_OUTPUT, PIN_INPUT_DIGITAL_PULLUP, PIN_INPUT_ANALOG, PIN_UNUSED
+
+_PIN_MAP = { 1: 'input', 2: 'input', 5: 'output', 6: 'input_pullup', 7: 'input', 8: 'analog', 9: 'analog' }
+
+# ..............................................................................
+def _connect(slave):
+    _clock = VirtualClock()
+    _pi = SimulatedPi({ SLAVE_I2C_ADDRESS: slave }, timing=TimingModel(realtime=False), clock=_clock)
+    return I2cMaster(SLAVE_I2C_ADDRESS, Level.WARN, pi=_pi), _pi, _clock
+
+
+def _report(label, pi, clock, start=0.0):
+    print('{:<32} {:2d} transactions; {:5.2f}ms'.format(label, pi.bus_transactions, ( clock() - start ) * 1000.0))
+
+
+# ..............................................................................
+def main():
+
+    # one pin at a time
+    _master, _pi, _clock = _connect(SimulatedSlave(loop_delay_ms=None))
+    for _pin, _name in _PIN_MAP.items():
+        if _name == 'input':
+            _master.configure_pin_as_digital_input(_pin)
+        elif _name == 'input_pullup':
+            _master.configure_pin_as_digital_input_pullup(_pin)
+        elif _name == 'analog':
+            _master.configure_pin_as_analog_input(_pin)
+        else:
+            _master.configure_pin_as_output(_pin)
+    _report('one pin at a time:', _pi, _clock)
+    _master.close()
+
+    # a pin map
+    _slave = SimulatedSlave(loop_delay_ms=None)
+    _master, _pi, _clock = _connect(_slave)
+    assert _master.apply_pin_map(_PIN_MAP)
+    _report('pin map:', _pi, _clock)
+    _master.close()
+    assert _slave.pin_assignments[5] == PIN_OUTPUT and _slave.pin_assignments[6] == PIN_INPUT_DIGITAL_PULLUP \
+            and _slave.pin_assignments[8] == PIN_INPUT_ANALOG and _slave.pin_assignments[0] == PIN_UNUSED
+
+    # the master restarts
+    _master, _pi, _clock = _connect(_slave)
+    assert not _master.apply_pin_map(_PIN_MAP)
+    _report('pin map after master restart:', _pi, _clock)
+
+    # the map changes
+    _pi.reset_counters()
+    _start = _clock()
+    _changed_map = dict(_PIN_MAP)
+    _changed_map[9] = 'unused'
+    assert _master.apply_pin_map(_changed_map)
+    _report('changed pin map:', _pi, _clock, _start)
+    _master.close()
+
+    # the slave restarts
+    _master, _pi, _clock = _connect(SimulatedSlave(loop_delay_ms=None))
+    assert _master.apply_pin_map(_PIN_MAP)
+    _report('pin map after slave restart:', _pi, _clock)
+    _master.close()
+
+
+if __name__== "__main__":
+    main()
+
+#EOF
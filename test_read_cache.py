@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 by Murray Altheim. All rights reserved. This file is part
+# of the pimaster2ardslave project and is released under the MIT Licence;
+# please see the LICENSE file included as part of this package.
+#
+# author:   Murray Altheim
+# created:  2020-05-25
+# modified: 2020-05-25
+#
+# This polls three pins of a simulated slave (two digital inputs and an
+# analog input whose value changes continuously) every 10ms for ten of the
+# slave's loops, with and without the I2cMaster's read cache, comparing the
+# bus transactions of each. Each value served from the cache is checked
+# against the value the slave would return at that moment, so that a value
+# served past the slave's next loop is caught. It then checks that writing an
+# output and configuring a pin invalidate the cache, and that the cache works
+# in framed mode. It requires no hardware, nor pigpio.
+#
+
+from lib.logger import Level
+from lib.i2c_master import I2cMaster
+from lib.slave_simulator import SimulatedSlave, SimulatedPi, TimingModel, VirtualClock
+from lib.protocol import SLAVE_I2C_ADDRESS
+
+_LOOP_DELAY_MS = 100
+_POLL_S        = 0.010
+_LOOPS         = 10
+_PINS          = [ 6, 7, 8 ]
+
+# ..............................................................................
+def _poll(cached, framed=False):
+    '''
+        Polls the pins for _LOOPS loops, returning the bus transactions and
+        the master's statistics.
+    '''
+    _clock = VirtualClock(start=0.0123) # out of step with the slave's loops
+    _slave = SimulatedSlave(clock=_clock, loop_delay_ms=_LOOP_DELAY_MS)
+    _slave.set_analog(8, lambda t: int(t * 1000) % 1024)
+    _pi = SimulatedPi({ SLAVE_I2C_ADDRESS: _slave }, timing=TimingModel(realtime=False), clock=_clock)
+    _master = I2cMaster(SLAVE_I2C_ADDRESS, Level.WARN, pi=_pi)
+    try:
+        _master.apply_pin_map({ 5: 'output', 6: 'input', 7: 'input_pullup', 8: 'analog' })
+        _master.set_framing(framed)
+        if cached:
+            _master.set_read_cache(True, _LOOP_DELAY_MS, _clock)
+        _pi.reset_counters()
+        _reads = 0
+        _end = _clock() + _LOOPS * _LOOP_DELAY_MS / 1000.0
+        while _clock() < _end:
+            _slave.set_input(6, int(_clock() / 0.037) % 2)
+            for _pin in _PINS:
+                _transactions = _pi.bus_transactions
+                _value = _master.get_input_from_pin(_pin)
+                if _pi.bus_transactions == _transactions: # served from the cache
+                    _slave.service()
+                    assert _value == _slave.get_value_of(_pin), 'pin {:d} read {:d} rather than {:d} at {:.4f}s'.format(
+                            _pin, _value, _slave.get_value_of(_pin), _clock())
+                _reads += 1
+            _transactions = _pi.bus_transactions
+            _values = _master.read_pins(_PINS)
+            if _pi.bus_transactions == _transactions:
+                _slave.service()
+                assert [ _values[_pin] for _pin in _PINS ] == [ _slave.get_value_of(_pin) for _pin in _PINS ]
+            _reads += 1
+            _clock.advance(_POLL_S)
+        _transactions = _pi.bus_transactions
+        _stats = _master.stats()
+        print('{:<24} {:4d} reads in {:4d} transactions; cache hits {:4d}, misses {:3d} ({:.1%}).'.format(
+                ( 'cached' if cached else 'uncached' ) + ( ', framed:' if framed else ':' ), _reads, _transactions,
+                _stats['cache']['hits'], _stats['cache']['misses'], _stats['cache']['hit_rate']))
+
+        if cached:
+            # writing an output or configuring a pin invalidates the cache
+            for _invalidate in [ lambda: _master.set_outputs({ 5: True }), lambda: _master.set_output_on_pin(5, False),
+                    lambda: _master.configure_pin_as_analog_input(6) ]:
+                _master.get_input_from_pin(6)
+                _pi.reset_counters()
+                _master.get_input_from_pin(6) # a hit
+                assert _pi.bus_transactions == 0
+                _invalidate()
+                _master.get_input_from_pin(6) # a miss
+                assert _pi.bus_transactions == 2
+            print('output writes and configuration invalidated the cache.')
+            _master.set_read_cache(False)
+        return _transactions, _stats
+    finally:
+        _master.close()
+
+
+# ..............................................................................
+def main():
+
+    _uncached, _ = _poll(False)
+    _cached, _stats = _poll(True)
+    # about a miss on each loop, plus one per pin as the pins are first read
+    assert _cached < 2 * _LOOPS and _stats['cache']['hit_rate'] > 0.9
+    _framed, _stats = _poll(True, framed=True)
+    assert _framed < 2 * _LOOPS and _stats['cache']['hit_rate'] > 0.9
+    print('the cache saved {:.1%} of the transactions.'.format(1.0 - _cached / _uncached))
+
+
+if __name__== "__main__":
+    main()
+
+#EOF
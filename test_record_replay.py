@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 by Murray Altheim. All rights reserved. This file is part
+# of the pimaster2ardslave project and is released under the MIT Licence;
+# please see the LICENSE file included as part of this package.
+#
+# author:   Murray Altheim
+# created:  2020-05-24
+# modified: 2020-05-24
+#
+# This records an I2cMaster session against a simulated slave (configuring
+# pins, reading, writing outputs, legacy and framed commands, and enough
+# reads to extend the file's preallocation), then replays the recording as
+# fast as possible through a fresh simulated slave with the same inputs,
+# checking that every reply matches, and through one with a different input,
+# checking that the mismatches are reported by command. Finally it replays
+# a short recording in real time, checking that it takes as long as it did
+# when recorded. It requires no hardware, nor pigpio.
+#
+
+import os, tempfile
+
+from lib.logger import Level
+from lib.i2c_master import I2cMaster
+from lib.recorder import Replayer, HEADER, RECORD, BLOCK_RECORDS, OP_ZIP
+from lib.slave_simulator import SimulatedSlave, SimulatedPi, TimingModel, VirtualClock
+from lib.protocol import SLAVE_I2C_ADDRESS, ANALOG_MODE_MEDIAN
+
+_LOOP_DELAY_MS = 10
+_READS         = BLOCK_RECORDS + 100
+
+# ..............................................................................
+def _slave(clock, analog=400):
+    _slave = SimulatedSlave(clock=clock, loop_delay_ms=_LOOP_DELAY_MS)
+    _slave.set_input(6, 1)
+    _slave.set_analog(8, analog)
+    return _slave
+
+
+def _record(path, reads):
+    '''
+        Records a session, returning its duration by the recorder's clock.
+    '''
+    _clock = VirtualClock()
+    _pi = SimulatedPi({ SLAVE_I2C_ADDRESS: _slave(_clock) }, timing=TimingModel(realtime=False), clock=_clock)
+    _master = I2cMaster(SLAVE_I2C_ADDRESS, Level.WARN, pi=_pi)
+    try:
+        _master.start_recording(path, clock=_clock)
+        _master.apply_pin_map({ 5: 'output', 6: 'input_pullup', 7: 'output', 8: 'analog' })
+        _master.set_analog_mode(8, ANALOG_MODE_MEDIAN, 5)
+        _master.set_outputs({ 5: True, 7: True })
+        _master.write_i2c_data(8)
+        _master.read_i2c_data()
+        _master.set_framing(True)
+        for i in range(reads):
+            _master.get_input_from_pin(6 + ( i % 3 ))
+        _master.read_pins([ 5, 6, 7, 8 ])
+        _master.set_framing(False)
+        _master.read_pins()
+        return _clock()
+    finally:
+        _master.close()
+
+
+# ..............................................................................
+def main():
+
+    _path = tempfile.mktemp(suffix='.i2cr')
+    try:
+        _duration = _record(_path, _READS)
+        print('recorded {:.1f}s of bus traffic in {:d} bytes ({:d} byte records).'.format(_duration, os.path.getsize(_path), RECORD.size))
+        assert os.path.getsize(_path) == HEADER.size + 2 * BLOCK_RECORDS * RECORD.size
+
+        _replayer = Replayer(_path, Level.WARN)
+        try:
+            assert len(_replayer) == _READS + 11
+            assert _replayer[0].command == 259 and _replayer[0].operation == OP_ZIP # the pin map's handshake
+            assert _replayer[-1].read[:2] == bytes([ 250, 0 ]) # pin 0 is unassigned
+
+            # as fast as possible, with the same inputs
+            _clock = VirtualClock()
+            _result = _replayer.replay({ SLAVE_I2C_ADDRESS: _slave(_clock) }, advance=_clock.advance)
+            print('replayed {:d} transactions in {:.0f}ms; {:d} mismatched.'.format(_result.transactions, _result.elapsed * 1000.0, _result.mismatches))
+            assert _result.transactions == len(_replayer) and _result.mismatches == 0
+
+            # with a different analog input
+            _clock = VirtualClock()
+            _result = _replayer.replay({ SLAVE_I2C_ADDRESS: _slave(_clock, analog=800) }, advance=_clock.advance)
+            print('replayed with a different input: {:d} mismatched, by command: {}.'.format(_result.mismatches, _result.mismatched_commands))
+            assert sorted(_result.mismatched_commands) == [ 8, 234, 235 ] and _result.mismatched_commands[8] > _READS // 4
+        finally:
+            _replayer.close()
+
+        # in real time
+        _duration = _record(_path, 200)
+        _replayer = Replayer(_path, Level.WARN)
+        try:
+            _result = _replayer.replay({ SLAVE_I2C_ADDRESS: _slave(VirtualClock()) }, realtime=True)
+            print('replayed {:.0f}ms of bus traffic in real time in {:.0f}ms.'.format(_duration * 1000.0, _result.elapsed * 1000.0))
+            assert _result.elapsed >= _replayer[-1].timestamp - _replayer[0].timestamp
+        finally:
+            _replayer.close()
+
+    finally:
+        if os.path.exists(_path):
+            os.remove(_path)
+
+
+if __name__== "__main__":
+    main()
+
+#EOF
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 by Murray Altheim. All rights reserved. This file is part
+# of the pimaster2ardslave project and is released under the MIT Licence;
+# please see the LICENSE file included as part of this package.
+#
+# author:   Murray Altheim
+# created:  2020-05-25
+# modified: 2020-05-25
+#
+# This measures the freshness of the values read from a simulated slave at
+# a range of sample periods: a digital input is toggled at random times
+# (the same for each period) and polled every 5ms, and the latency of each
+# toggle, from the change at the pin to the first poll returning the new
+# level, is measured. A value should be on average about half a sample
+# period old and never more than a period (plus a poll). It also checks
+# that the slave takes a sample per period, and that a period that is too
+# short is refused. It requires no hardware, nor pigpio.
+#
+
+import random
+
+from lib.logger import Level
+from lib.i2c_master import I2cMaster
+from lib.slave_simulator import SimulatedSlave, SimulatedPi, TimingModel, VirtualClock
+from lib.protocol import SLAVE_I2C_ADDRESS, LOOP_DELAY_MS, MIN_SAMPLE_PERIOD_MS
+
+_PERIODS_MS = [ 1000, 100, 20, MIN_SAMPLE_PERIOD_MS ]
+_POLL_S     = 0.005
+_DURATION_S = 20.0
+_PIN        = 6
+
+# ..............................................................................
+def _toggle_times(seed=7):
+    '''
+        Returns the times of the toggles, at random intervals longer than the
+        longest period so that none is missed.
+    '''
+    _random = random.Random(seed)
+    _times = []
+    _time = 0.5
+    while _time < _DURATION_S - 2.0:
+        _times.append(_time)
+        _time += _random.uniform(1.2, 2.0) * max(_PERIODS_MS) / 1000.0
+    return _times
+
+
+def _measure(period_ms, toggles):
+    '''
+        Polls the pin for _DURATION_S at the sample period, returning the
+        latencies (seconds) of the toggles and the slave's loop count.
+    '''
+    _clock = VirtualClock()
+    _slave = SimulatedSlave(clock=_clock, loop_delay_ms=LOOP_DELAY_MS)
+    _pi = SimulatedPi({ SLAVE_I2C_ADDRESS: _slave }, timing=TimingModel(realtime=False), clock=_clock)
+    _master = I2cMaster(SLAVE_I2C_ADDRESS, Level.WARN, pi=_pi)
+    try:
+        _master.apply_pin_map({ _PIN: 'input' })
+        _master.set_sample_period(period_ms)
+        assert _master.sample_period == period_ms
+        _loops = _slave.loop_count
+        _start = _clock()
+        _pending = list(toggles)
+        _level = 0
+        _changed = None
+        _latencies = []
+        while _clock() - _start < _DURATION_S:
+            if _pending and _clock() - _start >= _pending[0]:
+                _slave.service() # the slave's samples due before the toggle see the old level
+                _pending.pop(0)
+                _level ^= 1
+                _slave.set_input(_PIN, _level)
+                _changed = _clock()
+            if _changed is not None and _master.get_input_from_pin(_PIN) == _level:
+                _latencies.append(_clock() - _changed)
+                _changed = None
+            _clock.advance(_POLL_S)
+        _slave.service()
+        return _latencies, _slave.loop_count - _loops
+    finally:
+        _master.close()
+
+
+# ..............................................................................
+def main():
+
+    _toggles = _toggle_times()
+    _means = []
+    for _period_ms in _PERIODS_MS:
+        _latencies, _loops = _measure(_period_ms, _toggles)
+        _mean = sum(_latencies) / len(_latencies)
+        _period = _period_ms / 1000.0
+        print('sample period {:4d}ms: {:5d} samples; {:d} toggles seen after mean {:6.1f}ms, max {:6.1f}ms.'.format(
+                _period_ms, _loops, len(_latencies), _mean * 1000.0, max(_latencies) * 1000.0))
+        assert len(_latencies) == len(_toggles)
+        assert abs(_loops - _DURATION_S / _period) <= 2
+        assert max(_latencies) <= _period + 2 * _POLL_S
+        assert abs(_mean - _period / 2.0) <= max(0.25 * _period, 2 * _POLL_S)
+        _means.append(_mean)
+    assert _means == sorted(_means, reverse=True)
+
+    _master = I2cMaster(SLAVE_I2C_ADDRESS, Level.WARN, pi=SimulatedPi({ SLAVE_I2C_ADDRESS: SimulatedSlave() }))
+    try:
+        try:
+            _master.set_sample_period(MIN_SAMPLE_PERIOD_MS - 1)
+            raise AssertionError('a sample period of {:d}ms was not refused.'.format(MIN_SAMPLE_PERIOD_MS - 1))
+        except ValueError:
+            pass
+        assert _master.sample_period == LOOP_DELAY_MS
+    finally:
+        _master.close()
+    print('a sample period of {:d}ms was refused.'.format(MIN_SAMPLE_PERIOD_MS - 1))
+
+
+if __name__== "__main__":
+    main()
+
+#EOF
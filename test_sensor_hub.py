@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 by Murray Altheim. All rights reserved. This file is part
+# of the pimaster2ardslave project and is released under the MIT Licence;
+# please see the LICENSE file included as part of this package.
+#
+# author:   Murray Altheim
+# created:  2020-05-25
+# modified: 2020-05-25
+#
+# This runs a SensorHub over a simulated slave and starts several reader
+# processes (this script, run as 'test_sensor_hub.py reader ...'), each of
+# which reads the sampled pins from the hub's shared memory as fast as it
+# can, displaying the cost of a read. A thread of the hub meanwhile publishes
+# a pin as fast as it can, whose value is derived from its timestamp, so
+# that a reader catches any torn read. Each reader also writes an output and
+# makes commands the hub refuses or that fail, through the hub's socket,
+# authenticated by the key the hub wrote beside it. It first checks that a
+# socket in a shared directory is refused, then that the socket and key are
+# closed to others, that the readers saw the slave's values, that no read
+# was torn, that the output was written, and that the readers added no bus
+# traffic.
+# Finally it checks that a reader gives up on a hub that died while
+# publishing a pin. It requires no hardware, nor pigpio.
+#
+
+import os, sys, json, time, tempfile, threading, subprocess
+from multiprocessing import shared_memory, resource_tracker
+
+from lib.logger import Level
+from lib.i2c_master import I2cMaster
+from lib.sensor_hub import SensorHub, HubClient, SharedSnapshot
+from lib.slave_simulator import SimulatedSlave, SimulatedPi, TimingModel
+from lib.protocol import SLAVE_I2C_ADDRESS, PIN_COUNT
+
+_READERS  = 3
+_READS    = 200000
+_RATE_HZ  = 100
+_TORN_PIN = PIN_COUNT - 1 # not a pin of the slave, published by a thread of the hub
+
+# ..............................................................................
+def _reader(name, address):
+    '''
+        Run in a reader process: reads the pins, then makes its commands,
+        writing its results to stdout as JSON.
+    '''
+    _client = HubClient(name, address)
+    try:
+        while _client.get_sample(8) is None or _client.get_sample(_TORN_PIN) is None:
+            time.sleep(0.001)
+        _start = time.perf_counter()
+        for _ in range(_READS):
+            _client.get_sample(8)
+        _read_ns = ( time.perf_counter() - _start ) / _READS * 1e9
+        _torn = _checked = 0
+        _end = time.monotonic() + 0.5
+        while time.monotonic() < _end:
+            _value, _timestamp = _client.get_sample(_TORN_PIN)
+            if _value != int(_timestamp) & 0xFFFF:
+                _torn += 1
+            _checked += 1
+        _written = _client.set_outputs({ 5: True })
+        _errors = []
+        for _call in [ lambda: _client.call('read_i2c_data'), lambda: _client.set_sample_period(1) ]:
+            try:
+                _call()
+            except ValueError as e:
+                _errors.append(str(e))
+        print(json.dumps({ 'pins': _client.pins, 'values': [ _client.get_sample(_pin)[0] for _pin in ( 6, 8 ) ],
+                'read_ns': _read_ns, 'torn': _torn, 'checked': _checked, 'written': _written, 'errors': _errors }))
+    finally:
+        _client.close()
+
+
+# ..............................................................................
+def _dead_hub(name):
+    '''
+        Run in a process standing in for a hub that dies while publishing a pin.
+    '''
+    _snapshot = SharedSnapshot(name, create=True, pin_mask=1 << 6)
+    # left to the test to unlink, rather than this process's resource tracker
+    resource_tracker.unregister(_snapshot._shm._name, 'shared_memory')
+    _snapshot.publish(6, 1, time.monotonic())
+    _snapshot._sequence[6] += 1 # as publish() does, before dying
+    os._exit(0)
+
+
+# ..............................................................................
+def main():
+
+    _name = 'i2c-hub-test-{:d}'.format(os.getpid())
+    _directory = tempfile.mkdtemp() # private to the user, as is hub_directory()
+    _address = os.path.join(_directory, _name + '.sock')
+    _slave = SimulatedSlave(loop_delay_ms=10)
+    _slave.set_input(6, 1)
+    _slave.set_analog(8, 400)
+    _pi = SimulatedPi({ SLAVE_I2C_ADDRESS: _slave }, timing=TimingModel(realtime=False))
+    _master = I2cMaster(SLAVE_I2C_ADDRESS, Level.WARN, pi=_pi)
+    _hub = None
+    _stop = threading.Event()
+    try:
+        _master.apply_pin_map({ 5: 'output', 6: 'input', 8: 'analog' })
+        # a socket in a directory open to other users is refused
+        _hub = SensorHub(_master, { 6: _RATE_HZ }, Level.WARN, name=_name,
+                address=os.path.join(tempfile.gettempdir(), _name + '.sock'))
+        try:
+            _hub.start()
+            raise AssertionError('the hub started in a shared directory.')
+        except PermissionError as e:
+            print('refused: {}'.format(e))
+        finally:
+            _hub.close()
+
+        _hub = SensorHub(_master, { 6: _RATE_HZ, 8: _RATE_HZ }, Level.WARN, name=_name, address=_address)
+        _hub.start()
+        for _path in ( _address, _address + '.key' ):
+            assert os.stat(_path).st_mode & 0o077 == 0, '{} is open to others.'.format(_path)
+
+        def _publish():
+            i = 1
+            while not _stop.is_set():
+                _hub.snapshot.publish(_TORN_PIN, i & 0xFFFF, float(i))
+                i += 1
+        _publisher = threading.Thread(target=_publish, daemon=True)
+        _publisher.start()
+
+        _pi.reset_counters()
+        _start = time.monotonic()
+        _processes = [ subprocess.Popen([ sys.executable, __file__, 'reader', _name, _address ], stdout=subprocess.PIPE)
+                for _ in range(_READERS) ]
+        _results = []
+        for _process in _processes:
+            _output, _ = _process.communicate(timeout=60)
+            assert _process.returncode == 0, 'reader failed.'
+            _results.append(json.loads(_output))
+        _elapsed = time.monotonic() - _start
+        _transactions = _pi.bus_transactions
+        _stop.set()
+        _publisher.join()
+
+        _expected = [ _slave.get_value_of(6), _slave.get_value_of(8) ]
+        for i, _result in enumerate(_results):
+            print('reader {:d}: {:d} reads at {:.0f}ns per read; {:d} of {:d} reads torn; values {}.'.format(
+                    i, _READS, _result['read_ns'], _result['torn'], _result['checked'], _result['values']))
+            assert _result['pins'] == [ 6, 8 ] and _result['values'] == _expected
+            assert _result['torn'] == 0 and _result['checked'] > 0
+            assert _result['written'] == 1 << 5
+            assert len(_result['errors']) == 2, 'commands were not refused: {}'.format(_result['errors'])
+        assert _hub.command_count == _READERS # only the outputs written succeeded
+        assert _slave.get_output(5) == 1
+        # the pins falling due together are read in one transaction; each reader wrote an output
+        _budget = _elapsed * _RATE_HZ * 1.2 + _READERS + 10
+        print('{:d} bus transactions in {:.1f}s for {:d} reads by {:d} readers (budget {:.0f}).'.format(
+                _transactions, _elapsed, _READERS * _READS, _READERS, _budget))
+        assert _transactions <= _budget
+    finally:
+        _stop.set()
+        if _hub is not None:
+            _hub.close()
+        _master.close()
+    assert not os.path.exists('/dev/shm/' + _name)
+
+    # a reader of a hub that died while publishing gives up on it
+    _name += '-dead'
+    subprocess.run([ sys.executable, __file__, 'dead_hub', _name ], check=True)
+    _client = HubClient(_name, _address)
+    try:
+        _client.get_sample(6)
+        raise AssertionError('read a pin of a dead hub.')
+    except RuntimeError as e:
+        print('a reader of a dead hub gave up: {}'.format(e))
+    finally:
+        _client.close()
+        shared_memory.SharedMemory(_name).unlink()
+    os.rmdir(_directory)
+
+
+if __name__== "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == 'reader':
+        _reader(sys.argv[2], sys.argv[3])
+    elif len(sys.argv) > 1 and sys.argv[1] == 'dead_hub':
+        _dead_hub(sys.argv[2])
+    else:
+        main()
+
+#EOF
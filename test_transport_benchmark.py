@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright 2020 by Murray Altheim. All rights reserved. This file is part
+# of the pimaster2ardslave project and is released under the MIT Licence;
+# please see the LICENSE file included as part of this package.
+#
+# author:   Murray Altheim
+# created:  2020-05-24
+# modified: 2020-05-24
+#
+# This benchmarks the per-command latency of the I2cMaster over each of its
+# transports (see lib/i2c_transport.py): pigpio, whose every call is a round
+# trip to the pigpio daemon; i2c-dev, a single I2C_RDWR ioctl per command;
+# and the simulator alone, at no modelled cost, which exposes the master's
+# own overhead.
+#
+# By default the pigpio and i2c-dev transports are run against a simulated
+# slave (via a SimulatedPi and a SimulatedI2cDev respectively) with the timing
+# model below, and requires no hardware, nor pigpio. With the argument
+# 'hardware' they are instead run against an Arduino slave on I²C bus 1,
+# which requires pigpio and its daemon, and the i2c-dev module.
+#
+
+import sys
+
+from lib.logger import Level
+from lib.i2c_master import I2cMaster
+from lib.i2c_transport import PigpioTransport, I2cDevTransport
+from lib.slave_simulator import SimulatedSlave, SimulatedPi, SimulatedI2cDev, TimingModel
+from lib.benchmark import Benchmark
+
+_DEVICE_ID = 0x08  # must match Arduino's SLAVE_I2C_ADDRESS
+_BUS       = 1
+
+# ..............................................................................
+def _measure(benchmark, label, master, iterations):
+    '''
+        Measures a single read and a block read over the master, returning
+        the result of the single read.
+    '''
+    master.configure_pin_as_analog_input(8)
+    _result = benchmark.measure('{:<10} get_input_from_pin(8)'.format(label), lambda: master.get_input_from_pin(8), iterations)
+    benchmark.measure('{:<10} read_pins(5 pins)'.format(label), lambda: master.read_pins([ 5, 6, 7, 8, 9 ]), iterations)
+    return _result
+
+
+# ..............................................................................
+def main():
+
+    _iterations = 500
+    _hardware = len(sys.argv) > 1 and sys.argv[1] == 'hardware'
+    _timing = TimingModel(bus_hz=100000, daemon_s=0.00015, isr_s=0.00002, ioctl_s=0.00003)
+
+    # pigpio
+    if _hardware:
+        import pigpio
+        _pi = pigpio.pi()
+        _benchmark = Benchmark(Level.INFO)
+    else:
+        _pi = SimulatedPi({ _DEVICE_ID: SimulatedSlave() }, timing=_timing)
+        _benchmark = Benchmark(Level.INFO, pi=_pi)
+    _transport = PigpioTransport(_pi, _BUS, _DEVICE_ID)
+    try:
+        _pigpio = _measure(_benchmark, 'pigpio', I2cMaster(_DEVICE_ID, Level.WARN, pi=_pi, transport=_transport), _iterations)
+    finally:
+        _transport.close()
+        if _hardware:
+            _pi.stop()
+
+    # i2c-dev
+    if _hardware:
+        _transport = I2cDevTransport(_BUS, _DEVICE_ID)
+        _benchmark = Benchmark(Level.INFO)
+    else:
+        _dev = SimulatedI2cDev({ _DEVICE_ID: SimulatedSlave() }, timing=_timing)
+        _transport = I2cDevTransport(_BUS, _DEVICE_ID, fd=-1, ioctl=_dev.ioctl)
+        _benchmark = Benchmark(Level.INFO, pi=_dev)
+    try:
+        _i2c_dev = _measure(_benchmark, 'i2c-dev', I2cMaster(_DEVICE_ID, Level.WARN, transport=_transport), _iterations)
+    finally:
+        _transport.close()
+    _benchmark.compare(_pigpio, _i2c_dev)
+
+    # the simulator alone
+    _pi = SimulatedPi({ _DEVICE_ID: SimulatedSlave() }, timing=TimingModel(realtime=False))
+    _benchmark = Benchmark(Level.INFO, pi=_pi)
+    _measure(_benchmark, 'simulator', I2cMaster(_DEVICE_ID, Level.WARN, pi=_pi), _iterations)
+
+
+if __name__== "__main__":
+    main()
+
+#EOF